@@ -0,0 +1,292 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESOURCES_DIR = os.path.join(os.path.dirname(__file__), "..", "test", "wp", "resources")
+
+
+def load_fixture(name):
+    with open(os.path.join(RESOURCES_DIR, name), 'r') as f:
+        return json.loads(f.read())
+
+
+##
+# Behaviour of the stand-in servers: every request is delayed by latency (+ up to jitter) seconds
+# and fails with a 503 at failure_rate. Builds take build_duration seconds and fail at
+# build_failure_rate, deployments of releases take release_duration seconds.
+class FakeSettings(object):
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, build_duration=1.0, build_failure_rate=0.0,
+                 release_duration=0.5, seed=42):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.build_duration = build_duration
+        self.build_failure_rate = build_failure_rate
+        self.release_duration = release_duration
+        self.seed = seed
+
+
+##
+# State of the fake Azure DevOps: pipelines are resolved by name, a build is queued for every commit
+# pushed to the (bare) repository of a build-pipeline - just like a CI-trigger would
+def _timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + f"{seconds % 1:.7f}"[1:] + "Z"
+
+
+class FakeAzureDevOps(object):
+    def __init__(self, settings, repositories):
+        self.settings = settings
+        self.repositories = repositories
+        self._random = random.Random(settings.seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._definitions = {}
+        # commits pushed before the run don't trigger builds
+        self._initial_commits = {name: head_commit(path) for name, path in repositories.items()}
+        self._builds = {}
+        self._releases = {}
+
+    def definition_id(self, kind, name):
+        with self._lock:
+            if (kind, name) not in self._definitions:
+                self._definitions[(kind, name)] = next(self._ids)
+
+            return self._definitions[(kind, name)]
+
+    def definition(self, kind, name):
+        return {"count": 1, "value": [{"id": self.definition_id(kind, name), "name": name}]}
+
+    def _pipeline_name(self, definition_id):
+        with self._lock:
+            return next((name for (kind, name), i in self._definitions.items() if i == definition_id), None)
+
+    def recent_builds(self, definition_id):
+        name = self._pipeline_name(definition_id)
+        head = head_commit(self.repositories[name]) if name in self.repositories else None
+        with self._lock:
+            if head is not None and head != self._initial_commits.get(name) and \
+                    not any(b["definition"] == definition_id and b["sourceVersion"] == head
+                            for b in self._builds.values()):
+                build_id = next(self._ids)
+                failed = self._random.random() < self.settings.build_failure_rate
+                self._builds[build_id] = {"id": build_id, "definition": definition_id, "sourceVersion": head,
+                                          "queued": time.monotonic(), "started": time.time(),
+                                          "result": "failed" if failed else "succeeded"}
+            builds = [self._build_status(b) for b in self._builds.values() if b["definition"] == definition_id]
+
+        builds.sort(key=lambda b: b["id"], reverse=True)
+        return {"count": len(builds), "value": builds}
+
+    def queue_build(self, definition_id):
+        with self._lock:
+            build_id = next(self._ids)
+            self._builds[build_id] = {"id": build_id, "definition": definition_id, "sourceVersion": None,
+                                      "queued": time.monotonic(), "started": time.time(), "result": "succeeded"}
+            return self._build_status(self._builds[build_id])
+
+    def build(self, build_id):
+        with self._lock:
+            build = self._builds.get(build_id)
+            return self._build_status(build) if build is not None else None
+
+    def _build_status(self, build):
+        completed = time.monotonic() - build["queued"] >= self.settings.build_duration
+        status = {"id": build["id"], "buildNumber": f"20200101.{build['id']}", "sourceVersion": build["sourceVersion"],
+                  "status": "completed" if completed else "inProgress",
+                  "result": build["result"] if completed else None, "startTime": _timestamp(build["started"])}
+        if completed:
+            status["finishTime"] = _timestamp(build["started"] + self.settings.build_duration)
+        return status
+
+    def create_release(self, definition_id):
+        with self._lock:
+            release_id = next(self._ids)
+            self._releases[release_id] = {"id": release_id, "definition": definition_id, "created": time.monotonic()}
+            return {"id": release_id, "name": f"Release-{release_id}", "status": "active"}
+
+    def releases(self, release_ids):
+        with self._lock:
+            releases = [self._releases[i] for i in release_ids if i in self._releases]
+            deployed = [time.monotonic() - r["created"] >= self.settings.release_duration for r in releases]
+
+        return {"count": len(releases),
+                "value": [{"id": r["id"], "status": "active",
+                           "environments": [{"id": 1, "name": "rollout", "status": "succeeded" if d else "inProgress",
+                                             "conditions": [{"conditionType": "event", "name": "ReleaseStarted"}]},
+                                            {"id": 2, "name": "manual", "status": "notStarted", "conditions": []}]}
+                          for r, d in zip(releases, deployed)]}
+
+
+##
+# the commit HEAD of a bare repository points to (loose or packed ref)
+def head_commit(repo_path):
+    with open(os.path.join(repo_path, "HEAD"), 'r') as f:
+        head = f.read().strip()
+    if not head.startswith("ref: "):
+        return head
+
+    ref = head[len("ref: "):]
+    try:
+        with open(os.path.join(repo_path, ref), 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    with open(os.path.join(repo_path, "packed-refs"), 'r') as f:
+        for line in f:
+            if line.rstrip().endswith(" " + ref):
+                return line.split(" ")[0]
+
+    return None
+
+
+##
+# The stand-ins for Docker Hub, api.wordpress.org, dev.azure.com and vsrm.dev.azure.com.
+# Each one listens on its own port, so they are different hosts for the http-client (metrics, circuit-breakers).
+# The responses are built from the fixtures of the unit-tests.
+class FakeUpstreams(object):
+    SERVICES = ("docker_hub", "wordpress_api", "azure_org", "azure_org_vs")
+
+    def __init__(self, settings=None, repositories=None, host="127.0.0.1"):
+        self.settings = settings if settings is not None else FakeSettings()
+        self.azure = FakeAzureDevOps(self.settings, repositories or {})
+        self.requests = {}
+        self._random = random.Random(self.settings.seed)
+        self._lock = threading.Lock()
+        self._tags = load_fixture("wordpress-tag-list.json")
+        self._last_tags = load_fixture("wordpress-tag-list_lastpage.json")
+        self._core_version = load_fixture("core_version_check.json")
+        self._plugin_update = load_fixture("plugin_response.json")
+        self._servers = {service: ThreadingHTTPServer((host, 0), _handler_for(self, service))
+                         for service in FakeUpstreams.SERVICES}
+        self._threads = []
+
+    def start(self):
+        for service, server in self._servers.items():
+            server.daemon_threads = True
+            thread = threading.Thread(target=server.serve_forever, name=f"fake-{service}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self._servers.values():
+            server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join()
+
+    def url(self, service):
+        host, port = self._servers[service].server_address
+        return f"http://{host}:{port}/"
+
+    ##
+    # the config-values pointing the app to the stand-ins
+    def config(self):
+        return {service + "_url" if service in ("docker_hub", "wordpress_api") else service: self.url(service)
+                for service in FakeUpstreams.SERVICES}
+
+    def respond(self, service, method, path, query, body):
+        with self._lock:
+            self.requests[service] = self.requests.get(service, 0) + 1
+            fail = self._random.random() < self.settings.failure_rate
+        delay = self.settings.latency + self._random.uniform(0, self.settings.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            return 503, {"message": "injected failure"}
+
+        return getattr(self, f"_{service}")(method, path, query, body)
+
+    def _docker_hub(self, method, path, query, body):
+        if path.endswith("/tags"):
+            if query.get("page") == "2":
+                return 200, self._last_tags
+            return 200, dict(self._tags, next=f"{self.url('docker_hub')}{path.lstrip('/')}?page=2&page_size=100")
+        tag = path.rstrip("/").rsplit("/", 1)[1]
+        known = next((t for t in self._tags["results"] + self._last_tags["results"] if t["name"] == tag), None)
+        digest = "sha256:" + hashlib.sha256(tag.encode("UTF-8")).hexdigest()
+        return 200, known if known is not None else {"name": tag, "digest": digest, "images": []}
+
+    def _wordpress_api(self, method, path, query, body):
+        if path.endswith("/core/version-check/1.7/"):
+            return 200, self._core_version
+        if path.endswith("/plugins/update-check/1.1/") and method == "POST":
+            return 200, self._plugin_update
+
+        return 404, {"message": f"unknown path {path}"}
+
+    def _azure_org(self, method, path, query, body):
+        if path.endswith("/_apis/build/definitions"):
+            return 200, self.azure.definition("build", query["name"])
+        if path.endswith("/_apis/build/builds") and method == "POST":
+            return 200, self.azure.queue_build(json.loads(body)["definition"]["id"])
+        if path.endswith("/_apis/build/builds"):
+            return 200, self.azure.recent_builds(int(query["definitions"]))
+        if "/_apis/build/builds/" in path:
+            build = self.azure.build(int(path.rsplit("/", 1)[1]))
+            return (200, build) if build is not None else (404, {"message": "unknown build"})
+
+        return 404, {"message": f"unknown path {path}"}
+
+    def _azure_org_vs(self, method, path, query, body):
+        if path.endswith("/_apis/release/definitions"):
+            return 200, self.azure.definition("release", query["searchText"])
+        if path.endswith("/_apis/release/releases") and method == "POST":
+            return 200, self.azure.create_release(json.loads(body)["definitionId"])
+        if path.endswith("/_apis/release/releases"):
+            return 200, self.azure.releases([int(i) for i in query["releaseIdFilter"].split(",")])
+
+        return 404, {"message": f"unknown path {path}"}
+
+
+def _handler_for(upstreams, service):
+    class FakeUpstreamHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def _handle(self, method):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode("UTF-8") if length > 0 else ""
+            url = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            status, payload = upstreams.respond(service, method, url.path, query, body)
+            data = json.dumps(payload).encode("UTF-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeUpstreamHandler
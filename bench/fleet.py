@@ -0,0 +1,78 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import subprocess
+from bench import fake_upstream
+
+SEED_VERSION = "5.4.1"
+PROJECT = "BENCH"
+GIT_IDENTITY = {"GIT_AUTHOR_NAME": "Bench", "GIT_AUTHOR_EMAIL": "bench@localhost",
+                "GIT_COMMITTER_NAME": "Bench", "GIT_COMMITTER_EMAIL": "bench@localhost"}
+
+
+def git(cwd, *args):
+    subprocess.run(["git", *args], cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   env=dict(os.environ, **GIT_IDENTITY))
+
+
+##
+# a wordpress-image repository as the updater expects it: pipeline (+ template), Dockerfile based on the
+# wordpress-image and the plugin-list - all of them behind the latest versions of the fixtures
+def write_seed_repository(path):
+    os.makedirs(os.path.join(path, "init"))
+    with open(os.path.join(fake_upstream.RESOURCES_DIR, "azure-pipelines.yml.template"), 'r') as f:
+        template = f.read()
+    with open(os.path.join(path, "azure-pipelines.yml.template"), 'w') as f:
+        f.write(template)
+    with open(os.path.join(path, "azure-pipelines.yml"), 'w') as f:
+        f.write(template.replace("{{ wp_version }}", SEED_VERSION))
+    with open(os.path.join(path, "Dockerfile"), 'w') as f:
+        f.write(f"FROM wordpress:{SEED_VERSION}-apache\n\nCOPY init /init\n")
+    shutil.copy(os.path.join(fake_upstream.RESOURCES_DIR, "plugin-list.json"), os.path.join(path, "init"))
+
+
+##
+# Creates size bare repositories (copies of one seed) below directory.
+# Returns the repositories to check (as in wp.repos) and the bare repository of every build-pipeline
+def create_fleet(directory, size):
+    seed = os.path.join(directory, "seed")
+    seed_bare = os.path.join(directory, "seed.git")
+    write_seed_repository(seed)
+    git(seed, "init", "-q")
+    git(seed, "add", "--all")
+    git(seed, "commit", "-q", "-m", "seed")
+    git(directory, "clone", "-q", "--bare", seed, seed_bare)
+
+    to_check = {}
+    pipeline_repositories = {}
+    for i in range(size):
+        key = f"bench-{i:04d}"
+        bare = os.path.join(directory, "repos", f"{key}.git")
+        shutil.copytree(seed_bare, bare)
+        to_check[key] = {
+            "img-repo": f"file://{bare}",
+            "update-pipeline": f"Update Wordpress DB ({key})",
+            "build-img-pipeline": f"wp-{key}-img",
+            "rollout-pipeline": f"Rollout Wordpress Image ({key})",
+            "project": PROJECT
+        }
+        pipeline_repositories[f"wp-{key}-img"] = bare
+
+    return to_check, pipeline_repositories
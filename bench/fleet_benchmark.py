@@ -0,0 +1,190 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from bench import fake_upstream
+from bench import fleet
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_SIZES = "10,100,1000"
+DEFAULT_TOLERANCE = 0.25
+# the app polls the stand-ins much more often than the real services
+BENCH_CONFIG = {"poll_interval": 0.2, "max_poll_interval": 1, "pipeline_start_delay": 0, "service_hook_port": None,
+                "max_queued_builds": None, "agent_pool": None, "run_budget": None, "upstream_version_provider":
+                    "wordpress-api"}
+
+
+##
+# Runs wp.app.main against a synthetic fleet of the given size in a fresh process
+# (so peak memory and module-caches start from scratch) and returns its measurements
+def run_fleet(size, settings, parallel, directory):
+    to_check, pipeline_repositories = fleet.create_fleet(directory, size)
+    upstreams = fake_upstream.FakeUpstreams(settings, pipeline_repositories).start()
+    try:
+        workdir = os.path.join(directory, "workdir", "")
+        os.makedirs(workdir)
+        config = dict(BENCH_CONFIG, workdir=workdir, metrics_dir=workdir, max_parallel_repos=parallel,
+                      **upstreams.config())
+        child_config = os.path.join(directory, "child.json")
+        with open(child_config, 'w') as f:
+            f.write(json.dumps({"config": config, "to_check": to_check,
+                                "result": os.path.join(directory, "result.json")}))
+
+        log = os.path.join(directory, "app.log")
+        with open(log, 'w') as f:
+            subprocess.run([sys.executable, "-m", "bench.fleet_benchmark", "--child", child_config], cwd=ROOT_DIR,
+                           stdout=f, stderr=subprocess.STDOUT, check=True,
+                           env=dict(os.environ, PYTHONPATH=ROOT_DIR, **fleet.GIT_IDENTITY))
+        with open(os.path.join(directory, "result.json"), 'r') as f:
+            result = json.loads(f.read())
+    finally:
+        upstreams.stop()
+
+    result["requests"] = dict(upstreams.requests)
+    result["requests_per_repo"] = round(sum(upstreams.requests.values()) / size, 2)
+    return result
+
+
+##
+# the part running in the child-process: configure the app and run it
+def run_child(child_config):
+    with open(child_config, 'r') as f:
+        child = json.loads(f.read())
+
+    from wp import config as conf
+    for name, value in child["config"].items():
+        setattr(conf, name, value)
+    from wp import app
+    from wp import instrumentation
+    from wp import profiling
+    from wp import repos
+    repos.to_check = child["to_check"]
+
+    start = time.monotonic()
+    try:
+        app.main([])
+        failed = False
+    except SystemExit:
+        failed = True
+    wall_time = time.monotonic() - start
+
+    metrics = instrumentation.default_metrics()
+    result = {"size": len(child["to_check"]), "wall_time": round(wall_time, 3), "failed": failed,
+              "failed_repos": metrics.counter("repositories", result="failed"),
+              "retries": sum(c["value"] for c in metrics.snapshot()["counters"] if c["name"] == "http_retries"),
+              "peak_rss": profiling.max_rss()}
+    with open(child["result"], 'w') as f:
+        f.write(json.dumps(result))
+
+
+##
+# Returns the regressions of the results compared to the baseline (beyond the tolerance)
+def compare(results, baseline, tolerance):
+    regressions = []
+    for size, result in results.items():
+        base = baseline.get(size)
+        if base is None:
+            continue
+        for measure in ("wall_time", "peak_rss", "requests_per_repo"):
+            if base[measure] > 0 and result[measure] > base[measure] * (1 + tolerance):
+                regressions.append(f"{size} repos: {measure} {result[measure]} > {base[measure]} "
+                                   f"(+{(result[measure] / base[measure] - 1) * 100:.0f}%)")
+        if result["failed_repos"] > base["failed_repos"]:
+            regressions.append(f"{size} repos: {result['failed_repos']} failed repositories "
+                               f"(baseline: {base['failed_repos']})")
+
+    return regressions
+
+
+def print_results(results, baseline):
+    print(f"{'repos':>6} {'wall[s]':>9} {'base':>9} {'rss[MiB]':>9} {'base':>9} {'req/repo':>9} {'base':>9} "
+          f"{'failed':>7} {'retries':>8}  requests per host")
+    for size, r in results.items():
+        b = baseline.get(size, {})
+        print(f"{size:>6} {r['wall_time']:>9.2f} {b.get('wall_time', '-'):>9} {r['peak_rss'] / 2 ** 20:>9.1f} "
+              f"{_mib(b.get('peak_rss')):>9} {r['requests_per_repo']:>9} {b.get('requests_per_repo', '-'):>9} "
+              f"{r['failed_repos']:>7} {r['retries']:>8}  {r['requests']}")
+
+
+def _mib(value):
+    return "-" if value is None else f"{value / 2 ** 20:.1f}"
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="bench.fleet_benchmark",
+                                     description="Runs wp.app against stand-in servers for synthetic fleets")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"fleet-sizes to run (default: {DEFAULT_SIZES})")
+    parser.add_argument("--parallel", type=int, default=10, help="max_parallel_repos of the app")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds each request of the stand-ins takes")
+    parser.add_argument("--jitter", type=float, default=0.01, help="additional random latency (up to seconds)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests failing with a 503")
+    parser.add_argument("--build-duration", type=float, default=1.0, help="seconds a build takes")
+    parser.add_argument("--build-failure-rate", type=float, default=0.0, help="share of failing builds")
+    parser.add_argument("--release-duration", type=float, default=0.5, help="seconds a release takes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"allowed regression against the baseline (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument("--keep", action="store_true", help="keep fleets, workdirs and logs of the app")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.child is not None:
+        run_child(args.child)
+        return
+
+    settings = fake_upstream.FakeSettings(args.latency, args.jitter, args.failure_rate, args.build_duration,
+                                          args.build_failure_rate, args.release_duration, args.seed)
+    results = {}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        directory = tempfile.mkdtemp(prefix=f"wp-bench-{size}-")
+        print(f"run fleet of {size} repositories in {directory} ...")
+        results[str(size)] = run_fleet(size, settings, args.parallel, directory)
+        if not args.keep:
+            subprocess.run(["rm", "-rf", directory], check=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.loads(f.read())
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(json.dumps(dict(baseline, **results), indent=2))
+        print(f"saved baseline to {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    if len(regressions) > 0:
+        sys.exit("Regressions against the baseline:\n" + "\n".join(regressions))
+
+
+if __name__ == '__main__':
+    main()
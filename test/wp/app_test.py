@@ -16,23 +16,56 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import json
+import os
+import tempfile
+import threading
 import unittest
 import time
 from mockito import when, mock, unstub, ANY, verify, verifyZeroInteractions
 
 from wp import app
+from wp import config as conf
+from wp import cassette
+from wp import deadline
+from wp import history
+from wp import instrumentation
 from wp.git.repository_fetcher import RepositoryFetcher
+from wp import plan
 from wp import repos
-from wp.project import docker_hub as dh
+from wp import run_journal
+from wp import profiling
+from wp import sharding
+from wp import tracing
+from wp import workers
+from wp.project import upstream
 from wp.project import updater
+from wp.pipeline import build_scheduler
 from wp.pipeline import pipeline_interaction as pipe
 from wp.pipeline import release_pipeline_interaction as rpi
+from wp.pipeline import release_tracker
 
 
 class AppTest(unittest.TestCase):
     def setUp(self) -> None:
         unittest.TestCase.setUp(self)
         self.orig_repos = repos.to_check
+        self.orig_max_parallel_repos = getattr(conf, "max_parallel_repos", 1)
+        self.orig_stage_budgets = getattr(conf, "stage_budgets", None)
+        self.orig_run_budget = getattr(conf, "run_budget", None)
+        self.orig_workdir = conf.workdir
+        self.orig_intervals = {name: getattr(conf, name, None)
+                               for name in ("poll_interval", "max_poll_interval", "pipeline_start_delay",
+                                            "service_hook_port")}
+        self.orig_shard_status_dir = getattr(conf, "shard_status_dir", None)
+        self.journal = run_journal.RunJournal()
+        when(run_journal).open_journal().thenReturn(self.journal)
+        when(instrumentation).export(ANY())
+        when(tracing).export()
+        tracing.set_default_recorder(tracing.Recorder())
+        instrumentation.set_default_metrics(instrumentation.Metrics())
+        self.history = history.RunHistory(":memory:")
+        history.set_default_history(self.history)
         self.dummy_latest_version = "5.4.2"
         self.dummy_init_repo_path = "/data/DUS/infra-docker-contentengine"
         self.dummy_img_repo_path = "/data/DUS/infra-docker-contentengine-img"
@@ -48,69 +81,431 @@ class AppTest(unittest.TestCase):
     def tearDown(self) -> None:
         unittest.TestCase.tearDown(self)
         repos.to_check = self.orig_repos
+        conf.max_parallel_repos = self.orig_max_parallel_repos
+        conf.stage_budgets = self.orig_stage_budgets
+        conf.run_budget = self.orig_run_budget
+        conf.workdir = self.orig_workdir
+        for name, value in self.orig_intervals.items():
+            setattr(conf, name, value)
+        cassette.activate(None)
+        conf.shard_status_dir = self.orig_shard_status_dir
+        run_journal.set_default_journal(None)
+        instrumentation.set_default_metrics(None)
+        tracing.set_default_recorder(None)
+        history.set_default_history(None)
+        self.history.close()
         unstub()
 
     def test_process_repository(self):
         when(RepositoryFetcher).clone_or_update_repo().thenReturn(self.dummy_img_repo_path)
         when(RepositoryFetcher).cleanup()
-        when(app).process_img_repo(ANY(), ANY(), ANY())
+        when(app).process_img_repo(ANY(), ANY(), ANY(), ANY())
 
         result = app.process_repository(self.dummy_repo, "dummy_repo", self.dummy_latest_version)
         self.assertEqual(0, result)
 
         verify(RepositoryFetcher, times=1).clone_or_update_repo()
         verify(RepositoryFetcher, times=1).cleanup()
-        verify(app, times=1).process_img_repo(self.dummy_repo, self.dummy_img_repo_path, self.dummy_latest_version)
+        verify(app, times=1).process_img_repo(self.dummy_repo, self.dummy_img_repo_path, self.dummy_latest_version,
+                                              "dummy_repo")
+
+    def test_process_repository_keeps_clone(self):
+        when(RepositoryFetcher).clone_or_update_repo().thenReturn(self.dummy_img_repo_path)
+        when(RepositoryFetcher).cleanup()
+        when(app).process_img_repo(ANY(), ANY(), ANY(), ANY())
+
+        result = app.process_repository(self.dummy_repo, "dummy_repo", self.dummy_latest_version, keep_clone=True)
+        self.assertEqual(0, result)
+
+        verify(RepositoryFetcher, times=0).cleanup()
+
+    def test_process_repository_for_exceeded_stage_budget(self):
+        conf.stage_budgets = {"build": 0.1}
+        when(RepositoryFetcher).clone_or_update_repo().thenReturn(self.dummy_img_repo_path)
+        when(RepositoryFetcher).cleanup()
+        when(updater).compare_and_update(ANY(), ANY(), ANY(), ANY()).thenReturn(updater.UpdateResult(True, False))
+        when(app).wait_for_build(ANY(), ANY(), ANY()).thenAnswer(lambda *args: deadline.sleep(60))
+        when(app).trigger_database_update(ANY())
+
+        start = time.monotonic()
+        result = app.process_repository(self.dummy_repo, "dummy_repo", self.dummy_latest_version, keep_clone=True)
+        self.assertEqual(1, result)
+        self.assertLess(time.monotonic() - start, 5)
+
+        verify(app, times=0).trigger_database_update(ANY(), ANY())
+        verify(RepositoryFetcher, times=1).cleanup()
+
+    def test_process_repositories_within_run_budget(self):
+        repos.to_check = self._dummy_repos()
+        conf.run_budget = 42
+        budgets = []
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenAnswer(
+            lambda *args: budgets.append(deadline.current().limiting().name) or 0)
+
+        result = app.process_repositories("5.4.2")
+        self.assertEqual(0, result)
+        self.assertEqual(["run", "run", "run"], budgets)
+
+    def test_process_repositories_in_repo_workers(self):
+        repos.to_check = self._dummy_repos()
+        repo_workers = mock({"processes": 2}, spec=workers.RepoWorkers)
+        when(workers).create_workers().thenReturn(repo_workers)
+        when(repo_workers).run(ANY(), "5.4.2", False, ANY(), ANY(), ANY()).thenReturn(1)
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenReturn(0)
+
+        self.assertEqual(1, app.process_repositories("5.4.2"))
+        verify(app, times=0).process_repository(ANY(), ANY(), ANY(), ANY())
+
+    def test_process_repositories_in_threads_while_recording(self):
+        repos.to_check = self._dummy_repos()
+        repo_workers = mock({"processes": 2}, spec=workers.RepoWorkers)
+        when(workers).create_workers().thenReturn(repo_workers)
+        cassette.activate(mock(cassette.Cassette))
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenReturn(0)
+
+        self.assertEqual(0, app.process_repositories("5.4.2"))
+        verify(app, times=3).process_repository(ANY(), ANY(), ANY(), ANY())
+        verify(repo_workers, times=0).run(ANY(), ANY(), ANY(), ANY(), ANY(), ANY())
+
+    def test_process_repositories_starts_longest_builds_first(self):
+        repos.to_check = {key: dict(self.dummy_repo, **{"build-img-pipeline": f"{key}-img"})
+                          for key in ("short", "long", "medium")}
+        for key, duration in (("short", 60.0), ("long", 600.0), ("medium", 300.0)):
+            self.history.record_build(key, "PRJ", f"{key}-img", 1, "succeeded", duration)
+        started = []
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenAnswer(
+            lambda repo, key, *args: started.append(key) or 0)
+
+        self.assertEqual(0, app.process_repositories("5.4.2"))
+        self.assertEqual(["long", "medium", "short"], started)
+
+    def test_process_repository_records_history(self):
+        when(RepositoryFetcher).clone_or_update_repo().thenReturn(self.dummy_img_repo_path)
+        when(RepositoryFetcher).cleanup()
+        when(app).process_img_repo(ANY(), ANY(), ANY(), ANY()).thenAnswer(
+            lambda *args: run_journal.default_journal().record("dummy_repo", run_journal.PUSHED,
+                                                                  update={"wp": True}))
+        app.process_repository(self.dummy_repo, "dummy_repo", self.dummy_latest_version)
+        self.assertEqual({"result": "succeeded", "error": None, "version": self.dummy_latest_version},
+                         self.history.last_result("dummy_repo"))
+
+        when(app).process_img_repo(ANY(), ANY(), ANY(), ANY()).thenRaise(RuntimeError("TEST ERROR"))
+        app.process_repository(self.dummy_repo, "other_repo", self.dummy_latest_version)
+        self.assertEqual({"result": "failed", "error": "RuntimeError('TEST ERROR')", "version": None},
+                         self.history.last_result("other_repo"))
+
+    def test_process_repository_skips_completed_repository(self):
+        run_journal.default_journal().record("dummy_repo", run_journal.DONE)
+        when(RepositoryFetcher).clone_or_update_repo()
+        when(app).process_img_repo(ANY(), ANY(), ANY(), ANY())
+
+        self.assertEqual(0, app.process_repository(self.dummy_repo, "dummy_repo", self.dummy_latest_version))
+
+        verify(RepositoryFetcher, times=0).clone_or_update_repo()
+        verify(app, times=0).process_img_repo(ANY(), ANY(), ANY(), ANY())
+
+    def test_process_repository_resumes_pushed_repository(self):
+        journal = run_journal.default_journal()
+        journal.record("dummy_repo", run_journal.PUSHED, sha="a1b2c3", update={
+            "wp": True, "plugins": False, "fingerprint": "f1ng3rpr1nt", "prebuilt": None,
+            "parent_digests": {"wordpress:5.4.2-apache": "sha256:42"}, "refreshed_images": []})
+        journal.record_release("dummy_repo", "update-pipeline", 27253)
+        when(RepositoryFetcher).clone_or_update_repo()
+        when(RepositoryFetcher).cleanup()
+        when(updater).compare_and_update(ANY(), ANY(), ANY(), ANY())
+        when(app).wait_for_build(ANY(), ANY(), ANY()).thenReturn(36)
+        when(updater).record_image(ANY(), ANY(), ANY(), ANY())
+        dummy_pipeline = mock(rpi.ReleasePipeline)
+        when(rpi).ReleasePipeline(ANY(), ANY()).thenReturn(dummy_pipeline)
+        when(dummy_pipeline).validate().thenReturn({"id": 21, "artifacts": [
+            {"alias": "_wp-cloud-img", "type": "Build", "definitionReference": {"definition": {"id": "7"}}}]})
+        when(dummy_pipeline).trigger_release(ANY(), ANY()).thenReturn({"id": 27254})
+        dummy_build_pipeline = mock(pipe.Pipeline)
+        when(pipe).Pipeline("PRJ", "wp-cloud-img").thenReturn(dummy_build_pipeline)
+        when(dummy_build_pipeline).validate().thenReturn({"id": 7})
+        dummy_tracker = mock(release_tracker.ReleaseTracker)
+        when(release_tracker).default_tracker().thenReturn(dummy_tracker)
+        when(dummy_tracker).wait_for_release(ANY(), ANY()).thenReturn("succeeded")
+
+        self.assertEqual(0, app.process_repository(self.dummy_repo, "dummy_repo", self.dummy_latest_version))
+
+        # no new clone, no new check/push - the build of the pushed commit is waited for
+        verify(RepositoryFetcher, times=0).clone_or_update_repo()
+        verify(RepositoryFetcher, times=0).cleanup()
+        verify(updater, times=0).compare_and_update(ANY(), ANY(), ANY(), ANY())
+        verify(app, times=1).wait_for_build("PRJ", "wp-cloud-img", "a1b2c3")
+        # the db-update was already triggered, only the rollout is new
+        verify(rpi, times=1).ReleasePipeline("PRJ", self.dummy_repo["rollout-pipeline"])
+        # the release deploys exactly the image of the build
+        verify(dummy_pipeline, times=1).trigger_release(21, {"_wp-cloud-img": 36})
+        verify(dummy_tracker, times=1).wait_for_release("PRJ", 27253)
+        verify(dummy_tracker, times=1).wait_for_release("PRJ", 27254)
+        self.assertEqual(run_journal.DONE, journal.stage("dummy_repo"))
+        self.assertEqual(36, journal.entry("dummy_repo")["build_id"])
+
+    def test_process_repository_journal(self):
+        journal = run_journal.default_journal()
+        dummy_update = updater.UpdateResult(True, False)
+        dummy_update.pushed_sha = "a1b2c3"
+        when(RepositoryFetcher).clone_or_update_repo().thenReturn(self.dummy_img_repo_path)
+        when(RepositoryFetcher).cleanup()
+        when(updater).compare_and_update(ANY(), ANY(), ANY(), ANY()).thenReturn(dummy_update)
+        when(app).provide_image(ANY(), ANY()).thenReturn(36)
+        when(app).run_release(ANY(), ANY(), ANY()).thenRaise(Exception("TEST ERROR"))
+
+        self.assertEqual(1, app.process_repository(self.dummy_repo, "dummy_repo", self.dummy_latest_version))
+
+        entry = journal.entry("dummy_repo")
+        self.assertEqual(run_journal.BUILT, entry["stage"])
+        self.assertEqual("a1b2c3", entry["sha"])
+        self.assertEqual(36, entry["build_id"])
+        self.assertEqual("TEST ERROR", entry["error"])
+
+    def test_main_exports_metrics(self):
+        repos.to_check = self._dummy_repos()
+        when(app).determine_latest_version().thenReturn("5.4.2")
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenReturn(0, 1, 0)
+
+        with self.assertRaises(SystemExit):
+            app.main([])
+
+        verify(instrumentation, times=1).export(ANY())
+        self.assertEqual(1, instrumentation.default_metrics().timer("run_duration")[0])
+
+    def test_process_repository_records_stages(self):
+        when(RepositoryFetcher).clone_or_update_repo().thenReturn(self.dummy_img_repo_path)
+        when(RepositoryFetcher).cleanup()
+        when(updater).compare_and_update(ANY(), ANY(), ANY(), ANY()).thenRaise(Exception("TEST ERROR"))
+
+        app.process_repository(self.dummy_repo, "dummy_repo", self.dummy_latest_version)
+
+        metrics = instrumentation.default_metrics()
+        self.assertEqual(1, metrics.timer("stage_duration", stage="fetch", result="succeeded")[0])
+        self.assertEqual(1, metrics.timer("stage_duration", stage="update", result="failed")[0])
+        self.assertEqual(1, metrics.counter("repositories", result="failed"))
+
+    def test_process_repositories_traces_repositories(self):
+        repos.to_check = self._dummy_repos()
+        conf.max_parallel_repos = 3
+        when(RepositoryFetcher).clone_or_update_repo().thenReturn(self.dummy_img_repo_path)
+        when(RepositoryFetcher).cleanup()
+        when(updater).compare_and_update(ANY(), ANY(), ANY(), ANY()).thenReturn(updater.UpdateResult())
+
+        app.process_repositories("5.4.2")
+
+        spans = tracing.default_recorder().spans()
+        run = [s for s in spans if s.name == "run"][0]
+        repo_spans = {s.attributes["key"]: s for s in spans if s.name == "repo"}
+        self.assertEqual(set(repos.to_check), set(repo_spans))
+        for repo_span in repo_spans.values():
+            self.assertEqual(run.span_id, repo_span.parent_id)
+            children = sorted(s.name for s in spans if s.parent_id == repo_span.span_id)
+            self.assertEqual(["fetch", "update"], children)
+        verify(tracing, times=1).export()
+
+    def test_main_profile(self):
+        repos.to_check = self._dummy_repos()
+        when(app).determine_latest_version().thenReturn("5.4.2")
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenReturn(1)
+        when(profiling).start()
+        when(profiling).stop()
+
+        with self.assertRaises(SystemExit):
+            app.main(["--profile"])
+
+        verify(profiling, times=1).start()
+        verify(profiling, times=1).stop()
+
+    def test_main_replay(self):
+        repos.to_check = self._dummy_repos()
+        conf.poll_interval = 10
+        conf.max_poll_interval = 60
+        conf.pipeline_start_delay = 5
+        player = mock(cassette.Cassette)
+        when(cassette).Cassette("run.cassette.gz", cassette.REPLAY, 10.0).thenReturn(player)
+        when(player).open().thenReturn(player)
+        when(player).close()
+        when(app).determine_latest_version().thenReturn("5.4.2")
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenAnswer(
+            lambda *args: self.assertIs(player, cassette.active()) or 0)
+
+        app.main(["--replay", "run.cassette.gz", "--replay-speed", "10"])
+
+        self.assertEqual((1, 6, 0.5), (conf.poll_interval, conf.max_poll_interval, conf.pipeline_start_delay))
+        self.assertIsNone(cassette.active())
+        verify(player, times=1).close()
+
+    def test_main_plan(self):
+        repos.to_check = self._dummy_repos()
+        dummy_plan = {"repositories": {}, "pending": 0, "errors": 0, "estimated_build_seconds": 0}
+        when(app).determine_latest_version().thenReturn("5.4.2")
+        when(plan).plan_fleet("5.4.2", repos.to_check).thenReturn(dummy_plan)
+        when(plan).write_plan(ANY(), ANY())
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY())
+
+        app.main(["--plan", "--plan-output", "/tmp/dummy-plan.json"])
+
+        verify(plan, times=1).write_plan(dummy_plan, "/tmp/dummy-plan.json")
+        verify(app, times=0).process_repository(ANY(), ANY(), ANY(), ANY())
+        verify(run_journal, times=0).open_journal()
+
+    def test_main_plan_for_errors(self):
+        repos.to_check = self._dummy_repos()
+        when(app).determine_latest_version().thenReturn("5.4.2")
+        when(plan).plan_fleet(ANY(), ANY()).thenReturn({"repositories": {}, "pending": 0, "errors": 1,
+                                                        "estimated_build_seconds": 0})
+        when(plan).write_plan(ANY(), ANY())
+
+        with self.assertRaises(SystemExit):
+            app.main(["--plan"])
+
+        verify(plan, times=1).write_plan(ANY(), None)
+
+    def test_parse_args_for_record_and_replay(self):
+        with self.assertRaises(SystemExit):
+            app.parse_args(["--record", "a.cassette.gz", "--replay", "b.cassette.gz"])
+
+    def test_main_resume(self):
+        repos.to_check = self._dummy_repos()
+        when(self.journal).resume().thenReturn("5.4.1")
+        when(app).determine_latest_version()
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenReturn(0)
+
+        app.main(["--resume"])
+
+        verify(app, times=0).determine_latest_version()
+        verify(app, times=3).process_repository(ANY(), ANY(), "5.4.1", False)
+        self.assertIs(self.journal, run_journal.default_journal())
+
+    def test_main_resume_without_interrupted_run(self):
+        repos.to_check = self._dummy_repos()
+        when(app).determine_latest_version().thenReturn("5.4.2")
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenReturn(0)
+
+        app.main(["--resume"])
+
+        verify(app, times=3).process_repository(ANY(), ANY(), "5.4.2", False)
+
+    def test_process_repository_removes_clone_for_error(self):
+        when(RepositoryFetcher).clone_or_update_repo().thenReturn(self.dummy_img_repo_path)
+        when(RepositoryFetcher).cleanup()
+        when(app).process_img_repo(ANY(), ANY(), ANY(), ANY()).thenRaise(Exception("TEST ERROR"))
+
+        result = app.process_repository(self.dummy_repo, "dummy_repo", self.dummy_latest_version, keep_clone=True)
+        self.assertEqual(1, result)
+
+        verify(RepositoryFetcher, times=1).cleanup()
 
     def test_process_img_repo(self):
         dummy_release_details = {"id": 21, "name": "update pipeline"}
-        when(updater).compare_and_update(ANY(), ANY()).thenReturn(True)
-        when(app).wait_for_build(ANY(), ANY())
+        dummy_update = updater.UpdateResult(True, False)
+        dummy_update.fingerprint = "f1ng3rpr1nt"
+        when(updater).compare_and_update(ANY(), ANY(), ANY(), ANY()).thenReturn(dummy_update)
+        when(app).wait_for_build(ANY(), ANY(), ANY()).thenReturn(36)
+        when(updater).record_image(ANY(), ANY(), ANY(), ANY())
+        when(pipe.Pipeline).validate().thenReturn({"id": 7})
         dummy_pipeline = mock(rpi.ReleasePipeline)
         when(rpi).ReleasePipeline(ANY(), ANY()).thenReturn(dummy_pipeline)
         when(dummy_pipeline).validate().thenReturn(dummy_release_details)
-        when(dummy_pipeline).trigger_release(ANY())
+        when(dummy_pipeline).trigger_release(ANY(), ANY()).thenReturn({"id": 27253})
+        dummy_tracker = mock(release_tracker.ReleaseTracker)
+        when(release_tracker).default_tracker().thenReturn(dummy_tracker)
+        when(dummy_tracker).wait_for_release(ANY(), ANY()).thenReturn("succeeded")
 
         app.process_img_repo(self.dummy_repo, self.dummy_img_repo_path, self.dummy_latest_version)
 
-        verify(updater, times=1).compare_and_update(self.dummy_img_repo_path, self.dummy_latest_version)
-        verify(app, times=1).wait_for_build(self.dummy_repo["project"], self.dummy_repo["build-img-pipeline"])
+        verify(updater, times=1).compare_and_update(self.dummy_img_repo_path, self.dummy_latest_version,
+                                                    ("PRJ", "wp-cloud-img"), None)
+        verify(app, times=1).wait_for_build(self.dummy_repo["project"], self.dummy_repo["build-img-pipeline"], None)
+        verify(updater, times=1).record_image(dummy_update, "PRJ", "wp-cloud-img", 36)
         verify(rpi, times=1).ReleasePipeline(self.dummy_repo["project"], self.dummy_repo["update-pipeline"])
         verify(rpi, times=1).ReleasePipeline(self.dummy_repo["project"], self.dummy_repo["rollout-pipeline"])
         verify(dummy_pipeline, times=2).validate()
-        verify(dummy_pipeline, times=2).trigger_release(21)
+        verify(dummy_pipeline, times=2).trigger_release(21, None)
+        verify(dummy_tracker, times=2).wait_for_release("PRJ", 27253)
+
+    def test_process_img_repo_for_failed_database_update(self):
+        dummy_update = updater.UpdateResult(True, False)
+        when(updater).compare_and_update(ANY(), ANY(), ANY(), ANY()).thenReturn(dummy_update)
+        when(app).provide_image(ANY(), ANY())
+        when(app).run_release(ANY(), ANY(), ANY()).thenRaise(Exception("TEST ERROR"))
+
+        with self.assertRaises(Exception):
+            app.process_img_repo(self.dummy_repo, self.dummy_img_repo_path, self.dummy_latest_version)
+
+        # no rollout without successful db-update
+        verify(app, times=1).run_release(self.dummy_repo, None, "update-pipeline")
+        verify(app, times=0).run_release(self.dummy_repo, None, "rollout-pipeline")
+
+    def test_run_release_for_failed_release(self):
+        dummy_pipeline = mock(rpi.ReleasePipeline)
+        when(rpi).ReleasePipeline(ANY(), ANY()).thenReturn(dummy_pipeline)
+        when(dummy_pipeline).validate().thenReturn({"id": 21})
+        when(dummy_pipeline).trigger_release(ANY(), ANY()).thenReturn({"id": 27253})
+        dummy_tracker = mock(release_tracker.ReleaseTracker)
+        when(release_tracker).default_tracker().thenReturn(dummy_tracker)
+        when(dummy_tracker).wait_for_release(ANY(), ANY()).thenReturn("rejected")
+
+        with self.assertRaises(Exception):
+            app.run_release(self.dummy_repo, "dummy_repo", "rollout-pipeline")
+
+        verify(dummy_tracker, times=1).wait_for_release("PRJ", 27253)
 
     def test_process_img_repo_for_no_update_required(self):
-        when(updater).compare_and_update(ANY(), ANY()).thenReturn(False)
-        when(app).wait_for_build(ANY(), ANY())
+        when(updater).compare_and_update(ANY(), ANY(), ANY(), ANY()).thenReturn(updater.UpdateResult())
+        when(app).wait_for_build(ANY(), ANY(), ANY())
         when(rpi.ReleasePipeline)
         when(pipe.Pipeline)
 
         app.process_img_repo(self.dummy_repo, self.dummy_img_repo_path, self.dummy_latest_version)
 
-        verify(updater, times=1).compare_and_update(self.dummy_img_repo_path, self.dummy_latest_version)
-        verify(app, times=0).wait_for_build(ANY(), ANY())
+        verify(updater, times=1).compare_and_update(self.dummy_img_repo_path, self.dummy_latest_version,
+                                                    ("PRJ", "wp-cloud-img"), None)
+        verify(app, times=0).wait_for_build(ANY(), ANY(), ANY())
         verifyZeroInteractions(rpi.ReleasePipeline, pipe.Pipeline)
 
+    def test_provide_image_for_reusable_image(self):
+        dummy_update = updater.UpdateResult(True, True)
+        dummy_update.prebuilt = {"project": "PRJ", "pipeline": "wp-cloud-img", "build_id": 36, "mode": "reuse"}
+        when(app).wait_for_build(ANY(), ANY(), ANY())
+        when(app).retag_image(ANY(), ANY())
+        when(updater).record_image(ANY(), ANY(), ANY(), ANY())
+
+        self.assertEqual(36, app.provide_image(self.dummy_repo, dummy_update))
+
+        verify(app, times=0).wait_for_build(ANY(), ANY(), ANY())
+        verify(app, times=0).retag_image(ANY(), ANY())
+        verify(updater, times=1).record_image(dummy_update, "PRJ", "wp-cloud-img", None)
+
+    def test_provide_image_for_retag(self):
+        dummy_repo = dict(self.dummy_repo, **{"retag-pipeline": "wp-retag"})
+        dummy_update = updater.UpdateResult(True, True)
+        dummy_update.prebuilt = {"project": "PRJ", "pipeline": "wp-other-img", "build_id": 36, "mode": "retag"}
+        dummy_pipeline = mock({"build_id": 42}, spec=pipe.Pipeline)
+        when(pipe).Pipeline(ANY(), ANY()).thenReturn(dummy_pipeline)
+        when(dummy_pipeline).trigger_build_and_wait(ANY()).thenReturn("succeeded")
+        when(app).wait_for_build(ANY(), ANY(), ANY())
+        when(updater).record_image(ANY(), ANY(), ANY(), ANY())
+
+        self.assertEqual(42, app.provide_image(dummy_repo, dummy_update))
+        self.assertEqual("wp-retag", app.image_pipeline(dummy_repo, dummy_update))
+
+        verify(app, times=0).wait_for_build(ANY(), ANY(), ANY())
+        verify(pipe, times=1).Pipeline("PRJ", "wp-retag")
+        verify(dummy_pipeline, times=1).trigger_build_and_wait({"sourceProject": "PRJ", "sourcePipeline": "wp-other-img",
+                                                                "sourceBuildId": 36, "targetPipeline": "wp-cloud-img"})
+
     def test_determine_latest_version(self):
-        expected_image_name = "wordpress"
-        expected_filter = r"[0-9]+\.[0-9]+\.[0-9]-apache"
         expected_result = "5.4.2"
-        dummy_tags = {"narf": "dummy tags"}
-        dummy_filtered_tags = {"zort": "filtered tags"}
-        dummy_highest_version = "5.4.2-apache"
-
-        when(dh).fetch_tags(ANY()).thenReturn(dummy_tags)
-        when(dh).filter_tags_regex(ANY(), ANY()).thenReturn(dummy_filtered_tags)
-        when(dh).determine_highest_version(ANY()).thenReturn(dummy_highest_version)
+        dummy_provider = mock(upstream.WordpressCoreVersionProvider)
+        when(upstream).create_provider().thenReturn(dummy_provider)
+        when(dummy_provider).latest_version().thenReturn(expected_result)
 
         result = app.determine_latest_version()
-        self.assertIsNotNone(result)
         self.assertEqual(expected_result, result)
 
-        verify(dh, times=1).fetch_tags(expected_image_name)
-        verify(dh, times=1).filter_tags_regex(dummy_tags, expected_filter)
-        verify(dh, times=1).determine_highest_version(dummy_filtered_tags)
+        verify(upstream, times=1).create_provider()
+        verify(dummy_provider, times=1).latest_version()
 
     def test_wait_for_build_with_error(self):
         dummy_build_result = "error"
@@ -129,12 +524,107 @@ class AppTest(unittest.TestCase):
         repos.to_check = self._dummy_repos()
         dummy_latest_version = "5.4.2"
         when(app).determine_latest_version().thenReturn(dummy_latest_version)
-        when(app).process_repository(ANY(), ANY(), ANY()).thenReturn(0)
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenReturn(0)
 
-        app.main()
+        app.main([])
 
         verify(app, times=1).determine_latest_version()
-        verify(app, times=3).process_repository(ANY(), ANY(), dummy_latest_version)
+        verify(app, times=3).process_repository(ANY(), ANY(), dummy_latest_version, False)
+
+    def test_main_processes_repositories_concurrently(self):
+        repos.to_check = self._dummy_repos()
+        conf.max_parallel_repos = 3
+        # all repositories have to be in flight at the same time, otherwise the barrier breaks
+        barrier = threading.Barrier(3, timeout=5)
+        when(app).determine_latest_version().thenReturn("5.4.2")
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenAnswer(lambda *args: barrier.wait() * 0)
+
+        app.main([])
+
+        verify(app, times=3).process_repository(ANY(), ANY(), "5.4.2", False)
+
+    def test_main_for_errors(self):
+        repos.to_check = self._dummy_repos()
+        when(app).determine_latest_version().thenReturn("5.4.2")
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenReturn(0, 1, 1)
+
+        with self.assertRaises(SystemExit):
+            app.main([])
+
+    def test_main_processes_only_repositories_of_shard(self):
+        repos.to_check = self._dummy_repos()
+        when(app).determine_latest_version().thenReturn("5.4.2")
+        when(app).process_repository(ANY(), ANY(), ANY(), ANY()).thenReturn(0)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            conf.workdir = workdir + "/"
+            conf.shard_status_dir = None
+            shards = [k for k in repos.to_check if sharding.shard_of(k, 2) == 1]
+            app.main(["--shard-index", "1", "--shard-count", "2", "--run-id", "42"])
+
+            self.assertEqual(os.path.join(workdir, "shard-1", ""), conf.workdir)
+            with open(os.path.join(workdir, "shard-status-1-of-2.json"), 'r') as f:
+                self.assertEqual("42", json.loads(f.read())["run_id"])
+        for key in shards:
+            verify(app, times=1).process_repository(ANY(), key, "5.4.2", False)
+        verify(app, times=len(shards)).process_repository(ANY(), ANY(), ANY(), ANY())
+
+    def test_parse_args_for_invalid_shard(self):
+        with self.assertRaises(SystemExit):
+            app.parse_args(["--shard-index", "2", "--shard-count", "2"])
+        with self.assertRaises(SystemExit):
+            app.parse_args(["--shard-index", "0"])
+        with self.assertRaises(SystemExit):
+            app.parse_args(["--shard-index", "0", "--shard-count", "2"])
+        with self.assertRaises(SystemExit):
+            app.parse_args(["--aggregate-shards", "2"])
+
+    def test_main_aggregate_shards(self):
+        with tempfile.TemporaryDirectory() as status_dir:
+            conf.shard_status_dir = status_dir
+            sharding.write_status(status_dir, "42", 0, 2, ["a"], 0, "5.4.2")
+            with self.assertRaises(SystemExit):
+                app.main(["--aggregate-shards", "2", "--run-id", "42"])
+
+            sharding.write_status(status_dir, "41", 1, 2, ["b"], 0, "5.4.2")
+            with self.assertRaises(SystemExit):
+                app.main(["--aggregate-shards", "2", "--run-id", "42"])
+
+            sharding.write_status(status_dir, "42", 1, 2, ["b"], 0, "5.4.2")
+            app.main(["--aggregate-shards", "2", "--run-id", "42"])
+
+            sharding.write_status(status_dir, "42", 1, 2, ["b"], 1, "5.4.2")
+            with self.assertRaises(SystemExit):
+                app.main(["--aggregate-shards", "2", "--run-id", "42"])
+
+    def test_process_img_repo_releases_build_slot_for_failed_journal(self):
+        dummy_update = updater.UpdateResult(True, False)
+        dummy_slot = mock(build_scheduler.BuildWaveScheduler)
+        dummy_update.build_slot = dummy_slot
+        when(updater).compare_and_update(ANY(), ANY(), ANY(), ANY()).thenReturn(dummy_update)
+        when(dummy_slot).release()
+        dummy_journal = mock(run_journal.RunJournal)
+        when(run_journal).default_journal().thenReturn(dummy_journal)
+        when(dummy_journal).record(ANY(), ANY(), sha=ANY(), update=ANY()).thenRaise(OSError("TEST ERROR"))
+        when(app).deploy_update(ANY(), ANY(), ANY())
+
+        with self.assertRaises(OSError):
+            app.process_img_repo(self.dummy_repo, self.dummy_img_repo_path, self.dummy_latest_version, "dummy")
+
+        verify(dummy_slot, times=1).release()
+        verify(app, times=0).deploy_update(ANY(), ANY(), ANY())
+        self.assertIsNone(dummy_update.build_slot)
+
+    def test_provide_image_releases_build_slot_for_failed_build(self):
+        dummy_update = mock(updater.UpdateResult)
+        dummy_update.prebuilt = None
+        when(dummy_update).release_build_slot()
+        when(app).wait_for_build(ANY(), ANY(), ANY()).thenRaise(Exception("TEST ERROR"))
+
+        with self.assertRaises(Exception):
+            app.provide_image(self.dummy_repo, dummy_update)
+
+        verify(dummy_update, times=1).release_build_slot()
 
     @staticmethod
     def _dummy_repos():
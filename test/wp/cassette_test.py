@@ -0,0 +1,117 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+import requests
+from wp import cassette as sut
+
+
+class CassetteTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "run.cassette.gz")
+        self.sent = []
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        sut.deactivate()
+        self.tmp_dir.cleanup()
+
+    def _send(self, url, **kwargs):
+        self.sent.append(url)
+        if url.endswith("/unreachable"):
+            raise requests.exceptions.ConnectionError("TEST ERROR")
+        response = requests.models.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers["Content-Type"] = "application/json"
+        response._content = f"{{\"poll\": {len(self.sent)}}}".encode("UTF-8")
+        return response
+
+    def _record(self):
+        recorder = sut.Cassette(self.path, sut.RECORD).open()
+        send = recorder.wrap("GET", self._send)
+        send("https://dev.azure.com/org/PRJ/_apis/build/builds/42", timeout=30)
+        send("https://dev.azure.com/org/PRJ/_apis/build/builds/42", timeout=30)
+        recorder.wrap("POST", self._send)("https://api.wordpress.org/plugins/update-check/1.1/", data="plugins=42")
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            send("https://hub.docker.com/unreachable")
+        self.assertEqual("a1b2c3", recorder.pushed_commit("dummy_repo_img", "a1b2c3"))
+        self.assertEqual("f0e1d2", recorder.fetched_commit("dummy_repo_img", "f0e1d2"))
+        recorder.close()
+
+    def test_replay(self):
+        self._record()
+        player = sut.Cassette(self.path, sut.REPLAY, speed=0).open()
+        send = player.wrap("GET", self._send)
+        self.sent = []
+
+        polls = [send("https://dev.azure.com/org/PRJ/_apis/build/builds/42", timeout=5).json() for i in range(3)]
+        posted = player.wrap("POST", self._send)("https://api.wordpress.org/plugins/update-check/1.1/",
+                                                 data="plugins=42")
+
+        self.assertEqual([{"poll": 1}, {"poll": 2}, {"poll": 2}], polls)
+        self.assertEqual({"poll": 3}, posted.json())
+        self.assertEqual("application/json", posted.headers["Content-Type"])
+        self.assertEqual([], self.sent)
+
+    def test_replay_for_recorded_error(self):
+        self._record()
+        player = sut.Cassette(self.path, sut.REPLAY, speed=0).open()
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            player.wrap("GET", self._send)("https://hub.docker.com/unreachable")
+
+    def test_replay_for_unknown_request(self):
+        self._record()
+        player = sut.Cassette(self.path, sut.REPLAY, speed=0).open()
+
+        with self.assertRaises(sut.CassetteMissError):
+            player.wrap("GET", self._send)("https://dev.azure.com/org/PRJ/_apis/build/builds/43")
+
+    def test_replay_for_different_body(self):
+        self._record()
+        player = sut.Cassette(self.path, sut.REPLAY, speed=0).open()
+
+        response = player.wrap("POST", self._send)("https://api.wordpress.org/plugins/update-check/1.1/",
+                                                   data="plugins=7")
+        self.assertEqual({"poll": 3}, response.json())
+
+    def test_replay_pushed_commits(self):
+        self._record()
+        player = sut.Cassette(self.path, sut.REPLAY, speed=0).open()
+
+        self.assertEqual("a1b2c3", player.pushed_commit("dummy_repo_img", "d4e5f6"))
+        with self.assertRaises(sut.CassetteMissError):
+            player.pushed_commit("dummy_repo_img", "d4e5f6")
+
+    def test_replay_fetched_commits(self):
+        self._record()
+        player = sut.Cassette(self.path, sut.REPLAY, speed=0).open()
+
+        self.assertEqual("f0e1d2", player.fetched_commit("dummy_repo_img", "a1b2c3"))
+        self.assertEqual("f0e1d2", player.fetched_commit("dummy_repo_img", "a1b2c3"))
+        with self.assertRaises(sut.CassetteMissError):
+            player.fetched_commit("dummy_repo", "a1b2c3")
+
+
+if __name__ == '__main__':
+    unittest.main()
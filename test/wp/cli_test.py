@@ -0,0 +1,120 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+from mockito import when, unstub, ANY, verify
+from wp import app
+from wp import cli
+from wp import config as conf
+from wp import history
+from wp import run_journal
+from wp import storage
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+# seconds "python -m wp.cli status" may take on top of the start of the interpreter
+STARTUP_BUDGET = 0.15
+HEAVY_MODULES = ("requests", "jinja2", "packaging", "urllib3", "wp.app")
+
+
+class CliTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.orig_workdir = conf.workdir
+        when(app).main(ANY())
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        conf.workdir = self.orig_workdir
+        unstub()
+
+    def test_run_passes_options_to_app(self):
+        cli.main(["run", "--shard-index", "0", "--shard-count", "2"])
+
+        verify(app, times=1).main(["--shard-index", "0", "--shard-count", "2"])
+
+    def test_plan_and_resume(self):
+        cli.main(["plan", "--plan-output", "/tmp/dummy-plan.json"])
+        cli.main(["resume", "--workdir", "/tmp/dummy-workdir"])
+
+        verify(app, times=1).main(["--plan", "--plan-output", "/tmp/dummy-plan.json"])
+        verify(app, times=1).main(["--resume"])
+        self.assertEqual("/tmp/dummy-workdir/", conf.workdir)
+
+    def test_status(self):
+        with TemporaryDirectory("dummy-workdir") as td:
+            journal = run_journal.RunJournal(storage.JsonStore(os.path.join(td, run_journal.JOURNAL_FILE)))
+            journal.start("5.4.2")
+            journal.record("site-a", run_journal.DONE)
+            journal.record("site-b", run_journal.PUSHED)
+            journal.record_error("site-b", RuntimeError("build failed"))
+            run_history = history.RunHistory(os.path.join(td, history.HISTORY_FILE))
+            run_history.start_run("5.4.2", 2)
+            run_history.close()
+            output = io.StringIO()
+
+            with contextlib.redirect_stdout(output), self.assertRaises(SystemExit):
+                cli.main(["status", "--workdir", td])
+
+        report = json.loads(output.getvalue())
+        self.assertEqual("5.4.2", report["run"]["latest_version"])
+        self.assertEqual({"done": 1, "pushed": 1}, report["stages"])
+        self.assertEqual({"site-b": "build failed"}, report["errors"])
+        self.assertEqual(2, report["last_run"]["repositories"])
+
+    def test_status_for_unknown_arguments(self):
+        with self.assertRaises(SystemExit):
+            cli.main(["status", "--shard-index", "0"])
+
+    def test_status_starts_within_budget(self):
+        with TemporaryDirectory("dummy-workdir") as td:
+            baseline = self._run("import time; start = time.perf_counter(); print(time.perf_counter() - start)")
+            result = self._run("import sys, time; start = time.perf_counter(); from wp import cli; "
+                               f"cli.main(['status', '--workdir', '{td}']); duration = time.perf_counter() - start; "
+                               f"print([m for m in {HEAVY_MODULES} if m in sys.modules]); print(duration)")
+
+        loaded, duration = result.splitlines()[-2:]
+        self.assertEqual("[]", loaded)
+        self.assertLess(float(duration) - float(baseline), STARTUP_BUDGET)
+
+    def test_load_config_from_file(self):
+        with TemporaryDirectory("dummy-config") as td:
+            config_file = os.path.join(td, "site.py")
+            with open(config_file, "w") as f:
+                f.write("workdir = '/tmp/dummy-workdir/'\n")
+
+            result = self._run(f"from wp import cli; cli.load_config('{config_file}'); from wp import config; "
+                               f"from wp import storage; print(storage.state_path('x'))")
+
+        self.assertEqual("/tmp/dummy-workdir/x", result.strip())
+
+    @staticmethod
+    def _run(code):
+        return subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, stdout=subprocess.PIPE, check=True,
+                              encoding="UTF-8", env=dict(os.environ, PYTHONPATH=ROOT_DIR)).stdout
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import time
+import unittest
+from mockito import when, unstub, ANY, verify
+from tempfile import TemporaryDirectory
+from wp import app
+from wp import config as conf
+from wp import daemon
+from wp import repos
+from wp.project import wp_plugins as plugins
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.orig_repos = repos.to_check
+        self.orig_workdir = conf.workdir
+        self.sut = daemon.Daemon(check_interval=300, full_run_interval=3600)
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        repos.to_check = self.orig_repos
+        conf.workdir = self.orig_workdir
+        unstub()
+
+    def test_tick_processes_repositories_only_for_changes(self):
+        when(daemon).upstream_signature().thenReturn(
+            {"wp": "5.4.2", "plugins": "a"}, {"wp": "5.4.2", "plugins": "a"}, {"wp": "5.5.0", "plugins": "a"})
+        when(daemon).plugin_signature().thenReturn("a")
+        when(app).process_repositories(ANY(), keep_clones=ANY()).thenReturn(0)
+
+        self.assertTrue(self.sut.tick())
+        self.assertFalse(self.sut.tick())
+        self.assertTrue(self.sut.tick())
+
+        verify(app, times=1).process_repositories("5.4.2", keep_clones=True)
+        verify(app, times=1).process_repositories("5.5.0", keep_clones=True)
+
+    def test_tick_uses_mirrors_after_run_as_baseline(self):
+        # the run itself updated the plugins of the mirrors
+        when(daemon).upstream_signature().thenReturn({"wp": "5.4.2", "plugins": "outdated"},
+                                                     {"wp": "5.4.2", "plugins": "updated"})
+        when(daemon).plugin_signature().thenReturn("updated")
+        when(app).process_repositories(ANY(), keep_clones=ANY()).thenReturn(0)
+
+        self.assertTrue(self.sut.tick())
+        self.assertFalse(self.sut.tick())
+
+    def test_tick_for_full_run_interval(self):
+        when(daemon).upstream_signature().thenReturn({"wp": "5.4.2", "plugins": "a"})
+        when(daemon).plugin_signature().thenReturn("a")
+        when(app).process_repositories(ANY(), keep_clones=ANY()).thenReturn(1)
+
+        self.assertTrue(self.sut.tick())
+        self.sut._last_full_run = time.monotonic() - 3601
+        self.assertTrue(self.sut.tick())
+        self.assertEqual(2, self.sut.runs)
+
+    def test_tick_for_unavailable_upstream(self):
+        when(daemon).upstream_signature().thenRaise(RuntimeError("TEST ERROR"))
+        when(app).process_repositories(ANY(), keep_clones=ANY())
+
+        self.assertFalse(self.sut.tick())
+
+        verify(app, times=0).process_repositories(ANY(), keep_clones=ANY())
+
+    def test_plugin_signature(self):
+        with TemporaryDirectory("workdir") as td:
+            conf.workdir = td + "/"
+            repos.to_check = {"repo1": {"img-repo": "https://example.org/repo1"},
+                              "repo2": {"img-repo": "https://example.org/repo2"},
+                              "repo3": {"img-repo": "https://example.org/repo3"}}
+            self._write_plugin_list(td, "repo1", {"akismet": "4.1.6", "wordpress-seo": "14.6"})
+            self._write_plugin_list(td, "repo2", {"akismet": "4.1.5"})
+            when(plugins).call_wp_api(ANY()).thenReturn(
+                {"plugins": {"akismet": {"new_version": "4.1.7", "package": "x"}}})
+
+            result = json.loads(daemon.plugin_signature())
+
+        self.assertEqual({"updates": {"akismet": "4.1.7"}, "missing": ["repo3"]}, result)
+        verify(plugins, times=1).call_wp_api({"plugins": {"akismet": {"Version": "4.1.5"},
+                                                          "wordpress-seo": {"Version": "14.6"}}})
+
+    def test_plugin_signature_for_no_updates(self):
+        with TemporaryDirectory("workdir") as td:
+            conf.workdir = td + "/"
+            repos.to_check = {"repo1": {"img-repo": "https://example.org/repo1"}}
+            self._write_plugin_list(td, "repo1", {"akismet": "4.1.7"})
+            when(plugins).call_wp_api(ANY()).thenReturn({"plugins": []})
+
+            result = json.loads(daemon.plugin_signature())
+
+        self.assertEqual({"updates": {}, "missing": []}, result)
+
+    @staticmethod
+    def _write_plugin_list(workdir, key, versions):
+        os.makedirs(f"{workdir}/{key}_img/init")
+        plugins.write_plugin_list(f"{workdir}/{key}_img",
+                                  {"plugins": [{"key": k, "version": v} for k, v in versions.items()]})
+
+
+if __name__ == '__main__':
+    unittest.main()
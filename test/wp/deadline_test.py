@@ -0,0 +1,126 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextvars
+import threading
+import time
+import unittest
+from mockito import unstub
+from wp import config as conf
+from wp import deadline as sut
+
+
+class DeadlineTest(unittest.TestCase):
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        unstub()
+
+    def test_without_budget(self):
+        self.assertIsNone(sut.current())
+        self.assertIsNone(sut.remaining())
+        self.assertEqual(30, sut.timeout(30))
+        self.assertIsNone(sut.timeout())
+        sut.check()
+
+    def test_nested_budgets(self):
+        with sut.budget("run", 100):
+            with sut.budget("repo", 10) as repo:
+                self.assertLessEqual(sut.remaining(), 10)
+                self.assertIs(repo, repo.limiting())
+                with sut.budget("stage") as stage:
+                    # a stage without own budget is limited by the enclosing ones
+                    self.assertIs(repo, stage.limiting())
+                    self.assertEqual(5, sut.timeout(5))
+                    self.assertLessEqual(sut.timeout(50), 10)
+            with sut.budget("repo", 1000) as repo:
+                self.assertIsNot(repo, repo.limiting())
+                self.assertLessEqual(sut.remaining(), 100)
+
+        self.assertIsNone(sut.current())
+
+    def test_exceeded_budget(self):
+        with sut.budget("repo", 0.05):
+            with sut.budget("build", 10):
+                time.sleep(0.1)
+                with self.assertRaises(sut.DeadlineExceeded) as e:
+                    sut.check()
+                self.assertEqual("repo", e.exception.name)
+                with self.assertRaises(sut.DeadlineExceeded):
+                    sut.timeout(30)
+
+    def test_sleep_ends_with_budget(self):
+        start = time.monotonic()
+        with sut.budget("build", 0.1):
+            with self.assertRaises(sut.DeadlineExceeded):
+                sut.sleep(10)
+
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_stage(self):
+        orig_budgets = getattr(conf, "stage_budgets", None)
+        conf.stage_budgets = {"build": 42}
+        try:
+            with sut.stage("build") as build:
+                self.assertEqual(42, build.seconds)
+            with sut.stage("release") as release:
+                self.assertIsNone(release.seconds)
+        finally:
+            conf.stage_budgets = orig_budgets
+
+    def test_stage_beside(self):
+        orig_budgets = getattr(conf, "stage_budgets", None)
+        conf.stage_budgets = {"update": 0.2, "queue": 42}
+        try:
+            with sut.budget("repo", 100) as repo:
+                with sut.stage("update") as update:
+                    with sut.stage_beside("queue") as queue:
+                        # waiting longer than the budget of the update
+                        time.sleep(0.3)
+                        sut.check()
+                        self.assertIs(repo, queue.parent)
+                        self.assertEqual(42, queue.seconds)
+                    self.assertIs(update, sut.current())
+                    # the wait didn't use up the budget of the update
+                    sut.check()
+                    self.assertGreater(sut.remaining(), 0.1)
+                    time.sleep(0.25)
+                    with self.assertRaises(sut.DeadlineExceeded):
+                        sut.check()
+        finally:
+            conf.stage_budgets = orig_budgets
+
+    def test_budget_in_threads(self):
+        results = []
+
+        def _remaining():
+            results.append(sut.remaining())
+
+        with sut.budget("run", 10):
+            thread = threading.Thread(target=contextvars.copy_context().run, args=(_remaining,))
+            thread.start()
+            thread.join()
+            thread = threading.Thread(target=_remaining)
+            thread.start()
+            thread.join()
+
+        self.assertLessEqual(results[0], 10)
+        self.assertIsNone(results[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
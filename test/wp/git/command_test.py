@@ -0,0 +1,80 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from wp import config as conf
+from wp import deadline
+from wp import instrumentation
+from wp.git import command as sut
+
+
+class CommandTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.orig_git_timeout = getattr(conf, "git_timeout", sut.DEFAULT_GIT_TIMEOUT)
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        conf.git_timeout = self.orig_git_timeout
+
+    def test_run(self):
+        result = sut.run("echo out && echo err >&2 && exit 3")
+
+        self.assertEqual(3, result.returncode)
+        self.assertEqual("out\n", result.stdout)
+        self.assertEqual("err\n", result.stderr)
+
+    def test_run_counts_git_commands(self):
+        instrumentation.set_default_metrics(instrumentation.Metrics())
+        try:
+            sut.run("git --version && git unknown-subcommand")
+
+            metrics = instrumentation.default_metrics()
+            self.assertEqual(1, metrics.counter("git_commands", command="unknown-subcommand", result="failed"))
+            self.assertEqual(1, metrics.timer("git_command_duration", command="unknown-subcommand")[0])
+        finally:
+            instrumentation.set_default_metrics(None)
+
+    def test_run_for_timeout(self):
+        conf.git_timeout = 0.2
+        start = time.monotonic()
+
+        with self.assertRaises(deadline.DeadlineExceeded):
+            sut.run("sleep 10")
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_run_kills_child_processes(self):
+        with TemporaryDirectory("command") as td:
+            marker = f"{td}/marker"
+            start = time.monotonic()
+            with deadline.budget("fetch", 0.2):
+                with self.assertRaises(deadline.DeadlineExceeded) as e:
+                    # the shell forks the sleep, which would hold the pipes open and touch the marker
+                    sut.run(f"cd {td} && sleep 1 && touch {marker}")
+            self.assertEqual("fetch", e.exception.name)
+            self.assertLess(time.monotonic() - start, 1)
+
+            time.sleep(1.2)
+            self.assertFalse(os.path.exists(marker))
+
+
+if __name__ == '__main__':
+    unittest.main()
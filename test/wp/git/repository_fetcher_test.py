@@ -18,11 +18,12 @@
 
 import os
 import unittest
-import subprocess
 import shutil
 from tempfile import TemporaryDirectory
 from mockito import mock, when, unstub, ANY, verify
+from wp import cassette
 from wp.git.repository_fetcher import RepositoryFetcher
+from wp.git import command
 from wp.git.exceptions import RepositoryException
 from wp import config as conf
 
@@ -36,11 +37,12 @@ class RepositoryFetcherTest(unittest.TestCase):
         self.sut = RepositoryFetcher(self.dummy_url, self.dummy_name)
         self.conf_workdir = conf.workdir
         self.process = mock({"returncode": 0, "stderr": "", "stdout": ""})
-        when(subprocess).run(ANY(str), capture_output=True, encoding='UTF-8', shell=True).thenReturn(self.process)
+        when(command).run(ANY(str)).thenReturn(self.process)
 
     def tearDown(self) -> None:
         unittest.TestCase.tearDown(self)
         conf.workdir = self.conf_workdir
+        cassette.activate(None)
         unstub()
 
     def test_clone_repo(self):
@@ -49,16 +51,16 @@ class RepositoryFetcherTest(unittest.TestCase):
 
         result = self.sut.clone_repo()
         self.assertEqual(expected_target_path, result)
-        verify(subprocess, times=1).run(expected_cmd, capture_output=True, encoding="UTF-8", shell=True)
+        verify(command, times=1).run(expected_cmd)
 
     def test_clone_repo_for_error(self):
         expected_cmd = f"cd {conf.workdir} && git clone {self.dummy_url} {self.dummy_name}"
         dummy_output = "Cloning into 'infra-docker-dummy'..."
         self.process = mock({"returncode": 1, "stderr": "error cloning repo", "stdout": dummy_output})
-        when(subprocess).run(ANY(str), capture_output=True, encoding="UTF-8", shell=True).thenReturn(self.process)
+        when(command).run(ANY(str)).thenReturn(self.process)
 
         self.assertRaises(RepositoryException, self.sut.clone_repo)
-        verify(subprocess, times=1).run(expected_cmd, capture_output=True, encoding="UTF-8", shell=True)
+        verify(command, times=1).run(expected_cmd)
 
     def test_update_repo(self):
         expected_target_path = conf.workdir + self.dummy_name
@@ -66,7 +68,33 @@ class RepositoryFetcherTest(unittest.TestCase):
 
         result = self.sut.update_repo()
         self.assertEqual(expected_target_path, result)
-        verify(subprocess, times=1).run(expected_cmd, capture_output=True, encoding="UTF-8", shell=True)
+        verify(command, times=1).run(expected_cmd)
+
+    def test_clone_or_update_repo_for_recording(self):
+        recorder = mock(cassette.Cassette)
+        recorder.replaying = False
+        when(recorder).fetched_commit(ANY(), ANY()).thenReturn("a1b2c3")
+        cassette.activate(recorder)
+        when(command).run(f"cd {conf.workdir}{self.dummy_name} && git rev-parse HEAD").thenReturn(
+            mock({"returncode": 0, "stderr": "", "stdout": "a1b2c3\n"}))
+
+        self.sut.clone_or_update_repo()
+
+        verify(recorder, times=1).fetched_commit(self.dummy_name, "a1b2c3")
+        verify(command, times=0).run(f"cd {conf.workdir}{self.dummy_name} && git reset -q --hard a1b2c3")
+
+    def test_clone_or_update_repo_for_replay(self):
+        replay = mock(cassette.Cassette)
+        replay.replaying = True
+        when(replay).fetched_commit(ANY(), ANY()).thenReturn("d4e5f6")
+        cassette.activate(replay)
+        when(command).run(f"cd {conf.workdir}{self.dummy_name} && git rev-parse HEAD").thenReturn(
+            mock({"returncode": 0, "stderr": "", "stdout": "a1b2c3\n"}))
+
+        self.assertEqual(conf.workdir + self.dummy_name, self.sut.clone_or_update_repo())
+
+        verify(replay, times=1).fetched_commit(self.dummy_name, "a1b2c3")
+        verify(command, times=1).run(f"cd {conf.workdir}{self.dummy_name} && git reset -q --hard d4e5f6")
 
     def test_clone_or_update_repo_for_update(self):
         with TemporaryDirectory("dummy-repo") as td:
@@ -78,7 +106,7 @@ class RepositoryFetcherTest(unittest.TestCase):
             result = self.sut.clone_or_update_repo()
 
         self.assertEqual(expected_target_path, result)
-        verify(subprocess, times=1).run(expected_cmd, capture_output=True, encoding="UTF-8", shell=True)
+        verify(command, times=1).run(expected_cmd)
 
     def test_clone_or_update_repo_for_clone(self):
         conf.workdir = "/tmp/INVALID/"
@@ -87,7 +115,7 @@ class RepositoryFetcherTest(unittest.TestCase):
 
         result = self.sut.clone_or_update_repo()
         self.assertEqual(expected_target_path, result)
-        verify(subprocess, times=1).run(expected_cmd, capture_output=True, encoding="UTF-8", shell=True)
+        verify(command, times=1).run(expected_cmd)
 
     def test_cleanup(self):
         expected_target_path = conf.workdir + self.dummy_name
@@ -97,6 +125,40 @@ class RepositoryFetcherTest(unittest.TestCase):
 
         verify(shutil, times=1).rmtree(expected_target_path)
 
+    def test_fetch_tree_for_clone(self):
+        conf.workdir = "/tmp/INVALID/"
+        expected_cmd = f"cd {conf.workdir} && git clone -q --depth 1 --filter=blob:none --no-checkout " \
+            f"{self.dummy_url} {self.dummy_name}"
+
+        self.assertEqual(conf.workdir + self.dummy_name, self.sut.fetch_tree())
+        verify(command, times=1).run(expected_cmd)
+
+    def test_fetch_tree_for_update(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            os.makedirs(f"{td}/{self.dummy_name}/.git")
+            conf.workdir = td + "/"
+            expected_cmd = f"cd {conf.workdir}{self.dummy_name} && git fetch -q --depth 1 --filter=blob:none origin"
+
+            self.sut.fetch_tree()
+
+        verify(command, times=1).run(expected_cmd)
+
+    def test_list_tree(self):
+        expected_cmd = f"cd {self.sut.target_path()} && git ls-tree -r --full-tree origin/HEAD"
+        dummy_output = "100644 blob a1b2c3\tDockerfile\n100644 blob d4e5f6\tinit/plugin list.json\n" \
+            "160000 commit 0a1b2c\tvendor/theme\n"
+        when(command).run(expected_cmd).thenReturn(mock({"returncode": 0, "stderr": "", "stdout": dummy_output}))
+
+        result = self.sut.list_tree()
+        self.assertEqual({"Dockerfile": "a1b2c3", "init/plugin list.json": "d4e5f6"}, result)
+
+    def test_read_blob_for_error(self):
+        self.process = mock({"returncode": 128, "stderr": "fatal: bad object", "stdout": ""})
+        when(command).run(ANY(str)).thenReturn(self.process)
+
+        self.assertRaises(RepositoryException, self.sut.read_blob, "a1b2c3")
+        verify(command, times=1).run(f"cd {self.sut.target_path()} && git cat-file blob a1b2c3")
+
 
 if __name__ == '__main__':
     unittest.main()
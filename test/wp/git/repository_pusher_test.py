@@ -16,10 +16,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import subprocess
 import unittest
 from mockito import mock, when, unstub, ANY, verify
 from wp.git.repository_pusher import RepositoryPusher
+from wp import cassette
+from wp.git import command
 from wp.git.exceptions import RepositoryException
 
 
@@ -32,29 +33,68 @@ class RepositoryPusherTest(unittest.TestCase):
 
     def tearDown(self) -> None:
         unittest.TestCase.tearDown(self)
+        cassette.activate(None)
         unstub()
 
     def test_commit_and_push(self):
         dummy_msg = "update wp to version 42"
         expected_cmd = f"cd {self.dummy_path} && git add --all && git commit -m '{dummy_msg}'"
         expected_push_cmd = f"cd {self.dummy_path} && git push"
-        when(subprocess).run(ANY(str), capture_output=True, encoding="UTF-8", shell=True).thenReturn(self.process)
+        when(command).run(ANY(str)).thenReturn(self.process)
 
         self.sut.commit_and_push(dummy_msg)
-        verify(subprocess, times=1).run(expected_cmd, capture_output=True, encoding="UTF-8", shell=True)
-        verify(subprocess, times=1).run(expected_push_cmd, capture_output=True, encoding="UTF-8", shell=True)
+        verify(command, times=1).run(expected_cmd)
+        verify(command, times=1).run(expected_push_cmd)
+
+    def test_commit_and_push_returns_pushed_sha(self):
+        expected_cmd = f"cd {self.dummy_path} && git rev-parse HEAD"
+        when(command).run(ANY(str)).thenReturn(self.process)
+        when(command).run(expected_cmd).thenReturn(mock({"returncode": 0, "stderr": "", "stdout": "a1b2c3\n"}))
+
+        self.assertEqual("a1b2c3", self.sut.commit_and_push("update wp to version 42"))
+
+    def test_commit_and_push_for_replay(self):
+        expected_push_cmd = f"cd {self.dummy_path} && git push"
+        replay = mock(cassette.Cassette)
+        replay.replaying = True
+        when(replay).pushed_commit("tmp", "a1b2c3").thenReturn("d4e5f6")
+        cassette.activate(replay)
+        when(command).run(ANY(str)).thenReturn(mock({"returncode": 0, "stderr": "", "stdout": "a1b2c3\n"}))
+
+        self.assertEqual("d4e5f6", self.sut.commit_and_push("update wp to version 42"))
+        verify(command, times=0).run(expected_push_cmd)
+        verify(command, times=1).run(f"cd {self.dummy_path} && git reset -q --hard HEAD~1")
+
+    def test_commit_and_push_allow_empty(self):
+        dummy_msg = "rebuild for parent-image wordpress:5.4.2-apache@sha256:42"
+        expected_cmd = f"cd {self.dummy_path} && git add --all && git commit --allow-empty -m '{dummy_msg}'"
+        when(command).run(ANY(str)).thenReturn(self.process)
+
+        self.sut.commit_and_push(dummy_msg, allow_empty=True)
+        verify(command, times=1).run(expected_cmd)
 
     def test_commit_and_push_for_error(self):
         dummy_msg = "update wp to version 42"
         expected_cmd = f"cd {self.dummy_path} && git add --all && git commit -m '{dummy_msg}'"
         expected_push_cmd = f"cd {self.dummy_path} && git push"
         self.process = mock({"returncode": 1, "stderr": "error cloning repo", "stdout": "TEST ERROR"})
-        when(subprocess).run(ANY(str), capture_output=True, encoding="UTF-8", shell=True).thenReturn(self.process)
+        when(command).run(ANY(str)).thenReturn(self.process)
 
         with self.assertRaises(RepositoryException):
             self.sut.commit_and_push(dummy_msg)
-        verify(subprocess, times=1).run(expected_cmd, capture_output=True, encoding="UTF-8", shell=True)
-        verify(subprocess, times=0).run(expected_push_cmd, capture_output=True, encoding="UTF-8", shell=True)
+        verify(command, times=1).run(expected_cmd)
+        verify(command, times=0).run(expected_push_cmd)
+
+    def test_staged_blobs(self):
+        expected_cmd = f"cd {self.dummy_path} && git add --all && git ls-files -s"
+        dummy_output = "100644 a1b2c3 0\tDockerfile\n100755 d4e5f6 0\tinit/plugin list.json\n"
+        self.process = mock({"returncode": 0, "stderr": "", "stdout": dummy_output})
+        when(command).run(ANY(str)).thenReturn(self.process)
+
+        result = self.sut.staged_blobs()
+        self.assertEqual({"Dockerfile": "a1b2c3", "init/plugin list.json": "d4e5f6"}, result)
+
+        verify(command, times=1).run(expected_cmd)
 
 
 if __name__ == '__main__':
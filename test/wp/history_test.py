@@ -0,0 +1,124 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from mockito import when, unstub
+from wp import history
+
+
+class RunHistoryTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.sut = history.RunHistory(":memory:")
+        self.sut.start_run("5.4.2", 3)
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        history.set_default_history(None)
+        self.sut.close()
+        unstub()
+
+    def test_build_duration(self):
+        for duration in (300.0, 100.0, 200.0):
+            self.sut.record_build("site-a", "PRJ", "site-a-img", 42, "succeeded", duration)
+        self.sut.record_build("site-a", "PRJ", "site-a-img", 43, "failed", 5.0)
+        self.sut.record_build("site-a", "PRJ", "site-a-img", 44, "succeeded", None)
+
+        self.assertEqual(200.0, self.sut.build_duration("PRJ", "site-a-img"))
+        self.assertIsNone(self.sut.build_duration("PRJ", "site-b-img"))
+
+    def test_repository_duration_and_last_result(self):
+        self.sut.record_repository("site-a", "succeeded", 60.0, version="5.4.2")
+        self.sut.record_repository("site-a", "failed", 1.0, error="RuntimeError('boom')")
+
+        self.assertEqual(60.0, self.sut.repository_duration("site-a"))
+        self.assertEqual({"result": "failed", "error": "RuntimeError('boom')", "version": None},
+                         self.sut.last_result("site-a"))
+        self.assertIsNone(self.sut.last_result("site-b"))
+
+    def test_is_persisted(self):
+        with TemporaryDirectory("dummy-history") as td:
+            path = os.path.join(td, "state", history.HISTORY_FILE)
+            run_history = history.RunHistory(path)
+            run_history.start_run("5.4.2", 1)
+            run_history.record_build("site-a", "PRJ", "site-a-img", 42, "succeeded", 120.0)
+            run_history.finish_run(0)
+            run_history.close()
+
+            run_history = history.RunHistory(path)
+            self.assertEqual(120.0, run_history.build_duration("PRJ", "site-a-img"))
+            run_history.close()
+
+    def test_record_stage_of_current_repository(self):
+        history.set_default_history(self.sut)
+        history.record_stage("fetch", "succeeded", 1.0)
+        with history.repository("site-a"):
+            history.record_stage("fetch", "succeeded", 2.0)
+
+        self.assertEqual([("site-a", "fetch", "succeeded", 2.0)],
+                         self.sut._db.execute("SELECT key, stage, result, duration FROM stages").fetchall())
+
+    def test_longest_first(self):
+        repositories = {key: {"project": "PRJ", "build-img-pipeline": f"{key}-img"}
+                        for key in ("short", "unknown", "long")}
+        self.sut.record_build("short", "PRJ", "short-img", 1, "succeeded", 60.0)
+        self.sut.record_build("long", "PRJ", "long-img", 2, "succeeded", 600.0)
+
+        result = history.longest_first(repositories, self.sut)
+        self.assertEqual(["unknown", "long", "short"], list(result.keys()))
+        self.assertEqual(repositories["long"], result["long"])
+
+
+class EtaTest(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        unstub()
+
+    def test_remaining(self):
+        when(time).monotonic().thenReturn(100.0)
+        sut = history.Eta({"a": 300.0, "b": 100.0, "c": None, "d": 200.0}, 2)
+        self.assertEqual(400.0, sut.remaining())
+
+        sut.start("a")
+        sut.start("b")
+        when(time).monotonic().thenReturn(200.0)
+        sut.finish("b")
+        # a: 200s left, c (as average): 200s, d: 200s - on two workers
+        self.assertEqual(300.0, sut.remaining())
+
+    def test_remaining_is_at_least_the_longest_running(self):
+        when(time).monotonic().thenReturn(0.0)
+        sut = history.Eta({"a": 1000.0, "b": 10.0}, 4)
+        sut.start("a")
+
+        self.assertEqual(1000.0, sut.remaining())
+
+    def test_remaining_without_history(self):
+        sut = history.Eta({"a": None, "b": None}, 2)
+
+        self.assertIsNone(sut.remaining())
+        sut.report()
+
+
+if __name__ == '__main__':
+    unittest.main()
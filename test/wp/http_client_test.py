@@ -0,0 +1,171 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import requests
+import time
+import unittest
+from mockito import mock, when, unstub, ANY, verify
+from wp import cassette
+from wp import http_client as sut
+from wp import instrumentation
+
+
+class HttpClientTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        sut.reset_circuit_breakers()
+        instrumentation.set_default_metrics(instrumentation.Metrics())
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        sut.close_session()
+        sut.reset_circuit_breakers()
+        cassette.activate(None)
+        instrumentation.set_default_metrics(None)
+        unstub()
+
+    def test_without_session(self):
+        response = mock({"status_code": 200}, spec=requests.Response)
+        when(requests).get(ANY(), headers=ANY(), timeout=ANY()).thenReturn(response)
+        when(requests).post(ANY(), data=ANY(), timeout=ANY()).thenReturn(response)
+
+        self.assertIs(response, sut.get("https://example.org/", headers={"Accept": "application/json"}))
+        self.assertIs(response, sut.post("https://example.org/", data="x"))
+
+        verify(requests, times=1).get("https://example.org/", headers={"Accept": "application/json"}, timeout=ANY())
+        verify(requests, times=1).post("https://example.org/", data="x", timeout=ANY())
+
+    def test_with_session(self):
+        session = sut.use_session()
+        response = mock({"status_code": 200}, spec=requests.Response)
+        when(session).get(ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
+        when(session).post(ANY(), data=ANY(), timeout=ANY()).thenReturn(response)
+        when(requests).get(ANY(), auth=ANY(), timeout=ANY())
+
+        self.assertIs(session, sut.use_session())
+        self.assertIs(response, sut.get("https://example.org/", auth=("user", "pat")))
+        self.assertIs(response, sut.post("https://example.org/", data="x"))
+
+        verify(session, times=1).get("https://example.org/", auth=("user", "pat"), timeout=ANY())
+        verify(requests, times=0).get(ANY(), auth=ANY(), timeout=ANY())
+
+    def test_counts_requests_and_bytes(self):
+        response = mock({"status_code": 200, "content": b"{\"count\": 0}"}, spec=requests.Response)
+        when(requests).post(ANY(), data=ANY(), timeout=ANY()).thenReturn(response)
+        when(requests).get(ANY(), timeout=ANY()).thenRaise(requests.exceptions.Timeout("TEST ERROR"))
+
+        sut.post("https://api.wordpress.org/plugins/update-check/1.1/", data="plugins=42")
+        with self.assertRaises(requests.exceptions.Timeout):
+            sut.get("https://api.wordpress.org/core/version-check/1.7/")
+
+        metrics = instrumentation.default_metrics()
+        self.assertEqual(1, metrics.counter("http_requests", host="api.wordpress.org", status=200))
+        self.assertEqual(1, metrics.counter("http_requests", host="api.wordpress.org", status="Timeout"))
+        self.assertEqual(10, metrics.counter("http_sent_bytes", host="api.wordpress.org"))
+        self.assertEqual(12, metrics.counter("http_received_bytes", host="api.wordpress.org"))
+        self.assertEqual(2, metrics.timer("http_request_duration", host="api.wordpress.org")[0])
+
+    def test_with_cassette(self):
+        replayed = mock({"status_code": 200}, spec=requests.Response)
+        replay = mock(cassette.Cassette)
+        when(replay).wrap("GET", ANY()).thenReturn(lambda url, **kwargs: replayed)
+        when(requests).get(ANY(), timeout=ANY())
+        cassette.activate(replay)
+
+        self.assertIs(replayed, sut.get("https://dev.azure.com/organization/_apis/build"))
+
+        verify(requests, times=0).get(ANY(), timeout=ANY())
+
+    def test_close_session(self):
+        session = sut.use_session()
+        when(session).close()
+
+        sut.close_session()
+
+        verify(session, times=1).close()
+        self.assertIsNot(session, sut.use_session())
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        failure = mock({"status_code": 503}, spec=requests.Response)
+        when(requests).get(ANY(), timeout=ANY()).thenReturn(failure)
+        breaker = sut.circuit_breaker("https://dev.azure.com/")
+        breaker.failure_threshold = 3
+
+        for i in range(3):
+            self.assertIs(failure, sut.get("https://dev.azure.com/organization/_apis/build"))
+        self.assertEqual(sut.CircuitBreaker.OPEN, breaker.state)
+
+        # all clients of the host fail fast now
+        with self.assertRaises(sut.CircuitOpenError):
+            sut.get("https://dev.azure.com/organization/_apis/release")
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            sut.post("https://dev.azure.com/organization/_apis/build", data="x")
+        verify(requests, times=3).get(ANY(), timeout=ANY())
+
+        # other hosts are not affected
+        sut.get("https://hub.docker.com/v2/repositories/library/wordpress/tags")
+        verify(requests, times=1).get("https://hub.docker.com/v2/repositories/library/wordpress/tags", timeout=ANY())
+
+    def test_circuit_counts_consecutive_failures_only(self):
+        failure = mock({"status_code": 500}, spec=requests.Response)
+        success = mock({"status_code": 404}, spec=requests.Response)
+        when(requests).get(ANY(), timeout=ANY()).thenReturn(failure, failure, success, failure, failure)
+        breaker = sut.circuit_breaker("https://dev.azure.com/")
+        breaker.failure_threshold = 3
+
+        for i in range(5):
+            sut.get("https://dev.azure.com/")
+
+        self.assertEqual(sut.CircuitBreaker.CLOSED, breaker.state)
+
+    def test_circuit_for_connection_errors(self):
+        when(requests).get(ANY(), timeout=ANY()).thenRaise(requests.exceptions.ConnectTimeout("TEST ERROR"))
+        breaker = sut.circuit_breaker("https://api.wordpress.org/")
+        breaker.failure_threshold = 2
+
+        for i in range(2):
+            with self.assertRaises(requests.exceptions.ConnectTimeout):
+                sut.get("https://api.wordpress.org/core/version-check/1.7/")
+
+        self.assertEqual(sut.CircuitBreaker.OPEN, breaker.state)
+
+    def test_circuit_half_open(self):
+        breaker = sut.CircuitBreaker("dev.azure.com", failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.1)
+        # a single probe
+        self.assertTrue(breaker.allow())
+        self.assertEqual(sut.CircuitBreaker.HALF_OPEN, breaker.state)
+        self.assertFalse(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(sut.CircuitBreaker.OPEN, breaker.state)
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.1)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(sut.CircuitBreaker.CLOSED, breaker.state)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+import unittest
+from wp import deadline
+from wp import instrumentation as sut
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        sut.set_default_metrics(sut.Metrics())
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        sut.set_default_metrics(None)
+
+    def test_counters(self):
+        sut.inc("http_requests", host="dev.azure.com", status=200)
+        sut.inc("http_requests", host="dev.azure.com", status=200)
+        sut.inc("http_received_bytes", 42, host="dev.azure.com")
+
+        metrics = sut.default_metrics()
+        self.assertEqual(2, metrics.counter("http_requests", status=200, host="dev.azure.com"))
+        self.assertEqual(0, metrics.counter("http_requests", host="dev.azure.com", status=503))
+        self.assertEqual(42, metrics.counter("http_received_bytes", host="dev.azure.com"))
+
+    def test_timers(self):
+        sut.observe("build_wait", 3.0, pipeline="wp-cloud-img")
+        sut.observe("build_wait", 1.0, pipeline="wp-cloud-img")
+
+        self.assertEqual((2, 4.0, 3.0), sut.default_metrics().timer("build_wait", pipeline="wp-cloud-img"))
+
+    def test_merge(self):
+        worker = sut.Metrics()
+        worker.inc("http_requests", 3, host="dev.azure.com")
+        worker.observe("build_wait", 5.0, pipeline="wp-cloud-img")
+        sut.inc("http_requests", host="dev.azure.com")
+        sut.observe("build_wait", 1.0, pipeline="wp-cloud-img")
+
+        sut.default_metrics().merge(worker.snapshot())
+
+        metrics = sut.default_metrics()
+        self.assertEqual(4, metrics.counter("http_requests", host="dev.azure.com"))
+        self.assertEqual((2, 6.0, 5.0), metrics.timer("build_wait", pipeline="wp-cloud-img"))
+
+    def test_stage(self):
+        with sut.stage("fetch"):
+            pass
+        with self.assertRaises(deadline.DeadlineExceeded):
+            with sut.stage("build"):
+                raise deadline.DeadlineExceeded("build", 1)
+
+        metrics = sut.default_metrics()
+        self.assertEqual(1, metrics.timer("stage_duration", stage="fetch", result="succeeded")[0])
+        self.assertEqual(1, metrics.timer("stage_duration", stage="build", result="failed")[0])
+
+    def test_git_subcommands(self):
+        self.assertEqual("add+commit", sut.git_subcommands("cd /tmp/x && git add --all && git commit -m 'git x'"))
+        self.assertEqual("clone", sut.git_subcommands("git clone --mirror https://x /tmp/x"))
+        self.assertEqual("other", sut.git_subcommands("echo 42"))
+
+    def test_prometheus_text(self):
+        sut.inc("http_requests", host="dev.azure.com", status=200)
+        sut.observe("build_wait", 2.5, pipeline="wp \"cloud\"")
+
+        expected = "# TYPE wp_updater_http_requests_total counter\n" \
+                   "wp_updater_http_requests_total{host=\"dev.azure.com\",status=\"200\"} 1\n" \
+                   "# TYPE wp_updater_build_wait_seconds summary\n" \
+                   "wp_updater_build_wait_seconds_count{pipeline=\"wp \\\"cloud\\\"\"} 1\n" \
+                   "wp_updater_build_wait_seconds_sum{pipeline=\"wp \\\"cloud\\\"\"} 2.5\n" \
+                   "# TYPE wp_updater_build_wait_seconds_max gauge\n" \
+                   "wp_updater_build_wait_seconds_max{pipeline=\"wp \\\"cloud\\\"\"} 2.5\n"
+        self.assertEqual(expected, sut.default_metrics().prometheus_text())
+
+    def test_export(self):
+        sut.inc("repositories", result="succeeded")
+        with tempfile.TemporaryDirectory() as directory:
+            sut.export({"latest_version": "5.4.2", "errors": 0}, directory)
+
+            with open(os.path.join(directory, sut.PROMETHEUS_FILE), 'r') as f:
+                self.assertIn("wp_updater_repositories_total{result=\"succeeded\"} 1", f.read())
+            with open(os.path.join(directory, sut.SUMMARY_FILE), 'r') as f:
+                summary = json.loads(f.read())
+
+        self.assertEqual("5.4.2", summary["latest_version"])
+        self.assertEqual([{"name": "repositories", "labels": {"result": "succeeded"}, "value": 1}],
+                         summary["metrics"]["counters"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextvars
+import io
+import json
+import threading
+import unittest
+from wp import log
+
+
+class LogTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.stream = io.StringIO()
+        log.set_default_logger(log.Logger(log.INFO, stream=self.stream, buffer_size=3))
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        log.set_default_logger(None)
+
+    def records(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_info(self):
+        log.info("fetching repository", url="https://git.company.narf/repo.git")
+
+        record = self.records()[0]
+        self.assertEqual("info", record["level"])
+        self.assertEqual("fetching repository", record["message"])
+        self.assertEqual("https://git.company.narf/repo.git", record["url"])
+        self.assertEqual(threading.current_thread().name, record["thread"])
+        self.assertNotIn("repo", record)
+
+    def test_debug_is_off_by_default(self):
+        log.debug("POST-data", data="plugins=...")
+        log.warning("circuit opened")
+
+        self.assertEqual(["warning"], [r["level"] for r in self.records()])
+
+    def test_repository_is_written_when_finished(self):
+        with log.repository("site-a"):
+            with log.stage("fetch"):
+                log.info("fetching repository")
+            log.info("done")
+            self.assertEqual("", self.stream.getvalue())
+
+        records = self.records()
+        self.assertEqual(["fetching repository", "done"], [r["message"] for r in records])
+        self.assertEqual(["site-a", "site-a"], [r["repo"] for r in records])
+        self.assertEqual("fetch", records[0]["stage"])
+        self.assertNotIn("stage", records[1])
+        self.assertIn("elapsed", records[0])
+
+    def test_repositories_do_not_interleave(self):
+        started = threading.Barrier(2)
+
+        def process(key):
+            with log.repository(key):
+                for i in range(3):
+                    log.info(f"step {i}")
+                    if i == 0:
+                        started.wait()
+
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(process, key))
+                   for key in ("site-a", "site-b")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        keys = [r["repo"] for r in self.records()]
+        self.assertEqual(6, len(keys))
+        self.assertEqual(1, len(set(keys[:3])))
+        self.assertEqual(1, len(set(keys[3:])))
+
+    def test_repository_keeps_most_recent_records(self):
+        with log.repository("site-a"):
+            for i in range(5):
+                log.info(f"step {i}")
+
+        records = self.records()
+        self.assertEqual(2, records[0]["dropped"])
+        self.assertEqual(["step 2", "step 3", "step 4"], [r["message"] for r in records[1:]])
+
+    def test_exception(self):
+        try:
+            raise RuntimeError("TEST ERROR")
+        except RuntimeError:
+            log.exception("Unable to process repository")
+
+        record = self.records()[0]
+        self.assertEqual("error", record["level"])
+        self.assertIn("RuntimeError: TEST ERROR", record["traceback"])
+
+    def test_text_format(self):
+        log.set_default_logger(log.Logger(log.INFO, fmt="text", stream=self.stream))
+        with log.repository("site-a"), log.stage("build"):
+            log.info("build finished", build_id=42)
+
+        line = self.stream.getvalue()
+        self.assertIn("INFO    [site-a/build] build finished", line)
+        self.assertIn("build_id=42", line)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import requests
+import threading
+import time
+import unittest
+from mockito import mock, when, unstub, ANY, verify
+from wp import config as conf
+from wp.pipeline import build_scheduler as sut
+from wp.pipeline import pipeline_interaction as pipe
+
+
+class BuildSchedulerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        when(os).getenv("DEVOPS_PAT").thenReturn("totalgeheim")
+        self.pool = mock(sut.AgentPool)
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        sut.set_default_scheduler(None)
+        unstub()
+
+    @staticmethod
+    def _response(data):
+        return mock({"status_code": 200, "text": json.dumps(data)}, spec=requests.Response)
+
+    def test_agent_pool(self):
+        expected_pool_url = f"{conf.azure_org}_apis/distributedtask/pools?api-version=5.1&poolName=Build%20Pool"
+        expected_jobs_url = f"{conf.azure_org}_apis/distributedtask/pools/7/jobrequests?api-version=5.1"
+        expected_agents_url = f"{conf.azure_org}_apis/distributedtask/pools/7/agents?api-version=5.1"
+        when(pipe).request_retry(expected_pool_url, header=ANY(), credentials=ANY()).thenReturn(
+            self._response({"count": 1, "value": [{"id": 7, "name": "Build Pool"}]}))
+        when(pipe).request_retry(expected_jobs_url, header=ANY(), credentials=ANY()).thenReturn(
+            self._response({"count": 3, "value": [{"requestId": 1, "assignTime": "x", "result": "succeeded"},
+                                                  {"requestId": 2, "assignTime": "x"},
+                                                  {"requestId": 3}]}))
+        when(pipe).request_retry(expected_agents_url, header=ANY(), credentials=ANY()).thenReturn(
+            self._response({"count": 3, "value": [{"status": "online", "enabled": True},
+                                                  {"status": "offline", "enabled": True},
+                                                  {"status": "online", "enabled": False}]}))
+
+        pool = sut.AgentPool("Build Pool")
+        self.assertEqual(1, pool.queued_jobs())
+        self.assertEqual(1, pool.online_agents())
+
+        verify(pipe, times=1).request_retry(expected_pool_url, header=ANY(), credentials=ANY())
+
+    def test_agent_pool_for_unknown_pool(self):
+        when(pipe).request_retry(ANY(), header=ANY(), credentials=ANY()).thenReturn(
+            self._response({"count": 0, "value": []}))
+
+        with self.assertRaises(RuntimeError):
+            sut.AgentPool("INVALID").queued_jobs()
+
+    def test_unlimited_scheduler(self):
+        scheduler = sut.BuildWaveScheduler()
+        for i in range(100):
+            scheduler.acquire()
+
+        self.assertEqual(100, scheduler.in_flight)
+
+    def test_scheduler_limits_builds_in_flight(self):
+        scheduler = sut.BuildWaveScheduler(max_queued=2, poll_interval=5)
+        scheduler.acquire()
+        scheduler.acquire()
+        acquired = threading.Event()
+
+        def _acquire():
+            scheduler.acquire()
+            acquired.set()
+
+        waiting = threading.Thread(target=_acquire)
+        waiting.start()
+        self.assertFalse(acquired.wait(0.2))
+
+        # the waiting push goes out as soon as a slot frees up, not after the poll-interval
+        start = time.monotonic()
+        scheduler.release()
+        self.assertTrue(acquired.wait(2))
+        self.assertLess(time.monotonic() - start, 1)
+        waiting.join()
+        self.assertEqual(2, scheduler.in_flight)
+
+    def test_scheduler_respects_pool_queue(self):
+        when(self.pool).online_agents().thenReturn(2)
+        when(self.pool).queued_jobs().thenReturn(3, 1)
+        scheduler = sut.BuildWaveScheduler(max_queued=2, pool=self.pool, poll_interval=0.01)
+
+        scheduler.acquire()
+
+        self.assertEqual(1, scheduler.in_flight)
+        verify(self.pool, times=2).queued_jobs()
+
+    def test_release_does_not_wait_for_pool_requests(self):
+        requested = threading.Event()
+        proceed = threading.Event()
+
+        def queued_jobs():
+            requested.set()
+            proceed.wait(2)
+            return 0
+
+        when(self.pool).online_agents().thenReturn(1)
+        when(self.pool).queued_jobs().thenAnswer(queued_jobs)
+        scheduler = sut.BuildWaveScheduler(max_queued=2, pool=self.pool, slots={os.getpid(): 1})
+        waiting = threading.Thread(target=scheduler.acquire)
+        waiting.start()
+        self.assertTrue(requested.wait(2))
+
+        released = threading.Thread(target=scheduler.release)
+        released.start()
+        released.join(0.5)
+        self.assertFalse(released.is_alive())
+        proceed.set()
+        waiting.join()
+        self.assertEqual(1, scheduler.in_flight)
+
+    def test_release_all(self):
+        scheduler = sut.BuildWaveScheduler(max_queued=2, slots={42: 2, os.getpid(): 0})
+        self.assertFalse(scheduler._has_slot())
+
+        scheduler.release_all(42)
+        scheduler.release_all(21)
+
+        self.assertEqual(0, scheduler.in_flight)
+        self.assertTrue(scheduler._has_slot())
+
+    def test_scheduler_falls_back_to_own_builds_for_unavailable_pool(self):
+        when(self.pool).online_agents().thenReturn(None)
+        when(self.pool).queued_jobs().thenReturn(None)
+        scheduler = sut.BuildWaveScheduler(max_queued=1, pool=self.pool)
+
+        scheduler.acquire()
+        self.assertFalse(scheduler._has_slot())
+
+    def test_default_scheduler(self):
+        result = sut.default_scheduler()
+
+        self.assertIs(result, sut.default_scheduler())
+        self.assertEqual(getattr(conf, "max_queued_builds", None), result.max_queued)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,11 +17,16 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from datetime import datetime
+import json
 import os
 import unittest
 import requests
 import time
 from mockito import mock, when, unstub, ANY, verify
+from wp import deadline
+from wp import http_client
+from wp.pipeline import polling
+from wp.pipeline import pipeline_interaction as pipe
 from wp.pipeline.pipeline_interaction import Pipeline
 from wp import config as conf
 
@@ -36,23 +41,43 @@ class PipelineTest(unittest.TestCase):
         self.expected_credentials = (conf.git_user, self.dummy_azure_pat)
         when(os).getenv("DEVOPS_PAT").thenReturn(self.dummy_azure_pat)
         self.sut = Pipeline(self.dummy_project, self.dummy_pipeline_name)
+        pipe.definitions.clear()
 
     def tearDown(self) -> None:
         unittest.TestCase.tearDown(self)
+        http_client.reset_circuit_breakers()
         unstub()
 
     def test_validate_pipeline_for_invalid_name(self):
         expected_url = f"{conf.azure_org}{self.dummy_project}/_apis/build/definitions?api-version=5.1&name={self.dummy_pipeline_name}"
         dummy_result = "{\"count\":0,\"value\":[]}"
         response = mock({"status_code": 200, "text": dummy_result}, spec=requests.Response)
-        when(requests).get(ANY(), headers=ANY(), auth=ANY()).thenReturn(response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
 
         result = self.sut.validate()
         self.assertIsNone(result)
 
-        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials)
+        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials, timeout=ANY())
         verify(os, times=1).getenv("DEVOPS_PAT")
 
+    def test_validate_pipeline_is_cached(self):
+        with open(os.path.dirname(__file__) + "/../resources/pipeline_details.json", 'r') as f:
+            dummy_response = f.read()
+        response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
+
+        self.assertEqual(91, self.sut.validate()["id"])
+        self.assertEqual(91, Pipeline(self.dummy_project, self.dummy_pipeline_name).validate()["id"])
+        verify(requests, times=1).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY())
+
+        orig_ttl = pipe.definitions.ttl
+        pipe.definitions.ttl = 0
+        try:
+            self.sut.validate()
+        finally:
+            pipe.definitions.ttl = orig_ttl
+        verify(requests, times=2).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY())
+
     def test_validate_pipeline_for_valid_name(self):
         expected_url = conf.azure_org + self.dummy_project + \
                        "/_apis/build/definitions?api-version=5.1&name=" + self.dummy_pipeline_name
@@ -60,14 +85,14 @@ class PipelineTest(unittest.TestCase):
             dummy_response = f.read()
 
         response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
-        when(requests).get(ANY(), headers=ANY(), auth=ANY()).thenReturn(response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
 
         result = self.sut.validate()
         self.assertIsNotNone(result)
         self.assertEqual(91, result["id"])
         self.assertEqual("infra-docker-dummy", result["name"])
 
-        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials)
+        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials, timeout=ANY())
         verify(os, times=1).getenv("DEVOPS_PAT")
 
     def test_trigger_build_pipeline(self):
@@ -79,7 +104,7 @@ class PipelineTest(unittest.TestCase):
             dummy_response = f.read()
 
         response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
-        when(requests).post(ANY(), data=ANY(), headers=ANY(), auth=ANY()).thenReturn(response)
+        when(requests).post(ANY(), data=ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
 
         result = self.sut.trigger_build(dummy_pipeline_id)
         self.assertIsNotNone(result)
@@ -88,7 +113,7 @@ class PipelineTest(unittest.TestCase):
         self.assertEqual("20200512.1", result["buildNumber"])
 
         verify(requests, times=1).post(expected_url, data=expected_data, headers=self.expected_headers,
-                                      auth=self.expected_credentials)
+                                      auth=self.expected_credentials, timeout=ANY())
         verify(os, times=1).getenv("DEVOPS_PAT")
 
     def test_fetch_build_status_for_error(self):
@@ -97,12 +122,12 @@ class PipelineTest(unittest.TestCase):
         expected_url = f"{conf.azure_org}{self.dummy_project}/_apis/build/builds/{dummy_build_id}?api-version=5.1"
 
         response = mock({"status_code": 500, "text": "TEST ERROR"}, spec=requests.Response)
-        when(requests).get(ANY(), headers=ANY(), auth=ANY()).thenReturn(response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
 
         result = self.sut.fetch_build_status(dummy_build_id)
         self.assertIsNone(result)
 
-        verify(requests, times=expected_request_invocations).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials)
+        verify(requests, times=expected_request_invocations).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials, timeout=ANY())
 
     def test_fetch_build_status(self):
         dummy_build_id = 32174
@@ -112,7 +137,7 @@ class PipelineTest(unittest.TestCase):
             dummy_response = f.read()
 
         response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
-        when(requests).get(ANY(), headers=ANY(), auth=ANY()).thenReturn(response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
 
         result = self.sut.fetch_build_status(dummy_build_id)
         self.assertIsNotNone(result)
@@ -121,7 +146,7 @@ class PipelineTest(unittest.TestCase):
         self.assertEqual("succeeded", result["result"])
         self.assertEqual("20200728.3", result["buildNumber"])
 
-        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials)
+        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials, timeout=ANY())
 
     def test_fetch_most_recent_build(self):
         dummy_pipeline_id = 42
@@ -134,7 +159,7 @@ class PipelineTest(unittest.TestCase):
 
         response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
         when(self.sut)._now().thenReturn(dummy_current_timestamp)
-        when(requests).get(ANY(), headers=ANY(), auth=ANY()).thenReturn(response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
 
         result = self.sut.fetch_most_recent_build(dummy_pipeline_id)
         self.assertIsNotNone(result)
@@ -143,20 +168,102 @@ class PipelineTest(unittest.TestCase):
         self.assertEqual("succeeded", result["result"])
         self.assertEqual("20200728.3", result["buildNumber"])
 
-        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials)
+        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials, timeout=ANY())
+
+    def test_find_build_for_commit(self):
+        dummy_pipeline_id = 42
+        expected_url = f"{conf.azure_org}{self.dummy_project}/_apis/build/builds?api-version=5.1" \
+            f"&definitions={dummy_pipeline_id}&$top=20&queryOrder=queueTimeDescending"
+        with open(os.path.dirname(__file__) + "/../resources/pipeline_build_list.json", 'r') as f:
+            dummy_response = f.read()
+        response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
+
+        result = self.sut.find_build_for_commit(dummy_pipeline_id, "15871ea11d06861096fcd0540b5f486dd2f75436")
+        self.assertEqual(32174, result["id"])
+        self.assertIsNone(self.sut.find_build_for_commit(dummy_pipeline_id, "a1b2c3"))
+
+        verify(requests, times=2).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials,
+                                      timeout=ANY())
+
+    def test_estimate_build_duration(self):
+        expected_url = f"{conf.azure_org}{self.dummy_project}/_apis/build/builds?api-version=5.1" \
+            f"&definitions=42&$top=20&queryOrder=queueTimeDescending&statusFilter=completed&resultFilter=succeeded"
+        builds = [{"startTime": "2020-07-28T14:03:01.3948315Z", "finishTime": "2020-07-28T14:03:45.5879407Z"},
+                  {"startTime": "2020-07-28T15:00:00.1Z", "finishTime": "2020-07-28T15:10:00.2Z"},
+                  {"startTime": "2020-07-28T16:00:00Z", "finishTime": "2020-07-28T16:02:00Z"},
+                  {"startTime": "2020-07-28T17:00:00Z"}]
+        response = mock({"status_code": 200, "text": json.dumps({"count": 4, "value": builds})},
+                        spec=requests.Response)
+        when(self.sut).validate().thenReturn({"id": 42, "name": self.dummy_pipeline_name})
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
+
+        self.assertEqual(120, self.sut.estimate_build_duration())
+        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials,
+                                      timeout=ANY())
+
+    def test_estimate_build_duration_without_builds(self):
+        response = mock({"status_code": 200, "text": "{\"count\": 0, \"value\": []}"}, spec=requests.Response)
+        when(self.sut).validate().thenReturn({"id": 42, "name": self.dummy_pipeline_name})
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
+
+        self.assertIsNone(self.sut.estimate_build_duration())
+
+    def test_wait_for_build_of_commit(self):
+        dummy_build_status = {"id": 36, "buildNumber": "123", "status": "notStarted", "result": ""}
+        when(time).sleep(ANY())
+        when(self.sut).validate().thenReturn({"id": 42, "name": self.dummy_pipeline_name})
+        when(self.sut).find_build_for_commit(ANY(), ANY()).thenReturn(None, None, dummy_build_status)
+        when(self.sut).wait_for_build_with_id(ANY(), ANY()).thenReturn("succeeded")
+
+        result = self.sut.wait_for_build_of_commit("a1b2c3")
+        self.assertEqual("succeeded", result)
+
+        verify(self.sut, times=3).find_build_for_commit(42, "a1b2c3")
+        verify(self.sut, times=1).wait_for_build_with_id(36, dummy_build_status)
+
+    def test_wait_for_build_with_id_determines_build_duration(self):
+        dummy_build_status = {"id": 36, "buildNumber": "123", "status": "completed", "result": "succeeded",
+                              "startTime": "2020-07-28T14:03:01.3948315Z", "finishTime": "2020-07-28T14:05:31.58Z"}
+
+        self.assertEqual("succeeded", self.sut.wait_for_build_with_id(36, dummy_build_status))
+        self.assertEqual(150, self.sut.build_duration)
+
+    def test_wait_for_build_with_id_for_exceeded_deadline(self):
+        when(polling.AdaptivePoller).wait(None).thenRaise(deadline.DeadlineExceeded("build", 1))
+
+        with self.assertRaises(deadline.DeadlineExceeded):
+            self.sut.wait_for_build_with_id(36, {})
+
+    def test_wait_for_build_with_id_for_failed_status_request(self):
+        dummy_build_status = {"id": 36, "buildNumber": "123", "status": "completed", "result": "succeeded"}
+        when(polling.AdaptivePoller).wait(None)
+        when(self.sut).fetch_build_status(36).thenReturn(None).thenReturn(dummy_build_status)
+
+        self.assertEqual("succeeded", self.sut.wait_for_build_with_id(36, {}))
+        verify(self.sut, times=2).fetch_build_status(36)
 
     def test_fetch_most_recent_build_for_connection_error(self):
         dummy_pipeline_id = 21
         expected_request_invocations = 3
         expected_url = f"{conf.azure_org}{self.dummy_project}/_apis/build/builds?api-version=5.1" \
                        f"&definitions={dummy_pipeline_id}&$top=1&queryOrder=queueTimeDescending"
-        when(requests).get(ANY(), headers=ANY(), auth=ANY()).thenRaise(requests.exceptions.ConnectionError("TEST ERROR"))
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenRaise(requests.exceptions.ConnectionError("TEST ERROR"))
 
         result = self.sut.fetch_most_recent_build(dummy_pipeline_id)
         self.assertIsNone(result)
 
         verify(requests, times=expected_request_invocations).get(expected_url, headers=self.expected_headers,
-                                                                 auth=self.expected_credentials)
+                                                                 auth=self.expected_credentials, timeout=ANY())
+
+    def test_request_retry_for_timeout(self):
+        dummy_url = f"{conf.azure_org}{self.dummy_project}/_apis/build/builds/36?api-version=5.1"
+        dummy_response = mock({"status_code": 200, "text": "{}"})
+        when(requests).get(dummy_url, headers=ANY(), auth=ANY(), timeout=ANY()) \
+            .thenRaise(requests.exceptions.ReadTimeout("TEST ERROR")).thenReturn(dummy_response)
+
+        self.assertIs(dummy_response, pipe.request_retry(dummy_url))
+        verify(requests, times=2).get(dummy_url, headers=ANY(), auth=ANY(), timeout=ANY())
 
     def test_wait_for_build_pipeline(self):
         dummy_validation_result = {"id": 42, "name": self.dummy_pipeline_name}
@@ -178,7 +285,9 @@ class PipelineTest(unittest.TestCase):
         verify(self.sut, times=1).validate()
         verify(self.sut, times=1).fetch_most_recent_build(42)
         verify(self.sut, times=3).fetch_build_status(36)
-        verify(time, times=3).sleep(10)
+        # polling backs off, while the status stays the same
+        verify(time, times=2).sleep(10)
+        verify(time, times=1).sleep(15)
 
     def test_trigger_build_and_wait(self):
         dummy_pipeline_id = 42
@@ -186,16 +295,29 @@ class PipelineTest(unittest.TestCase):
         dummy_build_status = {"id": 36}
         dummy_result_status = "succeeded"
         when(self.sut).validate().thenReturn(dummy_pipeline_details)
-        when(self.sut).trigger_build(ANY()).thenReturn(dummy_build_status)
+        when(self.sut).trigger_build(ANY(), ANY()).thenReturn(dummy_build_status)
         when(self.sut).wait_for_build_with_id(ANY(), ANY()).thenReturn(dummy_result_status)
 
         result = self.sut.trigger_build_and_wait()
         self.assertEqual(dummy_result_status, result)
 
         verify(self.sut, times=1).validate()
-        verify(self.sut, times=1).trigger_build(dummy_pipeline_id)
+        verify(self.sut, times=1).trigger_build(dummy_pipeline_id, None)
         verify(self.sut, times=1).wait_for_build_with_id(36, {})
 
+    def test_trigger_build_pipeline_with_parameters(self):
+        dummy_pipeline_id = 42
+        expected_url = conf.azure_org + self.dummy_project + "/_apis/build/builds?api-version=5.1"
+        expected_data = "{\"definition\": {\"id\": 42}, \"parameters\": \"{\\\"narf\\\": \\\"zort\\\"}\"}"
+        response = mock({"status_code": 200, "text": "{\"id\": 36}"}, spec=requests.Response)
+        when(requests).post(ANY(), data=ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
+
+        result = self.sut.trigger_build(dummy_pipeline_id, {"narf": "zort"})
+        self.assertEqual(36, result["id"])
+
+        verify(requests, times=1).post(expected_url, data=expected_data, headers=self.expected_headers,
+                                      auth=self.expected_credentials, timeout=ANY())
+
 
 if __name__ == '__main__':
     unittest.main()
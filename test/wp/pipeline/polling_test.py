@@ -0,0 +1,59 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import unittest
+from mockito import when, unstub, ANY, verify
+from wp.pipeline import polling as sut
+
+
+class PollingTest(unittest.TestCase):
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        unstub()
+
+    def test_poller_backs_off(self):
+        poller = sut.AdaptivePoller(10, 30, 2)
+
+        self.assertEqual([10, 20, 30, 30], [poller.next_interval() for i in range(4)])
+
+    def test_poller_resets_on_status_change(self):
+        poller = sut.AdaptivePoller(10, 60, 2)
+        poller.observe("notStarted")
+        poller.next_interval()
+        poller.next_interval()
+
+        poller.observe("notStarted")
+        self.assertEqual(40, poller.next_interval())
+
+        poller.observe("inProgress")
+        self.assertEqual(10, poller.next_interval())
+
+    def test_sleep(self):
+        when(time).sleep(ANY())
+        poller = sut.AdaptivePoller(5, 60, 1.5)
+
+        poller.sleep()
+        poller.sleep()
+
+        verify(time, times=1).sleep(5)
+        verify(time, times=1).sleep(7.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,7 +20,10 @@ import os
 import requests
 import unittest
 from mockito import mock, when, unstub, ANY, verify
+from wp import http_client
 from wp import config as conf
+from wp.pipeline import pipeline_interaction as pipe
+from wp.pipeline import release_pipeline_interaction as rpi
 from wp.pipeline.release_pipeline_interaction import ReleasePipeline
 
 
@@ -34,36 +37,40 @@ class ReleasePipelineInteractionTest(unittest.TestCase):
         self.expected_credentials = (conf.git_user, self.dummy_azure_pat)
         when(os).getenv("DEVOPS_PAT").thenReturn(self.dummy_azure_pat)
         self.sut = ReleasePipeline(self.dummy_project, self.dummy_pipeline_name)
+        pipe.definitions.clear()
 
     def tearDown(self) -> None:
         unittest.TestCase.tearDown(self)
+        http_client.reset_circuit_breakers()
         unstub()
 
     def test_validate_for_invalid_name(self):
-        expected_url = f"{conf.azure_org_vs}{self.dummy_project}/_apis/release/definitions?api-version=5.1&searchText=Setup%20Wordpress%20DB"
+        expected_url = f"{conf.azure_org_vs}{self.dummy_project}/_apis/release/definitions?api-version=5.1&searchText=Setup%20Wordpress%20DB" \
+            "&$expand=artifacts"
         dummy_result = "{\"count\":0,\"value\":[]}"
         response = mock({"status_code": 200, "text": dummy_result}, spec=requests.Response)
-        when(requests).get(ANY(), headers=ANY(), auth=ANY()).thenReturn(response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
 
         result = self.sut.validate()
         self.assertIsNone(result)
 
-        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials)
+        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials, timeout=ANY())
         verify(os, times=1).getenv("DEVOPS_PAT")
 
     def test_validate(self):
-        expected_url = f"{conf.azure_org_vs}{self.dummy_project}/_apis/release/definitions?api-version=5.1&searchText=Setup%20Wordpress%20DB"
+        expected_url = f"{conf.azure_org_vs}{self.dummy_project}/_apis/release/definitions?api-version=5.1&searchText=Setup%20Wordpress%20DB" \
+            "&$expand=artifacts"
         with open(os.path.dirname(__file__) + "/../resources/release_pipeline_list.json", 'r') as f:
             dummy_response = f.read()
         response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
-        when(requests).get(ANY(), headers=ANY(), auth=ANY()).thenReturn(response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
 
         result = self.sut.validate()
         self.assertIsNotNone(result)
         self.assertEqual(68, result["id"])
         self.assertEqual(self.dummy_pipeline_name, result["name"])
 
-        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials)
+        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials, timeout=ANY())
         verify(os, times=1).getenv("DEVOPS_PAT")
 
     def test_trigger_release(self):
@@ -74,7 +81,7 @@ class ReleasePipelineInteractionTest(unittest.TestCase):
             dummy_response = f.read()
 
         response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
-        when(requests).post(ANY(), data=ANY(), headers=ANY(), auth=ANY()).thenReturn(response)
+        when(requests).post(ANY(), data=ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
 
         result = self.sut.trigger_release(dummy_pipeline_id)
         self.assertIsNotNone(result)
@@ -83,9 +90,93 @@ class ReleasePipelineInteractionTest(unittest.TestCase):
         self.assertEqual("Release-10", result["name"])
 
         verify(requests, times=1).post(expected_url, data=expected_data, headers=self.expected_headers,
-                                       auth=self.expected_credentials)
+                                       auth=self.expected_credentials, timeout=ANY())
         verify(os, times=1).getenv("DEVOPS_PAT")
 
+    def test_trigger_release_with_artifacts(self):
+        expected_data = "{\"definitionId\": 42, \"description\": \"auto-update trigger\", " \
+                        "\"artifacts\": [{\"alias\": \"_wp-cloud-img\", \"instanceReference\": {\"id\": \"36\"}}]}"
+        response = mock({"status_code": 200, "text": "{\"id\": 27253}"}, spec=requests.Response)
+        when(requests).post(ANY(), data=ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
+
+        self.assertEqual(27253, self.sut.trigger_release(42, {"_wp-cloud-img": 36})["id"])
+        verify(requests, times=1).post(ANY(), data=expected_data, headers=ANY(), auth=ANY(), timeout=ANY())
+
+    def test_artifact_alias(self):
+        definition = {"artifacts": [
+            {"alias": "_helm-charts", "type": "Git", "definitionReference": {"definition": {"id": "7"}}},
+            {"alias": "_wp-cloud-img", "type": "Build", "definitionReference": {"definition": {"id": "7"}}}]}
+
+        self.assertEqual("_wp-cloud-img", rpi.artifact_alias(definition, 7))
+        self.assertIsNone(rpi.artifact_alias(definition, 8))
+        self.assertIsNone(rpi.artifact_alias({}, 7))
+
+    def test_fetch_releases(self):
+        expected_url = f"{conf.azure_org_vs}{self.dummy_project}/_apis/release/releases?api-version=5.1" \
+            f"&releaseIdFilter=27253,27254&$expand=environments"
+        with open(os.path.dirname(__file__) + "/../resources/release_list_status.json", 'r') as f:
+            dummy_response = f.read()
+        response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
+
+        result = rpi.fetch_releases(self.dummy_project, [27254, 27253])
+        self.assertEqual({27253, 27254}, set(result.keys()))
+        self.assertIsNone(rpi.release_result(result[27253]))
+        self.assertEqual("succeeded", rpi.release_result(result[27254]))
+
+        verify(requests, times=1).get(expected_url, headers=self.expected_headers, auth=self.expected_credentials, timeout=ANY())
+
+    def test_fetch_releases_for_error(self):
+        response = mock({"status_code": 500, "text": "TEST ERROR"}, spec=requests.Response)
+        when(requests).get(ANY(), headers=ANY(), auth=ANY(), timeout=ANY()).thenReturn(response)
+
+        self.assertIsNone(rpi.fetch_releases(self.dummy_project, [27253]))
+
+    def test_release_result(self):
+        def release(*states, status="active"):
+            return {"status": status, "environments": [{"status": s} for s in states]}
+
+        self.assertIsNone(rpi.release_result(release()))
+        self.assertIsNone(rpi.release_result(release("notStarted")))
+        self.assertIsNone(rpi.release_result(release("succeeded", "queued")))
+        self.assertIsNone(rpi.release_result(release("rejected", "inProgress")))
+        self.assertEqual("succeeded", rpi.release_result(release("succeeded", "succeeded")))
+        self.assertEqual("rejected", rpi.release_result(release("succeeded", "rejected")))
+        self.assertEqual("canceled", rpi.release_result(release("canceled")))
+        self.assertEqual("partiallySucceeded", rpi.release_result(release("partiallySucceeded")))
+        self.assertEqual("abandoned", rpi.release_result(release("inProgress", status="abandoned")))
+
+    def test_release_result_for_manual_environment(self):
+        started = [{"conditionType": "event", "name": "ReleaseStarted", "value": ""}]
+        after_test = [{"conditionType": "environmentState", "name": "test", "value": "4"}]
+
+        def release(test, prod, manual="notStarted"):
+            return {"status": "active", "environments": [{"name": "test", "status": test, "conditions": started},
+                                                         {"name": "prod", "status": prod, "conditions": after_test},
+                                                         {"name": "manual", "status": manual, "conditions": []}]}
+
+        self.assertIsNone(rpi.release_result(release("succeeded", "notStarted")))
+        self.assertEqual("succeeded", rpi.release_result(release("succeeded", "succeeded")))
+        self.assertIsNone(rpi.release_result(release("succeeded", "succeeded", manual="inProgress")))
+        self.assertEqual("rejected", rpi.release_result(release("succeeded", "succeeded", manual="rejected")))
+
+    def test_release_result_for_manual_environments_only(self):
+        release = {"status": "active", "environments": [{"name": "prod", "status": "notStarted", "conditions": []},
+                                                        {"name": "nightly", "status": "notStarted", "conditions": [
+                                                            {"conditionType": "schedule", "name": "nightly"}]}]}
+
+        self.assertEqual("succeeded", rpi.release_result(release))
+
+    def test_release_result_for_configured_environments(self):
+        orig_environments = getattr(conf, "release_environments", None)
+        conf.release_environments = ["prod"]
+        try:
+            release = {"status": "active", "environments": [{"name": "test", "status": "notStarted"},
+                                                            {"name": "prod", "status": "succeeded"}]}
+            self.assertEqual("succeeded", rpi.release_result(release))
+        finally:
+            conf.release_environments = orig_environments
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,106 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import unittest
+from mockito import when, unstub, ANY, verify
+from wp.pipeline import release_pipeline_interaction as rpi
+from wp.pipeline import release_tracker as sut
+
+
+class ReleaseTrackerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.sut = sut.ReleaseTracker(timeout=5, poll_interval=0.01, max_poll_interval=0.05)
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        # the polling-thread must not outlive the stubs
+        worker = self.sut._worker
+        if worker is not None:
+            worker.join(5)
+        sut.set_default_tracker(None)
+        unstub()
+
+    @staticmethod
+    def _release(release_id, *states):
+        return {"id": release_id, "status": "active", "environments": [{"status": s} for s in states]}
+
+    def test_wait_for_release(self):
+        when(rpi).fetch_releases("PRJ", [27253]).thenReturn(
+            {27253: self._release(27253, "notStarted")},
+            {27253: self._release(27253, "inProgress")},
+            {27253: self._release(27253, "succeeded")})
+
+        result = self.sut.wait_for_release("PRJ", 27253)
+        self.assertEqual("succeeded", result)
+
+        verify(rpi, times=3).fetch_releases("PRJ", [27253])
+
+    def test_wait_for_failed_release(self):
+        when(rpi).fetch_releases("PRJ", [27253]).thenReturn({27253: self._release(27253, "rejected")})
+
+        self.assertEqual("rejected", self.sut.wait_for_release("PRJ", 27253))
+
+    def test_wait_for_release_with_fetch_errors(self):
+        when(rpi).fetch_releases("PRJ", [27253]).thenReturn(None).thenRaise(RuntimeError("TEST ERROR")) \
+            .thenReturn({27253: self._release(27253, "succeeded")})
+
+        self.assertEqual("succeeded", self.sut.wait_for_release("PRJ", 27253))
+
+    def test_wait_for_release_timeout(self):
+        self.sut = sut.ReleaseTracker(timeout=0.2, poll_interval=0.01, max_poll_interval=0.01)
+        when(rpi).fetch_releases("PRJ", [27253]).thenReturn({27253: self._release(27253, "inProgress")})
+
+        self.assertEqual(sut.TIMED_OUT, self.sut.wait_for_release("PRJ", 27253))
+
+    def test_wait_for_concurrent_releases(self):
+        # releases of the same project are fetched within one request
+        polled = []
+        states = {27253: ["inProgress", "succeeded"], 27254: ["inProgress", "inProgress", "rejected"]}
+        all_registered = threading.Barrier(2)
+
+        def _fetch(project, release_ids):
+            polled.append(list(release_ids))
+            return {i: self._release(i, states[i].pop(0) if len(states[i]) > 1 else states[i][0])
+                    for i in release_ids}
+
+        when(rpi).fetch_releases(ANY(), ANY()).thenAnswer(_fetch)
+        results = {}
+
+        def _wait(release_id):
+            all_registered.wait(timeout=5)
+            results[release_id] = self.sut.wait_for_release("PRJ", release_id)
+
+        waiters = [threading.Thread(target=_wait, args=(i,)) for i in (27253, 27254)]
+        for w in waiters:
+            w.start()
+        for w in waiters:
+            w.join(5)
+
+        self.assertEqual({27253: "succeeded", 27254: "rejected"}, results)
+        self.assertIn([27253, 27254], [sorted(p) for p in polled])
+
+    def test_default_tracker(self):
+        result = sut.default_tracker()
+
+        self.assertIs(result, sut.default_tracker())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from mockito import when, unstub, ANY, verify
+from wp.pipeline import pipeline_interaction as pipe
+from wp.pipeline import release_pipeline_interaction as rpi
+from wp.pipeline import release_tracker
+from wp.pipeline import service_hooks as sut
+
+
+class ServiceHooksTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.receiver = sut.ServiceHookReceiver("127.0.0.1", 0).start()
+        sut.set_default_receiver(self.receiver)
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        sut.set_default_receiver(None)
+        self.receiver.stop()
+        unstub()
+
+    ##
+    # fake sender: posts the event like Azure DevOps does
+    def _send(self, event, headers=None):
+        request = urllib.request.Request(f"http://127.0.0.1:{self.receiver.port}/", data=json.dumps(event).encode(),
+                                         headers=dict({"Content-Type": "application/json"}, **(headers or {})))
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def _send_later(self, event, delay=0.1):
+        sender = threading.Timer(delay, self._send, args=(event,))
+        sender.start()
+        return sender
+
+    @staticmethod
+    def _build_event(build_id, result="succeeded"):
+        return {"eventType": "build.complete",
+                "resource": {"id": build_id, "status": "completed", "result": result}}
+
+    @staticmethod
+    def _deployment_event(release_id, status="succeeded"):
+        return {"eventType": "ms.vss-release.deployment-completed-event",
+                "resource": {"environment": {"releaseId": release_id, "status": status}}}
+
+    def test_build_event(self):
+        subscription = self.receiver.subscribe(sut.BUILD_TOPIC, 36)
+        other = self.receiver.subscribe(sut.BUILD_TOPIC, 37)
+
+        self.assertEqual(200, self._send(self._build_event(36)))
+
+        self.assertTrue(subscription.wait(2))
+        self.assertEqual("succeeded", subscription.payload["result"])
+        self.assertFalse(other.wait(0))
+
+    def test_event_before_subscription(self):
+        self._send(self._build_event(36))
+
+        self.assertTrue(self.receiver.subscribe(sut.BUILD_TOPIC, 36).wait(0))
+
+    def test_deployment_event(self):
+        subscription = self.receiver.subscribe(sut.RELEASE_TOPIC)
+
+        self.assertEqual(200, self._send(self._deployment_event(27253)))
+        self.assertTrue(subscription.wait(2))
+        self.assertEqual(27253, subscription.payload["environment"]["releaseId"])
+
+    def test_invalid_events(self):
+        self.assertEqual(202, self._send({"eventType": "git.push", "resource": {}}))
+
+        request = urllib.request.Request(f"http://127.0.0.1:{self.receiver.port}/", data=b"no json")
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(request, timeout=5)
+        self.assertEqual(400, e.exception.code)
+
+    def test_token(self):
+        self.receiver.token = "totalgeheim"
+
+        self.assertEqual(401, self._send(self._build_event(36)))
+        self.assertEqual(200, self._send(self._build_event(36), {sut.TOKEN_HEADER: "totalgeheim"}))
+        self.assertEqual(1, self.receiver.received)
+
+    def test_wait_for_build_with_service_hook(self):
+        pipeline = pipe.Pipeline("PRJ", "wp-cloud-img")
+        when(pipeline).fetch_build_status(36).thenReturn(
+            {"id": 36, "buildNumber": "123", "status": "completed", "result": "succeeded"})
+        sender = self._send_later(self._build_event(36))
+
+        start = time.monotonic()
+        result = pipeline.wait_for_build_with_id(36, {"status": "inProgress"})
+        sender.join()
+
+        # the fallback-poll would take minutes
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual("succeeded", result)
+        verify(pipeline, times=1).fetch_build_status(36)
+
+    def test_wait_for_release_with_service_hook(self):
+        tracker = release_tracker.ReleaseTracker(timeout=5)
+        when(rpi).fetch_releases("PRJ", ANY()).thenReturn(
+            {27253: {"id": 27253, "status": "active", "environments": [{"status": "succeeded"}]}})
+        sender = self._send_later(self._deployment_event(27253))
+
+        start = time.monotonic()
+        result = tracker.wait_for_release("PRJ", 27253)
+        sender.join()
+
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual("succeeded", result)
+        verify(rpi, times=1).fetch_releases("PRJ", [27253])
+
+    def test_default_receiver_disabled(self):
+        sut.set_default_receiver(None)
+
+        self.assertIsNone(sut.default_receiver())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from mockito import mock, when, unstub, ANY, verify
+from wp import config as conf
+from wp import history
+from wp import plan
+from wp.pipeline import pipeline_interaction as pipe
+from wp.project import fingerprint as fp
+from wp.project import repo_manifest
+from wp.project import wp_plugins as plugins
+
+
+def manifest(wp_version, dockerfile, plugin_versions):
+    contents = {
+        "azure-pipelines.yml": f"variables:\n  wpVersion: '{wp_version}'\n",
+        "Dockerfile": dockerfile,
+        "init/plugin-list.json": json.dumps({"plugins": [{"key": key, "version": version, "download": ""}
+                                                         for key, version in plugin_versions.items()]})
+    }
+    blobs = {repo_manifest.blob_sha(c.encode("UTF-8")): c.encode("UTF-8") for c in contents.values()}
+    entries = {path: repo_manifest.blob_sha(c.encode("UTF-8")) for path, c in contents.items()}
+    return repo_manifest.scan_tree(entries, blobs.get, cache=repo_manifest.BlobCache())
+
+
+def repository(name):
+    return {"img-repo": f"https://git.company.narf/{name}.git", "project": "PRJ", "build-img-pipeline": f"{name}-img",
+            "update-pipeline": f"Update DB ({name})", "rollout-pipeline": f"Rollout ({name})"}
+
+
+class PlanTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.repositories = {"site-a": repository("site-a"), "site-b": repository("site-b")}
+        self.manifests = {
+            "site-a": manifest("5.4.2", "FROM wordpress:5.4.2-apache\n", {"classic-editor": "1.5", "akismet": "4.1"}),
+            "site-b": manifest("5.5.1", "FROM wordpress:5.5.1-apache\n", {"classic-editor": "1.6"})
+        }
+        when(plan).scan_repository(ANY(), ANY()).thenAnswer(lambda repo, key: self.manifests[key])
+        when(plan).refreshed_parent_images(ANY(), ANY()).thenReturn([])
+        when(pipe.Pipeline).estimate_build_duration().thenReturn(300.0)
+        self.plugin_status = {"plugins": {"classic-editor": {"new_version": "1.6", "package": "x.zip"}}}
+        when(plugins).call_wp_api(ANY()).thenReturn(self.plugin_status)
+        self.history = history.RunHistory(":memory:")
+        history.set_default_history(self.history)
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        history.set_default_history(None)
+        self.history.close()
+        unstub()
+
+    def test_plan_fleet(self):
+        result = plan.plan_fleet("5.5.1", self.repositories)
+
+        site_a = result["repositories"]["site-a"]
+        self.assertTrue(site_a["update"])
+        self.assertEqual({"from": "5.4.2", "to": "5.5.1"}, site_a["wp"])
+        self.assertEqual([{"path": "Dockerfile", "line": 1, "from": "wordpress:5.4.2-apache",
+                           "to": "wordpress:5.5.1-apache"}], site_a["parent_images"])
+        self.assertEqual([{"key": "classic-editor", "from": "1.5", "to": "1.6"}], site_a["plugins"])
+        self.assertEqual(["site-a-img", "Update DB (site-a)", "Rollout (site-a)"],
+                         [p["name"] for p in site_a["pipelines"]])
+        self.assertEqual(300.0, site_a["estimated_build_seconds"])
+
+        site_b = result["repositories"]["site-b"]
+        self.assertFalse(site_b["update"])
+        self.assertEqual([], site_b["plugins"])
+        self.assertEqual([], site_b["pipelines"])
+        self.assertIsNone(site_b["estimated_build_seconds"])
+
+        self.assertEqual(1, result["pending"])
+        self.assertEqual(0, result["errors"])
+        self.assertEqual(300.0, result["estimated_build_seconds"])
+        verify(pipe.Pipeline, times=1).estimate_build_duration()
+
+    def test_plan_fleet_estimates_builds_by_history(self):
+        self.history.record_build("site-a", "PRJ", "site-a-img", 42, "succeeded", 120.0)
+
+        result = plan.plan_fleet("5.5.1", self.repositories)
+
+        self.assertEqual(120.0, result["repositories"]["site-a"]["estimated_build_seconds"])
+        verify(pipe.Pipeline, times=0).estimate_build_duration()
+
+    def test_plan_fleet_asks_once_for_lowest_plugin_versions(self):
+        plan.plan_fleet("5.5.1", self.repositories)
+
+        verify(plugins, times=1).call_wp_api({"plugins": {"akismet": {"Version": "4.1"},
+                                                          "classic-editor": {"Version": "1.5"}}})
+
+    def test_plan_fleet_without_plugin_updates(self):
+        when(plugins).call_wp_api(ANY()).thenReturn({"plugins": []})
+
+        result = plan.plan_fleet("5.5.1", self.repositories)
+
+        self.assertEqual([], result["repositories"]["site-a"]["plugins"])
+        self.assertTrue(result["repositories"]["site-a"]["update"])
+        self.assertEqual(0, result["errors"])
+
+    def test_plan_fleet_for_failed_scan(self):
+        when(plan).scan_repository(ANY(), "site-b").thenRaise(RuntimeError("repository not found"))
+
+        result = plan.plan_fleet("5.5.1", self.repositories)
+
+        self.assertEqual({"error": "repository not found"}, result["repositories"]["site-b"])
+        self.assertTrue(result["repositories"]["site-a"]["update"])
+        self.assertEqual(1, result["errors"])
+
+    def test_refreshed_parent_images(self):
+        unstub(plan)
+        graph = self.manifests["site-b"].dependency_graph()
+        store = mock(fp.ParentDigestStore)
+        when(fp).ParentDigestStore().thenReturn(store)
+        when(store).load("site-b_img").thenReturn({"wordpress:5.5.1-apache": "sha256:42"})
+        when(fp).resolve_parent_digests(graph).thenReturn({"wordpress:5.5.1-apache": "sha256:43"})
+
+        self.assertEqual(["wordpress:5.5.1-apache@sha256:43"], plan.refreshed_parent_images("site-b_img", graph))
+
+    def test_write_plan(self):
+        workdir = conf.workdir
+        result = plan.plan_fleet("5.5.1", self.repositories)
+        try:
+            with TemporaryDirectory("dummy-workdir") as td:
+                conf.workdir = td
+                path = plan.write_plan(result)
+                with open(path) as f:
+                    written = json.load(f)
+                self.assertEqual(os.path.join(td, plan.PLAN_FILE), path)
+        finally:
+            conf.workdir = workdir
+
+        self.assertEqual(result, written)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+from wp import profiling as sut
+
+
+class ProfilingTest(unittest.TestCase):
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        sut.stop()
+
+    def test_stage_without_profiler(self):
+        with sut.stage("fetch"):
+            pass
+
+        self.assertIsNone(sut.active())
+
+    def test_profile_stages(self):
+        def process():
+            with sut.stage("update"):
+                sorted(str(i) for i in range(20000))
+                time.sleep(0.1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            sut.start(directory)
+            sut.active().interval = 0.005
+            workers = [threading.Thread(target=process, name=f"repo_{i}") for i in range(2)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            sut.stop()
+
+            stats = pstats.Stats(os.path.join(directory, "stage-update.pstats"))
+            self.assertIn("<built-in method builtins.sorted>", [func[2] for func in stats.stats])
+            self.assertTrue(os.path.exists(os.path.join(directory, sut.MAIN_STATS_FILE)))
+            with open(os.path.join(directory, sut.COLLAPSED_FILE), 'r') as f:
+                stacks = f.read().splitlines()
+            with open(os.path.join(directory, sut.MEMORY_FILE), 'r') as f:
+                memory = json.loads(f.read())
+
+        self.assertTrue(any(s.startswith("update;") and "process (profiling_test.py" in s for s in stacks))
+        self.assertTrue(all(int(s.rsplit(" ", 1)[1]) > 0 for s in stacks))
+        self.assertEqual(2, memory["update"]["count"])
+        self.assertGreater(memory["update"][sut.TRACED_KEY], 0)
+        self.assertGreaterEqual(memory["update"]["peak_rss_growth"], 0)
+        self.assertGreater(memory["update"]["process_peak_rss"], memory["update"]["peak_rss_growth"])
+        self.assertIsNone(sut.active())
+
+    def test_profile_stage_rss_growth(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sut.start(directory)
+            with sut.stage("fetch"):
+                pass
+            with sut.stage("update"):
+                len(bytearray(512 * 2 ** 20))
+            sut.stop()
+
+            with open(os.path.join(directory, sut.MEMORY_FILE), 'r') as f:
+                memory = json.loads(f.read())
+
+        self.assertLess(memory["fetch"]["peak_rss_growth"], 256 * 2 ** 20)
+        self.assertGreater(memory["update"]["peak_rss_growth"], 256 * 2 ** 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,8 +19,11 @@
 import json
 import os
 import requests
+import threading
+import time
 import unittest
 from mockito import mock, when, unstub, ANY, verify
+from wp import http_client
 import wp.project.docker_hub as sut
 
 
@@ -33,6 +36,8 @@ class DockerHubTest(unittest.TestCase):
 
     def tearDown(self) -> None:
         unittest.TestCase.tearDown(self)
+        http_client.reset_circuit_breakers()
+        sut.clear_tag_index()
         unstub()
 
     def test_fetch_tags_for_error_response(self):
@@ -40,12 +45,12 @@ class DockerHubTest(unittest.TestCase):
             "status_code": 500,
             "text": "TEST Error"
         }, spec=requests.Response)
-        when(requests).get(ANY(str)).thenReturn(response)
+        when(requests).get(ANY(str), timeout=ANY()).thenReturn(response)
 
         with self.assertRaises(RuntimeError):
             sut.fetch_tags(self.dummy_image_name)
 
-        verify(requests, times=1).get(self.expected_uri)
+        verify(requests, times=1).get(self.expected_uri, timeout=ANY())
 
     def test_fetch_tags(self):
         with open(os.path.dirname(__file__) + "/../resources/wordpress-tag-list.json", 'r') as f:
@@ -55,14 +60,14 @@ class DockerHubTest(unittest.TestCase):
 
         response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
         response2 = mock({"status_code": 200, "text": dummy_response_last}, spec=requests.Response)
-        when(requests).get(ANY(str)).thenReturn(response, response2)
+        when(requests).get(ANY(str), timeout=ANY()).thenReturn(response, response2)
 
         result = sut.fetch_tags(self.dummy_image_name)
         self.assertIsNotNone(result)
         self.assertEqual(200, len(result))
 
-        verify(requests, times=1).get(self.expected_uri)
-        verify(requests, times=1).get(self.expected_uri2)
+        verify(requests, times=1).get(self.expected_uri, timeout=ANY())
+        verify(requests, times=1).get(self.expected_uri2, timeout=ANY())
 
     def test_filter_tags(self):
         name_filter = "apache"
@@ -98,6 +103,101 @@ class DockerHubTest(unittest.TestCase):
         self.assertEqual("5.4.1", sut.filter_version_name("5.4.1"))
         self.assertEqual("5.5", sut.filter_version_name("5.5.0"))
         self.assertEqual("5.0", sut.filter_version_name("5.0.0"))
+        self.assertEqual("6.4.10", sut.filter_version_name("6.4.10"))
+        self.assertEqual("10.1", sut.filter_version_name("10.1.0"))
+
+    def test_docker_version_name(self):
+        self.assertEqual("5.5.0", sut.docker_version_name("5.5"))
+        self.assertEqual("6.4.10", sut.docker_version_name("6.4.10"))
+
+    def test_determine_highest_version_for_two_digit_patch_level(self):
+        dummy_tags = [{"id": 42, "name": "6.4.9-apache"},
+                      {"id": 21, "name": "6.4.10-apache"}]
+
+        self.assertEqual("6.4.10-apache", sut.determine_highest_version(dummy_tags))
+
+    def test_fetch_tag(self):
+        expected_uri = f"https://hub.docker.com/v2/repositories/library/{self.dummy_image_name}/tags/5.4.2-apache"
+        dummy_tag = {"name": "5.4.2-apache", "digest": "sha256:42"}
+        response = mock({"status_code": 200, "text": json.dumps(dummy_tag)}, spec=requests.Response)
+        when(requests).get(ANY(str), timeout=ANY()).thenReturn(response)
+
+        result = sut.fetch_tag(self.dummy_image_name, "5.4.2-apache")
+        self.assertEqual(dummy_tag, result)
+
+        verify(requests, times=1).get(expected_uri, timeout=ANY())
+
+    def test_fetch_tag_for_unknown_tag(self):
+        response = mock({"status_code": 404, "text": "not found"}, spec=requests.Response)
+        when(requests).get(ANY(str), timeout=ANY()).thenReturn(response)
+
+        self.assertIsNone(sut.fetch_tag(self.dummy_image_name, "99.0.0-apache"))
+
+    def test_lookup_tag(self):
+        dummy_tag = {"name": "5.4.2-apache", "digest": "sha256:42"}
+        when(sut).fetch_tag(ANY(), ANY()).thenReturn(dummy_tag)
+
+        self.assertEqual(dummy_tag, sut.lookup_tag("wordpress", "5.4.2-apache"))
+        self.assertEqual(dummy_tag, sut.lookup_tag("wordpress", "5.4.2-apache"))
+
+        verify(sut, times=1).fetch_tag("wordpress", "5.4.2-apache")
+
+    def test_lookup_tag_requests_tag_once_for_concurrent_lookups(self):
+        dummy_tag = {"name": "5.4.2-apache", "digest": "sha256:42"}
+        when(sut).fetch_tag(ANY(), ANY()).thenAnswer(lambda *args: time.sleep(0.1) or dummy_tag)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(sut.lookup_tag("wordpress", "5.4.2-apache")))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([dummy_tag] * 4, results)
+        verify(sut, times=1).fetch_tag("wordpress", "5.4.2-apache")
+
+    def test_share_tag_index(self):
+        dummy_tag = {"name": "5.4.2-apache", "digest": "sha256:42"}
+        when(sut).fetch_tag(ANY(), ANY()).thenReturn(dummy_tag)
+        sut.lookup_tag("wordpress", "5.4.2-apache")
+        shared = sut.tag_index()
+        sut.clear_tag_index()
+
+        sut.share_tag_index(shared, threading.Lock())
+        self.assertEqual(dummy_tag, sut.lookup_tag("wordpress", "5.4.2-apache"))
+        self.assertEqual(dummy_tag, sut.lookup_tag("wordpress", "5.5-apache"))
+
+        self.assertIn(("wordpress", "5.5-apache"), shared)
+        verify(sut, times=1).fetch_tag("wordpress", "5.4.2-apache")
+
+    def test_lookup_tag_uses_fetched_tag_list(self):
+        with open(os.path.dirname(__file__) + "/../resources/wordpress-tag-list_lastpage.json", 'r') as f:
+            dummy_response = f.read()
+        response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
+        when(requests).get(ANY(str), timeout=ANY()).thenReturn(response)
+        when(sut).fetch_tag(ANY(), ANY())
+        tags = sut.fetch_tags(self.dummy_image_name)
+
+        result = sut.lookup_tag(self.dummy_image_name, tags[0]["name"])
+        self.assertEqual(tags[0], result)
+
+        verify(sut, times=0).fetch_tag(ANY(), ANY())
+
+    def test_tag_digest(self):
+        with open(os.path.dirname(__file__) + "/../resources/wordpress-tag-list.json", 'r') as f:
+            dummy_tag = json.loads(f.read())["results"][0]
+
+        self.assertEqual("sha256:e43e1228cf064b90b5befa5a741870d1cb976d731662c6602cb9e17ac968fead",
+                         sut.tag_digest(dummy_tag))
+        self.assertEqual("sha256:42", sut.tag_digest({"digest": "sha256:42", "images": []}))
+        self.assertIsNone(sut.tag_digest(None))
+
+    def test_fetch_tag_for_error_response(self):
+        response = mock({"status_code": 500, "text": "TEST Error"}, spec=requests.Response)
+        when(requests).get(ANY(str), timeout=ANY()).thenReturn(response)
+
+        with self.assertRaises(RuntimeError):
+            sut.fetch_tag(self.dummy_image_name, "5.4.2-apache")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,90 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from tempfile import TemporaryDirectory
+from mockito import when, unstub, ANY, verify
+from wp import storage
+from wp.project import docker_hub as dh
+from wp.project import fingerprint as sut
+from wp.project import image_graph
+
+
+class FingerprintTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.dummy_blobs = {"Dockerfile": "aaa", "init/plugin-list.json": "bbb", "azure-pipelines.yml": "ccc"}
+        self.dummy_digests = {"wordpress:5.4.2-apache": "sha256:42"}
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        unstub()
+
+    def test_compute(self):
+        result = sut.compute(self.dummy_blobs, "5.4.2", self.dummy_digests)
+
+        self.assertEqual(64, len(result))
+        self.assertEqual(result, sut.compute(dict(self.dummy_blobs), "5.4.2", dict(self.dummy_digests)))
+        # the pipeline-file contains site-specific names, but is no build-input
+        self.assertEqual(result, sut.compute(dict(self.dummy_blobs, **{"azure-pipelines.yml": "ddd"}),
+                                             "5.4.2", self.dummy_digests))
+        self.assertNotEqual(result, sut.compute(dict(self.dummy_blobs, Dockerfile="ddd"), "5.4.2", self.dummy_digests))
+        self.assertNotEqual(result, sut.compute(self.dummy_blobs, "5.4.3", self.dummy_digests))
+        self.assertNotEqual(result, sut.compute(self.dummy_blobs, "5.4.2", {"wordpress:5.4.2-apache": "sha256:21"}))
+
+    def test_compute_for_unresolved_parents(self):
+        self.assertIsNone(sut.compute(self.dummy_blobs, "5.4.2", {}))
+        self.assertIsNone(sut.compute(self.dummy_blobs, "5.4.2", {"registry.local/wp:5": None}))
+
+    def test_resolve_parent_digests(self):
+        graph = image_graph.DependencyGraph({"Dockerfile": image_graph.parse_dockerfile([
+            "FROM wordpress:5.4.2-apache", "FROM registry.local/base:1", "FROM alpine@sha256:21"])})
+        when(dh).lookup_tag(ANY(), ANY()).thenReturn({"name": "5.4.2-apache", "digest": "sha256:42"})
+
+        result = sut.resolve_parent_digests(graph)
+        self.assertEqual({"wordpress:5.4.2-apache": "sha256:42", "registry.local/base:1": None,
+                          "alpine@sha256:21": "sha256:21"}, result)
+
+        verify(dh, times=1).lookup_tag("wordpress", "5.4.2-apache")
+
+    def test_fingerprint_index(self):
+        with TemporaryDirectory("dummy-state") as td:
+            index = sut.FingerprintIndex(storage.JsonStore(f"{td}/index.json"))
+            self.assertIsNone(index.lookup("f1ng3rpr1nt"))
+            self.assertIsNone(index.lookup(None))
+
+            index.record("f1ng3rpr1nt", "PRJ", "wp-img", 36)
+            index.record(None, "PRJ", "wp-img", 37)
+
+            result = sut.FingerprintIndex(storage.JsonStore(f"{td}/index.json")).lookup("f1ng3rpr1nt")
+            self.assertEqual({"PRJ", "wp-img", 36}, {result["project"], result["pipeline"], result["build_id"]})
+
+    def test_parent_digest_store(self):
+        with TemporaryDirectory("dummy-state") as td:
+            store = sut.ParentDigestStore(storage.JsonStore(f"{td}/digests.json"))
+            self.assertEqual({}, store.load("dummy_img"))
+
+            store.save("dummy_img", {"wordpress:5.4.2-apache": "sha256:42", "registry.local/x:1": None})
+            store.save("other_img", {"registry.local/x:1": None})
+
+            self.assertEqual({"wordpress:5.4.2-apache": "sha256:42"}, store.load("dummy_img"))
+            self.assertEqual({}, store.load("other_img"))
+
+
+if __name__ == '__main__':
+    unittest.main()
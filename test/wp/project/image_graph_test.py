@@ -0,0 +1,99 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from wp.project import image_graph as sut
+
+
+class ImageGraphTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.multi_stage = ["# syntax = docker/dockerfile:1.0-experimental",
+                            "ARG WP_VERSION=\"5.4.1\"",
+                            "ARG PHP=7.4",
+                            "FROM --platform=linux/amd64 wordpress:${WP_VERSION}-php${PHP}-apache AS base",
+                            "ARG IGNORED=1",
+                            "FROM composer:2 as build",
+                            "FROM base",
+                            "COPY --from=build /app /var/www/html"]
+
+    def test_parse_dockerfile(self):
+        result = sut.parse_dockerfile(self.multi_stage)
+
+        self.assertEqual({"WP_VERSION", "PHP"}, set(result["args"].keys()))
+        self.assertEqual({"line": 1, "default": "5.4.1", "raw": "\"5.4.1\""}, result["args"]["WP_VERSION"])
+        self.assertEqual([{"line": 3, "source": "wordpress:${WP_VERSION}-php${PHP}-apache", "alias": "base"},
+                          {"line": 5, "source": "composer:2", "alias": "build"},
+                          {"line": 6, "source": "base", "alias": None}], result["stages"])
+
+    def test_substitute_args(self):
+        self.assertEqual("wordpress:5.4-apache", sut.substitute_args("wordpress:${V}-apache", {"V": "5.4"}))
+        self.assertEqual("wordpress:5.4-apache", sut.substitute_args("wordpress:$V-apache", {"V": "5.4"}))
+        self.assertEqual("wordpress:1-apache", sut.substitute_args("wordpress:${V:-1}-apache", {}))
+        self.assertEqual("wordpress:${V}-apache", sut.substitute_args("wordpress:${V}-apache", {"V": None}))
+
+    def test_image_ref(self):
+        ref = sut.ImageRef.parse("registry:5000/library/wordpress:5.4.2-apache@sha256:42")
+        self.assertEqual("registry:5000/library/wordpress", ref.name)
+        self.assertEqual("5.4.2-apache", ref.tag)
+        self.assertEqual("sha256:42", ref.digest)
+        self.assertEqual("registry:5000/library/wordpress:5.4.2-apache@sha256:42", str(ref))
+
+        self.assertEqual("wordpress", sut.ImageRef.parse("docker.io/library/wordpress").short_name)
+        self.assertIsNone(sut.ImageRef.parse("registry:5000/wordpress").tag)
+
+    def test_dependency_graph(self):
+        graph = sut.DependencyGraph({"web/Dockerfile": sut.parse_dockerfile(self.multi_stage),
+                                     "cron/Dockerfile": sut.parse_dockerfile(["FROM wordpress:5.4.2-apache"])})
+
+        self.assertEqual(4, len(graph.stages))
+        self.assertEqual(["composer:2", "wordpress:5.4.1-php7.4-apache", "wordpress:5.4.2-apache"],
+                         [str(i) for i in graph.external_images()])
+        base = [s for s in graph.stages if s.alias == "base"][0]
+        self.assertEqual(1, len(graph.dependants(base)))
+        self.assertEqual(2, len(graph.stages_for_image("wordpress")))
+
+    def test_dependency_graph_with_build_args(self):
+        graph = sut.DependencyGraph({"Dockerfile": sut.parse_dockerfile(["ARG VERSION", "FROM wordpress:${VERSION}-apache"])},
+                                    {"VERSION": "5.4.2", "MIRROR": "http://mirror"})
+
+        self.assertEqual(["wordpress:5.4.2-apache"], [str(i) for i in graph.external_images()])
+
+    def test_plan_version_updates(self):
+        graph = sut.DependencyGraph({"web/Dockerfile": sut.parse_dockerfile(self.multi_stage),
+                                     "cron/Dockerfile": sut.parse_dockerfile(["FROM wordpress:5.4.1-apache"]),
+                                     "cli/Dockerfile": sut.parse_dockerfile(["FROM wordpress:cli-2.4"])})
+
+        result = sut.plan_version_updates(graph, "wordpress", "5.4.10")
+        self.assertEqual([sut.LineEdit("cron/Dockerfile", 0, "wordpress:5.4.1-apache", "wordpress:5.4.10-apache"),
+                          sut.LineEdit("web/Dockerfile", 1, "WP_VERSION=\"5.4.1\"", "WP_VERSION=\"5.4.10\"")], result)
+
+    def test_plan_version_updates_for_pipeline_managed_args(self):
+        graph = sut.DependencyGraph({"Dockerfile": sut.parse_dockerfile(["ARG VERSION=5.4.1", "FROM wordpress:${VERSION}-apache"])},
+                                    {"VERSION": "5.4.1"})
+
+        self.assertEqual([], sut.plan_version_updates(graph, "wordpress", "5.5"))
+
+    def test_plan_version_updates_for_current_images(self):
+        graph = sut.DependencyGraph({"Dockerfile": sut.parse_dockerfile(["FROM wordpress:5.5.0-apache"])})
+
+        self.assertEqual([], sut.plan_version_updates(graph, "wordpress", "5.5"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,6 +22,7 @@ from pathlib import Path
 from shutil import copyfile
 from tempfile import TemporaryDirectory
 from wp.project.repo_details import RepoDetails
+from wp.project import repo_manifest
 
 
 class RepoDetailsTest(unittest.TestCase):
@@ -35,9 +36,11 @@ class RepoDetailsTest(unittest.TestCase):
         }
         self.dummy_path = "/tmp/dummy-repo"
         self.sut = RepoDetails(self.dummy_repo)
+        repo_manifest.set_default_cache(repo_manifest.BlobCache())
 
     def tearDown(self) -> None:
         unittest.TestCase.tearDown(self)
+        repo_manifest.set_default_cache(None)
 
     def test_determine_imageversion_for_missing_azurepipeline(self):
         expected_version = RepoDetails.DEFAULT_IMAGE_VERSION
@@ -63,6 +66,16 @@ class RepoDetailsTest(unittest.TestCase):
             result = self.sut.determine_parent_image(td)
             self.assertEqual(expected_parent, result)
 
+    def test_determine_parent_image_for_missing_dockerfile(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            with self.assertRaises(RuntimeError):
+                self.sut.determine_parent_image(td)
+
+    def test_grep_parent(self):
+        self.assertEqual("wordpress:5.4.2-apache", self.sut.grep_parent(["# comment", "FROM wordpress:5.4.2-apache"]))
+        with self.assertRaises(RuntimeError):
+            self.sut.grep_parent(["RUN true"])
+
 
 if __name__ == '__main__':
     unittest.main()
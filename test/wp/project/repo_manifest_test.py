@@ -0,0 +1,200 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import unittest
+from pathlib import Path
+from shutil import copyfile
+from tempfile import TemporaryDirectory
+from wp.project import repo_manifest as sut
+
+
+class RepoManifestTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.resources = os.path.dirname(__file__) + "/../resources"
+        self.cache = sut.BlobCache()
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+
+    def _create_repo(self, td):
+        os.makedirs(f"{td}/init")
+        os.makedirs(f"{td}/docker/web")
+        copyfile(f"{self.resources}/azure-pipelines.yml", f"{td}/azure-pipelines.yml")
+        copyfile(f"{self.resources}/azure-pipelines.yml.template", f"{td}/azure-pipelines.yml.template")
+        copyfile(f"{self.resources}/plugin-list.json", f"{td}/init/plugin-list.json")
+        copyfile(f"{self.resources}/Dockerfile", f"{td}/docker/web/Dockerfile")
+
+    @staticmethod
+    def _write(path, content):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_blob_sha_matches_git(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            self._write(f"{td}/Dockerfile", "FROM wordpress:5.4.2-apache\n")
+            expected = subprocess.run(["git", "hash-object", f"{td}/Dockerfile"],
+                                      capture_output=True, encoding="UTF-8").stdout.strip()
+
+            with open(f"{td}/Dockerfile", "rb") as f:
+                self.assertEqual(expected, sut.blob_sha(f.read()))
+
+    def test_scan(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            self._create_repo(td)
+
+            result = sut.scan(td, self.cache)
+
+        self.assertEqual("3.7", result.image_version)
+        self.assertEqual({"MIRROR": "http://ftp.halifax.rwth-aachen.de/ubuntu", "FE_VERSION": "3.7"}, result.build_args)
+        self.assertEqual(["docker/web/Dockerfile"], result.dockerfiles)
+        self.assertEqual(["ubuntu:18.04"], result.parent_images["docker/web/Dockerfile"])
+        self.assertEqual(2, len(result.plugin_list["plugins"]))
+        self.assertTrue(result.has_file(sut.PIPELINE_TEMPLATE))
+        self.assertEqual(4, len(result.files))
+
+    def test_scan_takes_blob_shas_from_git(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            self._create_repo(td)
+            subprocess.run(["git", "init", "-q", td], check=True)
+            self._write(f"{td}/docker/web/Dockerfile", "FROM wordpress:5.4.2-apache\n")
+            expected = subprocess.run(["git", "hash-object", f"{td}/docker/web/Dockerfile"],
+                                      capture_output=True, encoding="UTF-8").stdout.strip()
+
+            result = sut.scan(td, self.cache)
+
+        self.assertEqual(expected, result.files["docker/web/Dockerfile"])
+        self.assertEqual(expected, result.blobs["docker/web/Dockerfile"])
+        self.assertEqual(["wordpress:5.4.2-apache"], result.parent_images["docker/web/Dockerfile"])
+        self.assertEqual(4, len(result.files))
+
+    def test_scan_for_invalid_plugin_list(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            self._create_repo(td)
+            self._write(f"{td}/init/plugin-list.json", "{\"plugins\": [")
+
+            result = sut.scan(td, self.cache)
+
+        self.assertEqual("3.7", result.image_version)
+        self.assertEqual(["docker/web/Dockerfile"], result.dockerfiles)
+        self.assertIsNone(result.plugin_list)
+        self.assertIn(sut.PLUGIN_LIST, result.errors)
+        self.assertTrue(result.has_file(sut.PLUGIN_LIST))
+
+    def test_scan_for_empty_repo(self):
+        result = sut.scan("/tmp/INVALID/dummy-repo", self.cache)
+
+        self.assertIsNone(result.image_version)
+        self.assertEqual([], result.dockerfiles)
+        self.assertIsNone(result.plugin_list)
+
+    def test_discover_skips_ignored_and_deep_directories(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            self._write(f"{td}/Dockerfile", "FROM wordpress\n")
+            self._write(f"{td}/node_modules/pkg/Dockerfile", "FROM node\n")
+            self._write(f"{td}/wp-content/plugins/x/Dockerfile", "FROM php\n")
+            self._write(f"{td}/a/b/c/d/Dockerfile", "FROM deep\n")
+            self._write(f"{td}/a/b/c/d/e/Dockerfile", "FROM too-deep\n")
+
+            result = [p for p, kind in sut.discover(td)]
+
+        self.assertEqual(["Dockerfile", "a/b/c/d/Dockerfile"], result)
+
+    def test_scan_uses_cache_for_identical_content(self):
+        with TemporaryDirectory("dummy-repo1") as td1, TemporaryDirectory("dummy-repo2") as td2:
+            self._create_repo(td1)
+            self._create_repo(td2)
+
+            first = sut.scan(td1, self.cache)
+            second = sut.scan(td2, self.cache)
+
+        self.assertEqual(3, self.cache.misses)
+        self.assertEqual(3, self.cache.hits)
+        self.assertEqual(first.files, second.files)
+        self.assertEqual(first.plugin_list, second.plugin_list)
+        self.assertIsNot(first.plugin_list, second.plugin_list)
+
+    def test_scan_tree(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            self._create_repo(td)
+            blobs = {}
+            for rel_path in ["azure-pipelines.yml", "azure-pipelines.yml.template", "init/plugin-list.json",
+                             "docker/web/Dockerfile"]:
+                with open(f"{td}/{rel_path}", "rb") as f:
+                    blobs[rel_path] = f.read()
+            expected = sut.scan(td, sut.BlobCache())
+        entries = {path: sut.blob_sha(content) for path, content in blobs.items()}
+        entries.update({"README.md": "a1b2c3", "node_modules/pkg/Dockerfile": "d4e5f6"})
+        contents = {sut.blob_sha(content): content for content in blobs.values()}
+        read = []
+
+        def read_blob(sha):
+            read.append(sha)
+            return contents[sha]
+
+        result = sut.scan_tree(entries, read_blob, "dummy-repo", self.cache)
+        sut.scan_tree(entries, read_blob, "dummy-repo", self.cache)
+
+        self.assertEqual(expected.files, result.files)
+        self.assertEqual("3.7", result.image_version)
+        self.assertEqual(expected.build_args, result.build_args)
+        self.assertEqual(expected.dockerfile_details, result.dockerfile_details)
+        self.assertEqual(expected.plugin_list, result.plugin_list)
+        # the template is not parsed, everything else is read once only
+        self.assertEqual(3, len(read))
+
+    def test_discoverable(self):
+        self.assertTrue(sut.discoverable("Dockerfile"))
+        self.assertTrue(sut.discoverable("a/b/c/d/Dockerfile"))
+        self.assertFalse(sut.discoverable("a/b/c/d/e/Dockerfile"))
+        self.assertFalse(sut.discoverable("wp-content/plugins/x/Dockerfile"))
+
+    def test_cache_is_persisted(self):
+        with TemporaryDirectory("dummy-repo") as td, TemporaryDirectory("dummy-cache") as cache_dir:
+            self._create_repo(td)
+            sut.scan(td, sut.BlobCache(cache_dir))
+
+            cache = sut.BlobCache(cache_dir)
+            result = sut.scan(td, cache)
+
+        self.assertEqual(0, cache.misses)
+        self.assertEqual(3, cache.hits)
+        self.assertEqual("3.7", result.image_version)
+
+    def test_grep_parents(self):
+        lines = ["FROM wordpress:5.4.2-apache AS base", "RUN true", "FROM base"]
+        self.assertEqual(["wordpress:5.4.2-apache AS base", "base"], sut.grep_parents(lines))
+
+    def test_dependency_graph(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            self._write(f"{td}/azure-pipelines.yml", "variables:\n  wpVersion: '5.4.2'\n\nsteps:\n"
+                                                     "  - arguments: '--build-arg VERSION=\"$(wpVersion)\"'\n")
+            self._write(f"{td}/Dockerfile", "ARG VERSION\nFROM wordpress:${VERSION}-apache\n")
+            self._write(f"{td}/cron/Dockerfile", "FROM wordpress:5.4.2-apache AS cron\nFROM cron\n")
+
+            result = sut.scan(td, self.cache).dependency_graph()
+
+        self.assertEqual(3, len(result.stages))
+        self.assertEqual(["wordpress:5.4.2-apache"], [str(i) for i in result.external_images()])
+
+
+if __name__ == '__main__':
+    unittest.main()
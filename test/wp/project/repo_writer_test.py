@@ -20,6 +20,8 @@ import os
 import unittest
 from shutil import copyfile
 from tempfile import TemporaryDirectory
+from wp.project import image_graph
+from wp.project import repo_writer
 from wp.project.repo_writer import RepoWriter
 
 
@@ -27,9 +29,13 @@ class RepoWriterTest(unittest.TestCase):
     def setUp(self) -> None:
         unittest.TestCase.setUp(self)
         self.maxDiff = None
+        self.tmpl_file = "azure-pipelines.yml.template"
+        self.resources = os.path.dirname(__file__) + "/../resources"
+        repo_writer.set_template_engine(repo_writer.TemplateEngine())
 
     def tearDown(self) -> None:
         unittest.TestCase.tearDown(self)
+        repo_writer.set_template_engine(None)
 
     def test_update_wp_version(self):
         dummy_version = "42"
@@ -48,6 +54,58 @@ class RepoWriterTest(unittest.TestCase):
                 result = f.read()
 
             self.assertEqual(expected_result, result)
+            self.assertEqual(sorted([tmpl_file, "azure-pipelines.yml"]), sorted(os.listdir(td)))
+
+    def test_update_wp_version_keeps_file_mode(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            copyfile(f"{self.resources}/{self.tmpl_file}", f"{td}/{self.tmpl_file}")
+            copyfile(f"{self.resources}/azure-pipelines.yml", f"{td}/azure-pipelines.yml")
+            os.chmod(f"{td}/azure-pipelines.yml", 0o664)
+
+            RepoWriter(td).update_wp_version("42")
+
+            self.assertEqual(0o664, os.stat(f"{td}/azure-pipelines.yml").st_mode & 0o777)
+
+    def test_apply_line_edits(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            os.makedirs(f"{td}/web")
+            with open(f"{td}/web/Dockerfile", "w") as f:
+                f.write("ARG V=5.4.1\nFROM wordpress:${V}-apache\n")
+
+            RepoWriter(td).apply_line_edits([image_graph.LineEdit("web/Dockerfile", 0, "V=5.4.1", "V=5.5.0")])
+
+            with open(f"{td}/web/Dockerfile", 'r') as f:
+                self.assertEqual("ARG V=5.5.0\nFROM wordpress:${V}-apache\n", f.read())
+
+    def test_apply_line_edits_for_changed_line(self):
+        with TemporaryDirectory("dummy-repo") as td:
+            with open(f"{td}/Dockerfile", "w") as f:
+                f.write("FROM ubuntu\n")
+
+            with self.assertRaises(RuntimeError):
+                RepoWriter(td).apply_line_edits([image_graph.LineEdit("Dockerfile", 0, "wordpress:1", "wordpress:2")])
+
+    def test_identical_templates_are_compiled_once(self):
+        engine = repo_writer.TemplateEngine()
+        with open(f"{self.resources}/{self.tmpl_file}", 'r') as f:
+            source = f.read()
+
+        first = engine.get_template(source)
+        second = engine.get_template(str(source))
+        other = engine.get_template(source + "# changed\n")
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+
+    def test_bytecode_cache(self):
+        with TemporaryDirectory("dummy-cache") as cache_dir:
+            engine = repo_writer.TemplateEngine(cache_dir)
+            engine.get_template("version: '{{ wp_version }}'")
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+            # a fresh engine (e.g. the next run) loads the compiled template from the bytecode-cache
+            template = repo_writer.TemplateEngine(cache_dir).get_template("version: '{{ wp_version }}'")
+            self.assertEqual("version: '42'", template.render(wp_version="42"))
 
 
 if __name__ == '__main__':
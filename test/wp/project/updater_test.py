@@ -16,11 +16,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
+import threading
 import unittest
+from tempfile import TemporaryDirectory
 from mockito import when, mock, unstub, ANY, verify, verifyZeroInteractions
 from wp.project.repo_details import RepoDetails
+from wp.project import fingerprint
+from wp.project import repo_manifest
 from wp.project import repo_writer as repow
 from wp.git import repository_pusher as repush
+from wp.pipeline import build_scheduler
 from wp.project import updater as sut
 from wp.project import wp_plugins
 
@@ -31,6 +37,9 @@ class UpdaterTest(unittest.TestCase):
         self.dummy_repo_path = "/tmp"
         self.dummy_latest_version = "42"
         self.dummy_repo_pusher = mock(repush.RepositoryPusher)
+        self.dummy_manifest = repo_manifest.RepoManifest(self.dummy_repo_path)
+        when(repo_manifest).scan(ANY()).thenReturn(self.dummy_manifest)
+        when(sut).check_parent_digests(ANY(), ANY()).thenReturn(({}, []))
 
     def tearDown(self) -> None:
         unittest.TestCase.tearDown(self)
@@ -50,17 +59,16 @@ class UpdaterTest(unittest.TestCase):
         dummy_plugin_json = {"plugin": "NARF"}
         dummy_request_body = {"request": "ZORT"}
         dummy_plugin_status = {"status": "POIT"}
-        when(wp_plugins).read_plugin_list(ANY()).thenReturn(dummy_plugin_json)
+        self.dummy_manifest.plugin_list = dummy_plugin_json
         when(wp_plugins).build_request_body(ANY()).thenReturn(dummy_request_body)
         when(wp_plugins).call_wp_api(ANY()).thenReturn(dummy_plugin_status)
         when(wp_plugins).is_update_plugins(ANY()).thenReturn(False)
         when(wp_plugins).update_plugin_list(ANY(), ANY())
         when(wp_plugins).write_plugin_list(ANY(), ANY())
 
-        result = sut.check_and_update_plugins(self.dummy_repo_path)
+        result = sut.check_and_update_plugins(self.dummy_repo_path, self.dummy_manifest)
         self.assertFalse(result)
 
-        verify(wp_plugins, times=1).read_plugin_list(self.dummy_repo_path)
         verify(wp_plugins, times=1).build_request_body(dummy_plugin_json)
         verify(wp_plugins, times=1).call_wp_api(dummy_request_body)
         verify(wp_plugins, times=1).is_update_plugins(dummy_plugin_status)
@@ -72,100 +80,341 @@ class UpdaterTest(unittest.TestCase):
         dummy_request_body = {"request": "ZORT"}
         dummy_plugin_status = {"status": "POIT"}
         dummy_plugin_updated_json = {"plugin": "update"}
-        when(wp_plugins).read_plugin_list(ANY()).thenReturn(dummy_plugin_json)
+        self.dummy_manifest.plugin_list = dummy_plugin_json
         when(wp_plugins).build_request_body(ANY()).thenReturn(dummy_request_body)
         when(wp_plugins).call_wp_api(ANY()).thenReturn(dummy_plugin_status)
         when(wp_plugins).is_update_plugins(ANY()).thenReturn(True)
         when(wp_plugins).update_plugin_list(ANY(), ANY()).thenReturn(dummy_plugin_updated_json)
         when(wp_plugins).write_plugin_list(ANY(), ANY())
 
-        result = sut.check_and_update_plugins(self.dummy_repo_path)
+        result = sut.check_and_update_plugins(self.dummy_repo_path, self.dummy_manifest)
         self.assertTrue(result)
 
-        verify(wp_plugins, times=1).read_plugin_list(self.dummy_repo_path)
         verify(wp_plugins, times=1).build_request_body(dummy_plugin_json)
         verify(wp_plugins, times=1).call_wp_api(dummy_request_body)
         verify(wp_plugins, times=1).is_update_plugins(dummy_plugin_status)
         verify(wp_plugins, times=1).update_plugin_list(dummy_plugin_json, dummy_plugin_status)
         verify(wp_plugins, times=1).write_plugin_list(self.dummy_repo_path, dummy_plugin_updated_json)
 
+    def test_check_and_update_plugins_for_invalid_plugin_list(self):
+        self.dummy_manifest.errors[repo_manifest.PLUGIN_LIST] = "Expecting value: line 1 column 1 (char 0)"
+        when(wp_plugins).call_wp_api(ANY())
+
+        with self.assertRaisesRegex(RuntimeError, "Expecting value"):
+            sut.check_and_update_plugins(self.dummy_repo_path, self.dummy_manifest)
+
+        verify(wp_plugins, times=0).call_wp_api(ANY())
+
     def test_check_and_update_wp_for_no_update_required(self):
         dummy_repo_version = "21"
         dummy_latest_version = "21"
 
-        when(RepoDetails).determine_imageversion(self.dummy_repo_path).thenReturn(dummy_repo_version)
+        when(RepoDetails).determine_imageversion(ANY(), ANY()).thenReturn(dummy_repo_version)
         when(sut).update_wp_version(ANY(), ANY())
+        when(sut).check_and_update_parent_images(ANY(), ANY(), ANY()).thenReturn(False)
 
-        result = sut.check_and_update_wp(self.dummy_repo_path, dummy_latest_version)
+        result = sut.check_and_update_wp(self.dummy_repo_path, dummy_latest_version, self.dummy_manifest)
         self.assertFalse(result)
 
-        verify(RepoDetails, times=1).determine_imageversion(self.dummy_repo_path)
+        verify(RepoDetails, times=1).determine_imageversion(self.dummy_repo_path, self.dummy_manifest)
         verify(sut, times=0).update_wp_version(ANY(), ANY())
 
     def test_check_and_update_wp(self):
         dummy_repo_version = "21"
-        when(RepoDetails).determine_imageversion(self.dummy_repo_path).thenReturn(dummy_repo_version)
+        when(RepoDetails).determine_imageversion(ANY(), ANY()).thenReturn(dummy_repo_version)
         when(sut).update_wp_version(ANY(), ANY())
+        when(sut).check_and_update_parent_images(ANY(), ANY(), ANY()).thenReturn(False)
 
-        result = sut.check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version)
+        result = sut.check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version, self.dummy_manifest)
         self.assertTrue(result)
 
-        verify(RepoDetails, times=1).determine_imageversion(self.dummy_repo_path)
+        verify(RepoDetails, times=1).determine_imageversion(self.dummy_repo_path, self.dummy_manifest)
         verify(sut, times=1).update_wp_version(self.dummy_repo_path, self.dummy_latest_version)
+        # rescanned after the pipeline-update
+        verify(repo_manifest, times=1).scan(self.dummy_repo_path)
+        verify(sut, times=1).check_and_update_parent_images(self.dummy_repo_path, self.dummy_latest_version,
+                                                                self.dummy_manifest)
+
+    def test_check_and_update_wp_for_outdated_parent_image_only(self):
+        when(RepoDetails).determine_imageversion(self.dummy_repo_path, self.dummy_manifest).thenReturn("42")
+        when(sut).update_wp_version(ANY(), ANY())
+        when(sut).check_and_update_parent_images(ANY(), ANY(), ANY()).thenReturn(True)
+
+        self.assertTrue(sut.check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version, self.dummy_manifest))
+
+        verify(sut, times=0).update_wp_version(ANY(), ANY())
+
+    def test_check_and_update_parent_images(self):
+        unstub(repo_manifest)
+        repo_manifest.set_default_cache(repo_manifest.BlobCache())
+        with TemporaryDirectory("dummy-repo") as td:
+            self._write(f"{td}/web/Dockerfile", "ARG BASE=5.4.1\nFROM wordpress:${BASE}-apache AS base\n"
+                                                "FROM base\nRUN true\n")
+            self._write(f"{td}/cron/Dockerfile", "FROM wordpress:5.4.1-apache\n")
+            self._write(f"{td}/cli/Dockerfile", "FROM wordpress:cli-2.4\n")
+
+            self.assertTrue(sut.check_and_update_parent_images(td, "5.5", repo_manifest.scan(td)))
+            self.assertFalse(sut.check_and_update_parent_images(td, "5.5", repo_manifest.scan(td)))
+
+            with open(f"{td}/web/Dockerfile", 'r') as f:
+                self.assertEqual("ARG BASE=5.5.0\nFROM wordpress:${BASE}-apache AS base\nFROM base\nRUN true\n",
+                                 f.read())
+            with open(f"{td}/cron/Dockerfile", 'r') as f:
+                self.assertEqual("FROM wordpress:5.5.0-apache\n", f.read())
+            with open(f"{td}/cli/Dockerfile", 'r') as f:
+                self.assertEqual("FROM wordpress:cli-2.4\n", f.read())
+        repo_manifest.set_default_cache(None)
+
+    @staticmethod
+    def _write(path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
 
     def test_compare_and_update_no_update(self):
-        when(sut).check_and_update_wp(ANY(), ANY()).thenReturn(False)
-        when(sut).check_and_update_plugins(ANY()).thenReturn(False)
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(False)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(False)
         when(repush).RepositoryPusher(ANY())
 
         self.assertFalse(sut.compare_and_update(self.dummy_repo_path, "42"))
 
-        verify(sut, times=1).check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version)
-        verify(sut, times=1).check_and_update_plugins(self.dummy_repo_path)
+        verify(sut, times=1).check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version, self.dummy_manifest)
+        verify(sut, times=1).check_and_update_plugins(self.dummy_repo_path, self.dummy_manifest)
+        verify(sut, times=1).check_parent_digests(self.dummy_repo_path, self.dummy_manifest)
+        verify(repo_manifest, times=1).scan(self.dummy_repo_path)
         verifyZeroInteractions(repush)
 
+    def test_compare_and_update_rescans_after_update(self):
+        updated_manifest = repo_manifest.RepoManifest(self.dummy_repo_path)
+        when(repo_manifest).scan(ANY()).thenReturn(self.dummy_manifest).thenReturn(updated_manifest)
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(True)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(False)
+        when(sut).determine_fingerprint(ANY(), ANY(), ANY())
+        when(sut).push_changes(ANY(), ANY(), ANY(), skip_build=ANY(), refreshed_images=ANY())
+
+        sut.compare_and_update(self.dummy_repo_path, "42")
+
+        verify(repo_manifest, times=2).scan(self.dummy_repo_path)
+        verify(sut, times=1).check_and_update_wp(self.dummy_repo_path, "42", self.dummy_manifest)
+        verify(sut, times=1).check_parent_digests(self.dummy_repo_path, updated_manifest)
+        verify(sut, times=1).determine_fingerprint(self.dummy_repo_path, {}, updated_manifest)
+
     def test_compare_and_update_no_plugins_update(self):
-        when(sut).check_and_update_wp(ANY(), ANY()).thenReturn(True)
-        when(sut).check_and_update_plugins(ANY()).thenReturn(False)
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(True)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(False)
+        when(sut).determine_fingerprint(ANY(), ANY(), ANY())
         when(repush).RepositoryPusher(ANY()).thenReturn(self.dummy_repo_pusher)
         when(self.dummy_repo_pusher).commit_and_push(ANY())
         expected_commit_msg = f"auto-update wordpress: wp-version={True} | plugins={False}"
 
         self.assertTrue(sut.compare_and_update(self.dummy_repo_path, "42"))
 
-        verify(sut, times=1).check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version)
-        verify(sut, times=1).check_and_update_plugins(self.dummy_repo_path)
+        verify(sut, times=1).check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version, self.dummy_manifest)
+        verify(sut, times=1).check_and_update_plugins(self.dummy_repo_path, self.dummy_manifest)
         verify(repush, times=1).RepositoryPusher(self.dummy_repo_path)
         verify(self.dummy_repo_pusher, times=1).commit_and_push(expected_commit_msg)
 
     def test_compare_and_update_no_wp_update(self):
-        when(sut).check_and_update_wp(ANY(), ANY()).thenReturn(False)
-        when(sut).check_and_update_plugins(ANY()).thenReturn(True)
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(False)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(True)
+        when(sut).determine_fingerprint(ANY(), ANY(), ANY())
         when(repush).RepositoryPusher(ANY()).thenReturn(self.dummy_repo_pusher)
         when(self.dummy_repo_pusher).commit_and_push(ANY())
         expected_commit_msg = f"auto-update wordpress: wp-version={False} | plugins={True}"
 
         self.assertTrue(sut.compare_and_update(self.dummy_repo_path, "42"))
 
-        verify(sut, times=1).check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version)
-        verify(sut, times=1).check_and_update_plugins(self.dummy_repo_path)
+        verify(sut, times=1).check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version, self.dummy_manifest)
+        verify(sut, times=1).check_and_update_plugins(self.dummy_repo_path, self.dummy_manifest)
         verify(repush, times=1).RepositoryPusher(self.dummy_repo_path)
         verify(self.dummy_repo_pusher, times=1).commit_and_push(expected_commit_msg)
 
     def test_compare_and_update_full_update(self):
-        when(sut).check_and_update_wp(ANY(), ANY()).thenReturn(True)
-        when(sut).check_and_update_plugins(ANY()).thenReturn(True)
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(True)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(True)
+        when(sut).determine_fingerprint(ANY(), ANY(), ANY())
         when(repush).RepositoryPusher(ANY()).thenReturn(self.dummy_repo_pusher)
         when(self.dummy_repo_pusher).commit_and_push(ANY())
         expected_commit_msg = f"auto-update wordpress: wp-version={True} | plugins={True}"
 
         self.assertTrue(sut.compare_and_update(self.dummy_repo_path, "42"))
 
-        verify(sut, times=1).check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version)
-        verify(sut, times=1).check_and_update_plugins(self.dummy_repo_path)
+        verify(sut, times=1).check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version, self.dummy_manifest)
+        verify(sut, times=1).check_and_update_plugins(self.dummy_repo_path, self.dummy_manifest)
         verify(repush, times=1).RepositoryPusher(self.dummy_repo_path)
         verify(self.dummy_repo_pusher, times=1).commit_and_push(expected_commit_msg)
 
+    def test_compare_and_update_result(self):
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(True)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(False)
+        when(sut).determine_fingerprint(ANY(), ANY(), ANY()).thenReturn("f1ng3rpr1nt")
+        when(sut).push_changes(ANY(), ANY(), ANY(), skip_build=ANY(), refreshed_images=ANY())
+
+        result = sut.compare_and_update(self.dummy_repo_path, "42")
+        self.assertIsInstance(result, sut.UpdateResult)
+        self.assertTrue(result.updated_wp)
+        self.assertFalse(result.updated_plugins)
+        self.assertEqual({"plugins", "wp"}, set(result.timings.keys()))
+        self.assertEqual("f1ng3rpr1nt", result.fingerprint)
+        self.assertIsNone(result.prebuilt)
+
+        verify(sut, times=1).push_changes(self.dummy_repo_path, True, False, skip_build=False, refreshed_images=[])
+
+    def test_compare_and_update_for_prebuilt_image(self):
+        dummy_entry = {"project": "PRJ", "pipeline": "wp-img", "build_id": 36}
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(True)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(False)
+        when(sut).determine_fingerprint(ANY(), ANY(), ANY()).thenReturn("f1ng3rpr1nt")
+        when(fingerprint.FingerprintIndex).lookup(ANY()).thenReturn(dummy_entry)
+        when(repush).RepositoryPusher(ANY()).thenReturn(self.dummy_repo_pusher)
+        when(self.dummy_repo_pusher).commit_and_push(ANY())
+        expected_commit_msg = f"auto-update wordpress: wp-version={True} | plugins={False} ***NO_CI***"
+
+        result = sut.compare_and_update(self.dummy_repo_path, "42", ("PRJ", "wp-img"))
+        self.assertEqual(dict(dummy_entry, mode="reuse"), result.prebuilt)
+
+        verify(fingerprint.FingerprintIndex, times=1).lookup("f1ng3rpr1nt")
+        verify(self.dummy_repo_pusher, times=1).commit_and_push(expected_commit_msg)
+
+    def test_compare_and_update_holds_build_slot(self):
+        dummy_scheduler = mock(build_scheduler.BuildWaveScheduler)
+        when(dummy_scheduler).acquire()
+        when(dummy_scheduler).release()
+        when(build_scheduler).default_scheduler().thenReturn(dummy_scheduler)
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(True)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(False)
+        when(sut).determine_fingerprint(ANY(), ANY(), ANY())
+        when(sut).push_changes(ANY(), ANY(), ANY(), skip_build=ANY(), refreshed_images=ANY())
+
+        result = sut.compare_and_update(self.dummy_repo_path, "42")
+        self.assertIs(dummy_scheduler, result.build_slot)
+        verify(dummy_scheduler, times=1).acquire()
+        verify(dummy_scheduler, times=0).release()
+
+        result.release_build_slot()
+        result.release_build_slot()
+        verify(dummy_scheduler, times=1).release()
+
+    def test_compare_and_update_holds_build_slot_for_retag(self):
+        dummy_scheduler = mock(build_scheduler.BuildWaveScheduler)
+        when(dummy_scheduler).acquire()
+        when(build_scheduler).default_scheduler().thenReturn(dummy_scheduler)
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(True)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(False)
+        when(sut).determine_fingerprint(ANY(), ANY(), ANY()).thenReturn("f1ng3rpr1nt")
+        when(fingerprint.FingerprintIndex).lookup(ANY()).thenReturn(
+            {"project": "PRJ", "pipeline": "wp-other-img", "build_id": 36})
+        when(sut).push_changes(ANY(), ANY(), ANY(), skip_build=ANY(), refreshed_images=ANY())
+
+        result = sut.compare_and_update(self.dummy_repo_path, "42", ("PRJ", "wp-img"), ("PRJ", "wp-retag"))
+        self.assertEqual("retag", result.prebuilt["mode"])
+        self.assertIs(dummy_scheduler, result.build_slot)
+        verify(sut, times=1).push_changes(self.dummy_repo_path, True, False, skip_build=True, refreshed_images=[])
+
+    def test_compare_and_update_releases_build_slot_for_failed_push(self):
+        dummy_scheduler = mock(build_scheduler.BuildWaveScheduler)
+        when(dummy_scheduler).acquire()
+        when(dummy_scheduler).release()
+        when(build_scheduler).default_scheduler().thenReturn(dummy_scheduler)
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(True)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(False)
+        when(sut).determine_fingerprint(ANY(), ANY(), ANY())
+        when(sut).push_changes(ANY(), ANY(), ANY(), skip_build=ANY(), refreshed_images=ANY()).thenRaise(
+            RuntimeError("TEST ERROR"))
+
+        with self.assertRaises(RuntimeError):
+            sut.compare_and_update(self.dummy_repo_path, "42")
+
+        verify(dummy_scheduler, times=1).acquire()
+        verify(dummy_scheduler, times=1).release()
+
+    def test_compare_and_update_for_refreshed_parent_image(self):
+        dummy_digests = {"wordpress:5.4.2-apache": "sha256:42"}
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(False)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenReturn(False)
+        when(sut).check_parent_digests(ANY(), ANY()).thenReturn((dummy_digests, ["wordpress:5.4.2-apache@sha256:42"]))
+        when(sut).determine_fingerprint(ANY(), ANY(), ANY()).thenReturn("f1ng3rpr1nt")
+        when(repush).RepositoryPusher(ANY()).thenReturn(self.dummy_repo_pusher)
+        when(self.dummy_repo_pusher).commit_and_push(ANY(), allow_empty=ANY())
+        expected_commit_msg = f"auto-update wordpress: wp-version={False} | plugins={False} " \
+                              f"| parent-images=wordpress:5.4.2-apache@sha256:42"
+
+        result = sut.compare_and_update(self.dummy_repo_path, "42")
+        self.assertTrue(result)
+        self.assertEqual(dummy_digests, result.parent_digests)
+
+        verify(sut, times=1).determine_fingerprint(self.dummy_repo_path, dummy_digests, self.dummy_manifest)
+        verify(self.dummy_repo_pusher, times=1).commit_and_push(expected_commit_msg, allow_empty=True)
+
+    def test_check_parent_digests(self):
+        unstub(sut)
+        dummy_store = mock(fingerprint.ParentDigestStore)
+        when(fingerprint).ParentDigestStore().thenReturn(dummy_store)
+        when(fingerprint).resolve_parent_digests(ANY()).thenReturn(
+            {"wordpress:5.4.2-apache": "sha256:42", "composer:2": "sha256:21", "registry.local/x:1": None})
+        when(dummy_store).load(ANY()).thenReturn({"wordpress:5.4.2-apache": "sha256:41", "composer:2": "sha256:21"})
+
+        digests, refreshed = sut.check_parent_digests("/tmp/INVALID/dummy_img", self.dummy_manifest)
+        self.assertEqual(3, len(digests))
+        self.assertEqual(["wordpress:5.4.2-apache@sha256:42"], refreshed)
+
+        verify(dummy_store, times=1).load("dummy_img")
+        verify(dummy_store, times=0).save(ANY(), ANY())
+
+    def test_check_parent_digests_for_unknown_repo(self):
+        unstub(sut)
+        dummy_digests = {"wordpress:5.4.2-apache": "sha256:42"}
+        dummy_store = mock(fingerprint.ParentDigestStore)
+        when(fingerprint).ParentDigestStore().thenReturn(dummy_store)
+        when(fingerprint).resolve_parent_digests(ANY()).thenReturn(dummy_digests)
+        when(dummy_store).load(ANY()).thenReturn({})
+        when(dummy_store).save(ANY(), ANY())
+
+        self.assertEqual((dummy_digests, []), sut.check_parent_digests("/tmp/INVALID/dummy_img", self.dummy_manifest))
+
+        verify(dummy_store, times=1).save("dummy_img", dummy_digests)
+
+    def test_record_image(self):
+        dummy_update = sut.UpdateResult(True, False)
+        dummy_update.repo_path = "/tmp/dummy_img"
+        dummy_update.fingerprint = "f1ng3rpr1nt"
+        dummy_update.parent_digests = {"wordpress:5.4.2-apache": "sha256:42"}
+        when(fingerprint.FingerprintIndex).record(ANY(), ANY(), ANY(), ANY())
+        when(fingerprint.ParentDigestStore).save(ANY(), ANY())
+
+        sut.record_image(dummy_update, "PRJ", "wp-img", 36)
+
+        verify(fingerprint.FingerprintIndex, times=1).record("f1ng3rpr1nt", "PRJ", "wp-img", 36)
+        verify(fingerprint.ParentDigestStore, times=1).save("dummy_img", dummy_update.parent_digests)
+
+    def test_find_prebuilt_image(self):
+        dummy_entry = {"project": "PRJ", "pipeline": "wp-img", "build_id": 36}
+        when(fingerprint.FingerprintIndex).lookup(ANY()).thenReturn(dummy_entry)
+
+        self.assertEqual("reuse", sut.find_prebuilt_image("f1ng3rpr1nt", ("PRJ", "wp-img"), None)["mode"])
+        self.assertEqual("retag", sut.find_prebuilt_image("f1ng3rpr1nt", ("PRJ", "wp-other-img"), "retag")["mode"])
+        self.assertIsNone(sut.find_prebuilt_image("f1ng3rpr1nt", ("PRJ", "wp-other-img"), None))
+        self.assertIsNone(sut.find_prebuilt_image("f1ng3rpr1nt", None, None))
+
+    def test_run_checks_concurrently(self):
+        # both checks have to be in flight at the same time, otherwise the barrier breaks
+        barrier = threading.Barrier(2, timeout=5)
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenAnswer(lambda *args: barrier.wait() is not None)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenAnswer(lambda *args: barrier.wait() is None)
+
+        result = sut.run_checks(self.dummy_repo_path, self.dummy_latest_version, self.dummy_manifest)
+        self.assertTrue(result.updated_wp)
+        self.assertFalse(result.updated_plugins)
+
+    def test_run_checks_for_failing_check(self):
+        when(sut).check_and_update_wp(ANY(), ANY(), ANY()).thenReturn(True)
+        when(sut).check_and_update_plugins(ANY(), ANY()).thenRaise(RuntimeError("TEST ERROR"))
+
+        with self.assertRaises(RuntimeError):
+            sut.run_checks(self.dummy_repo_path, self.dummy_latest_version, self.dummy_manifest)
+
+        verify(sut, times=1).check_and_update_wp(self.dummy_repo_path, self.dummy_latest_version, self.dummy_manifest)
+
 
 if __name__ == '__main__':
     unittest.main()
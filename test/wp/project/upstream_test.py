@@ -0,0 +1,131 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import requests
+import unittest
+from mockito import mock, when, unstub, ANY, verify
+from wp import http_client
+from wp import storage
+from wp.project import docker_hub as dh
+from wp.project import upstream as sut
+
+
+class UpstreamTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.dummy_store = mock(storage.JsonStore)
+        self.primary = mock(sut.WordpressCoreVersionProvider)
+        self.primary.name = "wordpress-api"
+        self.index = mock(sut.DockerHubVersionProvider)
+        self.index.name = "docker-hub"
+        when(self.index).tag_name(ANY()).thenReturn("dummy-tag")
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        http_client.reset_circuit_breakers()
+        unstub()
+
+    def test_wordpress_core_version_provider(self):
+        with open(os.path.dirname(__file__) + "/../resources/core_version_check.json", 'r') as f:
+            dummy_response = f.read()
+        response = mock({"status_code": 200, "text": dummy_response}, spec=requests.Response)
+        when(requests).get(ANY(str), timeout=ANY()).thenReturn(response)
+
+        result = sut.WordpressCoreVersionProvider().latest_version()
+        self.assertEqual("6.4.10", result)
+
+        verify(requests, times=1).get(sut.WP_CORE_VERSION_URL, timeout=ANY())
+
+    def test_wordpress_core_version_provider_for_error_response(self):
+        response = mock({"status_code": 500, "text": "TEST Error"}, spec=requests.Response)
+        when(requests).get(ANY(str), timeout=ANY()).thenReturn(response)
+
+        with self.assertRaises(RuntimeError):
+            sut.WordpressCoreVersionProvider().latest_version()
+
+    def test_docker_hub_version_provider(self):
+        dummy_tags = [{"name": "6.4.9-apache"}, {"name": "6.4.10-apache"}, {"name": "6.4.10-fpm"}, {"name": "latest"}]
+        when(dh).fetch_tags(ANY()).thenReturn(dummy_tags)
+
+        result = sut.DockerHubVersionProvider().latest_version()
+        self.assertEqual("6.4.10", result)
+
+        verify(dh, times=1).fetch_tags("wordpress")
+
+    def test_docker_hub_version_provider_has_version(self):
+        when(dh).lookup_tag(ANY(), ANY()).thenReturn({"name": "6.5.0-apache"})
+
+        self.assertTrue(sut.DockerHubVersionProvider().has_version("6.5"))
+
+        verify(dh, times=1).lookup_tag("wordpress", "6.5.0-apache")
+
+    def test_cross_checked_provider_for_known_version(self):
+        when(self.primary).latest_version().thenReturn("6.4.2")
+        when(self.dummy_store).get(ANY()).thenReturn("6.4.2")
+
+        result = sut.CrossCheckedVersionProvider(self.primary, self.index, self.dummy_store).latest_version()
+        self.assertEqual("6.4.2", result)
+
+        verify(self.index, times=0).has_version(ANY())
+        verify(self.index, times=0).latest_version()
+        verify(self.dummy_store, times=0).put(ANY(), ANY())
+
+    def test_cross_checked_provider_for_new_version(self):
+        when(self.primary).latest_version().thenReturn("6.4.3")
+        when(self.dummy_store).get(ANY()).thenReturn("6.4.2")
+        when(self.dummy_store).put(ANY(), ANY())
+        when(self.index).has_version(ANY()).thenReturn(True)
+
+        result = sut.CrossCheckedVersionProvider(self.primary, self.index, self.dummy_store).latest_version()
+        self.assertEqual("6.4.3", result)
+
+        verify(self.index, times=1).has_version("6.4.3")
+        verify(self.index, times=0).latest_version()
+        verify(self.dummy_store, times=1).put("wordpress-api", "6.4.3")
+
+    def test_cross_checked_provider_for_unpublished_image(self):
+        when(self.primary).latest_version().thenReturn("6.4.3")
+        when(self.dummy_store).get(ANY()).thenReturn("6.4.2")
+        when(self.dummy_store).put(ANY(), ANY())
+        when(self.index).has_version(ANY()).thenReturn(False)
+
+        result = sut.CrossCheckedVersionProvider(self.primary, self.index, self.dummy_store).latest_version()
+        self.assertEqual("6.4.2", result)
+
+        verify(self.dummy_store, times=0).put(ANY(), ANY())
+
+    def test_cross_checked_provider_for_unavailable_primary(self):
+        when(self.primary).latest_version().thenRaise(RuntimeError("TEST ERROR"))
+        when(self.index).latest_version().thenReturn("6.4.1")
+
+        result = sut.CrossCheckedVersionProvider(self.primary, self.index, self.dummy_store).latest_version()
+        self.assertEqual("6.4.1", result)
+
+        verify(self.index, times=1).latest_version()
+
+    def test_create_provider(self):
+        self.assertIsInstance(sut.create_provider("docker-hub"), sut.DockerHubVersionProvider)
+        self.assertIsInstance(sut.create_provider("wordpress-api"), sut.CrossCheckedVersionProvider)
+
+        with self.assertRaises(ValueError):
+            sut.create_provider("INVALID")
+
+
+if __name__ == '__main__':
+    unittest.main()
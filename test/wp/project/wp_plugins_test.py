@@ -23,6 +23,7 @@ import unittest
 from mockito import mock, when, unstub, ANY, verify
 from shutil import copyfile
 from tempfile import TemporaryDirectory
+from wp import http_client
 from wp.project import wp_plugins as sut
 
 
@@ -34,6 +35,7 @@ class WpPluginsTest(unittest.TestCase):
 
     def tearDown(self) -> None:
         unittest.TestCase.tearDown(self)
+        http_client.reset_circuit_breakers()
         unstub()
 
     def test_read_plugin_list(self):
@@ -45,6 +47,11 @@ class WpPluginsTest(unittest.TestCase):
             result = sut.read_plugin_list(td)
             self.assertEqual(self.dummy_plugin_json, result)
 
+    def test_is_lower_version(self):
+        self.assertTrue(sut.is_lower_version("1.9.2", "1.10"))
+        self.assertFalse(sut.is_lower_version("1.10", "1.9.2"))
+        self.assertTrue(sut.is_lower_version("1.0-beta_2", "1.1-beta_2"))
+
     def test_build_request_body(self):
         result = sut.build_request_body(self.dummy_plugin_json)
 
@@ -62,7 +69,7 @@ class WpPluginsTest(unittest.TestCase):
             "content": "TEST Error 500",
             "reason": "Internal Server Error"
         }, spec=requests.Response)
-        when(requests).post(ANY(str), data=ANY(), headers=ANY()).thenReturn(response)
+        when(requests).post(ANY(str), data=ANY(), headers=ANY(), timeout=ANY()).thenReturn(response)
 
         with self.assertRaises(RuntimeError):
             sut.call_wp_api(dummy_request_body)
@@ -79,13 +86,13 @@ class WpPluginsTest(unittest.TestCase):
         expected_url = "https://api.wordpress.org/plugins/update-check/1.1/"
         expected_data = f"plugins={dummy_request_body_enc}"
         expected_response = json.loads(dummy_response_body)
-        when(requests).post(ANY(str), data=ANY(), headers=ANY()).thenReturn(response)
+        when(requests).post(ANY(str), data=ANY(), headers=ANY(), timeout=ANY()).thenReturn(response)
 
         result = sut.call_wp_api(dummy_request_json)
         self.assertEqual(expected_response, result)
 
         verify(requests, times=1).post(expected_url, data=expected_data,
-            headers={"content-type": "application/x-www-form-urlencoded", "user-agent": "curl/7.71.1"})
+            headers={"content-type": "application/x-www-form-urlencoded", "user-agent": "curl/7.71.1"}, timeout=ANY())
 
     def test_is_update_plugins(self):
         self.assertFalse(sut.is_update_plugins({"plugins": []}))
@@ -113,6 +120,7 @@ class WpPluginsTest(unittest.TestCase):
                 result = f.read()
 
             self.assertEqual(json.dumps(dummy_plugin_list, indent=2), result)
+            self.assertEqual([tmpl_file], os.listdir(f"{td}/init"))
 
     @staticmethod
     def _create_dummy_plugin_json():
@@ -0,0 +1,84 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from tempfile import TemporaryDirectory
+from wp import run_journal as sut
+from wp import storage
+
+
+class RunJournalTest(unittest.TestCase):
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        sut.set_default_journal(None)
+
+    def test_resume(self):
+        with TemporaryDirectory("journal") as td:
+            journal = sut.RunJournal(storage.JsonStore(f"{td}/{sut.JOURNAL_FILE}"))
+            journal.start("5.4.2")
+            journal.record("repo1", sut.DONE)
+            journal.record("repo2", sut.PUSHED, sha="a1b2c3", update={"wp": True})
+            journal.record_release("repo2", "update-pipeline", 27253)
+            journal.record_error("repo2", RuntimeError("TEST ERROR"))
+
+            # e.g. after the container got killed
+            resumed = sut.RunJournal(storage.JsonStore(f"{td}/{sut.JOURNAL_FILE}"))
+            self.assertEqual("5.4.2", resumed.resume())
+
+        self.assertTrue(resumed.reached("repo1", sut.DONE))
+        self.assertTrue(resumed.reached("repo2", sut.PUSHED))
+        self.assertFalse(resumed.reached("repo2", sut.BUILT))
+        self.assertFalse(resumed.reached("repo3", sut.STARTED))
+        self.assertEqual({"stage": sut.PUSHED, "sha": "a1b2c3", "update": {"wp": True}, "error": "TEST ERROR",
+                          "releases": {"update-pipeline": {"id": 27253, "result": None}}}, resumed.entry("repo2"))
+
+    def test_resume_for_finished_run(self):
+        with TemporaryDirectory("journal") as td:
+            journal = sut.RunJournal(storage.JsonStore(f"{td}/{sut.JOURNAL_FILE}"))
+            self.assertIsNone(journal.resume())
+
+            journal.start("5.4.2")
+            journal.finish()
+
+            self.assertIsNone(sut.RunJournal(storage.JsonStore(f"{td}/{sut.JOURNAL_FILE}")).resume())
+
+    def test_start_discards_previous_run(self):
+        journal = sut.RunJournal()
+        journal.start("5.4.1")
+        journal.record("repo1", sut.DONE)
+
+        journal.start("5.4.2")
+        self.assertIsNone(journal.stage("repo1"))
+
+    def test_record_clears_error(self):
+        journal = sut.RunJournal()
+        journal.record_error("repo1", "TEST ERROR")
+        journal.record("repo1", sut.BUILT, build_id=36)
+
+        self.assertEqual({"stage": sut.BUILT, "build_id": 36}, journal.entry("repo1"))
+
+    def test_entry_is_a_copy(self):
+        journal = sut.RunJournal()
+        journal.record("repo1", sut.PUSHED, update={"prebuilt": None})
+
+        journal.entry("repo1")["update"]["prebuilt"] = "changed"
+        self.assertIsNone(journal.entry("repo1")["update"]["prebuilt"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import tempfile
+import unittest
+from wp import sharding
+
+
+class ShardingTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.keys = [f"infra-docker-repo-{i}" for i in range(1000)]
+
+    def test_shard_of_is_stable(self):
+        self.assertEqual(sharding.shard_of("infra-docker-dummy", 7), sharding.shard_of("infra-docker-dummy", 7))
+        self.assertEqual(0, sharding.shard_of("infra-docker-dummy", 1))
+
+    def test_shard_of_spreads_keys_evenly(self):
+        counts = [0] * 4
+        for key in self.keys:
+            counts[sharding.shard_of(key, 4)] += 1
+
+        for count in counts:
+            self.assertTrue(200 < count < 300, counts)
+
+    def test_additional_shard_only_takes_over_keys(self):
+        moved = [key for key in self.keys if sharding.shard_of(key, 4) != sharding.shard_of(key, 5)]
+
+        self.assertTrue(all(sharding.shard_of(key, 5) == 4 for key in moved))
+        self.assertTrue(150 < len(moved) < 250, len(moved))
+
+    def test_select_covers_all_repositories_once(self):
+        repositories = {key: {"project": "PRJ"} for key in self.keys}
+        selected = [sharding.select(repositories, index, 3) for index in range(3)]
+
+        self.assertEqual(len(self.keys), sum(len(s) for s in selected))
+        self.assertEqual(set(self.keys), set().union(*selected))
+
+    def test_shard_workdir_does_not_depend_on_shard_count(self):
+        self.assertEqual("/data/WDU/shard-2/", sharding.shard_workdir("/data/WDU/", 2))
+
+    def test_aggregate_status(self):
+        with tempfile.TemporaryDirectory() as status_dir:
+            sharding.write_status(status_dir, "42", 0, 3, ["a", "b"], 0, "5.4.2")
+            sharding.write_status(status_dir, "42", 1, 3, ["c"], 2, "5.4.2")
+            sharding.write_status(status_dir, "42", 2, 4, ["d"], 5, "5.4.2")
+
+            self.assertEqual((2, [2]), sharding.aggregate_status(status_dir, 3, "42"))
+
+    def test_aggregate_status_for_status_of_previous_run(self):
+        with tempfile.TemporaryDirectory() as status_dir:
+            sharding.write_status(status_dir, "42", 0, 2, ["a"], 0, "5.4.2", "2020-07-01T10:00:00")
+            sharding.write_status(status_dir, "41", 1, 2, ["b"], 3, "5.4.1", "2020-06-30T10:00:00")
+
+            self.assertEqual((0, [1]), sharding.aggregate_status(status_dir, 2, "42"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from wp import storage as sut
+
+
+class StorageTest(unittest.TestCase):
+
+    def test_write_atomic(self):
+        with TemporaryDirectory("dummy-state") as td:
+            target = f"{td}/sub/dummy.txt"
+            sut.write_atomic(target, "NARF")
+
+            with open(target, 'r') as f:
+                self.assertEqual("NARF", f.read())
+            self.assertEqual(["dummy.txt"], os.listdir(f"{td}/sub"))
+            self.assertEqual(sut.DEFAULT_FILE_MODE, os.stat(target).st_mode & 0o777)
+
+    def test_json_store(self):
+        with TemporaryDirectory("dummy-state") as td:
+            store = sut.JsonStore(f"{td}/dummy.json")
+            self.assertEqual({}, store.load())
+            self.assertIsNone(store.get("narf"))
+
+            store.put("narf", "zort")
+            store.put("poit", 42)
+
+            self.assertEqual({"narf": "zort", "poit": 42}, sut.JsonStore(f"{td}/dummy.json").load())
+
+    def test_json_store_for_corrupt_file(self):
+        with TemporaryDirectory("dummy-state") as td:
+            with open(f"{td}/dummy.json", "w") as f:
+                f.write("{not json")
+
+            self.assertEqual({}, sut.JsonStore(f"{td}/dummy.json").load())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextvars
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from wp import tracing as sut
+
+
+class TracingTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        sut.set_default_recorder(sut.Recorder())
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        sut.set_default_recorder(None)
+
+    def test_span_nesting(self):
+        with sut.span("repo", key="dummy_repo") as repo:
+            with sut.span("build-wait") as build_wait:
+                sut.set_attribute("build_id", 42)
+            self.assertIs(repo, sut.current())
+
+        self.assertIsNone(sut.current())
+        self.assertEqual(repo.span_id, build_wait.parent_id)
+        self.assertEqual(repo.trace_id, build_wait.trace_id)
+        self.assertEqual({"build_id": 42}, build_wait.attributes)
+        self.assertEqual([build_wait, repo], sut.default_recorder().spans())
+
+    def test_adopt(self):
+        worker = sut.Recorder()
+        sut.set_default_recorder(worker)
+        with sut.span("repo", key="dummy_repo") as repo:
+            with sut.span("fetch") as fetch:
+                pass
+        sut.set_default_recorder(sut.Recorder())
+
+        with sut.span("run") as run:
+            sut.adopt(worker.spans(), run)
+
+        self.assertEqual([fetch, repo, run], sut.default_recorder().spans())
+        self.assertEqual(run.span_id, repo.parent_id)
+        self.assertEqual(repo.span_id, fetch.parent_id)
+        self.assertEqual({run.trace_id}, {repo.trace_id, fetch.trace_id})
+        self.assertEqual(3, len({s.span_id for s in sut.default_recorder().spans()}))
+
+    def test_span_for_error(self):
+        with self.assertRaises(ValueError):
+            with sut.span("push"):
+                raise ValueError("TEST ERROR")
+
+        failed = sut.default_recorder().spans()[0]
+        self.assertEqual("error", failed.status)
+        self.assertEqual("ValueError: TEST ERROR", failed.attributes["error"])
+
+    def test_span_nesting_across_threads(self):
+        def process(key):
+            with sut.span("repo", key=key) as repo:
+                with sut.span("fetch") as fetch:
+                    pass
+            return repo, fetch
+
+        with sut.span("run") as run:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = [executor.submit(contextvars.copy_context().run, process, f"repo-{i}") for i in range(8)]
+                spans = [r.result() for r in results]
+
+        for repo, fetch in spans:
+            self.assertEqual(run.span_id, repo.parent_id)
+            self.assertEqual(repo.span_id, fetch.parent_id)
+
+    def test_recorder_drops_spans_beyond_limit(self):
+        sut.set_default_recorder(sut.Recorder(max_spans=2))
+        for i in range(3):
+            with sut.span("fetch"):
+                pass
+
+        self.assertEqual(2, len(sut.default_recorder().spans()))
+        self.assertEqual(1, sut.default_recorder().dropped)
+
+    def test_export_chrome_trace(self):
+        with sut.span("repo", key="dummy_repo") as repo:
+            with sut.span("fetch"):
+                pass
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, sut.TRACE_FILE)
+            sut.export(path)
+            with open(path, 'r') as f:
+                trace = json.loads(f.read())
+
+        events = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+        self.assertEqual(["repo", "fetch"], [e["name"] for e in events])
+        self.assertEqual("dummy_repo", events[0]["args"]["key"])
+        self.assertEqual(repo.span_id, events[1]["args"]["parent_id"])
+        self.assertTrue(events[0]["ts"] <= events[1]["ts"])
+        self.assertTrue(events[1]["ts"] + events[1]["dur"] <= events[0]["ts"] + events[0]["dur"] + 1)
+        self.assertEqual(1, len([e for e in trace["traceEvents"] if e["ph"] == "M"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
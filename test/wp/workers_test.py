@@ -0,0 +1,247 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import http.server
+import io
+import json
+import os
+import queue
+import threading
+import tempfile
+import time
+import unittest
+from wp import config as conf
+from wp import history
+from wp import instrumentation
+from wp import log
+from wp import run_journal
+from wp import tracing
+from wp import workers as sut
+from wp.project import docker_hub as dh
+
+
+def _process(repo, key, latest_version, keep_clone):
+    journal = run_journal.default_journal()
+    journal.record(key, run_journal.PUSHED, pid=os.getpid(), resumed=journal.entry(key).get("resumed", False))
+    with log.repository(key), tracing.span("repo", key=key):
+        log.info("processed", latest_version=latest_version)
+        instrumentation.inc("repositories", result="succeeded")
+    return 0
+
+
+def _lookup_tag(repo, key, latest_version, keep_clone):
+    return 0 if dh.lookup_tag("wordpress", f"{latest_version}-apache") is not None else 1
+
+
+class _DockerHub(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        _DockerHub.requests.append(self.path)
+        body = json.dumps({"name": self.path.rsplit("/", 1)[1], "digest": "sha256:42"}).encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _build(repo, key, latest_version, keep_clone):
+    from wp.pipeline import build_scheduler
+    scheduler = build_scheduler.default_scheduler()
+    scheduler.acquire()
+    start = time.time()
+    time.sleep(0.5)
+    with open(repo["builds"], "a") as f:
+        f.write(f"{start} {time.time()}\n")
+    scheduler.release()
+    return 0
+
+
+def _hang(repo, key, latest_version, keep_clone):
+    if repo.get("hang"):
+        time.sleep(60)
+    return _process(repo, key, latest_version, keep_clone)
+
+
+def _spin(repo, key, latest_version, keep_clone):
+    while True:
+        pass
+
+
+def _allocate(repo, key, latest_version, keep_clone):
+    return len(bytearray(2 * 1024 ** 3))
+
+
+class RepoWorkersTest(unittest.TestCase):
+    def setUp(self) -> None:
+        unittest.TestCase.setUp(self)
+        self.output = io.StringIO()
+        log.set_default_logger(log.Logger(stream=self.output))
+        instrumentation.set_default_metrics(instrumentation.Metrics())
+        tracing.set_default_recorder(tracing.Recorder())
+        history.set_default_history(history.RunHistory(":memory:"))
+        self.journal = run_journal.RunJournal()
+        self.eta = history.Eta({"site-a": None, "site-b": None}, 2)
+        self.repositories = {"site-a": {"project": "PRJ"}, "site-b": {"project": "PRJ"}}
+
+    def tearDown(self) -> None:
+        unittest.TestCase.tearDown(self)
+        log.set_default_logger(None)
+        instrumentation.set_default_metrics(None)
+        tracing.set_default_recorder(None)
+        history.set_default_history(None)
+        run_journal.set_default_journal(None)
+        sut._events = None
+
+    def test_run(self):
+        self.journal.record("site-b", run_journal.STARTED, resumed=True)
+        workers = sut.RepoWorkers(2, target=_process)
+
+        with tracing.span("run") as run:
+            self.assertEqual(0, workers.run(self.repositories, "5.4.2", False, self.journal, self.eta, 60))
+
+        self.assertEqual(run_journal.PUSHED, self.journal.stage("site-a"))
+        self.assertFalse(self.journal.entry("site-a")["resumed"])
+        self.assertTrue(self.journal.entry("site-b")["resumed"])
+        self.assertEqual(2, instrumentation.default_metrics().counter("repositories", result="succeeded"))
+        spans = [s for s in tracing.default_recorder().spans() if s.name == "repo"]
+        self.assertEqual([run.span_id] * 2, [s.parent_id for s in spans])
+        self.assertEqual(2, len({s.span_id for s in spans} | {run.span_id}) - 1)
+        records = [json.loads(line) for line in self.output.getvalue().splitlines()]
+        self.assertEqual({"site-a", "site-b"}, {r["repo"] for r in records if r["message"] == "processed"})
+        self.assertEqual({"site-a", "site-b"}, self.eta.finished)
+
+    def test_run_shares_tag_index_between_workers(self):
+        docker_hub_url = getattr(conf, "docker_hub_url", None)
+        server = http.server.HTTPServer(("127.0.0.1", 0), _DockerHub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        conf.docker_hub_url = f"http://127.0.0.1:{server.server_port}/"
+        _DockerHub.requests = []
+        # every repository gets a worker of its own
+        workers = sut.RepoWorkers(1, max_repos=1, target=_lookup_tag)
+        try:
+            self.assertEqual(0, workers.run(self.repositories, "5.4.2", False, self.journal, self.eta, 60))
+        finally:
+            conf.docker_hub_url = docker_hub_url
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(["/v2/repositories/library/wordpress/tags/5.4.2-apache"], _DockerHub.requests)
+
+    def test_run_limits_builds_of_all_workers(self):
+        max_queued_builds = getattr(conf, "max_queued_builds", None)
+        conf.max_queued_builds = 1
+        workers = sut.RepoWorkers(2, target=_build)
+        try:
+            with tempfile.TemporaryDirectory() as td:
+                repositories = {key: {"builds": os.path.join(td, "builds")} for key in self.repositories}
+                self.assertEqual(0, workers.run(repositories, "5.4.2", False, self.journal, self.eta, 60))
+                with open(os.path.join(td, "builds"), "r") as f:
+                    builds = sorted(tuple(float(t) for t in line.split()) for line in f)
+        finally:
+            conf.max_queued_builds = max_queued_builds
+
+        self.assertEqual(2, len(builds))
+        self.assertLessEqual(builds[0][1], builds[1][0])
+
+    def test_run_recycles_workers(self):
+        workers = sut.RepoWorkers(1, max_repos=1, target=_process)
+
+        self.assertEqual(0, workers.run(self.repositories, "5.4.2", False, self.journal, self.eta, 60))
+
+        self.assertNotEqual(self.journal.entry("site-a")["pid"], self.journal.entry("site-b")["pid"])
+
+    def test_run_kills_worker_on_timeout(self):
+        self.repositories["site-a"]["hang"] = True
+        workers = sut.RepoWorkers(2, timeout=2, target=_hang)
+
+        start = time.monotonic()
+        self.assertEqual(1, workers.run(self.repositories, "5.4.2", False, self.journal, self.eta, 60))
+
+        self.assertLess(time.monotonic() - start, 30)
+        self.assertIn("timeout", self.journal.entry("site-a")["error"])
+        self.assertEqual(run_journal.PUSHED, self.journal.stage("site-b"))
+        self.assertNotIn("error", self.journal.entry("site-b"))
+        self.assertEqual(1, instrumentation.default_metrics().counter("repositories", result="failed"))
+        self.assertEqual("failed", history.default_history().last_result("site-a")["result"])
+
+    def test_run_for_cpu_limit(self):
+        workers = sut.RepoWorkers(1, cpu_limit=1, target=_spin)
+
+        self.assertEqual(1, workers.run({"site-a": {}}, "5.4.2", False, self.journal, self.eta, 60))
+        self.assertIn("died", self.journal.entry("site-a")["error"])
+
+    def test_run_for_memory_limit(self):
+        workers = sut.RepoWorkers(1, memory_limit=1024 ** 3, target=_allocate)
+
+        self.assertEqual(1, workers.run({"site-a": {}}, "5.4.2", False, self.journal, self.eta, 60))
+        self.assertIn("MemoryError", self.journal.entry("site-a")["error"])
+
+    def test_run_repository(self):
+        sut._events = queue.Queue()
+        log.default_logger().stream = io.StringIO()
+
+        outcome = sut.run_repository(_process, {}, "site-a", "5.4.2", False, {"stage": "started"}, None, None)
+
+        self.assertEqual(0, outcome["result"])
+        self.assertEqual(run_journal.PUSHED, outcome["journal"]["stage"])
+        self.assertEqual(("started", "site-a", os.getpid()), sut._events.get_nowait())
+        self.assertEqual(("journal", "site-a"), sut._events.get_nowait()[:2])
+        self.assertEqual("processed", outcome["log"][0]["message"])
+        self.assertEqual(["repo"], [s.name for s in outcome["spans"]])
+        self.assertEqual(1, outcome["metrics"]["counters"][0]["value"])
+
+    def test_run_repository_for_expired_budget(self):
+        sut._events = queue.Queue()
+        log.default_logger().stream = io.StringIO()
+
+        def expired(repo, key, latest_version, keep_clone):
+            from wp import deadline
+            deadline.check()
+
+        outcome = sut.run_repository(expired, {}, "site-a", "5.4.2", False, {}, time.time() - 1, None)
+
+        self.assertEqual(1, outcome["result"])
+        self.assertIn("error", outcome["journal"])
+
+    def test_config_snapshot(self):
+        snapshot = sut.config_snapshot(conf)
+
+        self.assertEqual(conf.workdir, snapshot["workdir"])
+        self.assertIsNone(snapshot["service_hook_port"])
+        self.assertFalse(any(name.startswith("_") for name in snapshot))
+
+    def test_create_workers(self):
+        orig = {name: getattr(conf, name, None) for name in ("repo_workers", "worker_timeout", "worker_max_repos")}
+        try:
+            conf.repo_workers = None
+            self.assertIsNone(sut.create_workers())
+
+            conf.repo_workers, conf.worker_timeout, conf.worker_max_repos = 4, 600, None
+            workers = sut.create_workers()
+            self.assertEqual((4, 600, sut.DEFAULT_MAX_REPOS), (workers.processes, workers.timeout, workers.max_repos))
+        finally:
+            for name, value in orig.items():
+                setattr(conf, name, value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,83 +16,471 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import argparse
+import concurrent.futures
+import contextvars
+import datetime
+import os
 import sys
 import time
-import traceback
+from wp import cassette
+from concurrent.futures import ThreadPoolExecutor
+from wp import config as conf
+from wp import deadline
+from wp import history
+from wp import instrumentation
+from wp import log
 from wp import repos
+from wp import run_journal
+from wp import plan
+from wp import profiling
+from wp import sharding
+from wp import tracing
+from wp import workers
 from wp.git.repository_fetcher import RepositoryFetcher
-from wp.project import docker_hub as dh
+from wp.project import upstream
 from wp.project import updater
 from wp.pipeline import pipeline_interaction as pipe
+from wp.pipeline import polling
 from wp.pipeline import release_pipeline_interaction as rpi
+from wp.pipeline import release_tracker
 
+DEFAULT_PIPELINE_START_DELAY = 5
 
-def process_repository(repo, key, latest_version):
-    git_repo_img = RepositoryFetcher(repo["img-repo"], f"{key}_img")
+
+##
+# keep_clone leaves the clone of a successfully processed repository in place (as mirror for the next run).
+# the log-records of the repository are written all at once, when it is finished
+def process_repository(repo, key, latest_version, keep_clone=False):
+    with log.repository(key):
+        return _process_repository(repo, key, latest_version, keep_clone)
+
+
+def _process_repository(repo, key, latest_version, keep_clone):
+    journal = run_journal.default_journal()
+    if journal.reached(key, run_journal.DONE):
+        log.info("already processed by the interrupted run - skip it")
+        return 0
+
+    git_repo_img = img_repo_fetcher(repo, key)
+    cloned = False
+    succeeded = False
+    start = time.monotonic()
 
     try:
-        img_repo_path = git_repo_img.clone_or_update_repo()
-        process_img_repo(repo, img_repo_path, latest_version)
+        with history.repository(key), tracing.span("repo", key=key, latest_version=latest_version), \
+                deadline.budget(f"repo {key}", getattr(conf, "repo_budget", None)):
+            if journal.reached(key, run_journal.PUSHED):
+                # the changes were pushed by the interrupted run, only build and releases are missing
+                resume_img_repo(repo, key, git_repo_img.target_path())
+            else:
+                cloned = True
+                with instrumentation.stage("fetch"):
+                    img_repo_path = git_repo_img.clone_or_update_repo()
+                process_img_repo(repo, img_repo_path, latest_version, key)
+        succeeded = True
+        instrumentation.inc("repositories", result="succeeded")
+        deployed = latest_version if journal.entry(key).get("update", {}).get("wp") else None
+        history.default_history().record_repository(key, "succeeded", time.monotonic() - start, version=deployed)
         return 0
     except (Exception, FileNotFoundError) as e:
-        print(f"Unable to process repository: {repo}")
-        print(f"{e}\nCaused by: {traceback.format_exc()}")
+        log.exception(f"Unable to process repository: {e}", img_repo=repo["img-repo"])
+        journal.record_error(key, e)
+        instrumentation.inc("repositories", result="failed")
+        history.default_history().record_repository(key, "failed", time.monotonic() - start, error=repr(e))
         return 1
     finally:
-        git_repo_img.cleanup()
+        if cloned and not (keep_clone and succeeded):
+            git_repo_img.cleanup()
+
+
+def img_repo_fetcher(repo, key):
+    return RepositoryFetcher(repo["img-repo"], f"{key}_img")
+
+
+def process_img_repo(repo, img_repo_path, latest_version, key=None):
+    journal = run_journal.default_journal()
+    with instrumentation.stage("update"):
+        update = updater.compare_and_update(img_repo_path, latest_version,
+                                            (repo["project"], repo["build-img-pipeline"]), repo.get("retag-pipeline"))
+    if update:
+        try:
+            journal.record(key, run_journal.PUSHED, sha=update.pushed_sha, update=journal_details(update))
+            deploy_update(repo, key, update)
+        except BaseException:
+            # the build releases the slot, but a failure before the build must not keep it
+            update.release_build_slot()
+            raise
+
+    journal.record(key, run_journal.DONE)
+
+
+def resume_img_repo(repo, key, img_repo_path):
+    progress = run_journal.default_journal().entry(key)
+    log.info(f"resume at stage '{progress['stage']}'", sha=progress.get("sha"))
+    update = updater.UpdateResult(progress["update"]["wp"], progress["update"]["plugins"])
+    update.repo_path = img_repo_path
+    update.pushed_sha = progress.get("sha")
+    update.fingerprint = progress["update"]["fingerprint"]
+    update.prebuilt = progress["update"]["prebuilt"]
+    update.parent_digests = progress["update"]["parent_digests"]
+    update.refreshed_images = progress["update"]["refreshed_images"]
+
+    deploy_update(repo, key, update)
+    run_journal.default_journal().record(key, run_journal.DONE)
+
+
+def journal_details(update):
+    return {"wp": update.updated_wp, "plugins": update.updated_plugins, "fingerprint": update.fingerprint,
+            "prebuilt": update.prebuilt, "parent_digests": update.parent_digests,
+            "refreshed_images": update.refreshed_images}
+
+
+def deploy_update(repo, key, update):
+    journal = run_journal.default_journal()
+    if journal.reached(key, run_journal.BUILT):
+        log.info("image was already built", build_id=journal.entry(key).get("build_id"))
+        update.release_build_slot()
+    else:
+        with instrumentation.stage("build"):
+            build_id = provide_image(repo, update)
+        journal.record(key, run_journal.BUILT, build_id=build_id, image_pipeline=image_pipeline(repo, update))
+
+    with instrumentation.stage("release"):
+        trigger_database_update(repo, key)
+        trigger_image_rollout(repo, key)
+
+
+##
+# Returns the build of the image to deploy: the new build, the reused one or the build of the retag-pipeline
+def provide_image(repo, update):
+    try:
+        if update.prebuilt is None:
+            build_id = wait_for_build(repo["project"], repo["build-img-pipeline"], update.pushed_sha)
+            updater.record_image(update, repo["project"], repo["build-img-pipeline"], build_id)
+            return build_id
+        if update.prebuilt["mode"] == "retag":
+            build_id = retag_image(repo, update)
+        else:
+            log.info("skip build - image with identical build-inputs exists", prebuilt=update.prebuilt)
+            build_id = update.prebuilt["build_id"]
+    finally:
+        update.release_build_slot()
+
+    updater.record_image(update, repo["project"], repo["build-img-pipeline"], None)
+    return build_id
+
+
+##
+# the pipeline, whose build provides the image of the update
+def image_pipeline(repo, update):
+    if update.prebuilt is not None and update.prebuilt["mode"] == "retag":
+        return repo["retag-pipeline"]
+
+    return repo["build-img-pipeline"]
+
+
+##
+# the retag-pipeline tags the image of the source-build as image of the target-pipeline (see README)
+def retag_image(repo, update):
+    pipeline = pipe.Pipeline(repo["project"], repo["retag-pipeline"])
+    parameters = {"sourceProject": update.prebuilt["project"], "sourcePipeline": update.prebuilt["pipeline"],
+                  "sourceBuildId": update.prebuilt["build_id"], "targetPipeline": repo["build-img-pipeline"]}
+    build_result = pipeline.trigger_build_and_wait(parameters)
+    if build_result != "succeeded":
+        raise Exception(f"Retag-Pipeline FAILED with result: {build_result}")
+
+    return pipeline.build_id
+
+
+##
+# both releases wait for their completion, so the rollout only starts after a successful db-update
+def trigger_database_update(repo, key=None):
+    with tracing.span("db-release", pipeline=repo["update-pipeline"]):
+        run_release(repo, key, "update-pipeline")
+
+
+def trigger_image_rollout(repo, key=None):
+    with tracing.span("rollout", pipeline=repo["rollout-pipeline"]):
+        run_release(repo, key, "rollout-pipeline")
+
 
+##
+# a release triggered by an interrupted run is not triggered again, but waited for
+def run_release(repo, key, pipeline_key):
+    journal = run_journal.default_journal()
+    project = repo["project"]
+    pipeline_name = repo[pipeline_key]
+    release = journal.entry(key).get("releases", {}).get(pipeline_key, {})
+    if release.get("result") == "succeeded":
+        log.info(f"release of \"{pipeline_name}\" already succeeded", release_id=release["id"])
+        return
 
-def process_img_repo(repo, img_repo_path, latest_version):
-    updated = updater.compare_and_update(img_repo_path, latest_version)
-    if updated:
-        wait_for_build(repo["project"], repo["build-img-pipeline"])
-        trigger_database_update(repo)
-        trigger_image_rollout(repo)
+    release_id = release.get("id")
+    if release_id is None:
+        pipeline = rpi.ReleasePipeline(project, pipeline_name)
+        details = pipeline.validate()
+        release_id = pipeline.trigger_release(details["id"], release_artifacts(repo, details, journal.entry(key)))["id"]
+        journal.record_release(key, pipeline_key, release_id)
+    else:
+        log.info(f"re-attach to release of \"{pipeline_name}\"", release_id=release_id)
+    tracing.set_attribute("release_id", release_id)
 
+    release_result = release_tracker.default_tracker().wait_for_release(project, release_id)
+    tracing.set_attribute("result", release_result)
+    journal.record_release(key, pipeline_key, release_id, release_result)
+    if release_result != "succeeded":
+        raise Exception(f"Release-Pipeline \"{pipeline_name}\" FAILED with result: {release_result}")
 
-def trigger_database_update(repo):
-    pipeline = rpi.ReleasePipeline(repo["project"], repo["update-pipeline"])
-    details = pipeline.validate()
-    pipeline.trigger_release(details["id"])
 
+##
+# the release deploys the image of the build recorded in the journal (which may be a reused or a retagged one),
+# otherwise azure would pick the latest build of the artifact
+def release_artifacts(repo, definition, entry):
+    build_id = entry.get("build_id")
+    if build_id is None:
+        return None
 
-def trigger_image_rollout(repo):
-    pipeline = rpi.ReleasePipeline(repo["project"], repo["rollout-pipeline"])
-    details = pipeline.validate()
-    pipeline.trigger_release(details["id"])
+    pipeline_name = entry.get("image_pipeline") or repo["build-img-pipeline"]
+    build_definition = pipe.Pipeline(repo["project"], pipeline_name).validate()
+    alias = rpi.artifact_alias(definition, build_definition["id"]) if build_definition is not None else None
+    if alias is None:
+        log.warning(f"release-definition \"{definition.get('name')}\" has no artifact of the pipeline - "
+                    f"the latest build is deployed", pipeline=pipeline_name, build_id=build_id)
+        return None
 
+    return {alias: build_id}
 
-def wait_for_build(project, pipeline_name):
-    print("wait for pipeline to start...")
-    time.sleep(5)  # give the previous git-commit time to trigger the pipeline
+
+##
+# with the SHA of the pushed commit, exactly its build is waited for - otherwise the most recent one
+def wait_for_build(project, pipeline_name, source_version=None):
+    log.info("wait for pipeline to start...", pipeline=pipeline_name)
+    with instrumentation.timed("pipeline_start_delay"):
+        # give the previous git-commit time to trigger the pipeline
+        deadline.sleep(getattr(conf, "pipeline_start_delay", DEFAULT_PIPELINE_START_DELAY))
     pipeline = pipe.Pipeline(project, pipeline_name)
-    build_result = pipeline.wait_for_build_pipeline()
+    with tracing.span("build-wait", pipeline=pipeline_name, sha=source_version) as build_wait, \
+            instrumentation.timed("build_wait", pipeline=pipeline_name):
+        if source_version:
+            build_result = pipeline.wait_for_build_of_commit(source_version)
+        else:
+            build_result = pipeline.wait_for_build_pipeline()
+        build_wait.set_attribute("build_id", pipeline.build_id)
+        build_wait.set_attribute("result", build_result)
+    instrumentation.inc("builds", pipeline=pipeline_name, result=build_result)
+    history.record_build(project, pipeline_name, pipeline.build_id, build_result, pipeline.build_duration)
     if build_result != "succeeded":
         raise Exception(f"Build-Pipeline FAILED with result: {build_result}")
 
+    return pipeline.build_id
+
 
 def determine_latest_version():
-    tags = dh.fetch_tags("wordpress")
-    filtered_tags = dh.filter_tags_regex(tags, r"[0-9]+\.[0-9]+\.[0-9]-apache")
-    print(f"matching tags: {filtered_tags}")
-    highest_version = dh.determine_highest_version(filtered_tags)
+    return upstream.create_provider().latest_version()
 
-    return dh.filter_version_name(highest_version.rsplit("-")[0])
 
+##
+# repositories still waiting, when the budget of the run is used up, fail right away - so the run ends in time.
+# without a journal, the progress is only tracked in memory.
+# the repositories with the longest builds (in the run-history) start first, the expected end of the run
+# is reported whenever a repository finishes (and every eta_interval seconds).
+# with repo_workers configured, the repositories are processed by (resource-limited) worker-processes.
+# at the end, the metrics of the process and the trace of the run are exported
+def process_repositories(latest_version, keep_clones=False, journal=None, repositories=None):
+    if repositories is None:
+        repositories = repos.to_check
+    run_history = history.default_history()
+    repositories = history.longest_first(repositories, run_history)
+    run_history.start_run(latest_version, len(repositories))
+    tracing.default_recorder().clear()
+    if journal is None:
+        journal = run_journal.RunJournal()
+        journal.start(latest_version)
+    run_journal.set_default_journal(journal)
+    start = time.monotonic()
+    log.info("Checking Wordpress-Repos...", repositories=len(repositories))
+    max_parallel_repos = getattr(conf, "max_parallel_repos", 1)
+    repo_workers = create_repo_workers()
+    eta = history.Eta(history.expected_durations(repositories, run_history),
+                      max_parallel_repos if repo_workers is None else repo_workers.processes)
+    eta_interval = getattr(conf, "eta_interval", history.DEFAULT_ETA_INTERVAL)
+    with tracing.span("run", latest_version=latest_version, repositories=len(repositories)), \
+            deadline.budget("run", getattr(conf, "run_budget", None)):
+        if repo_workers is not None:
+            occurred_errors = repo_workers.run(repositories, latest_version, keep_clones, journal, eta, eta_interval)
+        else:
+            occurred_errors = process_in_threads(repositories, latest_version, keep_clones, eta, eta_interval,
+                                                 max_parallel_repos)
+
+    duration = time.monotonic() - start
+    instrumentation.observe("run_duration", duration)
+    instrumentation.export({"latest_version": latest_version, "repositories": len(repositories),
+                            "errors": occurred_errors, "duration": round(duration, 3)})
+    tracing.export()
+    run_history.finish_run(occurred_errors)
+    return occurred_errors
+
+
+def process_in_threads(repositories, latest_version, keep_clones, eta, eta_interval, max_parallel_repos):
+    with ThreadPoolExecutor(max_workers=max_parallel_repos, thread_name_prefix="repo") as executor:
+        # every repository runs within (a copy of) the context holding the budget of the run
+        results = [executor.submit(contextvars.copy_context().run, process_tracked, eta, repo, key, latest_version,
+                                   keep_clones)
+                   for key, repo in repositories.items()]
+        pending = set(results)
+        while len(pending) > 0:
+            done, pending = concurrent.futures.wait(pending, eta_interval, concurrent.futures.FIRST_COMPLETED)
+            eta.report()
+
+    return sum(result.result() for result in results)
+
+
+##
+# recording, replaying and profiling only cover the own process - with them, threads process the repositories
+def create_repo_workers():
+    repo_workers = workers.create_workers()
+    if repo_workers is not None and (cassette.active() is not None or profiling.active() is not None):
+        log.warning("recording, replaying and profiling don't cover repo-workers - process repositories by threads")
+        return None
+
+    return repo_workers
+
+
+def process_tracked(eta, repo, key, latest_version, keep_clone):
+    eta.start(key)
+    try:
+        return process_repository(repo, key, latest_version, keep_clone)
+    finally:
+        eta.finish(key)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="wp.app", description="Updates the Wordpress-images of all repositories")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the interrupted previous run where it stopped")
+    parser.add_argument("--shard-index", type=int,
+                        help="only process the repositories of this shard (0 .. shard-count - 1)")
+    parser.add_argument("--shard-count", type=int, help="number of shards the repositories are spread across")
+    parser.add_argument("--run-id",
+                        help="identifies the run of all shards (e.g. the CI-build-id), required for sharded runs and "
+                             "--aggregate-shards")
+    parser.add_argument("--plan", action="store_true",
+                        help="only determine what a run would update and trigger (nothing is pushed or triggered)")
+    parser.add_argument("--plan-output", metavar="FILE",
+                        help=f"file of the update-plan (default: workdir/{plan.PLAN_FILE})")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"profile the run (cProfile per stage, sampled stacks, memory) into "
+                             f"workdir/{profiling.PROFILE_DIR}/")
+    recording = parser.add_mutually_exclusive_group()
+    recording.add_argument("--record", metavar="CASSETTE", help="record all http-interactions to the file")
+    recording.add_argument("--replay", metavar="CASSETTE",
+                           help="serve all http-interactions from the recorded file (nothing is pushed)")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="speed-up of recorded latencies and poll-intervals in a replay (0: no waits)")
+    parser.add_argument("--aggregate-shards", type=int, metavar="SHARD_COUNT",
+                        help="report the status of all shards and fail, if one of them failed or is missing")
+    args = parser.parse_args(argv)
+    if (args.shard_index is None) != (args.shard_count is None):
+        parser.error("--shard-index and --shard-count are required together")
+    if args.shard_count is not None and not 0 <= args.shard_index < args.shard_count:
+        parser.error(f"--shard-index has to be between 0 and {args.shard_count - 1}")
+    if (args.shard_count is not None or args.aggregate_shards is not None) and args.run_id is None:
+        parser.error("--run-id is required for sharded runs and --aggregate-shards")
+
+    return args
 
-def main():
-    print("Determine latest Wordpress-Version...")
-    latest_version = determine_latest_version()
-    occurred_errors = 0
 
-    print(f"Found latest version: {latest_version}")
-    print("Checking Wordpress-Repos...")
-    for key, repo in repos.to_check.items():
-        occurred_errors += process_repository(repo, key, latest_version)
+def shard_status_dir():
+    return getattr(conf, "shard_status_dir", None) or conf.workdir
 
+
+def aggregate_shards(shard_count, run_id):
+    occurred_errors, missing = sharding.aggregate_status(shard_status_dir(), shard_count, run_id)
+    if len(missing) > 0:
+        sys.exit(f"No status of the shards {missing}! Encountered {occurred_errors} Errors in the others!")
     if occurred_errors > 0:
         sys.exit(f"Unable to process repositories! Encountered {occurred_errors} Errors! CHECK LOG!")
 
 
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.aggregate_shards is not None:
+        aggregate_shards(args.aggregate_shards, args.run_id)
+        return
+
+    repositories = repos.to_check
+    status_dir = shard_status_dir()
+    if args.shard_count is not None:
+        repositories = sharding.select(repos.to_check, args.shard_index, args.shard_count)
+        # mirrors, journal and state of the shard stay apart from the other shards
+        conf.workdir = sharding.shard_workdir(conf.workdir, args.shard_index)
+        os.makedirs(conf.workdir, exist_ok=True)
+        log.info(f"shard {args.shard_index}/{args.shard_count}: {len(repositories)} of {len(repos.to_check)} "
+                 f"repositories", workdir=conf.workdir)
+
+    if args.record is not None:
+        cassette.activate(cassette.Cassette(args.record, cassette.RECORD).open())
+    if args.replay is not None:
+        replay(args.replay, args.replay_speed)
+    if args.profile:
+        profiling.start()
+    try:
+        if args.plan:
+            run_plan(args, repositories)
+        else:
+            run(args, repositories, status_dir)
+    finally:
+        if args.profile:
+            profiling.stop()
+        cassette.deactivate()
+
+
+##
+# nothing to wait for in a replay - besides the recorded latencies - so the waits are shortened as well
+def replay(path, speed):
+    cassette.activate(cassette.Cassette(path, cassette.REPLAY, speed).open())
+    conf.service_hook_port = None
+    for name, default in (("pipeline_start_delay", DEFAULT_PIPELINE_START_DELAY),
+                          ("poll_interval", polling.DEFAULT_INITIAL_INTERVAL),
+                          ("max_poll_interval", polling.DEFAULT_MAX_INTERVAL)):
+        setattr(conf, name, getattr(conf, name, default) / speed if speed > 0 else 0)
+
+
+def run(args, repositories, status_dir):
+    started = datetime.datetime.now().isoformat(timespec="seconds")
+    journal = run_journal.open_journal()
+    latest_version = journal.resume() if args.resume else None
+    if latest_version is not None:
+        log.info("Resume interrupted run", latest_version=latest_version)
+    else:
+        if args.resume:
+            log.info("No interrupted run found - start a new one")
+        log.info("Determine latest Wordpress-Version...")
+        latest_version = determine_latest_version()
+        log.info("Found latest version", latest_version=latest_version)
+        journal.start(latest_version)
+
+    occurred_errors = process_repositories(latest_version, journal=journal, repositories=repositories)
+    journal.finish()
+    if args.shard_count is not None:
+        sharding.write_status(status_dir, args.run_id, args.shard_index, args.shard_count, repositories,
+                              occurred_errors, latest_version, started)
+    if occurred_errors > 0:
+        sys.exit(f"Unable to process repositories! Encountered {occurred_errors} Errors! CHECK LOG!")
+
+
+##
+# a dry-run without journal: the plan is written, nothing else
+def run_plan(args, repositories):
+    log.info("Determine latest Wordpress-Version...")
+    latest_version = determine_latest_version()
+    log.info("Found latest version", latest_version=latest_version)
+    update_plan = plan.plan_fleet(latest_version, repositories)
+    plan.write_plan(update_plan, args.plan_output)
+    if update_plan["errors"] > 0:
+        sys.exit(f"Unable to plan repositories! Encountered {update_plan['errors']} Errors! CHECK LOG!")
+
+
 if __name__ == '__main__':
     main()
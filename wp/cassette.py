@@ -0,0 +1,210 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import datetime
+import gzip
+import hashlib
+import json
+import threading
+import time
+import requests
+
+CASSETTE_FORMAT = 2
+RECORD = "record"
+REPLAY = "replay"
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+class CassetteMissError(requests.exceptions.RequestException):
+    pass
+
+
+##
+# Records all http-interactions of a run (request, response, latency and time since the start) to a
+# gzipped json-lines file - or serves them back in replay-mode, without touching the network.
+# Replayed responses are matched by method and url (preferring the ones with the same body); repeated
+# requests (e.g. polling) get the recorded responses in order, once they are used up the last one again.
+# git isn't recorded, but the commit each repository was at, when the recorded run fetched it: a replay
+# resets the repositories to these commits, as the remote already contains the updates of the recorded run.
+# The recorded latencies are replayed divided by speed (0: no delays at all).
+# The SHAs of pushed commits are recorded as well: a replayed run doesn't push, but continues with the
+# commits of the recorded run, so it finds their builds.
+class Cassette(object):
+    def __init__(self, path, mode=REPLAY, speed=1.0):
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = None
+        self._responses = collections.defaultdict(collections.deque)
+        self._last = {}
+        self._commits = collections.defaultdict(collections.deque)
+        self._fetched = {}
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    def open(self):
+        if self.replaying:
+            self._load()
+        else:
+            self._file = gzip.open(self.path, "wt", encoding="UTF-8")
+            self._write({"format": CASSETTE_FORMAT, "recorded": datetime.datetime.now().isoformat(timespec="seconds")})
+
+        return self
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load(self):
+        with gzip.open(self.path, "rt", encoding="UTF-8") as f:
+            header = json.loads(f.readline())
+            if header.get("format") != CASSETTE_FORMAT:
+                raise ValueError(f"Unsupported cassette-format of {self.path}: {header.get('format')}")
+            for line in f:
+                entry = json.loads(line)
+                if entry.get("kind") == "push":
+                    self._commits[entry["key"]].append(entry["sha"])
+                elif entry.get("kind") == "fetch":
+                    self._fetched.setdefault(entry["key"], entry["sha"])
+                else:
+                    self._responses[(entry["method"], entry["url"])].append(entry)
+
+    def _write(self, entry):
+        with self._lock:
+            self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    ##
+    # the send-function (e.g. requests.get) for method, recording or replaying
+    def wrap(self, method, send):
+        if self.replaying:
+            return lambda url, **kwargs: self._replay(method, url, kwargs)
+
+        return lambda url, **kwargs: self._record(method, url, kwargs, send)
+
+    def _record(self, method, url, kwargs, send):
+        entry = {"t": round(time.monotonic() - self._start, 3), "method": method, "url": url,
+                 "body": body_hash(kwargs.get("data"))}
+        start = time.monotonic()
+        try:
+            response = send(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            self._write(dict(entry, latency=round(time.monotonic() - start, 3), error=type(e).__name__,
+                             message=str(e)))
+            raise
+
+        self._write(dict(entry, latency=round(time.monotonic() - start, 3), status=response.status_code,
+                         reason=response.reason, content_type=response.headers.get("Content-Type"),
+                         content=response.text))
+        return response
+
+    def _replay(self, method, url, kwargs):
+        key = (method, url)
+        body = body_hash(kwargs.get("data"))
+        with self._lock:
+            responses = self._responses.get(key)
+            if responses:
+                entry = next((e for e in responses if e["body"] == body), responses[0])
+                responses.remove(entry)
+            else:
+                entry = self._last.get(key)
+            if entry is None:
+                raise CassetteMissError(f"{method} {url} was not recorded in {self.path}")
+            self._last[key] = entry
+
+        if self.speed > 0:
+            time.sleep(entry["latency"] / self.speed)
+        if "error" in entry:
+            raise getattr(requests.exceptions, entry["error"], requests.exceptions.ConnectionError)(entry["message"])
+
+        return _response(entry)
+
+    ##
+    # Returns the SHA to continue with: the pushed one while recording, the recorded one in a replay
+    def pushed_commit(self, key, sha):
+        if not self.replaying:
+            self._write({"t": round(time.monotonic() - self._start, 3), "kind": "push", "key": key, "sha": sha})
+            return sha
+
+        with self._lock:
+            if len(self._commits[key]) == 0:
+                raise CassetteMissError(f"no push of {key} was recorded in {self.path}")
+
+            return self._commits[key].popleft()
+
+    ##
+    # Returns the SHA the repository has to be at: the fetched one while recording, the recorded one in a replay
+    def fetched_commit(self, key, sha):
+        if not self.replaying:
+            self._write({"t": round(time.monotonic() - self._start, 3), "kind": "fetch", "key": key, "sha": sha})
+            return sha
+
+        with self._lock:
+            if key not in self._fetched:
+                raise CassetteMissError(f"no fetch of {key} was recorded in {self.path}")
+
+            return self._fetched[key]
+
+
+def _response(entry):
+    response = requests.models.Response()
+    response.status_code = entry["status"]
+    response.reason = entry["reason"]
+    response.url = entry["url"]
+    response.encoding = "UTF-8"
+    response._content = entry["content"].encode("UTF-8")
+    if entry.get("content_type") is not None:
+        response.headers["Content-Type"] = entry["content_type"]
+
+    return response
+
+
+def body_hash(data):
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode("UTF-8")
+
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def active():
+    return _cassette
+
+
+def activate(cassette):
+    global _cassette
+    with _cassette_lock:
+        _cassette = cassette
+
+
+def deactivate():
+    global _cassette
+    with _cassette_lock:
+        cassette = _cassette
+        _cassette = None
+    if cassette is not None:
+        cassette.close()
@@ -0,0 +1,116 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import importlib.machinery
+import importlib.util
+import json
+import os
+import sys
+
+TEMPLATE_CONFIG = os.path.join(os.path.dirname(__file__), "config.py.tmpl")
+
+# everything else is imported by the subcommand - "status" gets by without requests, jinja2 and packaging
+
+
+##
+# wp.config is taken from the file - or, without wp/config.py, from the defaults of the template.
+# has to happen before any other module of wp is imported, they bind the config on import
+def load_config(path=None):
+    if path is None:
+        if "wp.config" in sys.modules or importlib.util.find_spec("wp.config") is not None:
+            return
+        path = TEMPLATE_CONFIG
+        print(f"no wp/config.py - using the defaults of {path}", file=sys.stderr)
+
+    loader = importlib.machinery.SourceFileLoader("wp.config", path)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader("wp.config", loader))
+    loader.exec_module(module)
+    sys.modules["wp.config"] = module
+    import wp
+    wp.config = module
+
+
+def parse_args(argv):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", metavar="FILE", help="configuration to use instead of wp/config.py")
+    common.add_argument("--workdir", help="overrides the workdir of the configuration")
+
+    parser = argparse.ArgumentParser(prog="wp.cli", description="Updates the Wordpress-images of all repositories")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    commands.required = True
+    commands.add_parser("run", parents=[common], help="process all repositories (options: see python -m wp.app -h)")
+    commands.add_parser("plan", parents=[common], help="only determine what a run would update and trigger")
+    commands.add_parser("resume", parents=[common], help="continue the interrupted previous run")
+    commands.add_parser("status", parents=[common],
+                        help="report the progress of the current (or last) run - fails, if it has errors")
+    # all other options are passed on to wp.app
+    return parser.parse_known_args(argv)
+
+
+def main(argv=None):
+    args, app_args = parse_args(sys.argv[1:] if argv is None else argv)
+    load_config(args.config)
+    if args.workdir is not None:
+        from wp import config as conf
+        conf.workdir = os.path.join(args.workdir, "")
+
+    if args.command == "status":
+        return status(app_args)
+
+    from wp import app
+    options = {"run": [], "plan": ["--plan"], "resume": ["--resume"]}[args.command]
+    app.main(options + app_args)
+
+
+def status(extra_args):
+    if len(extra_args) > 0:
+        sys.exit(f"unrecognized arguments: {' '.join(extra_args)}")
+
+    report = run_status()
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if len(report["errors"]) > 0:
+        sys.exit(1)
+
+
+##
+# the progress of the run in the journal and the last run in the run-history - without creating either
+def run_status():
+    from wp import history
+    from wp import run_journal
+    from wp import storage
+
+    journal = storage.JsonStore(storage.state_path(run_journal.JOURNAL_FILE)).load()
+    stages = {}
+    errors = {}
+    for key, entry in journal.get("repos", {}).items():
+        stages[entry.get("stage")] = stages.get(entry.get("stage"), 0) + 1
+        if "error" in entry:
+            errors[key] = entry["error"]
+
+    last_run = None
+    if os.path.exists(history.history_path()):
+        run_history = history.RunHistory(history.history_path())
+        last_run = run_history.last_run()
+        run_history.close()
+
+    return {"run": journal.get("run", {}), "stages": stages, "errors": errors, "last_run": last_run}
+
+
+if __name__ == '__main__':
+    main()
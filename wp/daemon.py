@@ -0,0 +1,132 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import time
+from wp import app
+from wp import config as conf
+from wp import http_client
+from wp import log
+from wp import repos
+from wp.project import wp_plugins as plugins
+
+DEFAULT_CHECK_INTERVAL = 300
+DEFAULT_FULL_RUN_INTERVAL = 86400
+MISSING_MIRROR = "missing"
+
+
+##
+# Long running alternative to the one-shot "python -m wp.app":
+# the upstream-sources are checked every check_interval seconds (a handful of requests) and the
+# repositories are only processed, if something changed - or at least every full_run_interval
+# seconds (e.g. for changes within the repositories or republished parent-images).
+# http-connections, pipeline-definitions, the tag-index and the repository-clones stay warm in between.
+class Daemon(object):
+    def __init__(self, check_interval=None, full_run_interval=None):
+        self.check_interval = check_interval if check_interval is not None else \
+            getattr(conf, "daemon_check_interval", DEFAULT_CHECK_INTERVAL)
+        self.full_run_interval = full_run_interval if full_run_interval is not None else \
+            getattr(conf, "daemon_full_run_interval", DEFAULT_FULL_RUN_INTERVAL)
+        self.runs = 0
+        self._signature = None
+        self._last_full_run = None
+
+    def run_forever(self):
+        http_client.use_session(max(http_client.DEFAULT_POOL_SIZE, 2 * getattr(conf, "max_parallel_repos", 1)))
+        log.info(f"daemon started: check upstream every {self.check_interval}s, "
+                 f"process all repositories at least every {self.full_run_interval}s")
+        while True:
+            self.tick()
+            time.sleep(self.check_interval)
+
+    ##
+    # Returns True, if the repositories were processed
+    def tick(self):
+        try:
+            signature = upstream_signature()
+        except Exception as e:
+            log.exception(f"Unable to check upstream-sources: {e}")
+            return False
+
+        if not self._is_due(signature):
+            log.info("no upstream changes", latest_version=signature["wp"])
+            return False
+
+        log.info("process repositories for upstream", upstream=signature)
+        occurred_errors = app.process_repositories(signature["wp"], keep_clones=True)
+        if occurred_errors > 0:
+            log.error(f"Unable to process repositories! Encountered {occurred_errors} Errors! CHECK LOG!")
+        self.runs += 1
+        self._last_full_run = time.monotonic()
+        # the run updated the mirrors, so their plugin-versions are the new baseline
+        self._signature = self._baseline(signature)
+        return True
+
+    def _is_due(self, signature):
+        if self._last_full_run is None or signature != self._signature:
+            return True
+
+        return time.monotonic() - self._last_full_run >= self.full_run_interval
+
+    @staticmethod
+    def _baseline(signature):
+        try:
+            return dict(signature, plugins=plugin_signature())
+        except Exception as e:
+            log.error(f"Unable to check plugin-updates: {e}")
+            return signature
+
+
+def upstream_signature():
+    return {"wp": app.determine_latest_version(), "plugins": plugin_signature()}
+
+
+##
+# a single update-check for the plugins of all repository-mirrors (with the lowest version
+# of each plugin). Its answer only changes, if a plugin got released or a mirror changed
+def plugin_signature():
+    lowest_versions = {}
+    missing = []
+    for key, repo in sorted(repos.to_check.items()):
+        repo_path = app.img_repo_fetcher(repo, key).target_path()
+        if not os.path.isfile(f"{repo_path}/init/plugin-list.json"):
+            missing.append(key)
+            continue
+        for plugin in plugins.read_plugin_list(repo_path)["plugins"]:
+            known = lowest_versions.get(plugin["key"])
+            if known is None or plugins.is_lower_version(plugin["version"], known):
+                lowest_versions[plugin["key"]] = plugin["version"]
+
+    updates = {}
+    if len(lowest_versions) > 0:
+        request = plugins.build_request_body({"plugins": [{"key": k, "version": v}
+                                                          for k, v in lowest_versions.items()]})
+        status = plugins.call_wp_api(request)
+        # the api answers with an empty list instead of an object, if there are no updates
+        updates = {k: v.get("new_version") for k, v in (status["plugins"] or {}).items()}
+
+    return json.dumps({"updates": updates, MISSING_MIRROR: missing}, sort_keys=True)
+
+
+def main():
+    Daemon().run_forever()
+
+
+if __name__ == '__main__':
+    main()
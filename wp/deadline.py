@@ -0,0 +1,134 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import contextvars
+import time
+from wp import config as conf
+
+DEFAULT_HTTP_TIMEOUT = 30
+STAGES = ("fetch", "update", "build", "release", "queue")
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, name, seconds):
+        super(DeadlineExceeded, self).__init__(f"time-budget of '{name}' ({seconds}s) exceeded")
+        self.name = name
+
+
+##
+# A time-budget. Budgets nest: the one expiring first limits all work within it.
+class Deadline(object):
+    def __init__(self, name, seconds=None, parent=None):
+        self.name = name
+        self.seconds = seconds
+        self.parent = parent
+        self.expires = None if seconds is None else time.monotonic() + seconds
+
+    def limiting(self):
+        limiting = self.parent.limiting() if self.parent is not None else None
+        if self.expires is not None and (limiting is None or self.expires <= limiting.expires):
+            return self
+
+        return limiting
+
+    def remaining(self):
+        limiting = self.limiting()
+        if limiting is None:
+            return None
+
+        return limiting.expires - time.monotonic()
+
+    def check(self):
+        limiting = self.limiting()
+        if limiting is not None and limiting.expires <= time.monotonic():
+            raise DeadlineExceeded(limiting.name, limiting.seconds)
+
+
+##
+# Runs the block with a budget of seconds (None: only the enclosing budgets apply).
+# The budget is bound to the context, threads have to be started with contextvars.copy_context().run
+@contextlib.contextmanager
+def budget(name, seconds=None):
+    token = _current.set(Deadline(name, seconds, _current.get()))
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def stage(name):
+    return budget(name, stage_budget(name))
+
+
+##
+# a stage within another stage, that doesn't use up the budget of the enclosing stage: only the budgets
+# around that stage (repository, run) apply, the enclosing stage expires later by the time spent in it.
+# For waits like the one for a free slot in the build-queue
+@contextlib.contextmanager
+def stage_beside(name):
+    current = _current.get()
+    enclosing = current if current is not None and current.name in STAGES else None
+    parent = current.parent if enclosing is not None else current
+    token = _current.set(Deadline(name, stage_budget(name), parent))
+    start = time.monotonic()
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+        if enclosing is not None and enclosing.expires is not None:
+            enclosing.expires += time.monotonic() - start
+
+
+def stage_budget(name):
+    return (getattr(conf, "stage_budgets", None) or {}).get(name)
+
+
+def current():
+    return _current.get()
+
+
+def remaining():
+    deadline = _current.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def check():
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check()
+
+
+##
+# the timeout for a blocking call: at most default, but never longer than the remaining budget
+def timeout(default=None):
+    check()
+    left = remaining()
+    if left is None:
+        return default
+    if default is None:
+        return left
+
+    return min(default, left)
+
+
+def sleep(seconds):
+    time.sleep(timeout(seconds))
+    check()
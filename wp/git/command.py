@@ -0,0 +1,48 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import signal
+import subprocess
+from wp import config as conf
+from wp import deadline
+from wp import instrumentation
+
+DEFAULT_GIT_TIMEOUT = 600
+
+
+##
+# Runs the (shell-)command with a timeout. The command runs in its own process-group, so a
+# timeout kills the git-processes started by the shell as well - not only the shell itself.
+def run(cmd):
+    timeout = deadline.timeout(getattr(conf, "git_timeout", DEFAULT_GIT_TIMEOUT))
+    subcommands = instrumentation.git_subcommands(cmd)
+    with instrumentation.timed("git_command_duration", command=subcommands), \
+            subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="UTF-8", shell=True,
+                             start_new_session=True) as process:
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            instrumentation.inc("git_commands", command=subcommands, result="timeout")
+            deadline.check()
+            raise deadline.DeadlineExceeded(f"git ({cmd})", timeout)
+
+    instrumentation.inc("git_commands", command=subcommands, result="ok" if process.returncode == 0 else "failed")
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
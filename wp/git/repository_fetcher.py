@@ -17,10 +17,12 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
-import subprocess
 import shutil
 from pathlib import Path
+from wp import cassette
 from wp import config as conf
+from wp import log
+from wp.git import command
 from wp.git.exceptions import RepositoryException
 
 
@@ -33,7 +35,7 @@ class RepositoryFetcher(object):
         self.name = name
 
     def clone_repo(self):
-        print(f"fetching repository: {self.url}")
+        log.info("fetching repository", url=self.url)
         cmd = f"cd {conf.workdir} && git clone {self.url} {self.name}"
         return self._invoke(cmd)
 
@@ -41,25 +43,77 @@ class RepositoryFetcher(object):
         return conf.workdir + self.name
 
     def update_repo(self):
-        print(f"updating repository: {self.target_path()}")
+        log.info("updating repository", path=self.target_path())
         cmd = f"cd {self.target_path()} && git pull --rebase"
         return self._invoke(cmd)
 
     def _invoke(self, cmd):
-        p = subprocess.run(cmd, capture_output=True, encoding="UTF-8", shell=True)
-        print(p.stdout)
+        p = command.run(cmd)
+        log.debug("git finished", command=cmd, stdout=p.stdout)
         if p.returncode >= 1:
             raise RepositoryException(p.stderr)
 
         return self.target_path()
 
+    ##
+    # a replayed run (see cassette) starts from the commit the recorded run started from
     def clone_or_update_repo(self):
-        print(f"Check if {self.target_path()} is a valid git repo")
         git_path = Path(self.target_path(), ".git")
         if git_path.is_dir():
-            return self.update_repo()
+            self.update_repo()
+        else:
+            self.clone_repo()
 
-        return self.clone_repo()
+        active = cassette.active()
+        if active is not None:
+            sha = active.fetched_commit(self.name, self.head_sha())
+            if active.replaying:
+                log.info("reset repository to the commit of the recorded run", path=self.target_path(), sha=sha)
+                self._invoke(f"cd {self.target_path()} && git reset -q --hard {sha}")
+
+        return self.target_path()
+
+    def head_sha(self):
+        p = command.run(f"cd {self.target_path()} && git rev-parse HEAD")
+        if p.returncode >= 1:
+            raise RepositoryException(p.stderr)
+
+        return p.stdout.strip()
+
+    ##
+    # shallow clone without checkout, blobs are only fetched when read (if the server supports
+    # partial clones) - enough to read single files of the most recent commit
+    def fetch_tree(self):
+        if Path(self.target_path(), ".git").is_dir():
+            log.info("updating tree of repository", path=self.target_path())
+            return self._invoke(f"cd {self.target_path()} && git fetch -q --depth 1 --filter=blob:none origin")
+
+        log.info("fetching tree of repository", url=self.url)
+        return self._invoke(f"cd {conf.workdir} && git clone -q --depth 1 --filter=blob:none --no-checkout "
+                            f"{self.url} {self.name}")
+
+    ##
+    # path -> blob-SHA of all files of the most recent commit
+    def list_tree(self):
+        p = command.run(f"cd {self.target_path()} && git ls-tree -r --full-tree origin/HEAD")
+        if p.returncode >= 1:
+            raise RepositoryException(p.stderr)
+
+        entries = {}
+        for line in p.stdout.splitlines():
+            meta, path = line.split("\t", 1)
+            mode, kind, sha = meta.split(" ")
+            if kind == "blob":
+                entries[path] = sha
+
+        return entries
+
+    def read_blob(self, sha):
+        p = command.run(f"cd {self.target_path()} && git cat-file blob {sha}")
+        if p.returncode >= 1:
+            raise RepositoryException(p.stderr)
+
+        return p.stdout.encode("UTF-8")
 
     def cleanup(self):
         shutil.rmtree(self.target_path())
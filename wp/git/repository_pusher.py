@@ -17,7 +17,9 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
-import subprocess
+from wp import cassette
+from wp import log
+from wp.git import command
 from wp.git.repository_fetcher import RepositoryFetcher
 from wp.git.exceptions import RepositoryException
 
@@ -28,19 +30,52 @@ class RepositoryPusher(object):
         os.putenv("GIT_ASKPASS", RepositoryFetcher.GIT_HELPER)
         self.repo_path = repo_path
 
-    def commit_and_push(self, message):
+    ##
+    # Returns the SHA of the pushed commit.
+    # A replayed run (see cassette) doesn't push - its commit is based on the commit the recorded run started from,
+    # which is behind the remote. The commit is dropped again (a later run would push it), the replay continues
+    # with the commit pushed by the recorded run
+    def commit_and_push(self, message, allow_empty=False):
         cmd = f"cd {self.repo_path} && git add --all && git commit -m '{message}'"
+        if allow_empty:
+            cmd = f"cd {self.repo_path} && git add --all && git commit --allow-empty -m '{message}'"
         push_cmd = f"cd {self.repo_path} && git push"
+        active = cassette.active()
 
-        print("commit changes...")
+        log.info("commit changes...")
         self._invoke(cmd)
 
-        print("push changes...")
-        self._invoke(push_cmd)
+        if active is not None and active.replaying:
+            log.info("replay - drop commit instead of pushing it")
+            self._invoke(f"cd {self.repo_path} && git reset -q --hard HEAD~1")
+        else:
+            log.info("push changes...")
+            self._invoke(push_cmd)
+
+        if active is not None:
+            return active.pushed_commit(os.path.basename(os.path.normpath(self.repo_path)), self.head_sha())
+        return self.head_sha()
+
+    def head_sha(self):
+        return self._invoke(f"cd {self.repo_path} && git rev-parse HEAD", verbose=False).strip()
+
+    ##
+    # stages all changes and returns the blob-SHA of every file in the index
+    def staged_blobs(self):
+        output = self._invoke(f"cd {self.repo_path} && git add --all && git ls-files -s", verbose=False)
+        blobs = {}
+        for line in output.splitlines():
+            meta, path = line.split("\t", 1)
+            blobs[path] = meta.split(" ")[1]
+
+        return blobs
 
     @staticmethod
-    def _invoke(cmd):
-        p = subprocess.run(cmd, capture_output=True, encoding="UTF-8", shell=True)
-        print(p.stdout)
+    def _invoke(cmd, verbose=True):
+        p = command.run(cmd)
+        if verbose:
+            log.debug("git finished", command=cmd, stdout=p.stdout)
         if p.returncode >= 1:
             raise RepositoryException(p.stderr)
+
+        return p.stdout
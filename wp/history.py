@@ -0,0 +1,242 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from wp import config as conf
+from wp import log
+from wp import storage
+
+HISTORY_FILE = "run-history.sqlite"
+RECENT_RUNS = 10
+DEFAULT_ETA_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, started REAL, finished REAL, latest_version TEXT,
+                                 repositories INTEGER, errors INTEGER);
+CREATE TABLE IF NOT EXISTS repositories (run_id INTEGER, key TEXT, result TEXT, duration REAL, error TEXT,
+                                         version TEXT, finished REAL);
+CREATE TABLE IF NOT EXISTS stages (run_id INTEGER, key TEXT, stage TEXT, result TEXT, duration REAL);
+CREATE TABLE IF NOT EXISTS builds (run_id INTEGER, key TEXT, project TEXT, pipeline TEXT, build_id INTEGER,
+                                   result TEXT, duration REAL, finished REAL);
+CREATE INDEX IF NOT EXISTS repositories_key ON repositories (key, finished);
+CREATE INDEX IF NOT EXISTS builds_pipeline ON builds (project, pipeline, finished);
+"""
+
+# the repository processed by the current thread (or task), set by repository()
+_current_key = contextvars.ContextVar("history_key", default=None)
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if len(values) > 0 else None
+
+
+##
+# What happened in the previous runs: per repository its duration, result (with the reason of a failure)
+# and the wp-version it deployed, the durations of its stages and of the builds per pipeline-definition.
+# Shared by all threads of a run.
+class RunHistory(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = None
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def start_run(self, latest_version, repositories):
+        with self._lock, self._db:
+            self.run_id = self._db.execute("INSERT INTO runs (started, latest_version, repositories) "
+                                           "VALUES (?, ?, ?)", (time.time(), latest_version, repositories)).lastrowid
+        return self.run_id
+
+    def finish_run(self, errors):
+        with self._lock, self._db:
+            self._db.execute("UPDATE runs SET finished = ?, errors = ? WHERE id = ?",
+                             (time.time(), errors, self.run_id))
+
+    def last_run(self):
+        with self._lock:
+            row = self._db.execute("SELECT id, started, finished, latest_version, repositories, errors FROM runs "
+                                   "ORDER BY id DESC LIMIT 1").fetchone()
+        if row is None:
+            return None
+
+        return dict(zip(("id", "started", "finished", "latest_version", "repositories", "errors"), row))
+
+    def record_repository(self, key, result, duration, error=None, version=None):
+        self._insert("INSERT INTO repositories VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (self.run_id, key, result, duration, error, version, time.time()))
+
+    def record_stage(self, key, stage, result, duration):
+        self._insert("INSERT INTO stages VALUES (?, ?, ?, ?, ?)", (self.run_id, key, stage, result, duration))
+
+    def record_build(self, key, project, pipeline, build_id, result, duration):
+        self._insert("INSERT INTO builds VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (self.run_id, key, project, pipeline, build_id, result, duration, time.time()))
+
+    def _insert(self, statement, values):
+        with self._lock, self._db:
+            self._db.execute(statement, values)
+
+    ##
+    # median duration of the recent successful builds of the pipeline-definition - or None without any
+    def build_duration(self, project, pipeline):
+        return _median(self._durations("SELECT duration FROM builds WHERE project = ? AND pipeline = ? "
+                                       "AND result = 'succeeded' AND duration IS NOT NULL "
+                                       "ORDER BY finished DESC LIMIT ?", (project, pipeline, RECENT_RUNS)))
+
+    ##
+    # median duration of the repository in the recent runs - or None without any
+    def repository_duration(self, key):
+        return _median(self._durations("SELECT duration FROM repositories WHERE key = ? AND result = 'succeeded' "
+                                       "ORDER BY finished DESC LIMIT ?", (key, RECENT_RUNS)))
+
+    def last_result(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT result, error, version FROM repositories WHERE key = ? "
+                                   "ORDER BY finished DESC LIMIT 1", (key,)).fetchone()
+        return None if row is None else {"result": row[0], "error": row[1], "version": row[2]}
+
+    def _durations(self, query, parameters):
+        with self._lock:
+            return [row[0] for row in self._db.execute(query, parameters)]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+##
+# Longest-processing-time-first: the repositories with the longest expected build start first, so the
+# long builds don't end up at the end of a parallel run. Repositories without any history start
+# first as well (their builds may be the longest) - in their configured order
+def longest_first(repositories, run_history):
+    def expected_build(item):
+        key, repo = item
+        duration = run_history.build_duration(repo.get("project"), repo.get("build-img-pipeline"))
+        return float("inf") if duration is None else duration
+
+    return dict(sorted(repositories.items(), key=expected_build, reverse=True))
+
+
+##
+# The expected end of a run, going by the durations of the repositories in the previous runs
+# (or the durations of their builds). Repositories without any history are expected to take as
+# long as the average one
+class Eta(object):
+
+    def __init__(self, expected, parallel):
+        known = [d for d in expected.values() if d is not None]
+        average = sum(known) / len(known) if len(known) > 0 else None
+        self.expected = {key: average if d is None else d for key, d in expected.items()}
+        self.parallel = max(1, parallel)
+        self.started = {}
+        self.finished = set()
+        self._lock = threading.Lock()
+
+    def start(self, key):
+        with self._lock:
+            self.started[key] = time.monotonic()
+
+    def finish(self, key):
+        with self._lock:
+            self.finished.add(key)
+
+    ##
+    # seconds until all repositories are expected to be finished - or None without any history
+    def remaining(self):
+        with self._lock:
+            now = time.monotonic()
+            unfinished = [key for key in self.expected if key not in self.finished]
+            if any(self.expected[key] is None for key in unfinished):
+                return None
+            running = [max(0.0, self.expected[key] - (now - self.started[key]))
+                       for key in unfinished if key in self.started]
+            waiting = [self.expected[key] for key in unfinished if key not in self.started]
+
+        return max(sum(running + waiting) / self.parallel, max(running + [0.0]))
+
+    def report(self):
+        remaining = self.remaining()
+        eta = "unknown" if remaining is None else \
+            f"{remaining:.0f}s (at {time.strftime('%H:%M:%S', time.localtime(time.time() + remaining))})"
+        running = len([key for key in self.started if key not in self.finished])
+        log.info(f"progress: {len(self.finished)} of {len(self.expected)} repositories done, {running} running - "
+                 f"ETA {eta}", done=len(self.finished), running=running, remaining=remaining)
+
+
+def expected_durations(repositories, run_history):
+    expected = {}
+    for key, repo in repositories.items():
+        duration = run_history.repository_duration(key)
+        expected[key] = duration if duration is not None else \
+            run_history.build_duration(repo.get("project"), repo.get("build-img-pipeline"))
+
+    return expected
+
+
+##
+# marks the repository the current thread works on - stages and builds are recorded for it
+@contextlib.contextmanager
+def repository(key):
+    token = _current_key.set(key)
+    try:
+        yield
+    finally:
+        _current_key.reset(token)
+
+
+def record_stage(stage, result, duration):
+    key = _current_key.get()
+    if key is not None:
+        default_history().record_stage(key, stage, result, duration)
+
+
+def record_build(project, pipeline, build_id, result, duration):
+    default_history().record_build(_current_key.get(), project, pipeline, build_id, result, duration)
+
+
+def history_path():
+    return getattr(conf, "history_db", None) or storage.state_path(HISTORY_FILE)
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def default_history():
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = RunHistory(history_path())
+
+        return _history
+
+
+def set_default_history(run_history):
+    global _history
+    with _history_lock:
+        _history = run_history
@@ -0,0 +1,206 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from wp import cassette
+from wp import config as conf
+from wp import deadline
+from wp import instrumentation
+from wp import log
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+
+_session = None
+_session_lock = threading.Lock()
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+##
+# raised instead of sending a request to a host, whose circuit is open. Being a ConnectionError,
+# the callers handle it like an unreachable host - just without waiting for it
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+##
+# One per upstream-host, shared by all requests to it: after failure_threshold consecutive failures
+# (connection-errors, timeouts, 5xx, 429) the circuit opens and requests fail fast.
+# After reset_timeout seconds a single request is let through (half-open): its success closes the
+# circuit again, its failure keeps it open for another reset_timeout.
+class CircuitBreaker(object):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, host, failure_threshold=None, reset_timeout=None):
+        self.host = host
+        self.failure_threshold = failure_threshold if failure_threshold is not None else \
+            getattr(conf, "circuit_failure_threshold", DEFAULT_FAILURE_THRESHOLD)
+        self.reset_timeout = reset_timeout if reset_timeout is not None else \
+            getattr(conf, "circuit_reset_timeout", DEFAULT_RESET_TIMEOUT)
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CircuitBreaker.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = CircuitBreaker.HALF_OPEN
+                self._probing = False
+            if self.state == CircuitBreaker.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CircuitBreaker.CLOSED:
+                log.info(f"circuit for {self.host} closed again")
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == CircuitBreaker.HALF_OPEN or \
+                    (self.state == CircuitBreaker.CLOSED and self.failures >= self.failure_threshold):
+                log.warning(f"circuit for {self.host} opened after {self.failures} consecutive failures - "
+                            f"requests fail fast for {self.reset_timeout}s")
+                self.state = CircuitBreaker.OPEN
+                self._opened_at = time.monotonic()
+
+    ##
+    # the request ended without telling anything about the host (e.g. a programming error)
+    def release(self):
+        with self._lock:
+            self._probing = False
+
+
+def circuit_breaker(url):
+    host = urllib.parse.urlsplit(url).netloc
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+
+        return _breakers[host]
+
+
+def reset_circuit_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+
+##
+# All http-calls go through here. Without a session every call opens its own connections
+# (plain requests.get/post); a long running process shares one session to keep the
+# connection-pools (and TLS-sessions) warm.
+# No call waits longer than http_timeout - or the remaining time-budget of the deadline.
+# Requests to hosts with an open circuit raise a CircuitOpenError right away.
+# Every request is counted (per host and status) and timed - and recorded/replayed with an active cassette.
+def get(url, **kwargs):
+    kwargs.setdefault("timeout", _timeout())
+    session = _session
+    return _guarded(_sender("GET", requests.get if session is None else session.get), url, kwargs)
+
+
+def post(url, **kwargs):
+    kwargs.setdefault("timeout", _timeout())
+    session = _session
+    return _guarded(_sender("POST", requests.post if session is None else session.post), url, kwargs)
+
+
+def _sender(method, send):
+    active = cassette.active()
+    return send if active is None else active.wrap(method, send)
+
+
+def _guarded(send, url, kwargs):
+    breaker = circuit_breaker(url)
+    if not breaker.allow():
+        instrumentation.inc("http_requests", host=breaker.host, status="circuit-open")
+        raise CircuitOpenError(f"circuit for {breaker.host} is open - skipped request to {url}")
+
+    start = time.monotonic()
+    try:
+        response = send(url, **kwargs)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        instrumentation.inc("http_requests", host=breaker.host, status=type(e).__name__)
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    finally:
+        instrumentation.observe("http_request_duration", time.monotonic() - start, host=breaker.host)
+
+    _count_transfer(breaker.host, kwargs.get("data"), response)
+    if response.status_code >= 500 or response.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+    return response
+
+
+def _count_transfer(host, data, response):
+    instrumentation.inc("http_requests", host=host, status=response.status_code)
+    if isinstance(data, (str, bytes)):
+        instrumentation.inc("http_sent_bytes", len(data), host=host)
+    content = getattr(response, "content", None)
+    if isinstance(content, bytes):
+        instrumentation.inc("http_received_bytes", len(content), host=host)
+
+
+def _timeout():
+    return deadline.timeout(getattr(conf, "http_timeout", deadline.DEFAULT_HTTP_TIMEOUT))
+
+
+def use_session(pool_size=DEFAULT_POOL_SIZE):
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+
+        return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,195 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import datetime
+import json
+import os
+import re
+import threading
+import time
+from wp import config as conf
+from wp import deadline
+from wp import history
+from wp import log
+from wp import profiling
+from wp import storage
+from wp import tracing
+
+PROMETHEUS_FILE = "wp_updater.prom"
+SUMMARY_FILE = "run-summary.json"
+METRIC_PREFIX = "wp_updater_"
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+##
+# Counters and timers of the process, each identified by its name and labels.
+# Counters only grow (e.g. requests), timers keep count, sum and max of the observed durations
+class Metrics(object):
+    def __init__(self):
+        self._counters = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            count, total, maximum = self._timers.get(key, (0, 0.0, 0.0))
+            self._timers[key] = (count + 1, total + seconds, max(maximum, seconds))
+
+    @contextlib.contextmanager
+    def timed(self, name, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def timer(self, name, **labels):
+        with self._lock:
+            return self._timers.get((name, tuple(sorted(labels.items()))), (0, 0.0, 0.0))
+
+    def snapshot(self):
+        with self._lock:
+            return {"counters": [{"name": name, "labels": dict(labels), "value": value}
+                                 for (name, labels), value in sorted(self._counters.items())],
+                    "timers": [{"name": name, "labels": dict(labels), "count": count, "sum": round(total, 6),
+                                "max": round(maximum, 6)}
+                               for (name, labels), (count, total, maximum) in sorted(self._timers.items())]}
+
+    ##
+    # adds the metrics of a snapshot (e.g. of a repo-worker process) to the ones of the process
+    def merge(self, snapshot):
+        with self._lock:
+            for c in snapshot["counters"]:
+                key = (c["name"], tuple(sorted(c["labels"].items())))
+                self._counters[key] = self._counters.get(key, 0) + c["value"]
+            for t in snapshot["timers"]:
+                key = (t["name"], tuple(sorted(t["labels"].items())))
+                count, total, maximum = self._timers.get(key, (0, 0.0, 0.0))
+                self._timers[key] = (count + t["count"], total + t["sum"], max(maximum, t["max"]))
+
+    ##
+    # Prometheus text-format (for the textfile-collector of the node-exporter):
+    # counters end with _total, timers are exported as summary (_count, _sum) plus a _max gauge
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name in sorted({c["name"] for c in snapshot["counters"]}):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name}_total counter")
+            lines += [f"{METRIC_PREFIX}{name}_total{_labels(c['labels'])} {c['value']}"
+                      for c in snapshot["counters"] if c["name"] == name]
+        for name in sorted({t["name"] for t in snapshot["timers"]}):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name}_seconds summary")
+            for t in (t for t in snapshot["timers"] if t["name"] == name):
+                lines.append(f"{METRIC_PREFIX}{name}_seconds_count{_labels(t['labels'])} {t['count']}")
+                lines.append(f"{METRIC_PREFIX}{name}_seconds_sum{_labels(t['labels'])} {t['sum']}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name}_seconds_max gauge")
+            lines += [f"{METRIC_PREFIX}{name}_seconds_max{_labels(t['labels'])} {t['max']}"
+                      for t in snapshot["timers"] if t["name"] == name]
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if len(labels) == 0:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+    return "{" + ",".join(f"{name}=\"{escape(value)}\"" for name, value in sorted(labels.items())) + "}"
+
+
+def default_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+
+        return _metrics
+
+
+def set_default_metrics(metrics):
+    global _metrics
+    with _metrics_lock:
+        _metrics = metrics
+
+
+def inc(name, value=1, **labels):
+    default_metrics().inc(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    default_metrics().observe(name, seconds, **labels)
+
+
+def timed(name, **labels):
+    return default_metrics().timed(name, **labels)
+
+
+##
+# A stage of a repository (fetch, update, build, release): runs within the time-budget (and span) of
+# the stage and records its duration - and whether it failed - in the metrics, the run-history and the log.
+# With --profile, the stage is profiled
+@contextlib.contextmanager
+def stage(name):
+    start = time.monotonic()
+    result = "failed"
+    try:
+        with log.stage(name), tracing.span(name), profiling.stage(name), deadline.stage(name):
+            yield
+        result = "succeeded"
+    finally:
+        duration = time.monotonic() - start
+        observe("stage_duration", duration, stage=name, result=result)
+        history.record_stage(name, result, duration)
+        log.info(f"stage {name} {result}", stage=name, result=result, duration=round(duration, 3))
+
+
+##
+# the git-subcommands of a shell-command, e.g. "cd /x && git add --all && git commit ..." -> "add+commit"
+def git_subcommands(cmd):
+    return "+".join(re.findall(r"(?:^|&&|;|\|)\s*git\s+([a-z][a-z-]*)", cmd)) or "other"
+
+
+def metrics_dir():
+    return getattr(conf, "metrics_dir", None) or conf.workdir
+
+
+##
+# writes the metrics as prometheus-textfile and a json-summary of the run
+def export(run_details, directory=None):
+    directory = directory if directory is not None else metrics_dir()
+    metrics = default_metrics()
+    summary = dict(run_details, exported=datetime.datetime.now().isoformat(timespec="seconds"),
+                   metrics=metrics.snapshot())
+    storage.write_atomic(os.path.join(directory, PROMETHEUS_FILE), metrics.prometheus_text())
+    storage.write_atomic(os.path.join(directory, SUMMARY_FILE), json.dumps(summary, indent=2))
+    log.info("exported metrics", directory=directory)
@@ -0,0 +1,204 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import contextlib
+import contextvars
+import datetime
+import json
+import sys
+import threading
+import time
+import traceback
+from wp import config as conf
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+DEFAULT_LEVEL = "info"
+DEFAULT_FORMAT = "json"
+DEFAULT_BUFFER_SIZE = 1000
+
+# the repository (and its buffer) resp. the stage of the current thread (or task)
+_repository = contextvars.ContextVar("log_repository", default=None)
+_stage = contextvars.ContextVar("log_stage", default=None)
+
+
+##
+# the records of a repository, written all at once when the repository is finished - so the records of
+# parallel repositories don't interleave. Only the most recent size records are kept.
+class RepositoryBuffer(object):
+
+    def __init__(self, key, size):
+        self.key = key
+        self.started = time.monotonic()
+        self.records = collections.deque(maxlen=size)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        with self._lock:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(record)
+
+    def drain(self):
+        with self._lock:
+            records = list(self.records)
+            dropped = self.dropped
+            self.records.clear()
+            self.dropped = 0
+        return records, dropped
+
+
+##
+# Writes records (a message with the repository, stage and seconds since the start of the repository,
+# plus arbitrary fields) as json-lines - or as plain text - to the stream (default: stdout).
+# Records below the level are dropped right away.
+class Logger(object):
+
+    def __init__(self, level=INFO, fmt=DEFAULT_FORMAT, buffer_size=DEFAULT_BUFFER_SIZE, stream=None):
+        self.level = level
+        self.fmt = fmt
+        self.buffer_size = buffer_size
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, message, fields):
+        if not self.enabled(level):
+            return
+
+        buffer = _repository.get()
+        record = {"time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"),
+                  "level": LEVEL_NAMES.get(level, str(level)), "message": message}
+        if buffer is not None:
+            record["repo"] = buffer.key
+            record["elapsed"] = round(time.monotonic() - buffer.started, 3)
+        if _stage.get() is not None:
+            record["stage"] = _stage.get()
+        record["thread"] = threading.current_thread().name
+        record.update(fields)
+
+        if buffer is not None:
+            buffer.append(record)
+        else:
+            self.write([record])
+
+    def flush(self, buffer):
+        records, dropped = buffer.drain()
+        if dropped > 0:
+            records.insert(0, {"time": records[0]["time"], "level": "warning", "repo": buffer.key,
+                               "message": f"{dropped} earlier records of the repository dropped", "dropped": dropped})
+        if len(records) > 0:
+            self.write(records)
+
+    def write(self, records):
+        lines = "".join(self.format(r) + "\n" for r in records)
+        with self._lock:
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write(lines)
+            stream.flush()
+
+    def format(self, record):
+        if self.fmt == "json":
+            return json.dumps(record, default=str)
+
+        fields = {k: v for k, v in record.items() if k not in ("time", "level", "message", "repo", "stage", "thread")}
+        context = "/".join(str(record[k]) for k in ("repo", "stage") if k in record)
+        text = f"{record['time']} {record['level'].upper():7} {f'[{context}] ' if context else ''}{record['message']}"
+        return text + "".join(f" {k}={v}" for k, v in fields.items())
+
+
+def create_logger():
+    level = getattr(conf, "log_level", None) or DEFAULT_LEVEL
+    return Logger(LEVELS[level.lower()], getattr(conf, "log_format", None) or DEFAULT_FORMAT,
+                  getattr(conf, "log_buffer_size", None) or DEFAULT_BUFFER_SIZE)
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def default_logger():
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            _logger = create_logger()
+
+        return _logger
+
+
+def set_default_logger(logger):
+    global _logger
+    with _logger_lock:
+        _logger = logger
+
+
+def debug(message, **fields):
+    default_logger().log(DEBUG, message, fields)
+
+
+def info(message, **fields):
+    default_logger().log(INFO, message, fields)
+
+
+def warning(message, **fields):
+    default_logger().log(WARNING, message, fields)
+
+
+def error(message, **fields):
+    default_logger().log(ERROR, message, fields)
+
+
+##
+# an error with the traceback of the exception currently handled
+def exception(message, **fields):
+    error(message, traceback=traceback.format_exc(), **fields)
+
+
+def enabled(level):
+    return default_logger().enabled(level)
+
+
+##
+# buffers the records of the repository, until the block is finished
+@contextlib.contextmanager
+def repository(key):
+    logger = default_logger()
+    buffer = RepositoryBuffer(key, logger.buffer_size)
+    token = _repository.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _repository.reset(token)
+        logger.flush(buffer)
+
+
+@contextlib.contextmanager
+def stage(name):
+    token = _stage.set(name)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
@@ -0,0 +1,177 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import threading
+import urllib.parse
+from wp import config as conf
+from wp import deadline
+from wp import log
+from wp.pipeline import pipeline_interaction as pipe
+
+ENV_DEVOPS_PAT = "DEVOPS_PAT"
+HEADERS_JSON = {"Content-Type": "application/json", "Accept": "application/json"}
+DEFAULT_POLL_INTERVAL = 15
+
+
+class AgentPool(object):
+    def __init__(self, pool_name):
+        self.pool_name = pool_name
+        self.credentials = (conf.git_user, os.getenv(ENV_DEVOPS_PAT))
+        self._pool_id = None
+
+    def pool_id(self):
+        if self._pool_id is None:
+            url = f"{conf.azure_org}_apis/distributedtask/pools?api-version=5.1" \
+                f"&poolName={urllib.parse.quote(self.pool_name)}"
+            json_data = self._get(url)
+            if json_data is None or json_data["count"] == 0:
+                raise RuntimeError(f"Agent-Pool \"{self.pool_name}\" not found!")
+            self._pool_id = json_data["value"][0]["id"]
+
+        return self._pool_id
+
+    def online_agents(self):
+        url = f"{conf.azure_org}_apis/distributedtask/pools/{self.pool_id()}/agents?api-version=5.1"
+        json_data = self._get(url)
+        if json_data is None:
+            return None
+
+        return len([a for a in json_data["value"] if a.get("enabled", True) and a.get("status") == "online"])
+
+    ##
+    # jobs waiting for an agent (not assigned yet and not finished)
+    def queued_jobs(self):
+        url = f"{conf.azure_org}_apis/distributedtask/pools/{self.pool_id()}/jobrequests?api-version=5.1"
+        json_data = self._get(url)
+        if json_data is None:
+            return None
+
+        return len([j for j in json_data["value"] if "assignTime" not in j and "result" not in j])
+
+    def _get(self, url):
+        response = pipe.request_retry(url, header=HEADERS_JSON, credentials=self.credentials)
+        if response.status_code != 200:
+            log.error(f"Unable to query agent-pool \"{self.pool_name}\"", status_code=response.status_code)
+            log.debug("agent-pool response", response=response.text)
+            return None
+
+        return json.loads(response.text)
+
+
+##
+# Releases pushes (which trigger builds) in waves: a push may only go out, if less than max_queued
+# builds wait for an agent. Without an agent-pool only the builds started by this process are counted,
+# with one it's the actual queue of the pool (including builds of others).
+# Every push has to acquire a slot, which is released once its build finished.
+# The pool is queried outside of the lock, so neither waiters nor release() wait for its requests.
+# The slots are counted per process in slots (pid -> builds in flight): repo-workers share slots and
+# condition (proxies of the parent, see share_slots), so the limit applies to all workers together.
+class BuildWaveScheduler(object):
+
+    def __init__(self, max_queued=None, pool=None, poll_interval=DEFAULT_POLL_INTERVAL, slots=None, condition=None):
+        self.max_queued = max_queued
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self._slots = slots if slots is not None else {}
+        self._condition = condition if condition is not None else threading.Condition()
+
+    @property
+    def in_flight(self):
+        return sum(self._slots.values())
+
+    def acquire(self):
+        while True:
+            pool_status = self._pool_status()
+            with self._condition:
+                if self._has_slot(pool_status):
+                    self._slots[os.getpid()] = self._slots.get(os.getpid(), 0) + 1
+                    return
+                log.info(f"build-queue is full ({self.in_flight} builds in flight) - wait for a free slot...")
+                # woken up by release() - or re-check the pool, builds of others may have finished
+                self._condition.wait(timeout=deadline.timeout(self.poll_interval))
+            deadline.check()
+
+    def release(self):
+        with self._condition:
+            self._slots[os.getpid()] = max(0, self._slots.get(os.getpid(), 0) - 1)
+            self._condition.notify()
+
+    ##
+    # frees the slots of a process, that won't release them any more (e.g. a killed repo-worker)
+    def release_all(self, pid):
+        with self._condition:
+            if self._slots.pop(pid, 0) > 0:
+                self._condition.notify_all()
+
+    ##
+    # (queued jobs, online agents) of the pool - or None without pool (or if it's unavailable)
+    def _pool_status(self):
+        if self.max_queued is None or self.pool is None:
+            return None
+
+        queued = self.pool.queued_jobs()
+        agents = self.pool.online_agents()
+        if queued is None or agents is None:
+            return None
+
+        return queued, agents
+
+    def _has_slot(self, pool_status=None):
+        if self.max_queued is None:
+            return True
+        if pool_status is None:
+            return self.in_flight < self.max_queued
+
+        queued, agents = pool_status
+        return queued < self.max_queued and self.in_flight < agents + self.max_queued
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+# (slots, condition) shared with the other processes, see share_slots
+_shared_slots = (None, None)
+
+
+def default_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            pool_name = getattr(conf, "agent_pool", None)
+            pool = AgentPool(pool_name) if pool_name is not None else None
+            _scheduler = BuildWaveScheduler(getattr(conf, "max_queued_builds", None), pool, slots=_shared_slots[0],
+                                            condition=_shared_slots[1])
+
+        return _scheduler
+
+
+##
+# the default scheduler counts the slots in slots and condition (e.g. a dict and a condition of a
+# multiprocessing-manager) - shared with other processes, that do the same
+def share_slots(slots, condition):
+    global _scheduler, _shared_slots
+    with _scheduler_lock:
+        _shared_slots = (slots, condition)
+        _scheduler = None
+
+
+def set_default_scheduler(scheduler):
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
@@ -20,12 +20,21 @@ import datetime
 import json
 import os
 import requests
+import threading
 import time
+import urllib.parse
 from wp import config as conf
+from wp import http_client
+from wp import instrumentation
+from wp import log
+from wp.pipeline import polling
+from wp.pipeline import service_hooks
 
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
 ENV_DEVOPS_PAT = "DEVOPS_PAT"
 HEADERS_JSON = {"Content-Type": "application/json", "Accept": "application/json"}
+DEFAULT_DEFINITION_TTL = 3600
+RECENT_BUILDS = 20
 
 
 def request_retry(url, header=None, credentials=None, counter=3):
@@ -38,6 +47,8 @@ def request_retry(url, header=None, credentials=None, counter=3):
     counter = counter - 1
     response = _http_get_request_no_throw(url, header, credentials)
     if response.status_code != 200:
+        if counter > 0:
+            instrumentation.inc("http_retries", host=urllib.parse.urlsplit(url).netloc)
         response = request_retry(url, header, credentials, counter)
 
     return response
@@ -45,15 +56,45 @@ def request_retry(url, header=None, credentials=None, counter=3):
 
 def _http_get_request_no_throw(url, header=None, credentials=None):
     try:
-        return requests.get(url, headers=header, auth=credentials)
-    except requests.exceptions.ConnectionError as e:
-        print(f"ERROR: {e}")
+        return http_client.get(url, headers=header, auth=credentials)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        log.error(f"{e}", url=url)
         response = SimpleResponse()
         response.status_code = 502
-        response.simple_text = f"ConnectionError: {e}"
+        response.simple_text = f"{type(e).__name__}: {e}"
         return response
 
 
+##
+# pipeline-definitions hardly ever change, so each one is resolved at most once per ttl
+class DefinitionIndex(object):
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(conf, "definition_cache_ttl", DEFAULT_DEFINITION_TTL)
+        self._lock = threading.Lock()
+        self._definitions = {}
+
+    def lookup(self, key, resolve):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._definitions.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                return entry[1]
+
+        definition = resolve()
+        if definition is not None:
+            with self._lock:
+                self._definitions[key] = (now, definition)
+
+        return definition
+
+    def clear(self):
+        with self._lock:
+            self._definitions.clear()
+
+
+definitions = DefinitionIndex()
+
+
 class SimpleResponse(requests.models.Response):
     def __init__(self):
         self.simple_text = ""
@@ -64,14 +105,31 @@ class SimpleResponse(requests.models.Response):
         return self.simple_text
 
 
+def _parse_time(value):
+    # fractions of azure-timestamps have up to 7 digits, which strptime can't parse
+    return datetime.datetime.strptime(value[:19], DATETIME_FORMAT)
+
+
+def _build_duration(build_status):
+    if not build_status.get("startTime") or not build_status.get("finishTime"):
+        return None
+
+    return (_parse_time(build_status["finishTime"]) - _parse_time(build_status["startTime"])).total_seconds()
+
+
 class Pipeline(object):
     def __init__(self, project, pipeline_name):
         self.project = project
         self.pipeline_name = pipeline_name
         self.credentials = (conf.git_user, os.getenv(ENV_DEVOPS_PAT))
+        self.build_id = None
+        self.build_duration = None
 
     def validate(self):
-        print(f"Validate Pipeline \"{self.pipeline_name}\" for project \"{self.project}\" ...")
+        return definitions.lookup(("build", self.project, self.pipeline_name), self._fetch_definition)
+
+    def _fetch_definition(self):
+        log.info(f"Validate Pipeline \"{self.pipeline_name}\" for project \"{self.project}\" ...")
         url = f"{conf.azure_org}{self.project}/_apis/build/definitions?api-version=5.1&name={self.pipeline_name}"
 
         response = request_retry(url, header=HEADERS_JSON, credentials=self.credentials)
@@ -84,73 +142,149 @@ class Pipeline(object):
 
         return json_data["value"][0]
 
-    def trigger_build_and_wait(self):
+    def trigger_build_and_wait(self, parameters=None):
         pipeline_details = self.validate()
-        build_status = self.trigger_build(pipeline_details["id"])
+        build_status = self.trigger_build(pipeline_details["id"], parameters)
         return self.wait_for_build_with_id(build_status["id"], {})
 
-    def trigger_build(self, pipeline_id):
-        print(f"Trigger Build-Pipeline \"{self.pipeline_name}\" for project \"{self.project}\" ...")
+    def trigger_build(self, pipeline_id, parameters=None):
+        log.info(f"Trigger Build-Pipeline \"{self.pipeline_name}\" for project \"{self.project}\" ...")
         url = f"{conf.azure_org}{self.project}/_apis/build/builds?api-version=5.1"
         data = "{\"definition\": {\"id\": " + str(pipeline_id) + "}}"
+        if parameters is not None:
+            # queue-time variables are passed as json-string
+            data = json.dumps({"definition": {"id": pipeline_id}, "parameters": json.dumps(parameters)})
 
-        response = requests.post(url, data=data, headers=HEADERS_JSON, auth=self.credentials)
+        response = http_client.post(url, data=data, headers=HEADERS_JSON, auth=self.credentials)
         if response.status_code != 200:
             raise RuntimeError(f"Queue build for pipeline FAILED! Got status code: {response.status_code}")
 
         return json.loads(response.text)
 
     def fetch_build_status(self, build_id):
-        print(f"fetch status of build {build_id} ...")
+        log.debug("fetch status of build ...", build_id=build_id)
         url = f"{conf.azure_org}{self.project}/_apis/build/builds/{build_id}?api-version=5.1"
 
         response = request_retry(url, header=HEADERS_JSON, credentials=self.credentials)
         if response.status_code != 200:
-            print(f"ERROR: Unable to fetch build-status for build {build_id}")
-            print(f"Response-Code: {response.status_code}"
-                  f"Response-Text: {response.text}")
+            log.error(f"Unable to fetch build-status for build {build_id}", status_code=response.status_code)
+            log.debug("build-status response", response=response.text)
             return None
 
         json_data = json.loads(response.text)
         return {"id": json_data["id"], "status": json_data["status"],
-                "result": json_data.get("result"), "buildNumber": json_data["buildNumber"]}
+                "result": json_data.get("result"), "buildNumber": json_data["buildNumber"],
+                "startTime": json_data.get("startTime"), "finishTime": json_data.get("finishTime")}
 
     def fetch_most_recent_build(self, pipeline_id):
-        print(f"fetch most recent build for pipeline {pipeline_id}")
+        log.debug("fetch most recent build", pipeline_id=pipeline_id)
         url = f"{conf.azure_org}{self.project}/_apis/build/builds?api-version=5.1" \
             f"&definitions={pipeline_id}&$top=1&queryOrder=queueTimeDescending"
 
         response = request_retry(url, header=HEADERS_JSON, credentials=self.credentials)
         if response.status_code != 200:
-            print(f"ERROR: Unable to fetch most recent build for pipeline {pipeline_id}")
-            print(f"Response-Code: {response.status_code} "
-                  f"Response-Text: {response.text}")
+            log.error(f"Unable to fetch most recent build for pipeline {pipeline_id}", status_code=response.status_code)
+            log.debug("recent builds response", response=response.text)
             return None
 
         json_data = json.loads(response.text)
         if json_data["count"] == 0:
-            print(f"ERROR: Unable to fetch most recent build for pipeline {pipeline_id} - count was 0")
+            log.error(f"Unable to fetch most recent build for pipeline {pipeline_id} - count was 0")
             return None
 
         return json_data["value"][0]
 
+    ##
+    # the build triggered by the given commit - or None, if it is not queued (yet)
+    def find_build_for_commit(self, pipeline_id, source_version):
+        log.debug("search build of commit", sha=source_version, pipeline_id=pipeline_id)
+        url = f"{conf.azure_org}{self.project}/_apis/build/builds?api-version=5.1" \
+            f"&definitions={pipeline_id}&$top={RECENT_BUILDS}&queryOrder=queueTimeDescending"
+
+        response = request_retry(url, header=HEADERS_JSON, credentials=self.credentials)
+        if response.status_code != 200:
+            log.error(f"Unable to fetch recent builds for pipeline {pipeline_id}", status_code=response.status_code)
+            log.debug("recent builds response", response=response.text)
+            return None
+
+        json_data = json.loads(response.text)
+        for build in json_data["value"]:
+            if build.get("sourceVersion") == source_version:
+                return build
+
+        return None
+
+    ##
+    # the median duration (in seconds) of the recent successful builds - or None without any
+    def estimate_build_duration(self):
+        pipeline_details = self.validate()
+        if pipeline_details is None:
+            return None
+
+        url = f"{conf.azure_org}{self.project}/_apis/build/builds?api-version=5.1" \
+            f"&definitions={pipeline_details['id']}&$top={RECENT_BUILDS}&queryOrder=queueTimeDescending" \
+            f"&statusFilter=completed&resultFilter=succeeded"
+        response = request_retry(url, header=HEADERS_JSON, credentials=self.credentials)
+        if response.status_code != 200:
+            log.error(f"Unable to fetch recent builds for pipeline {self.pipeline_name}",
+                      status_code=response.status_code)
+            return None
+
+        durations = sorted(d for d in map(_build_duration, json.loads(response.text)["value"]) if d is not None)
+        if len(durations) == 0:
+            return None
+
+        return durations[len(durations) // 2]
+
     @staticmethod
     def _now():
         return datetime.datetime.now()
 
     def wait_for_build_pipeline(self):
-        print(f"wait for build of '{self.pipeline_name}' to complete...")
+        log.info(f"wait for build of '{self.pipeline_name}' to complete...")
         pipeline_details = self.validate()
         build_status = self.fetch_most_recent_build(pipeline_details["id"])
         build_id = build_status["id"]
 
         return self.wait_for_build_with_id(build_id, build_status)
 
-    def wait_for_build_with_id(self, build_id, build_status):
-        while build_status.get("status") != "completed":
-            time.sleep(10)
-            build_status = self.fetch_build_status(build_id)
-            print(f"build {build_status['id']} is in status {build_status['status']}")
+    ##
+    # unlike wait_for_build_pipeline, this can't pick up the build of another (later) commit
+    def wait_for_build_of_commit(self, source_version):
+        log.info(f"wait for build of commit of '{self.pipeline_name}' to complete...", sha=source_version)
+        pipeline_details = self.validate()
+        poller = polling.AdaptivePoller()
+        build_status = self.find_build_for_commit(pipeline_details["id"], source_version)
+        while build_status is None:
+            poller.sleep()
+            build_status = self.find_build_for_commit(pipeline_details["id"], source_version)
 
-        print(f"build {build_status['id']} finished with result {build_status['result']}")
+        return self.wait_for_build_with_id(build_status["id"], build_status)
+
+    def wait_for_build_with_id(self, build_id, build_status):
+        self.build_id = build_id
+        receiver = service_hooks.default_receiver()
+        subscription = None
+        poller = polling.AdaptivePoller()
+        if receiver is not None:
+            # completion is pushed by the service-hook, polling is only the fallback
+            subscription = receiver.subscribe(service_hooks.BUILD_TOPIC, build_id)
+            interval = service_hooks.fallback_poll_interval()
+            poller = polling.AdaptivePoller(interval, interval)
+
+        try:
+            poller.observe(build_status.get("status"))
+            while build_status.get("status") != "completed":
+                poller.wait(subscription)
+                # a failed status-request (None) is retried with the next poll
+                build_status = self.fetch_build_status(build_id) or {}
+                poller.observe(build_status.get("status"))
+                log.debug(f"build is in status {build_status.get('status')}", build_id=build_id)
+        finally:
+            if subscription is not None:
+                receiver.unsubscribe(subscription)
+
+        self.build_duration = _build_duration(build_status)
+        log.info(f"build finished with result {build_status['result']}", build_id=build_id,
+                 duration=self.build_duration)
         return build_status['result']
@@ -0,0 +1,63 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from wp import config as conf
+from wp import deadline
+
+DEFAULT_INITIAL_INTERVAL = 10
+DEFAULT_MAX_INTERVAL = 60
+DEFAULT_BACKOFF_FACTOR = 1.5
+
+
+##
+# Polls fast right after a status-change and backs off while nothing happens.
+# Shared by the build- and the release-waiters.
+class AdaptivePoller(object):
+    def __init__(self, initial=None, maximum=None, factor=None):
+        self.initial = initial if initial is not None else \
+            getattr(conf, "poll_interval", DEFAULT_INITIAL_INTERVAL)
+        self.maximum = maximum if maximum is not None else \
+            getattr(conf, "max_poll_interval", DEFAULT_MAX_INTERVAL)
+        self.factor = factor if factor is not None else DEFAULT_BACKOFF_FACTOR
+        self.interval = self.initial
+        self._last_status = None
+
+    def next_interval(self):
+        interval = self.interval
+        self.interval = min(self.maximum, self.interval * self.factor)
+        return interval
+
+    def observe(self, status):
+        if status != self._last_status:
+            self._last_status = status
+            self.reset()
+
+    def reset(self):
+        self.interval = self.initial
+
+    def sleep(self):
+        deadline.sleep(self.next_interval())
+
+    ##
+    # like sleep, but a notification of the (service-hook) subscription ends the wait early
+    def wait(self, subscription=None):
+        if subscription is None:
+            self.sleep()
+        elif subscription.wait(deadline.timeout(self.next_interval())):
+            subscription.clear()
+        deadline.check()
@@ -18,13 +18,105 @@
 
 import json
 import os
-import requests
 import urllib.parse
 from wp import config as conf
+from wp import http_client
+from wp import log
 from wp.pipeline import pipeline_interaction as pipe
 
 ENV_DEVOPS_PAT = "DEVOPS_PAT"
 HEADERS_JSON = {"Content-Type": "application/json", "Accept": "application/json"}
+PENDING_STATES = {"undefined", "notStarted", "queued", "scheduled", "inProgress"}
+FAILED_STATES = ("rejected", "canceled", "partiallySucceeded")
+# condition of the environments deployed right after the creation of a release
+RELEASE_STARTED = {"conditionType": "event", "name": "ReleaseStarted"}
+
+
+##
+# fetches the given releases of the project (including their environments) in a single request.
+# Returns a dict release-id -> release or None, if the request failed
+def fetch_releases(project, release_ids):
+    ids = ",".join(str(i) for i in sorted(release_ids))
+    url = f"{conf.azure_org_vs}{project}/_apis/release/releases?api-version=5.1" \
+        f"&releaseIdFilter={ids}&$expand=environments"
+    credentials = (conf.git_user, os.getenv(ENV_DEVOPS_PAT))
+
+    response = pipe.request_retry(url, header=HEADERS_JSON, credentials=credentials)
+    if response.status_code != 200:
+        log.error(f"Unable to fetch status of releases {ids} for project {project}", status_code=response.status_code)
+        log.debug("releases response", response=response.text)
+        return None
+
+    json_data = json.loads(response.text)
+    return {r["id"]: r for r in json_data["value"]}
+
+
+##
+# Returns None while a deployment of the release is still pending, "succeeded" once all
+# environments it deploys are deployed or the status of the first failed environment
+def release_result(release):
+    if release.get("status") == "abandoned":
+        return "abandoned"
+
+    if len(release.get("environments") or []) == 0:
+        return None
+    states = [e.get("status", "undefined") for e in deployed_environments(release)]
+    if len(states) == 0:
+        # there is nothing to wait for: every environment is deployed manually or by a schedule
+        log.warning("release doesn't deploy any environment automatically", release_id=release.get("id"),
+                    release=release.get("name"))
+        return "succeeded"
+    if any(s in PENDING_STATES for s in states):
+        return None
+    for state in FAILED_STATES:
+        if state in states:
+            return state
+
+    return "succeeded"
+
+
+##
+# the environments the release deploys: the configured release_environments - or the ones triggered by the
+# creation of the release and the ones triggered (in turn) by their deployment. Environments deployed manually
+# (or with a schedule) never leave "notStarted", unless someone deploys them - then they count as well.
+# Without any conditions (of the environments), all environments count
+def deployed_environments(release):
+    environments = release.get("environments", [])
+    names = getattr(conf, "release_environments", None)
+    if names:
+        return [e for e in environments if e.get("name") in names]
+    if all("conditions" not in e for e in environments):
+        return environments
+
+    automatic = set()
+    triggered = [e for e in environments if _triggered_by(e, automatic)]
+    while len(triggered) > len(automatic):
+        automatic = {e.get("name") for e in triggered}
+        triggered = [e for e in environments if _triggered_by(e, automatic)]
+
+    return [e for e in environments
+            if e.get("name") in automatic or e.get("status", "undefined") not in ("undefined", "notStarted")]
+
+
+def _triggered_by(environment, automatic):
+    for condition in environment.get("conditions") or []:
+        if all(condition.get(k) == v for k, v in RELEASE_STARTED.items()):
+            return True
+        if condition.get("conditionType") == "environmentState" and condition.get("name") in automatic:
+            return True
+
+    return False
+
+
+##
+# alias of the artifact of the release-definition, that is built by the build-definition - or None
+def artifact_alias(definition, build_definition_id):
+    for artifact in definition.get("artifacts") or []:
+        reference = (artifact.get("definitionReference") or {}).get("definition") or {}
+        if artifact.get("type") == "Build" and str(reference.get("id")) == str(build_definition_id):
+            return artifact["alias"]
+
+    return None
 
 
 class ReleasePipeline(object):
@@ -34,9 +126,13 @@ class ReleasePipeline(object):
         self.credentials = (conf.git_user, os.getenv(ENV_DEVOPS_PAT))
 
     def validate(self):
-        print(f"Validate Pipeline \"{self.pipeline_name}\" for project \"{self.project}\" ...")
+        return pipe.definitions.lookup(("release", self.project, self.pipeline_name), self._fetch_definition)
+
+    def _fetch_definition(self):
+        log.info(f"Validate Pipeline \"{self.pipeline_name}\" for project \"{self.project}\" ...")
         search_param = urllib.parse.quote(self.pipeline_name)
-        url = f"{conf.azure_org_vs}{self.project}/_apis/release/definitions?api-version=5.1&searchText={search_param}"
+        url = f"{conf.azure_org_vs}{self.project}/_apis/release/definitions?api-version=5.1&searchText={search_param}" \
+            "&$expand=artifacts"
 
         response = pipe.request_retry(url, header=HEADERS_JSON, credentials=self.credentials)
         if response.status_code != 200:
@@ -48,12 +144,18 @@ class ReleasePipeline(object):
 
         return json_data["value"][0]
 
-    def trigger_release(self, pipeline_id):
-        print(f"Trigger release-pipeline \"{self.pipeline_name}\" for project {self.project}")
+    ##
+    # artifacts (alias and version) pin the artifacts of the release, the others are the latest versions
+    def trigger_release(self, pipeline_id, artifacts=None):
+        log.info(f"Trigger release-pipeline \"{self.pipeline_name}\" for project {self.project}", artifacts=artifacts)
         url = f"{conf.azure_org_vs}{self.project}/_apis/release/releases?api-version=5.1"
         data = "{\"definitionId\": " + str(pipeline_id) + ", \"description\": \"auto-update trigger\"}"
+        if artifacts:
+            data = json.dumps({"definitionId": pipeline_id, "description": "auto-update trigger",
+                               "artifacts": [{"alias": alias, "instanceReference": {"id": str(version)}}
+                                             for alias, version in sorted(artifacts.items())]})
 
-        response = requests.post(url, data=data, headers=HEADERS_JSON, auth=self.credentials)
+        response = http_client.post(url, data=data, headers=HEADERS_JSON, auth=self.credentials)
         if response.status_code != 200:
             raise RuntimeError(f"Create Release FAILED! Got status code: {response.status_code}")
 
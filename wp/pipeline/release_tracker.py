@@ -0,0 +1,141 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+from wp import config as conf
+from wp import deadline
+from wp import log
+from wp.pipeline import polling
+from wp.pipeline import release_pipeline_interaction as rpi
+from wp.pipeline import service_hooks
+
+DEFAULT_RELEASE_TIMEOUT = 3600
+TIMED_OUT = "timedOut"
+
+
+##
+# Waits for the completion of releases. All releases waited for (e.g. by parallel repositories)
+# are polled by a single background-thread with one request per project.
+class ReleaseTracker(object):
+    def __init__(self, timeout=None, poll_interval=None, max_poll_interval=None):
+        self.timeout = timeout if timeout is not None else \
+            getattr(conf, "release_timeout", DEFAULT_RELEASE_TIMEOUT)
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._results = {}
+        self._worker = None
+
+    def wait_for_release(self, project, release_id):
+        key = (project, release_id)
+        timeout = deadline.timeout(self.timeout)
+        expires = time.monotonic() + timeout
+        with self._condition:
+            self._pending[key] = None
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="release-tracker", daemon=True)
+                self._worker.start()
+
+            while key not in self._results:
+                remaining = expires - time.monotonic()
+                if remaining <= 0:
+                    log.warning(f"release {release_id} of project {project} did not finish within {timeout:.0f}s")
+                    self._pending.pop(key, None)
+                    deadline.check()
+                    return TIMED_OUT
+                self._condition.wait(remaining)
+
+            return self._results.pop(key)
+
+    def _run(self):
+        receiver = service_hooks.default_receiver()
+        subscription = None
+        poller = polling.AdaptivePoller(self.poll_interval, self.max_poll_interval)
+        if receiver is not None:
+            # every completed deployment triggers a poll of the pending releases
+            subscription = receiver.subscribe(service_hooks.RELEASE_TOPIC)
+            interval = service_hooks.fallback_poll_interval()
+            poller = polling.AdaptivePoller(interval, interval)
+
+        try:
+            self._poll_pending(poller, subscription)
+        finally:
+            if subscription is not None:
+                receiver.unsubscribe(subscription)
+
+    def _poll_pending(self, poller, subscription):
+        while True:
+            with self._condition:
+                if len(self._pending) == 0:
+                    self._worker = None
+                    return
+                projects = {}
+                for project, release_id in self._pending:
+                    projects.setdefault(project, []).append(release_id)
+
+            poller.wait(subscription)
+            states = {}
+            for project, release_ids in projects.items():
+                states.update(self._poll(project, release_ids))
+            poller.observe(sorted(states.items()))
+
+    def _poll(self, project, release_ids):
+        try:
+            releases = rpi.fetch_releases(project, release_ids)
+        except Exception as e:
+            log.exception(f"Unable to fetch status of releases {release_ids}: {e}")
+            releases = None
+        if releases is None:
+            return {}
+
+        states = {}
+        with self._condition:
+            for release_id, release in releases.items():
+                key = (project, release_id)
+                if key not in self._pending:
+                    continue
+                result = rpi.release_result(release)
+                states[key] = [e.get("status") for e in release.get("environments", [])]
+                if result is not None:
+                    log.info(f"release {release.get('name', release_id)} finished with result {result}")
+                    del self._pending[key]
+                    self._results[key] = result
+            self._condition.notify_all()
+
+        return states
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def default_tracker():
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = ReleaseTracker()
+
+        return _tracker
+
+
+def set_default_tracker(tracker):
+    global _tracker
+    with _tracker_lock:
+        _tracker = tracker
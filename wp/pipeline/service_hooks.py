@@ -0,0 +1,182 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from wp import config as conf
+from wp import log
+
+BUILD_TOPIC = "build"
+RELEASE_TOPIC = "release"
+BUILD_COMPLETE_EVENT = "build.complete"
+DEPLOYMENT_COMPLETED_EVENT = "ms.vss-release.deployment-completed-event"
+TOKEN_HEADER = "X-Hook-Token"
+DEFAULT_FALLBACK_POLL_INTERVAL = 300
+RECENT_EVENTS = 256
+
+
+class Subscription(object):
+    def __init__(self, topic, key=None):
+        self.topic = topic
+        self.key = key
+        self.payload = None
+        self._event = threading.Event()
+
+    def matches(self, topic, key):
+        return self.topic == topic and (self.key is None or self.key == key)
+
+    def notify(self, payload):
+        self.payload = payload
+        self._event.set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def clear(self):
+        self._event.clear()
+
+
+##
+# Receives the service-hooks of Azure DevOps (webhook-consumer, resource-version 5.1) and wakes up
+# everybody waiting for the completion of the build or release.
+# Events of builds nobody waits for (yet) are remembered for a while: fast builds may finish,
+# before the waiter subscribed.
+class ServiceHookReceiver(object):
+    def __init__(self, host="127.0.0.1", port=0, token=None):
+        self.token = token
+        self.received = 0
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        self._recent = collections.OrderedDict()
+        self._server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="service-hooks", daemon=True)
+        self._thread.start()
+        log.info(f"service-hook receiver listening on port {self.port}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def subscribe(self, topic, key=None):
+        subscription = Subscription(topic, key)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            if key is not None and (topic, key) in self._recent:
+                subscription.notify(self._recent[(topic, key)])
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def publish(self, topic, key, payload):
+        with self._lock:
+            self.received += 1
+            self._recent[(topic, key)] = payload
+            while len(self._recent) > RECENT_EVENTS:
+                self._recent.popitem(last=False)
+            for subscription in self._subscriptions:
+                if subscription.matches(topic, key):
+                    subscription.notify(payload)
+
+    ##
+    # Returns False for events, that are not understood
+    def dispatch(self, event):
+        event_type = event.get("eventType")
+        resource = event.get("resource") or {}
+        if event_type == BUILD_COMPLETE_EVENT and "id" in resource:
+            self.publish(BUILD_TOPIC, resource["id"], resource)
+            return True
+        if event_type == DEPLOYMENT_COMPLETED_EVENT:
+            environment = resource.get("environment") or {}
+            release_id = environment.get("releaseId")
+            if release_id is None:
+                release_id = ((resource.get("deployment") or {}).get("release") or {}).get("id")
+            self.publish(RELEASE_TOPIC, release_id, resource)
+            return True
+
+        return False
+
+
+def _handler_for(receiver):
+    class ServiceHookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if receiver.token is not None and self.headers.get(TOKEN_HEADER) != receiver.token:
+                self._respond(401)
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                event = json.loads(self.rfile.read(length))
+            except ValueError:
+                self._respond(400)
+                return
+
+            self._respond(200 if receiver.dispatch(event) else 202)
+
+        def _respond(self, status):
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return ServiceHookHandler
+
+
+_receiver = None
+_receiver_lock = threading.Lock()
+
+
+##
+# the receiver is only started, if a service_hook_port is configured; otherwise None
+def default_receiver():
+    global _receiver
+    with _receiver_lock:
+        port = getattr(conf, "service_hook_port", None)
+        if _receiver is None and port is not None:
+            host = getattr(conf, "service_hook_host", "0.0.0.0")
+            _receiver = ServiceHookReceiver(host, port, getattr(conf, "service_hook_token", None)).start()
+
+        return _receiver
+
+
+def set_default_receiver(receiver):
+    global _receiver
+    with _receiver_lock:
+        _receiver = receiver
+
+
+def fallback_poll_interval():
+    return getattr(conf, "service_hook_fallback_interval", DEFAULT_FALLBACK_POLL_INTERVAL)
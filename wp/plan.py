@@ -0,0 +1,167 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from packaging.version import parse
+from wp import config as conf
+from wp import history
+from wp import log
+from wp import repos
+from wp import storage
+from wp.git.repository_fetcher import RepositoryFetcher
+from wp.pipeline import pipeline_interaction as pipe
+from wp.project import fingerprint as fp
+from wp.project import image_graph
+from wp.project import repo_manifest
+from wp.project import upstream
+from wp.project import wp_plugins as plugins
+
+DEFAULT_MAX_PARALLEL_PLANS = 8
+PLAN_FILE = "update-plan.json"
+
+
+##
+# Dry-run of a whole run: determines for every repository, what a run would change, which pipelines it
+# would trigger and how long the builds take (going by the run-history or the recent builds).
+# Nothing is committed, pushed or triggered. The repositories are only fetched as tree (see
+# RepositoryFetcher.fetch_tree), the plugin-versions of all of them are checked with a single request.
+def plan_fleet(latest_version, repositories=None):
+    if repositories is None:
+        repositories = repos.to_check
+
+    manifests = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=getattr(conf, "max_parallel_plans", DEFAULT_MAX_PARALLEL_PLANS),
+                            thread_name_prefix="plan") as executor:
+        scans = {key: executor.submit(contextvars.copy_context().run, scan_repository, repo, key)
+                 for key, repo in repositories.items()}
+        for key, scan in scans.items():
+            try:
+                manifests[key] = scan.result()
+            except Exception as e:
+                log.error(f"Unable to scan repository {key}: {e}", repo=key)
+                errors[key] = str(e)
+
+        plugin_updates = latest_plugin_versions(manifests.values())
+        futures = {key: executor.submit(contextvars.copy_context().run, plan_repository, repositories[key], key,
+                                        manifest, latest_version, plugin_updates)
+                   for key, manifest in manifests.items()}
+        plans = {}
+        for key, future in futures.items():
+            try:
+                plans[key] = future.result()
+            except Exception as e:
+                log.error(f"Unable to plan repository {key}: {e}", repo=key)
+                errors[key] = str(e)
+
+    result = {key: plans[key] if key in plans else {"error": errors[key]} for key in repositories}
+    pending = [p for p in result.values() if p.get("update")]
+    return {
+        "latest_version": latest_version,
+        "repositories": result,
+        "pending": len(pending),
+        "errors": len(errors),
+        "estimated_build_seconds": sum(p["estimated_build_seconds"] or 0 for p in pending)
+    }
+
+
+def scan_repository(repo, key):
+    fetcher = RepositoryFetcher(repo["img-repo"], f"{key}_plan")
+    fetcher.fetch_tree()
+    return repo_manifest.scan_tree(fetcher.list_tree(), fetcher.read_blob, fetcher.target_path())
+
+
+##
+# key -> most recent version of all plugins, that have one. Asks for the lowest version in use of each
+# plugin, so the answer covers every repository
+def latest_plugin_versions(manifests):
+    lowest = {}
+    for manifest in manifests:
+        plugin_list = manifest.plugin_list or {"plugins": []}
+        for p in plugin_list["plugins"]:
+            if p["key"] not in lowest or plugins.is_lower_version(p["version"], lowest[p["key"]]):
+                lowest[p["key"]] = p["version"]
+
+    if len(lowest) == 0:
+        return {}
+
+    plugin_status = plugins.call_wp_api({"plugins": {key: {"Version": v} for key, v in sorted(lowest.items())}})
+    # without any update, the api answers with an empty list
+    return {key: value["new_version"] for key, value in (plugin_status["plugins"] or {}).items()}
+
+
+def plan_repository(repo, key, manifest, latest_version, plugin_updates):
+    wp = None
+    if manifest.image_version is not None and parse(manifest.image_version) < parse(latest_version):
+        wp = {"from": manifest.image_version, "to": latest_version}
+
+    graph = manifest.dependency_graph()
+    parent_images = [{"path": e.path, "line": e.line + 1, "from": e.old, "to": e.new}
+                     for e in image_graph.plan_version_updates(graph, upstream.WP_IMAGE_NAME, latest_version)]
+    refreshed_images = refreshed_parent_images(f"{key}_img", graph)
+
+    plugin_list = manifest.plugin_list or {"plugins": []}
+    plugin_changes = [{"key": p["key"], "from": p["version"], "to": plugin_updates[p["key"]]}
+                      for p in plugin_list["plugins"] if p["key"] in plugin_updates
+                      and plugins.is_lower_version(p["version"], plugin_updates[p["key"]])]
+
+    update = wp is not None or len(parent_images) > 0 or len(plugin_changes) > 0 or len(refreshed_images) > 0
+    pipelines = []
+    estimate = None
+    if update:
+        # an image with identical build-inputs would skip (or retag) the build - that can't be told without the update
+        pipelines = [{"type": "build", "project": repo["project"], "name": repo["build-img-pipeline"]},
+                     {"type": "release", "project": repo["project"], "name": repo["update-pipeline"]},
+                     {"type": "release", "project": repo["project"], "name": repo["rollout-pipeline"]}]
+        estimate = history.default_history().build_duration(repo["project"], repo["build-img-pipeline"])
+        if estimate is None:
+            estimate = pipe.Pipeline(repo["project"], repo["build-img-pipeline"]).estimate_build_duration()
+
+    log.info(f"plan for {key}", repo=key, update=update, wp=wp, parent_images=len(parent_images),
+             plugins=len(plugin_changes), refreshed=refreshed_images, estimated_build_seconds=estimate)
+    return {"update": update, "wp": wp, "parent_images": parent_images, "plugins": plugin_changes,
+            "refreshed_images": refreshed_images, "pipelines": pipelines, "estimated_build_seconds": estimate}
+
+
+##
+# like updater.check_parent_digests, but without recording the digests. The digests are stored by the
+# name of the clone of a run (see app.img_repo_fetcher)
+def refreshed_parent_images(clone_name, graph):
+    known = fp.ParentDigestStore().load(clone_name)
+    if len(known) == 0:
+        return []
+
+    digests = fp.resolve_parent_digests(graph)
+    return sorted(f"{ref}@{digest}" for ref, digest in digests.items()
+                  if digest is not None and known.get(ref) not in (None, digest))
+
+
+def plan_path():
+    return os.path.join(conf.workdir, PLAN_FILE)
+
+
+def write_plan(plan, path=None):
+    path = path or plan_path()
+    storage.write_atomic(path, json.dumps(plan, indent=2, sort_keys=True))
+
+    log.info(f"update-plan written to {path}: {plan['pending']} of {len(plan['repositories'])} repositories "
+             f"to update, {plan['errors']} errors, estimated build-time {plan['estimated_build_seconds']:.0f}s")
+    return path
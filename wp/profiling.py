@@ -0,0 +1,202 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from wp import config as conf
+from wp import log
+
+PROFILE_DIR = "profile"
+COLLAPSED_FILE = "stacks.collapsed"
+MEMORY_FILE = "memory.json"
+MAIN_STATS_FILE = "main.pstats"
+DEFAULT_SAMPLE_INTERVAL = 0.01
+# tracemalloc.reset_peak() is new in python 3.9 - before, a stage only knows the traced memory left at its end
+TRACED_PEAK = sys.version_info >= (3, 9)
+TRACED_KEY = "traced_peak" if TRACED_PEAK else "traced_growth"
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+##
+# Profiles a run without touching the profiled code:
+# - cProfile per stage (fetch, update ...), merged over all repositories, plus one for the main-thread
+# - a sampling profiler over all threads, written as collapsed stacks (flamegraph.pl, speedscope),
+#   the root of each stack is the stage its thread was in - so waits on the network show up as well
+# - per stage the traced (python-)memory peak (tracemalloc, see TRACED_KEY), how far the stage raised the
+#   peak RSS of the process (peak_rss_growth) and that peak at the end of the stage (process_peak_rss - it
+#   includes everything before the stage). Concurrent stages share both peaks, exact numbers need
+#   max_parallel_repos = 1
+class Profiler(object):
+    def __init__(self, directory, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._main = None
+        self._stats = {}
+        self._memory = {}
+        self._stacks = collections.Counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._started_tracemalloc = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+        self._sampler.start()
+        self._main = self._enable(cProfile.Profile())
+
+    def stop(self):
+        if self._main is not None:
+            self._main.disable()
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        thread_id = threading.get_ident()
+        with self._lock:
+            outer_stage = self._stages.get(thread_id)
+            self._stages[thread_id] = name
+        traced_at_start = tracemalloc.get_traced_memory()[0]
+        if TRACED_PEAK:
+            tracemalloc.reset_peak()
+        rss_at_start = max_rss()
+        # the main-thread is profiled as a whole already
+        profile = self._enable(cProfile.Profile()) if threading.current_thread() is not threading.main_thread() \
+            else None
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            current, peak = tracemalloc.get_traced_memory()
+            self._record(name, profile, time.monotonic() - start,
+                         (peak if TRACED_PEAK else current) - traced_at_start, max_rss() - rss_at_start)
+            with self._lock:
+                self._stages[thread_id] = outer_stage
+
+    ##
+    # only one profiler can be active per thread (with python >= 3.12 per process): the stage is
+    # still sampled, but without its own cProfile-stats then
+    @staticmethod
+    def _enable(profile):
+        try:
+            profile.enable()
+            return profile
+        except ValueError:
+            return None
+
+    def _record(self, name, profile, duration, traced, rss_growth):
+        with self._lock:
+            if profile is not None:
+                stats = pstats.Stats(profile)
+                if name in self._stats:
+                    self._stats[name].add(stats)
+                else:
+                    self._stats[name] = stats
+            memory = self._memory.setdefault(name, {"count": 0, "duration": 0.0, TRACED_KEY: 0, "peak_rss_growth": 0,
+                                                    "process_peak_rss": 0})
+            memory["count"] += 1
+            memory["duration"] += duration
+            memory[TRACED_KEY] = max(memory[TRACED_KEY], traced)
+            memory["peak_rss_growth"] = max(memory["peak_rss_growth"], rss_growth)
+            memory["process_peak_rss"] = max(memory["process_peak_rss"], max_rss())
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                with self._lock:
+                    root = self._stages.get(thread_id) or names.get(thread_id, "unknown")
+                    self._stacks[";".join([root] + stack[::-1])] += 1
+
+    def write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            for name, stats in self._stats.items():
+                stats.dump_stats(os.path.join(self.directory, f"stage-{name}.pstats"))
+            if self._main is not None:
+                pstats.Stats(self._main).dump_stats(os.path.join(self.directory, MAIN_STATS_FILE))
+            with open(os.path.join(self.directory, COLLAPSED_FILE), 'w') as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in sorted(self._stacks.items()))
+            with open(os.path.join(self.directory, MEMORY_FILE), 'w') as f:
+                f.write(json.dumps(self._memory, indent=2))
+        log.info("wrote profile", directory=self.directory)
+
+
+##
+# peak resident set size of the process (since its start) in bytes
+def max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def profile_dir():
+    return os.path.join(conf.workdir, PROFILE_DIR)
+
+
+def start(directory=None):
+    global _profiler
+    with _profiler_lock:
+        _profiler = Profiler(directory if directory is not None else profile_dir())
+        _profiler.start()
+        return _profiler
+
+
+def stop():
+    global _profiler
+    with _profiler_lock:
+        profiler = _profiler
+        _profiler = None
+    if profiler is not None:
+        profiler.stop()
+        profiler.write()
+
+
+def active():
+    return _profiler
+
+
+def stage(name):
+    profiler = _profiler
+    return profiler.stage(name) if profiler is not None else contextlib.nullcontext()
@@ -18,18 +18,40 @@
 
 import json
 import re
-import requests
+import threading
+import time
 from packaging.version import parse
+from wp import config as conf
+from wp import http_client
+from wp import log
+
+DEFAULT_TAG_INDEX_TTL = 900
+DOCKER_HUB_URL = "https://hub.docker.com/"
+
+# every tag fetched, by (image_name, tag-name) -> (time of the lookup, tag-details).
+# the details contain the digest, which changes when the tag is republished - so entries expire
+# for long running processes. Repo-workers share the index of the parent (see share_tag_index)
+_tag_index = {}
+_tag_index_lock = threading.Lock()
+# (image_name, tag-name) -> lock of its lookup
+_tag_lookups = {}
+# the lock of all lookups, if the index is shared with other processes
+_shared_lookup_lock = None
 
 
 def fetch_tags(image_name):
     url = _build_request_uri(image_name)
-    return _fetch_tags(url)
+    tags = _fetch_tags(url)
+    now = time.monotonic()
+    with _tag_index_lock:
+        _tag_index.update({(image_name, t["name"]): (now, t) for t in tags})
+
+    return tags
 
 
 def _fetch_tags(url):
-    print(f"request to: {url}")
-    response = requests.get(url)
+    log.debug("request to docker hub", url=url)
+    response = http_client.get(url)
 
     if response.status_code != 200:
         raise RuntimeError(f"Request to '{url}' failed! Got status code: {response.status_code}")
@@ -42,15 +64,101 @@ def _fetch_tags(url):
     return tag_list
 
 
-def _build_request_uri(image_name):
-    path = image_name
+def fetch_tag(image_name, tag):
+    url = _build_tag_uri(image_name, tag)
+    log.debug("request to docker hub", url=url)
+    response = http_client.get(url)
+
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise RuntimeError(f"Request to '{url}' failed! Got status code: {response.status_code}")
+
+    return json.loads(response.text)
+
+
+##
+# repositories sharing a parent-image look it up at the same time: the first one requests the tag,
+# the others wait for it and take it from the index
+def lookup_tag(image_name, tag):
+    key = (image_name, tag)
+    with _tag_index_lock:
+        lookup_lock = _shared_lookup_lock or _tag_lookups.setdefault(key, threading.Lock())
+
+    with lookup_lock:
+        now = time.monotonic()
+        with _tag_index_lock:
+            entry = _tag_index.get(key)
+            if entry is not None and now - entry[0] < getattr(conf, "tag_index_ttl", DEFAULT_TAG_INDEX_TTL):
+                return entry[1]
+
+        details = fetch_tag(image_name, tag)
+        with _tag_index_lock:
+            _tag_index[key] = (now, details)
+
+    return details
+
+
+def tag_index():
+    with _tag_index_lock:
+        return dict(_tag_index)
+
+
+##
+# index and lookup_lock (e.g. a dict and a lock of a multiprocessing-manager) replace the index of the
+# process, so processes sharing them request every tag only once
+def share_tag_index(index, lookup_lock):
+    global _tag_index, _shared_lookup_lock
+    with _tag_index_lock:
+        _tag_index = index
+        _shared_lookup_lock = lookup_lock
+
+
+##
+# starts over with an empty index of the own process
+def clear_tag_index():
+    global _tag_index, _shared_lookup_lock
+    with _tag_index_lock:
+        _tag_index = {}
+        _shared_lookup_lock = None
+        _tag_lookups.clear()
+
+
+def tag_digest(tag_details, architecture="amd64"):
+    if tag_details is None:
+        return None
+    if tag_details.get("digest") is not None:
+        return tag_details["digest"]
+
+    for image in tag_details.get("images", []):
+        if image.get("architecture") == architecture:
+            return image.get("digest")
+
+    return None
+
+
+def _repository_path(image_name):
     if "/" not in image_name:
-        path = "library/" + image_name
+        return "library/" + image_name
+
+    return image_name
+
+
+def _build_tag_uri(image_name, tag):
+    return f"{docker_hub_url()}v2/repositories/{_repository_path(image_name)}/tags/{tag}"
+
+
+def _build_request_uri(image_name):
+    path = _repository_path(image_name)
 
     # only fetches the latest 100 tags! default seems to be 10
     # 100 is the maximum for parameter page_size
     # in order to fetch more tags, its necessary to do multiple requests with the parameter "page"
-    return f"https://hub.docker.com/v2/repositories/{path}/tags?page_size=100"
+    return f"{docker_hub_url()}v2/repositories/{path}/tags?page_size=100"
+
+
+def docker_hub_url():
+    return getattr(conf, "docker_hub_url", None) or DOCKER_HUB_URL
 
 
 def filter_tags(tags, name_filter):
@@ -67,7 +175,8 @@ def determine_highest_version(tags):
     highest_version = None
     highest_version_name = None
     for t in tags:
-        current_version = parse(t["name"])
+        # strip variant-suffixes like "-apache", which are no valid PEP 440 versions
+        current_version = parse(t["name"].split("-")[0])
         if highest_version is None or highest_version < current_version:
             highest_version = current_version
             highest_version_name = t["name"]
@@ -79,8 +188,17 @@ def determine_highest_version(tags):
 # if patch-version is "0", it's not reflected in the download-links!
 # so we have to remove it.
 def filter_version_name(original_version):
-    match = re.search(r"([0-9]\.[0-9])\.0", original_version)
+    match = re.match(r"^([0-9]+\.[0-9]+)\.0$", original_version)
     if match is not None:
         return match.group(1)
 
     return original_version
+
+
+##
+# counterpart of filter_version_name: docker-tags always contain the patch-version
+def docker_version_name(version_name):
+    if re.match(r"^[0-9]+\.[0-9]+$", version_name) is not None:
+        return version_name + ".0"
+
+    return version_name
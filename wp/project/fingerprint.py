@@ -0,0 +1,101 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+import hashlib
+import json
+from wp import storage
+from wp.project import docker_hub as dh
+from wp.project import repo_manifest
+
+INDEX_FILE = "build-fingerprints.json"
+PARENT_DIGESTS_FILE = "parent-digests.json"
+# these only describe how and where the image is built, not what ends up in it
+EXCLUDED_FILES = {repo_manifest.PIPELINE_FILE, repo_manifest.PIPELINE_TEMPLATE}
+
+
+def is_docker_hub_image(image):
+    first = image.name.split("/")[0]
+    return "/" not in image.name or not ("." in first or ":" in first or first == "localhost")
+
+
+##
+# digest of every external parent-image. Mutable tags of other registries can't be resolved,
+# their digest stays None - which makes the whole fingerprint unusable.
+def resolve_parent_digests(graph):
+    digests = {}
+    for image in graph.external_images():
+        if image.digest is not None:
+            digests[str(image)] = image.digest
+        elif is_docker_hub_image(image):
+            digests[str(image)] = dh.tag_digest(dh.lookup_tag(image.short_name, image.tag or "latest"))
+        else:
+            digests[str(image)] = None
+
+    return digests
+
+
+def compute(blobs, wp_version, parent_digests):
+    if len(parent_digests) == 0 or None in parent_digests.values():
+        return None
+
+    inputs = {
+        "files": {path: sha for path, sha in blobs.items() if path not in EXCLUDED_FILES},
+        "wp_version": wp_version,
+        "parents": parent_digests
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("UTF-8")).hexdigest()
+
+
+class FingerprintIndex(object):
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else storage.JsonStore(storage.state_path(INDEX_FILE))
+
+    def lookup(self, fingerprint):
+        if fingerprint is None:
+            return None
+
+        return self.store.get(fingerprint)
+
+    def record(self, fingerprint, project, pipeline, build_id):
+        if fingerprint is None:
+            return
+
+        self.store.put(fingerprint, {
+            "project": project,
+            "pipeline": pipeline,
+            "build_id": build_id,
+            "recorded": datetime.datetime.now().isoformat(timespec="seconds")
+        })
+
+
+##
+# digests of the parent-images, the last image of each repo was built with
+class ParentDigestStore(object):
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else storage.JsonStore(storage.state_path(PARENT_DIGESTS_FILE))
+
+    def load(self, repo_key):
+        return self.store.get(repo_key, {})
+
+    def save(self, repo_key, digests):
+        resolved = {ref: digest for ref, digest in digests.items() if digest is not None}
+        if len(resolved) > 0:
+            self.store.put(repo_key, resolved)
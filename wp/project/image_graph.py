@@ -0,0 +1,235 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+from packaging.version import parse
+from wp.project import docker_hub as dh
+
+FROM_LINE_PATTERN = re.compile(r"^\s*FROM\s+(?:--platform=\S+\s+)?(\S+)(?:\s+AS\s+(\S+))?\s*$", re.IGNORECASE)
+ARG_LINE_PATTERN = re.compile(r"^\s*ARG\s+([A-Za-z_][A-Za-z0-9_]*)(?:=(\S*))?\s*$", re.IGNORECASE)
+ARG_REF_PATTERN = re.compile(r"\$\{([A-Za-z_][A-Za-z0-9_]*)(?::-([^}]*))?\}|\$([A-Za-z_][A-Za-z0-9_]*)")
+VERSION_TAG_PATTERN = re.compile(r"^([0-9]+\.[0-9]+(?:\.[0-9]+)?)(-.*)?$")
+DEFAULT_REGISTRY_PREFIXES = ("docker.io/library/", "docker.io/", "library/")
+
+
+##
+# extracts all global ARGs (the ones before the first FROM, which may be used in FROM-lines)
+# and every FROM-line (build-stage) of a Dockerfile
+def parse_dockerfile(lines):
+    args = {}
+    stages = []
+    for index, line in enumerate(lines):
+        match = FROM_LINE_PATTERN.match(line)
+        if match is not None:
+            stages.append({"line": index, "source": match.group(1), "alias": match.group(2)})
+            continue
+
+        match = ARG_LINE_PATTERN.match(line)
+        if match is not None and len(stages) == 0:
+            raw = match.group(2)
+            default = raw.strip("\"'") if raw is not None else None
+            args[match.group(1)] = {"line": index, "default": default, "raw": raw}
+
+    return {"args": args, "stages": stages}
+
+
+def substitute_args(value, args):
+    def _replace(match):
+        name = match.group(1) or match.group(3)
+        if args.get(name) is not None:
+            return args[name]
+        if match.group(2) is not None:
+            return match.group(2)
+
+        return match.group(0)
+
+    return ARG_REF_PATTERN.sub(_replace, value)
+
+
+class ImageRef(object):
+
+    def __init__(self, name, tag=None, digest=None):
+        self.name = name
+        self.tag = tag
+        self.digest = digest
+
+    @staticmethod
+    def parse(reference):
+        name, digest = reference, None
+        if "@" in name:
+            name, digest = name.split("@", 1)
+
+        tag = None
+        if ":" in name.rsplit("/", 1)[-1]:
+            name, tag = name.rsplit(":", 1)
+
+        return ImageRef(name, tag, digest)
+
+    @property
+    def short_name(self):
+        for prefix in DEFAULT_REGISTRY_PREFIXES:
+            if self.name.startswith(prefix):
+                return self.name[len(prefix):]
+
+        return self.name
+
+    def __eq__(self, other):
+        return isinstance(other, ImageRef) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __str__(self):
+        reference = self.name
+        if self.tag is not None:
+            reference += f":{self.tag}"
+        if self.digest is not None:
+            reference += f"@{self.digest}"
+
+        return reference
+
+    def __repr__(self):
+        return f"ImageRef({self})"
+
+
+class Stage(object):
+
+    def __init__(self, dockerfile, index, line, source, alias):
+        self.dockerfile = dockerfile
+        self.index = index
+        self.line = line
+        self.source = source
+        self.alias = alias
+        self.resolved = source
+        self.image = None
+        self.parent = None
+
+    @property
+    def is_templated(self):
+        return "$" in self.source
+
+    def __repr__(self):
+        target = self.parent.alias if self.parent is not None else self.image
+        return f"Stage({self.dockerfile}#{self.index} {self.alias or ''} <- {target})"
+
+
+##
+# build-stages of all Dockerfiles of a repository:
+# edges either point to a previous stage of the same Dockerfile (multi-stage build)
+# or to an external image
+class DependencyGraph(object):
+
+    def __init__(self, dockerfiles, build_args=None):
+        self.dockerfiles = dockerfiles
+        self.build_args = build_args if build_args is not None else {}
+        self.stages = []
+        for path in sorted(dockerfiles.keys()):
+            self._add_dockerfile(path, dockerfiles[path])
+
+    def _add_dockerfile(self, path, parsed):
+        args = {name: arg["default"] for name, arg in parsed["args"].items()}
+        args.update({name: value for name, value in self.build_args.items() if name in parsed["args"]})
+        aliases = {}
+
+        for index, raw_stage in enumerate(parsed["stages"]):
+            stage = Stage(path, index, raw_stage["line"], raw_stage["source"], raw_stage["alias"])
+            stage.resolved = substitute_args(stage.source, args)
+            if stage.resolved.lower() in aliases:
+                stage.parent = aliases[stage.resolved.lower()]
+            elif stage.resolved != "scratch":
+                stage.image = ImageRef.parse(stage.resolved)
+            if stage.alias is not None:
+                aliases[stage.alias.lower()] = stage
+            self.stages.append(stage)
+
+    def external_images(self):
+        return sorted({s.image for s in self.stages if s.image is not None}, key=str)
+
+    def stages_for_image(self, image_name):
+        return [s for s in self.stages if s.image is not None and s.image.short_name == image_name]
+
+    def dependants(self, stage):
+        return [s for s in self.stages if s.parent is stage]
+
+
+class LineEdit(object):
+
+    def __init__(self, path, line, old, new):
+        self.path = path
+        self.line = line
+        self.old = old
+        self.new = new
+
+    def __eq__(self, other):
+        return isinstance(other, LineEdit) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return f"LineEdit({self.path}:{self.line + 1} '{self.old}' -> '{self.new}')"
+
+
+def _outdated_tag(tag, latest_version):
+    match = VERSION_TAG_PATTERN.match(tag or "")
+    if match is None or parse(match.group(1)) >= parse(latest_version):
+        return None
+
+    return dh.docker_version_name(latest_version) + (match.group(2) or "")
+
+
+##
+# determines the edits required to move all stages based on "image_name" to "latest_version".
+# literal tags are changed in the FROM-line, ARG-templated tags in the default of the global ARG.
+# ARGs passed in by the pipeline are left alone, they are updated through the pipeline-template.
+def plan_version_updates(graph, image_name, latest_version):
+    edits = []
+    for stage in graph.stages_for_image(image_name):
+        new_tag = _outdated_tag(stage.image.tag, latest_version)
+        if new_tag is None:
+            continue
+
+        if not stage.is_templated:
+            new_source = str(ImageRef(stage.image.name, new_tag, None))
+            edits.append(LineEdit(stage.dockerfile, stage.line, stage.source, new_source))
+            continue
+
+        edit = _plan_arg_update(graph, stage, latest_version)
+        if edit is not None and edit not in edits:
+            edits.append(edit)
+
+    return edits
+
+
+def _plan_arg_update(graph, stage, latest_version):
+    # the version is the start of the tag, so the ARG has to be referenced right there
+    raw_tag = ImageRef.parse(stage.source).tag or ""
+    match = ARG_REF_PATTERN.match(raw_tag)
+    if match is None:
+        return None
+    name = match.group(1) or match.group(3)
+    if name in graph.build_args:
+        return None
+
+    arg = graph.dockerfiles[stage.dockerfile]["args"].get(name)
+    if arg is None or arg["default"] is None or VERSION_TAG_PATTERN.match(arg["default"]) is None:
+        return None
+
+    new_default = _outdated_tag(arg["default"], latest_version)
+    if new_default is None:
+        return None
+
+    quote = arg["raw"][0] if arg["raw"][0] in "\"'" else ""
+    return LineEdit(stage.dockerfile, arg["line"], f"{name}={arg['raw']}", f"{name}={quote}{new_default}{quote}")
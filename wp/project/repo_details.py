@@ -16,50 +16,61 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from pathlib import Path
-import re
+from wp import log
+from wp.project import repo_manifest
 
 
 class RepoDetails(object):
-    DEFAULT_IMAGE_VERSION = "latest"
+    DEFAULT_IMAGE_VERSION = repo_manifest.DEFAULT_IMAGE_VERSION
 
     def __init__(self, repo):
         self.repo = repo
 
+    ##
+    # manifest is the repo_manifest.scan of repo_path, scanned if not passed in
     @staticmethod
-    def determine_imageversion(repo_path):
-        print(f"Looking for azure-pipelines.yml in: {repo_path}")
-        az_pipeline_file = Path(repo_path, "azure-pipelines.yml")
-        if not az_pipeline_file.is_file():
-            print("Repo does not contain azure-pipelines.yml")
+    def determine_imageversion(repo_path, manifest=None):
+        log.debug("Looking for azure-pipelines.yml", path=repo_path)
+        if manifest is None:
+            manifest = repo_manifest.scan(repo_path)
+        if not manifest.has_file(repo_manifest.PIPELINE_FILE):
+            log.warning("Repo does not contain azure-pipelines.yml")
             return RepoDetails.DEFAULT_IMAGE_VERSION
 
-        with open(az_pipeline_file, 'r') as f:
-            return RepoDetails.grep_imageversion(f.readlines(), RepoDetails.DEFAULT_IMAGE_VERSION)
+        if manifest.image_version is None:
+            log.warning("No matching version-line azure-pipelines.yml")
+            return RepoDetails.DEFAULT_IMAGE_VERSION
+
+        return manifest.image_version
 
     @staticmethod
     def grep_imageversion(lines, default):
-        for line in lines:
-            match = re.search(r"[vV]ersion.*:\s*([\"'])?([^\"']*)([\"'])?", line)
-            if match is not None:
-                return match.group(2).rstrip()
+        version = repo_manifest.grep_imageversion(lines)
+        if version is None:
+            log.warning("No matching version-line azure-pipelines.yml")
+            return default
 
-        print("No matching version-line azure-pipelines.yml")
-        return default
+        return version
 
     @staticmethod
-    def determine_parent_image(repo_path):
-        dockerfiles = list(Path(repo_path).rglob("Dockerfile"))
-        print(f"Found Dockerfile(s): {dockerfiles}")
+    def determine_parent_image(repo_path, manifest=None):
+        if manifest is None:
+            manifest = repo_manifest.scan(repo_path)
+        dockerfiles = manifest.dockerfiles
+        log.debug("Found Dockerfile(s)", dockerfiles=dockerfiles)
+        if len(dockerfiles) == 0:
+            raise RuntimeError(f"Repo {repo_path} does not contain a Dockerfile!")
+
+        parents = manifest.parent_images[dockerfiles[0]]
+        if len(parents) == 0:
+            raise RuntimeError("File does not contain expected pattern for parent Docker-Image!")
 
-        with open(dockerfiles[0], 'r') as f:
-            return RepoDetails.grep_parent(f.readlines())
+        return parents[0]
 
     @staticmethod
     def grep_parent(lines):
-        for line in lines:
-            match = re.search(r"[fF][rR][oO][mM]\s*(.*)", line)
-            if match is not None:
-                return match.group(1)
+        parents = repo_manifest.grep_parents(lines)
+        if len(parents) == 0:
+            raise RuntimeError("File does not contain expected pattern for parent Docker-Image!")
 
-        raise RuntimeError("File does not contain expected pattern for parent Docker-Image!")
+        return parents[0]
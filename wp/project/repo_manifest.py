@@ -0,0 +1,335 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+from wp import log
+from wp import storage
+from wp.git import repository_pusher as repush
+from wp.project import image_graph
+
+PIPELINE_FILE = "azure-pipelines.yml"
+PIPELINE_TEMPLATE = "azure-pipelines.yml.template"
+PLUGIN_LIST = "init/plugin-list.json"
+DOCKERFILE = "Dockerfile"
+DEFAULT_IMAGE_VERSION = "latest"
+CACHE_DIR = "manifest-cache"
+# bump, whenever the structure of parsed values changes
+CACHE_FORMAT = 2
+
+# directories that never contain build-relevant manifests, but may contain thousands of files
+IGNORED_DIRS = {".git", ".svn", ".idea", "wp-content", "node_modules", "vendor", "__pycache__"}
+MAX_DEPTH = 4
+
+VERSION_PATTERN = re.compile(r"[vV]ersion.*:\s*([\"'])?([^\"']*)([\"'])?")
+FROM_PATTERN = re.compile(r"[fF][rR][oO][mM]\s*(.*)")
+VARIABLES_PATTERN = re.compile(r"^variables:\s*$")
+VARIABLE_PATTERN = re.compile(r"^\s+([A-Za-z_][A-Za-z0-9_.]*):\s*([\"'])?([^\"'#]*?)([\"'])?\s*$")
+VARIABLE_REF_PATTERN = re.compile(r"\$\(([A-Za-z_][A-Za-z0-9_.]*)\)")
+BUILD_ARG_PATTERN = re.compile(r"--build-arg\s+([A-Za-z_][A-Za-z0-9_]*)=(\"[^\"]*\"|'[^']*'|[^\s'\"]+)")
+
+
+def blob_sha(content):
+    # same as "git hash-object", so the key is identical to the SHA of the blob in the repository
+    header = f"blob {len(content)}\0".encode("UTF-8")
+    return hashlib.sha1(header + content).hexdigest()
+
+
+def grep_imageversion(lines):
+    for line in lines:
+        match = VERSION_PATTERN.search(line)
+        if match is not None:
+            return match.group(2).rstrip()
+
+    return None
+
+
+def grep_parents(lines):
+    parents = []
+    for line in lines:
+        match = FROM_PATTERN.search(line)
+        if match is not None:
+            parents.append(match.group(1))
+
+    return parents
+
+
+##
+# build-args passed to docker by the pipeline, with pipeline-variables "$(name)" resolved
+def grep_build_args(lines):
+    variables = {}
+    build_args = {}
+    in_variables = False
+    for line in lines:
+        if VARIABLES_PATTERN.match(line) is not None:
+            in_variables = True
+            continue
+        if in_variables and line.strip() != "" and not line[0].isspace() and not line.startswith("#"):
+            in_variables = False
+
+        match = VARIABLE_PATTERN.match(line) if in_variables else None
+        if match is not None:
+            variables[match.group(1)] = match.group(3)
+        for match in BUILD_ARG_PATTERN.finditer(line):
+            build_args[match.group(1)] = match.group(2).strip("\"'")
+
+    return {name: VARIABLE_REF_PATTERN.sub(lambda m: variables.get(m.group(1), m.group(0)), value)
+            for name, value in build_args.items()}
+
+
+def _parse_pipeline(content):
+    lines = content.decode("UTF-8").splitlines()
+    return {"version": grep_imageversion(lines), "build_args": grep_build_args(lines)}
+
+
+def _parse_dockerfile(content):
+    return image_graph.parse_dockerfile(content.decode("UTF-8").splitlines())
+
+
+def _parse_plugin_list(content):
+    return json.loads(content.decode("UTF-8"))
+
+
+PARSERS = {
+    "pipeline": _parse_pipeline,
+    "dockerfile": _parse_dockerfile,
+    "plugin-list": _parse_plugin_list
+}
+
+
+class BlobCache(object):
+    _MISSING = object()
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind, sha):
+        key = (kind, sha)
+        with self._lock:
+            value = self._entries.get(key, BlobCache._MISSING)
+        if value is BlobCache._MISSING:
+            value = self._read(kind, sha)
+        if value is BlobCache._MISSING:
+            self.misses += 1
+            return value
+
+        self.hits += 1
+        with self._lock:
+            self._entries[key] = value
+        return value
+
+    def put(self, kind, sha, value):
+        with self._lock:
+            self._entries[(kind, sha)] = value
+        self._write(kind, sha, value)
+
+    def _path(self, kind, sha):
+        return os.path.join(self.cache_dir, f"v{CACHE_FORMAT}", kind, sha[:2], sha + ".json")
+
+    def _read(self, kind, sha):
+        if self.cache_dir is None:
+            return BlobCache._MISSING
+        try:
+            with open(self._path(kind, sha), 'r') as f:
+                return json.loads(f.read())["value"]
+        except (OSError, ValueError, KeyError):
+            return BlobCache._MISSING
+
+    def _write(self, kind, sha, value):
+        if self.cache_dir is None:
+            return
+        try:
+            storage.write_atomic(self._path(kind, sha), json.dumps({"value": value}))
+        except OSError as e:
+            log.warning(f"unable to persist manifest-cache entry {kind}/{sha}: {e}")
+
+
+_default_cache = None
+
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = BlobCache(storage.state_path(CACHE_DIR))
+
+    return _default_cache
+
+
+def set_default_cache(cache):
+    global _default_cache
+    _default_cache = cache
+
+
+class RepoManifest(object):
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.files = {}
+        self.image_version = None
+        self.build_args = {}
+        self.dockerfile_details = {}
+        self.plugin_list = None
+        # rel_path -> error, for files that could not be parsed
+        self.errors = {}
+        # path -> blob-SHA of every file in the index, None if the repo is no git-repository
+        self.blobs = None
+
+    @property
+    def dockerfiles(self):
+        return sorted(self.dockerfile_details.keys())
+
+    @property
+    def parent_images(self):
+        return {path: [stage["source"] for stage in details["stages"]]
+                for path, details in self.dockerfile_details.items()}
+
+    def dependency_graph(self):
+        return image_graph.DependencyGraph(self.dockerfile_details, self.build_args)
+
+    def has_file(self, rel_path):
+        return rel_path in self.files
+
+    def __repr__(self):
+        return f"RepoManifest({self.repo_path}, files={sorted(self.files.keys())})"
+
+
+def discover(repo_path):
+    root_depth = os.path.normpath(repo_path).count(os.sep)
+    for dir_path, dir_names, file_names in os.walk(repo_path):
+        depth = os.path.normpath(dir_path).count(os.sep) - root_depth
+        # prune in-place, so os.walk never descends into ignored or too deep directories
+        dir_names[:] = sorted(d for d in dir_names if d not in IGNORED_DIRS and depth < MAX_DEPTH)
+        rel_dir = os.path.relpath(dir_path, repo_path)
+
+        for file_name in sorted(file_names):
+            rel_path = file_name if rel_dir == "." else os.path.join(rel_dir, file_name)
+            kind = _kind_of(rel_path, file_name)
+            if kind is not None:
+                yield rel_path, kind
+
+
+##
+# the same selection as discover, for the paths of a git-tree
+def discoverable(rel_path):
+    directories = rel_path.split("/")[:-1]
+    return len(directories) <= MAX_DEPTH and not any(d in IGNORED_DIRS for d in directories)
+
+
+def _kind_of(rel_path, file_name):
+    if file_name == DOCKERFILE:
+        return "dockerfile"
+    if rel_path == PIPELINE_FILE:
+        return "pipeline"
+    if rel_path == PIPELINE_TEMPLATE:
+        return "template"
+    if rel_path == PLUGIN_LIST:
+        return "plugin-list"
+
+    return None
+
+
+##
+# the blob-SHAs are taken from the index (after staging all changes), so only files missing in the cache are read.
+# Files outside of the index (ignored ones or no git-repository at all) are hashed instead.
+# A scan reflects the repo at the time of the scan, so rescan after writing to the repo
+def scan(repo_path, cache=None):
+    if cache is None:
+        cache = default_cache()
+
+    manifest = RepoManifest(repo_path)
+    manifest.blobs = index_blobs(repo_path)
+    for rel_path, kind in discover(repo_path):
+        content = None
+        sha = manifest.blobs.get(rel_path) if manifest.blobs is not None else None
+        if sha is None:
+            content = _read(repo_path, rel_path)
+            sha = blob_sha(content)
+        manifest.files[rel_path] = sha
+
+        if kind in PARSERS:
+            _parse(manifest, cache, rel_path, kind, sha,
+                   lambda: content if content is not None else _read(repo_path, rel_path))
+
+    return manifest
+
+
+def index_blobs(repo_path):
+    if not os.path.isdir(os.path.join(repo_path, ".git")):
+        return None
+
+    return repush.RepositoryPusher(repo_path).staged_blobs()
+
+
+def _read(repo_path, rel_path):
+    with open(os.path.join(repo_path, rel_path), 'rb') as f:
+        return f.read()
+
+
+##
+# like scan, but for a git-tree without checkout (e.g. of a partial clone): the blob-SHAs are taken from
+# tree_entries (path -> SHA, see "git ls-tree"), read_blob(sha) is only called for blobs not cached yet
+def scan_tree(tree_entries, read_blob, repo_path=None, cache=None):
+    if cache is None:
+        cache = default_cache()
+
+    manifest = RepoManifest(repo_path)
+    for rel_path, sha in sorted(tree_entries.items()):
+        kind = _kind_of(rel_path, os.path.basename(rel_path)) if discoverable(rel_path) else None
+        if kind is None:
+            continue
+        manifest.files[rel_path] = sha
+
+        if kind in PARSERS:
+            _parse(manifest, cache, rel_path, kind, sha, lambda: read_blob(sha))
+
+    return manifest
+
+
+##
+# a file that can't be parsed is recorded in manifest.errors, so e.g. a broken plugin-list
+# fails the plugin-check only and not the lookup of the image-version
+def _parse(manifest, cache, rel_path, kind, sha, read_content):
+    value = cache.get(kind, sha)
+    if value is BlobCache._MISSING:
+        try:
+            value = PARSERS[kind](read_content())
+        except ValueError as e:
+            log.warning(f"unable to parse {rel_path}: {e}", path=manifest.repo_path)
+            manifest.errors[rel_path] = str(e)
+            return
+        cache.put(kind, sha, value)
+    _apply(manifest, rel_path, kind, value)
+
+
+def _apply(manifest, rel_path, kind, value):
+    # cached values are shared between manifests, so hand out copies only
+    if kind == "pipeline":
+        manifest.image_version = value["version"]
+        manifest.build_args = dict(value["build_args"])
+    elif kind == "dockerfile":
+        manifest.dockerfile_details[rel_path] = copy.deepcopy(value)
+    elif kind == "plugin-list":
+        manifest.plugin_list = copy.deepcopy(value)
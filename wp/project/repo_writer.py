@@ -16,7 +16,81 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from jinja2 import Environment, FileSystemLoader
+import hashlib
+import os
+import threading
+from wp import log
+from wp import storage
+
+TEMPLATE_FILE = "azure-pipelines.yml.template"
+PIPELINE_FILE = "azure-pipelines.yml"
+BYTECODE_CACHE_DIR = "jinja-cache"
+
+
+##
+# templates are registered under the hash of their content,
+# so all repos carrying an identical template share one compiled template.
+# jinja2 is only imported, once the first template is rendered
+class TemplateEngine(object):
+
+    def __init__(self, bytecode_cache_dir=None):
+        from jinja2 import Environment, FunctionLoader
+        self._sources = {}
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.env = Environment(loader=FunctionLoader(self._sources.get), keep_trailing_newline=True,
+                               bytecode_cache=self._create_bytecode_cache(bytecode_cache_dir))
+
+    @staticmethod
+    def _create_bytecode_cache(bytecode_cache_dir):
+        if bytecode_cache_dir is None:
+            return None
+        try:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+        except OSError as e:
+            log.warning(f"unable to use jinja bytecode-cache {bytecode_cache_dir}: {e}")
+            return None
+
+        from jinja2 import FileSystemBytecodeCache
+        return FileSystemBytecodeCache(bytecode_cache_dir)
+
+    @staticmethod
+    def content_hash(source):
+        return hashlib.sha256(source.encode("UTF-8")).hexdigest()
+
+    def get_template(self, source):
+        key = TemplateEngine.content_hash(source)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                self._sources[key] = source
+                template = self.env.get_template(key)
+                self._templates[key] = template
+
+        return template
+
+    def render_file(self, template_path, target_path, **variables):
+        with open(template_path, 'r') as f:
+            source = f.read()
+
+        data = self.get_template(source).render(**variables)
+        storage.write_atomic(target_path, data)
+
+
+_engine = None
+
+
+def template_engine():
+    global _engine
+    if _engine is None:
+        _engine = TemplateEngine(storage.state_path(BYTECODE_CACHE_DIR))
+
+    return _engine
+
+
+def set_template_engine(engine):
+    global _engine
+    _engine = engine
 
 
 class RepoWriter(object):
@@ -25,9 +99,22 @@ class RepoWriter(object):
         self.repo_path = repo_path
 
     def update_wp_version(self, version):
-        env = Environment(loader=FileSystemLoader(self.repo_path), keep_trailing_newline=True)
-        template = env.get_template("azure-pipelines.yml.template")
-        data = template.render(wp_version=version)
+        template_engine().render_file(os.path.join(self.repo_path, TEMPLATE_FILE),
+                                      os.path.join(self.repo_path, PIPELINE_FILE), wp_version=version)
+
+    def apply_line_edits(self, edits):
+        edits_by_file = {}
+        for edit in edits:
+            edits_by_file.setdefault(edit.path, []).append(edit)
+
+        for path, file_edits in edits_by_file.items():
+            file_path = os.path.join(self.repo_path, path)
+            with open(file_path, 'r') as f:
+                lines = f.read().split("\n")
+
+            for edit in file_edits:
+                if edit.old not in lines[edit.line]:
+                    raise RuntimeError(f"Unable to apply {edit}: line changed to '{lines[edit.line]}'")
+                lines[edit.line] = lines[edit.line].replace(edit.old, edit.new, 1)
 
-        with open(self.repo_path + "/azure-pipelines.yml", "w") as pipeline_file:
-            pipeline_file.write(data)
+            storage.write_atomic(file_path, "\n".join(lines))
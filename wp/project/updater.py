@@ -16,40 +16,235 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from packaging.version import parse
 from wp.project.repo_details import RepoDetails
+from wp import deadline
+from wp import log
+from wp import tracing
+from wp.project import fingerprint as fp
+from wp.project import image_graph
+from wp.project import repo_manifest
+from wp.project import upstream
 from wp.project import repo_writer as repow
 from wp.git import repository_pusher as repush
+from wp.pipeline import build_scheduler
 from wp.project import wp_plugins as plugins
 
 
-def compare_and_update(repo_path, latest_version):
-    updated_plugins = check_and_update_plugins(repo_path)
-    updated_wp = check_and_update_wp(repo_path, latest_version)
+SKIP_CI_MARKER = "***NO_CI***"
 
-    if updated_plugins or updated_wp:
-        print(f"detected updates: plugins={updated_plugins}, wp={updated_wp} - push changes")
-        push_changes(repo_path, updated_wp, updated_plugins)
 
-    return updated_wp or updated_plugins
+class UpdateResult(object):
+    def __init__(self, updated_wp=False, updated_plugins=False, timings=None):
+        self.updated_wp = updated_wp
+        self.updated_plugins = updated_plugins
+        self.timings = timings if timings is not None else {}
+        self.repo_path = None
+        self.fingerprint = None
+        self.prebuilt = None
+        self.parent_digests = {}
+        self.refreshed_images = []
+        self.build_slot = None
+        self.pushed_sha = None
 
+    @property
+    def updated(self):
+        return self.updated_wp or self.updated_plugins or len(self.refreshed_images) > 0
+
+    def __bool__(self):
+        return self.updated
+
+    def release_build_slot(self):
+        if self.build_slot is not None:
+            self.build_slot.release()
+            self.build_slot = None
+
+    def __repr__(self):
+        return f"UpdateResult(wp={self.updated_wp}, plugins={self.updated_plugins}, " \
+            f"refreshed={self.refreshed_images}, prebuilt={self.prebuilt}, timings={self.timings})"
+
+
+##
+# build_pipeline is the (project, pipeline-name) building the image of the repo.
+# if an image with identical build-inputs exists, the push skips the CI-build: either the image
+# was built by the same pipeline, or it can be retagged by the retag_pipeline
+# the repo is scanned once for all checks, and only rescanned after the checks wrote to it
+def compare_and_update(repo_path, latest_version, build_pipeline=None, retag_pipeline=None):
+    with tracing.span("scan"):
+        manifest = repo_manifest.scan(repo_path)
+    result = run_checks(repo_path, latest_version, manifest)
+    result.repo_path = repo_path
+    with tracing.span("scan"):
+        if result.updated_wp or result.updated_plugins:
+            manifest = repo_manifest.scan(repo_path)
+        result.parent_digests, result.refreshed_images = check_parent_digests(repo_path, manifest)
+
+    if result.updated:
+        log.info("detected updates - push changes", plugins=result.updated_plugins, wp=result.updated_wp,
+                 refreshed=result.refreshed_images)
+        with tracing.span("fingerprint"):
+            result.fingerprint = determine_fingerprint(repo_path, result.parent_digests, manifest)
+            result.prebuilt = find_prebuilt_image(result.fingerprint, build_pipeline, retag_pipeline)
+        skip_build = result.prebuilt is not None
+        # a retag queues a build as well
+        reuse = skip_build and result.prebuilt["mode"] == "reuse"
+        result.build_slot = None if reuse else acquire_build_slot()
+        try:
+            with tracing.span("push", wp=result.updated_wp, plugins=result.updated_plugins,
+                              skip_build=skip_build) as push:
+                result.pushed_sha = push_changes(repo_path, result.updated_wp, result.updated_plugins,
+                                                 skip_build=skip_build, refreshed_images=result.refreshed_images)
+                push.set_attribute("sha", result.pushed_sha)
+        except BaseException:
+            result.release_build_slot()
+            raise
+
+    return result
+
+
+##
+# the push triggers the build, so it has to wait for a free slot in the build-queue - within the budget of
+# the "queue" stage, a full queue must not use up the budget of the update.
+# the slot is held by the UpdateResult, until the build finished
+def acquire_build_slot():
+    scheduler = build_scheduler.default_scheduler()
+    with deadline.stage_beside("queue"):
+        scheduler.acquire()
+    return scheduler
+
+
+def repo_key(repo_path):
+    return os.path.basename(os.path.normpath(repo_path))
+
+
+##
+# Docker Hub republishes tags (e.g. for PHP/Debian security-fixes) with a new digest.
+# Compares the digests of the (already updated) parent-images with the ones of the last build.
+# Returns all digests and the images, whose digest changed
+def check_parent_digests(repo_path, manifest):
+    graph = manifest.dependency_graph()
+    digests = fp.resolve_parent_digests(graph)
+    store = fp.ParentDigestStore()
+    known = store.load(repo_key(repo_path))
+    if len(known) == 0:
+        log.info("no known parent-image digests - record current ones")
+        store.save(repo_key(repo_path), digests)
+        return digests, []
+
+    refreshed = sorted(f"{ref}@{digest}" for ref, digest in digests.items()
+                       if digest is not None and known.get(ref) not in (None, digest))
+    log.info("refreshed parent-images", refreshed=refreshed)
+    return digests, refreshed
+
+
+def determine_fingerprint(repo_path, parent_digests, manifest):
+    blobs = manifest.blobs
+    if blobs is None:
+        blobs = repush.RepositoryPusher(repo_path).staged_blobs()
+    fingerprint = fp.compute(blobs, manifest.image_version, parent_digests)
+    log.info("build-input fingerprint", fingerprint=fingerprint)
+    return fingerprint
+
+
+def find_prebuilt_image(fingerprint, build_pipeline, retag_pipeline):
+    entry = fp.FingerprintIndex().lookup(fingerprint)
+    if entry is None or build_pipeline is None:
+        return None
+
+    if [entry["project"], entry["pipeline"]] == list(build_pipeline):
+        log.info("image with identical build-inputs already built", entry=entry)
+        return dict(entry, mode="reuse")
+    if retag_pipeline is not None:
+        log.info("image with identical build-inputs built by another pipeline - retag it", entry=entry)
+        return dict(entry, mode="retag")
+
+    log.info(f"image with identical build-inputs built by {entry['pipeline']}, but no retag-pipeline configured")
+    return None
+
+
+##
+# to be called, once the image of an update is available
+def record_image(update, project, pipeline, build_id):
+    if build_id is not None:
+        fp.FingerprintIndex().record(update.fingerprint, project, pipeline, build_id)
+    if update.repo_path is not None:
+        fp.ParentDigestStore().save(repo_key(update.repo_path), update.parent_digests)
+
+
+##
+# plugin- and wp-check write different files (init/plugin-list.json vs. azure-pipelines.yml),
+# so they can safely run side by side. Both start from the same manifest (see repo_manifest.scan)
+def run_checks(repo_path, latest_version, manifest):
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="update-check") as executor:
+        plugins_check = executor.submit(contextvars.copy_context().run, _timed, "plugins-check",
+                                        check_and_update_plugins, repo_path, manifest)
+        wp_check = executor.submit(contextvars.copy_context().run, _timed, "wp-check", check_and_update_wp, repo_path,
+                                   latest_version, manifest)
+        updated_plugins, plugins_duration = plugins_check.result()
+        updated_wp, wp_duration = wp_check.result()
+
+    timings = {"plugins": plugins_duration, "wp": wp_duration}
+    log.info("update-checks finished", plugins_duration=round(plugins_duration, 3), wp_duration=round(wp_duration, 3))
+    return UpdateResult(updated_wp, updated_plugins, timings)
+
+
+def _timed(name, check, *args):
+    start = time.monotonic()
+    with tracing.span(name) as check_span:
+        result = check(*args)
+        check_span.set_attribute("updated", result)
+    return result, time.monotonic() - start
+
+
+def push_changes(repo_path, updated_wp, updated_plugins, skip_build=False, refreshed_images=None):
+    message = f"auto-update wordpress: wp-version={updated_wp} | plugins={updated_plugins}"
+    if refreshed_images:
+        message += f" | parent-images={','.join(refreshed_images)}"
+    if skip_build:
+        message += f" {SKIP_CI_MARKER}"
 
-def push_changes(repo_path, updated_wp, updated_plugins):
     repo_pusher = repush.RepositoryPusher(repo_path)
-    repo_pusher.commit_and_push(f"auto-update wordpress: wp-version={updated_wp} | plugins={updated_plugins}")
+    if refreshed_images and not (updated_wp or updated_plugins):
+        # nothing changed in the repo itself, the commit only triggers the rebuild
+        return repo_pusher.commit_and_push(message, allow_empty=True)
 
+    return repo_pusher.commit_and_push(message)
 
-def check_and_update_wp(repo_path, latest_version):
-    print(f"compare version for {repo_path}")
-    wp_version = RepoDetails.determine_imageversion(repo_path)
+
+def check_and_update_wp(repo_path, latest_version, manifest):
+    log.debug("compare version", path=repo_path)
+    wp_version = RepoDetails.determine_imageversion(repo_path, manifest)
     current_version = parse(wp_version)
     remote_version = parse(latest_version)
 
-    print(f"wp update required: {current_version < remote_version}")
+    log.info(f"wp update required: {current_version < remote_version}", current=str(current_version),
+             latest=latest_version)
     if is_update_wp_version(current_version, remote_version):
         update_wp_version(repo_path, latest_version)
+        manifest = repo_manifest.scan(repo_path)
+
+    # runs after the pipeline-update, so ARGs passed in by the pipeline already carry the new version
+    updated_images = check_and_update_parent_images(repo_path, latest_version, manifest)
+    return is_update_wp_version(current_version, remote_version) or updated_images
+
+
+##
+# bumps every FROM (of every Dockerfile and build-stage) based on the wordpress-image,
+# that is not already covered by the pipeline-template. All of them end up in the same commit.
+def check_and_update_parent_images(repo_path, latest_version, manifest):
+    graph = manifest.dependency_graph()
+    log.debug("parent-images", images=[str(i) for i in graph.external_images()])
+    edits = image_graph.plan_version_updates(graph, upstream.WP_IMAGE_NAME, latest_version)
+    if len(edits) > 0:
+        log.info("update parent-images", edits=edits)
+        repo_writer = repow.RepoWriter(repo_path)
+        repo_writer.apply_line_edits(edits)
 
-    return is_update_wp_version(current_version, remote_version)
+    return len(edits) > 0
 
 
 def is_update_wp_version(current_version, remote_version):
@@ -61,9 +256,12 @@ def update_wp_version(repo_path, latest_version):
     repo_writer.update_wp_version(latest_version)
 
 
-def check_and_update_plugins(repo_path):
-    print("check for plugin-updates...")
-    plugins_json = plugins.read_plugin_list(repo_path)
+def check_and_update_plugins(repo_path, manifest):
+    log.debug("check for plugin-updates...")
+    plugins_json = manifest.plugin_list
+    if plugins_json is None:
+        error = manifest.errors.get(repo_manifest.PLUGIN_LIST, "file not found")
+        raise RuntimeError(f"Unable to read {repo_manifest.PLUGIN_LIST} of {repo_path}: {error}")
     plugin_request = plugins.build_request_body(plugins_json)
     plugin_status = plugins.call_wp_api(plugin_request)
     is_update = plugins.is_update_plugins(plugin_status)
@@ -72,5 +270,5 @@ def check_and_update_plugins(repo_path):
         plugins_json_update = plugins.update_plugin_list(plugins_json, plugin_status)
         plugins.write_plugin_list(repo_path, plugins_json_update)
 
-    print(f"plugin-update required: {is_update}")
+    log.info(f"plugin-update required: {is_update}")
     return is_update
@@ -0,0 +1,139 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import requests
+from packaging.version import parse
+from wp import config as conf
+from wp import http_client
+from wp import log
+from wp import storage
+from wp.project import docker_hub as dh
+from wp.project import wp_plugins
+
+WP_IMAGE_NAME = "wordpress"
+WP_IMAGE_VARIANT = "apache"
+WP_TAG_PATTERN = r"^[0-9]+\.[0-9]+\.[0-9]+-apache$"
+WP_CORE_VERSION_PATH = "core/version-check/1.7/"
+WP_CORE_VERSION_URL = wp_plugins.WORDPRESS_API_URL + WP_CORE_VERSION_PATH
+DEFAULT_PROVIDER = "wordpress-api"
+KNOWN_VERSIONS_FILE = "upstream-versions.json"
+
+
+class DockerHubVersionProvider(object):
+    name = "docker-hub"
+
+    def __init__(self, image_name=WP_IMAGE_NAME, variant=WP_IMAGE_VARIANT):
+        self.image_name = image_name
+        self.variant = variant
+
+    def latest_version(self):
+        tags = dh.fetch_tags(self.image_name)
+        filtered_tags = dh.filter_tags_regex(tags, WP_TAG_PATTERN)
+        log.debug("matching tags", tags=[t["name"] for t in filtered_tags])
+        highest_version = dh.determine_highest_version(filtered_tags)
+        if highest_version is None:
+            raise RuntimeError(f"No tag of image '{self.image_name}' matches {WP_TAG_PATTERN}")
+
+        return dh.filter_version_name(highest_version.rsplit("-")[0])
+
+    def tag_name(self, version):
+        return f"{dh.docker_version_name(version)}-{self.variant}"
+
+    def has_version(self, version):
+        return dh.lookup_tag(self.image_name, self.tag_name(version)) is not None
+
+
+class WordpressCoreVersionProvider(object):
+    name = "wordpress-api"
+
+    def __init__(self, url=None):
+        self.url = url if url is not None else wp_plugins.wordpress_api_url() + WP_CORE_VERSION_PATH
+
+    def latest_version(self):
+        log.debug("request to wordpress api", url=self.url)
+        response = http_client.get(self.url)
+        if response.status_code != 200:
+            raise RuntimeError(f"Request to '{self.url}' failed! Got status code: {response.status_code}")
+
+        offers = json.loads(response.text).get("offers", [])
+        versions = [o["current"] for o in offers if o.get("response") in ("upgrade", "latest") and "current" in o]
+        if len(versions) == 0:
+            raise RuntimeError(f"Response of '{self.url}' does not contain any version-offers")
+
+        return dh.filter_version_name(max(versions, key=parse))
+
+
+##
+# Asks the (cheap) primary provider and only consults the docker-hub index, if the primary reports
+# a version that was not seen before. A new version is only accepted, if the corresponding
+# parent-image is already published - otherwise the last known version is kept.
+class CrossCheckedVersionProvider(object):
+
+    def __init__(self, primary, index, store):
+        self.primary = primary
+        self.index = index
+        self.store = store
+        self.name = primary.name
+
+    def latest_version(self):
+        try:
+            candidate = self.primary.latest_version()
+        except (RuntimeError, ValueError, requests.exceptions.RequestException) as e:
+            log.warning(f"{self.primary.name} unavailable ({e}) - fall back to {self.index.name}")
+            return self.index.latest_version()
+
+        known_version = self.store.get(self.primary.name)
+        if candidate == known_version:
+            return candidate
+
+        log.info(f"new upstream version {candidate} (last known: {known_version}) - cross-check with {self.index.name}")
+        if self.index.has_version(candidate):
+            self.store.put(self.primary.name, candidate)
+            return candidate
+
+        log.info(f"version {candidate} is not yet available as '{self.index.tag_name(candidate)}'")
+        if known_version is not None:
+            return known_version
+
+        return self.index.latest_version()
+
+
+def _create_docker_hub_provider():
+    return DockerHubVersionProvider()
+
+
+def _create_wordpress_api_provider():
+    store = storage.JsonStore(storage.state_path(KNOWN_VERSIONS_FILE))
+    return CrossCheckedVersionProvider(WordpressCoreVersionProvider(), DockerHubVersionProvider(), store)
+
+
+# a provider has a name and returns the latest wordpress-version by latest_version()
+PROVIDERS = {
+    "docker-hub": _create_docker_hub_provider,
+    "wordpress-api": _create_wordpress_api_provider
+}
+
+
+def create_provider(name=None):
+    if name is None:
+        name = getattr(conf, "upstream_version_provider", DEFAULT_PROVIDER)
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown upstream-version provider '{name}'! Valid options: {list(PROVIDERS.keys())}")
+
+    return PROVIDERS[name]()
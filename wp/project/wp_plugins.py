@@ -17,8 +17,14 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import json
-import requests
 import urllib.parse
+from packaging.version import InvalidVersion, parse
+from wp import config as conf
+from wp import http_client
+from wp import log
+from wp import storage
+
+WORDPRESS_API_URL = "https://api.wordpress.org/"
 
 
 def read_plugin_list(repository_dir):
@@ -38,24 +44,36 @@ def build_request_body(plugin_json):
 
 
 def call_wp_api(request_body):
-    url = "https://api.wordpress.org/plugins/update-check/1.1/"
+    url = f"{wordpress_api_url()}plugins/update-check/1.1/"
     post_data = f"plugins={urllib.parse.quote(json.dumps(request_body), safe='')}"
-    print(f"request to: {url}")
-    print(f"POST-data: {post_data}")
-    response = requests.post(url, data=post_data,
-                             headers={"content-type": "application/x-www-form-urlencoded", "user-agent": "curl/7.71.1"})
+    log.debug("request to wordpress api", url=url, data=post_data)
+    response = http_client.post(url, data=post_data,
+                                headers={"content-type": "application/x-www-form-urlencoded", "user-agent": "curl/7.71.1"})
 
     if response.status_code != 200:
-        print(f"Got Response: {response.content}")
+        log.debug("wordpress api response", response=response.text)
         raise RuntimeError(f"Request to '{url}' failed! Got status code: {response.status_code} - {response.reason}")
 
     return json.loads(response.text)
 
 
+def wordpress_api_url():
+    return getattr(conf, "wordpress_api_url", None) or WORDPRESS_API_URL
+
+
 def is_update_plugins(plugin_status):
     return len(plugin_status["plugins"]) > 0
 
 
+##
+# plugin-versions do not necessarily follow PEP 440
+def is_lower_version(version, other):
+    try:
+        return parse(version) < parse(other)
+    except InvalidVersion:
+        return version < other
+
+
 def update_plugin_list(plugin_list, plugin_status):
     plugin_list_update = plugin_list
     for key in plugin_status["plugins"]:
@@ -68,6 +86,7 @@ def update_plugin_list(plugin_list, plugin_status):
     return plugin_list_update
 
 
+##
+# the wp-check scans the repo while the plugin-check runs, so it must never see a partially written list
 def write_plugin_list(repository_dir, plugin_list):
-    with open(f"{repository_dir}/init/plugin-list.json", "w") as plj:
-        plj.write(json.dumps(plugin_list, indent=2))
+    storage.write_atomic(f"{repository_dir}/init/plugin-list.json", json.dumps(plugin_list, indent=2))
@@ -5,6 +5,9 @@ to_check = {
         "update-pipeline": "Update Wordpress DB (SITENAME)",
         "build-img-pipeline": "wp-SITENAME-img",
         "rollout-pipeline": "Rollout Wordpress Image (SITENAME)",
+        # optional: build-pipeline, that retags an image with identical build-inputs built by another pipeline
+        # (queue-time variables sourceProject, sourcePipeline, sourceBuildId and targetPipeline, see README)
+        # "retag-pipeline": "wp-retag-img",
         "project": "YOUR_PROJECT"
     }
 }
@@ -0,0 +1,132 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import copy
+import datetime
+import threading
+from wp import storage
+
+JOURNAL_FILE = "run-journal.json"
+
+# stages of a repository within a run, in order
+STARTED = "started"
+PUSHED = "pushed"
+BUILT = "built"
+DONE = "done"
+STAGES = (STARTED, PUSHED, BUILT, DONE)
+
+
+##
+# Records the progress of a run per repository (stage reached, pushed commit, build-id, release-ids),
+# so an interrupted run can be resumed. Every change is written through (atomically) to the store;
+# without a store the journal only lives in memory.
+class RunJournal(object):
+    def __init__(self, store=None):
+        self.store = store
+        self._lock = threading.Lock()
+        self._data = {"run": {}, "repos": {}}
+
+    def start(self, latest_version):
+        with self._lock:
+            self._data = {"run": {"started": datetime.datetime.now().isoformat(timespec="seconds"),
+                                  "latest_version": latest_version, "finished": False},
+                          "repos": {}}
+            self._save()
+
+    ##
+    # Returns the wp-version of the interrupted run or None, if there is nothing to resume
+    def resume(self):
+        with self._lock:
+            data = self.store.load() if self.store is not None else {}
+            run = data.get("run", {})
+            if run.get("latest_version") is None or run.get("finished", False):
+                return None
+
+            self._data = {"run": run, "repos": data.get("repos", {})}
+            return run["latest_version"]
+
+    def finish(self):
+        with self._lock:
+            self._data["run"]["finished"] = True
+            self._save()
+
+    def entry(self, key):
+        with self._lock:
+            return copy.deepcopy(self._data["repos"].get(key, {}))
+
+    def stage(self, key):
+        return self.entry(key).get("stage")
+
+    def reached(self, key, stage):
+        current = self.stage(key)
+        return current is not None and STAGES.index(current) >= STAGES.index(stage)
+
+    def record(self, key, stage=None, **details):
+        with self._lock:
+            entry = self._data["repos"].setdefault(key, {"stage": STARTED})
+            entry.update(copy.deepcopy(details))
+            if stage is not None:
+                entry["stage"] = stage
+            entry.pop("error", None)
+            self._save()
+
+    ##
+    # replaces the entry of the repository (e.g. by the one reported by its repo-worker)
+    def put(self, key, entry):
+        with self._lock:
+            self._data["repos"][key] = copy.deepcopy(entry)
+            self._save()
+
+    def record_release(self, key, pipeline_key, release_id, result=None):
+        with self._lock:
+            entry = self._data["repos"].setdefault(key, {"stage": STARTED})
+            entry.setdefault("releases", {})[pipeline_key] = {"id": release_id, "result": result}
+            self._save()
+
+    def record_error(self, key, error):
+        with self._lock:
+            entry = self._data["repos"].setdefault(key, {"stage": STARTED})
+            entry["error"] = str(error)
+            self._save()
+
+    def _save(self):
+        if self.store is not None:
+            self.store.save(self._data)
+
+
+def open_journal():
+    return RunJournal(storage.JsonStore(storage.state_path(JOURNAL_FILE)))
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def default_journal():
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = RunJournal()
+
+        return _journal
+
+
+def set_default_journal(journal):
+    global _journal
+    with _journal_lock:
+        _journal = journal
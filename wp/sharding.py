@@ -0,0 +1,101 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+import glob
+import hashlib
+import json
+import os
+from wp import log
+from wp import storage
+
+STATUS_FILE_PATTERN = "shard-status-{index}-of-{count}.json"
+
+
+##
+# Jump Consistent Hash (Lamping, Veach 2014): maps the key to one of num_buckets buckets.
+# Growing from n to n+1 buckets only moves 1/(n+1) of the keys - all of them to the new bucket
+def jump_hash(key, num_buckets):
+    b, j = -1, 0
+    while j < num_buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+
+    return b
+
+
+##
+# python's hash() differs between processes, so the repository-key is hashed with sha256
+def shard_of(key, shard_count):
+    digest = hashlib.sha256(key.encode("UTF-8")).digest()
+    return jump_hash(int.from_bytes(digest[:8], "big"), shard_count)
+
+
+def select(repositories, shard_index, shard_count):
+    return {key: repo for key, repo in repositories.items() if shard_of(key, shard_count) == shard_index}
+
+
+##
+# the workdir of a shard only depends on its index: when the number of shards changes, most
+# repositories stay with their shard - and so with their mirrors and state
+def shard_workdir(workdir, shard_index):
+    return os.path.join(workdir, f"shard-{shard_index}", "")
+
+
+##
+# run_id identifies the run all shards belong to (e.g. the id of the CI-build starting them)
+def write_status(status_dir, run_id, shard_index, shard_count, repositories, occurred_errors, latest_version,
+                 started=None):
+    status = {"run_id": run_id, "index": shard_index, "count": shard_count, "repos": sorted(repositories),
+              "errors": occurred_errors, "latest_version": latest_version, "started": started,
+              "finished": datetime.datetime.now().isoformat(timespec="seconds")}
+    path = os.path.join(status_dir, STATUS_FILE_PATTERN.format(index=shard_index, count=shard_count))
+    storage.write_atomic(path, json.dumps(status, indent=2))
+    return path
+
+
+##
+# Returns (errors, missing shards) over all shards of the given shard-count.
+# The status of a shard, that did not finish in the given run, is a left-over of a previous run - so it's missing
+def aggregate_status(status_dir, shard_count, run_id):
+    errors = 0
+    missing = []
+    for index in range(shard_count):
+        path = os.path.join(status_dir, STATUS_FILE_PATTERN.format(index=index, count=shard_count))
+        try:
+            with open(path, 'r') as f:
+                status = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            missing.append(index)
+            continue
+        if status.get("run_id") != run_id:
+            log.warning(f"shard {index}/{shard_count}: status of another run", run_id=status.get("run_id"),
+                        finished=status.get("finished"))
+            missing.append(index)
+            continue
+        log.info(f"shard {index}/{shard_count}: {len(status['repos'])} repositories, {status['errors']} errors",
+                 finished=status["finished"])
+        errors += status["errors"]
+
+    stale = [p for p in glob.glob(os.path.join(status_dir, STATUS_FILE_PATTERN.format(index="*", count="*")))
+             if not p.endswith(f"-of-{shard_count}.json")]
+    if len(stale) > 0:
+        log.warning(f"ignoring status of other shard-counts: {stale}")
+
+    return errors, missing
@@ -0,0 +1,106 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import fcntl
+import json
+import os
+import stat
+import tempfile
+import threading
+from wp import config as conf
+from wp import log
+
+
+def state_path(name):
+    return os.path.join(conf.workdir, name)
+
+
+DEFAULT_FILE_MODE = 0o644
+
+
+##
+# write to a temp-file next to the target and rename it afterwards,
+# so readers (and crashes) never see a half-written file
+def write_atomic(path, data, mode=None):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    if mode is None:
+        mode = _current_mode(path)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _current_mode(path):
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return DEFAULT_FILE_MODE
+
+
+class JsonStore(object):
+    _lock = threading.RLock()
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            log.warning(f"ignoring corrupt state-file {self.path}: {e}")
+            return {}
+
+    def save(self, data):
+        with JsonStore._lock:
+            write_atomic(self.path, json.dumps(data, indent=2))
+
+    def get(self, key, default=None):
+        return self.load().get(key, default)
+
+    ##
+    # the read-modify-write holds an (advisory) file-lock as well, repo-workers in other processes
+    # may update the same file
+    def put(self, key, value):
+        with JsonStore._lock, _file_lock(self.path):
+            data = self.load()
+            data[key] = value
+            self.save(data)
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
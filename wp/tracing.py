@@ -0,0 +1,174 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from wp import config as conf
+from wp import log
+from wp import storage
+
+TRACE_FILE = "run-trace.json"
+DEFAULT_MAX_SPANS = 100000
+
+_current = contextvars.ContextVar("span", default=None)
+_span_ids = itertools.count(1)
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+##
+# A timed unit of work (a repository, a stage, a build-wait ...) with its attributes.
+# Spans nest by their context: threads started with contextvars.copy_context().run continue the
+# span of their creator, so concurrently processed repositories keep their own hierarchy.
+class Span(object):
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.attributes = dict(attributes or {})
+        self.pid = os.getpid()
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.status = "ok"
+        self.start = time.time()
+        self.end = None
+
+    def set_attribute(self, name, value):
+        self.attributes[name] = value
+
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def __repr__(self):
+        return f"Span({self.name}, id={self.span_id}, parent={self.parent_id}, {self.attributes})"
+
+
+##
+# Collects the finished spans of a run (at most max_spans, the ones beyond are dropped)
+class Recorder(object):
+    def __init__(self, max_spans=DEFAULT_MAX_SPANS):
+        self.max_spans = max_spans
+        self.dropped = 0
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            if len(self._spans) < self.max_spans:
+                self._spans.append(span)
+            else:
+                self.dropped += 1
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans = []
+            self.dropped = 0
+
+    ##
+    # Chrome trace-event format (chrome://tracing, Perfetto, speedscope): one complete event per span,
+    # lanes are the threads (of the worker-processes) - within a thread the spans nest properly.
+    # The parent/child relations are kept in the args of the events.
+    def chrome_trace(self):
+        spans = sorted(self.spans(), key=lambda s: s.start)
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for pid, tid, name in sorted({(s.pid, s.thread_id, s.thread_name) for s in spans})]
+        events += [{"name": s.name, "cat": s.name, "ph": "X", "pid": s.pid, "tid": s.thread_id,
+                    "ts": int(s.start * 1000000), "dur": int(s.duration() * 1000000),
+                    "args": dict(s.attributes, span_id=s.span_id, parent_id=s.parent_id, trace_id=s.trace_id,
+                                 status=s.status)}
+                   for s in spans]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped_spans": self.dropped}}
+
+
+def default_recorder():
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = Recorder()
+
+        return _recorder
+
+
+def set_default_recorder(recorder):
+    global _recorder
+    with _recorder_lock:
+        _recorder = recorder
+
+
+##
+# Runs the block as child-span of the current span. A failing block marks the span as failed.
+@contextlib.contextmanager
+def span(name, **attributes):
+    current_span = Span(name, _current.get(), attributes)
+    token = _current.set(current_span)
+    try:
+        yield current_span
+    except BaseException as e:
+        current_span.status = "error"
+        current_span.set_attribute("error", f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current_span.end = time.time()
+        _current.reset(token)
+        default_recorder().record(current_span)
+
+
+def current():
+    return _current.get()
+
+
+##
+# records the spans of another process (e.g. a repo-worker) as descendants of the parent span.
+# Their ids are only unique within their process, so they are assigned anew
+def adopt(spans, parent=None):
+    ids = {s.span_id: next(_span_ids) for s in spans}
+    for s in spans:
+        s.span_id = ids[s.span_id]
+        if s.parent_id in ids:
+            s.parent_id = ids[s.parent_id]
+            s.trace_id = parent.trace_id if parent is not None else ids.get(s.trace_id, s.span_id)
+        else:
+            s.parent_id = parent.span_id if parent is not None else None
+            s.trace_id = parent.trace_id if parent is not None else s.span_id
+        default_recorder().record(s)
+
+
+def set_attribute(name, value):
+    current_span = _current.get()
+    if current_span is not None:
+        current_span.set_attribute(name, value)
+
+
+def trace_path():
+    return os.path.join(getattr(conf, "metrics_dir", None) or conf.workdir, TRACE_FILE)
+
+
+def export(path=None):
+    path = path if path is not None else trace_path()
+    storage.write_atomic(path, json.dumps(default_recorder().chrome_trace()))
+    log.info("exported trace", path=path)
@@ -0,0 +1,311 @@
+# Copyright (C) 2020, Martin Drößler <m.droessler@handelsblattgroup.com>
+# Copyright (C) 2020, Handelsblatt GmbH
+#
+# This file is part of Docker-Update-Scanner
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import sys
+import time
+import types
+
+# only the stdlib is imported up front: a (spawned) worker imports the wp-modules once the configuration
+# of the parent is installed - it may not even find a wp/config.py of its own
+START_METHOD = "spawn"
+DEFAULT_MAX_REPOS = 10
+POLL_INTERVAL = 1
+# seconds a worker that exited may take to deliver the result of its last repository
+RESULT_GRACE = 5
+CONFIG_TYPES = (str, int, float, bool, list, tuple, dict, type(None))
+# the receiver of the service-hooks stays with the parent (the workers would compete for the port)
+WORKER_OVERRIDES = {"service_hook_port": None}
+
+# the channel of the worker to its parent
+_events = None
+
+
+##
+# Forwards every change of the journal-entry of the repository processed by a worker to the parent,
+# which keeps the actual journal
+class ForwardingStore(object):
+    def __init__(self, events, key):
+        self.events = events
+        self.key = key
+
+    def load(self):
+        return {}
+
+    def save(self, data):
+        self.events.put(("journal", self.key, data["repos"].get(self.key, {})))
+
+
+##
+# Processes the repositories in a pool of worker-processes instead of threads: a worker is limited in its
+# address-space (memory_limit bytes) and its cpu-time per repository (cpu_limit seconds), the worker of a
+# repository taking longer than timeout seconds is killed. Workers are replaced after max_repos repositories,
+# so a long run doesn't accumulate memory.
+# The result, metrics, spans and log-records of a repository come back once it is finished, the changes of
+# its journal-entry right away. target processes a single repository in the worker (app.process_repository)
+class RepoWorkers(object):
+
+    def __init__(self, processes, max_repos=DEFAULT_MAX_REPOS, timeout=None, memory_limit=None, cpu_limit=None,
+                 target=None):
+        self.processes = processes
+        self.max_repos = max_repos
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.target = target
+
+    ##
+    # returns the number of failed repositories
+    def run(self, repositories, latest_version, keep_clones, journal, eta, eta_interval):
+        from wp import app
+        from wp import config as conf
+        from wp import deadline
+        from wp import history
+        from wp import log
+        from wp.pipeline import build_scheduler
+        from wp.project import docker_hub as dh
+        target = self.target if self.target is not None else app.process_repository
+        run_history = history.default_history()
+        remaining = deadline.remaining()
+        expires = None if remaining is None else time.time() + remaining
+        context = multiprocessing.get_context(START_METHOD)
+        log.info(f"process repositories in {self.processes} repo-workers", max_repos=self.max_repos,
+                 timeout=self.timeout, memory_limit=self.memory_limit, cpu_limit=self.cpu_limit)
+        with context.Manager() as manager:
+            events = manager.Queue()
+            # max_queued_builds applies to all workers together, they count their builds in flight in the parent
+            build_slots = (manager.dict(), manager.Condition())
+            scheduler = build_scheduler.BuildWaveScheduler(slots=build_slots[0], condition=build_slots[1])
+            # the workers share one tag index, starting with the tags the parent already looked up
+            tag_index = (manager.dict(dh.tag_index()), manager.Lock())
+            initargs = (config_snapshot(conf), self.memory_limit, events, run_history.path, run_history.run_id,
+                        tag_index, build_slots)
+            # leaving the block terminates the pool: the task of a killed worker never completes, the pool
+            # would wait for it on close
+            with context.Pool(self.processes, initializer=initialize, initargs=initargs,
+                              maxtasksperchild=self.max_repos) as pool:
+                tasks = {key: pool.apply_async(run_repository, (target, repo, key, latest_version, keep_clones,
+                                                                journal.entry(key), expires, self.cpu_limit))
+                         for key, repo in repositories.items()}
+                return self._wait(tasks, events, journal, eta, eta_interval, scheduler)
+
+    def _wait(self, tasks, events, journal, eta, eta_interval, scheduler):
+        occurred_errors = 0
+        running = {}
+        last_report = time.monotonic()
+        while len(tasks) > 0:
+            self._receive(events, tasks, running, journal, eta)
+            for key in [key for key, task in tasks.items() if task.ready()]:
+                occurred_errors += self._finish(key, tasks.pop(key), journal)
+            for key, reason in self._failed_workers(tasks, running):
+                occurred_errors += 1
+                tasks.pop(key)
+                # the worker doesn't release its build-slots any more
+                scheduler.release_all(running[key][0])
+                fail(key, reason, time.monotonic() - running[key][1], journal)
+            for key in [key for key in running if key not in tasks]:
+                running.pop(key)
+                eta.finish(key)
+                last_report = 0
+            if time.monotonic() - last_report >= eta_interval:
+                eta.report()
+                last_report = time.monotonic()
+
+        return occurred_errors
+
+    def _receive(self, events, tasks, running, journal, eta):
+        try:
+            event = events.get(timeout=POLL_INTERVAL)
+            while True:
+                if event[0] == "started":
+                    running[event[1]] = (event[2], time.monotonic())
+                    eta.start(event[1])
+                elif event[0] == "journal" and event[1] in tasks:
+                    # (late changes of a repository that's already finished are outdated)
+                    journal.put(event[1], event[2])
+                event = events.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _finish(self, key, task, journal):
+        from wp import instrumentation
+        from wp import log
+        from wp import tracing
+        try:
+            outcome = task.get()
+        except Exception as e:
+            fail(key, f"repo-worker failed: {type(e).__name__}: {e}", 0.0, journal)
+            return 1
+
+        if len(outcome["journal"]) > 0:
+            journal.put(key, outcome["journal"])
+        instrumentation.default_metrics().merge(outcome["metrics"])
+        tracing.adopt(outcome["spans"], tracing.current())
+        if len(outcome["log"]) > 0:
+            log.default_logger().write(outcome["log"])
+        return outcome["result"]
+
+    ##
+    # repositories, whose worker exceeded the timeout (the worker is killed) or died (e.g. by the cpu-limit)
+    def _failed_workers(self, tasks, running):
+        alive = {p.pid for p in multiprocessing.active_children()}
+        failed = []
+        for key, (pid, started) in running.items():
+            if key not in tasks:
+                continue
+            if self.timeout is not None and time.monotonic() - started > self.timeout:
+                _kill(pid)
+                failed.append((key, f"repo-worker exceeded the timeout of {self.timeout}s - killed"))
+            elif pid not in alive and not tasks[key].wait(RESULT_GRACE) and not tasks[key].ready():
+                failed.append((key, f"repo-worker {pid} died"))
+
+        return failed
+
+
+def _kill(pid):
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def fail(key, reason, duration, journal):
+    from wp import history
+    from wp import instrumentation
+    from wp import log
+    with log.repository(key):
+        log.error(f"Unable to process repository: {reason}")
+    journal.record_error(key, reason)
+    instrumentation.inc("repositories", result="failed")
+    history.default_history().record_repository(key, "failed", duration, error=reason)
+
+
+##
+# repo-workers as configured - or None, if the repositories are processed by threads
+def create_workers():
+    from wp import config as conf
+    processes = getattr(conf, "repo_workers", None)
+    if not processes:
+        return None
+
+    return RepoWorkers(processes, getattr(conf, "worker_max_repos", None) or DEFAULT_MAX_REPOS,
+                       getattr(conf, "worker_timeout", None), getattr(conf, "worker_memory_limit", None),
+                       getattr(conf, "worker_cpu_limit", None))
+
+
+##
+# the configuration of the parent, including its changes at runtime (e.g. the workdir of a shard)
+def config_snapshot(conf):
+    values = {name: value for name, value in vars(conf).items()
+              if not name.startswith("_") and isinstance(value, CONFIG_TYPES)}
+    return dict(values, **WORKER_OVERRIDES)
+
+
+def install_config(values):
+    module = sys.modules.get("wp.config")
+    if module is None:
+        import wp
+        module = types.ModuleType("wp.config")
+        sys.modules["wp.config"] = module
+        wp.config = module
+    for name, value in values.items():
+        setattr(module, name, value)
+
+
+def limit_memory(limit):
+    if limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+##
+# the cpu-limit applies per repository: the soft-limit is moved on by the cpu-time the worker used so far.
+# A worker exceeding it is killed (SIGXCPU)
+def limit_cpu(seconds):
+    if seconds is None:
+        return
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+
+
+##
+# runs in every new worker. The records of the run-history are written by the worker itself (to the run
+# of the parent), the log-records are collected and written by the parent
+def initialize(config, memory_limit, events, history_path, run_id, tag_index, build_slots):
+    global _events
+    # an interrupt is handled by the parent, which terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    install_config(config)
+    from wp import history
+    from wp import log
+    from wp.pipeline import build_scheduler
+    from wp.project import docker_hub as dh
+    logger = log.create_logger()
+    logger.fmt = "json"
+    logger.stream = io.StringIO()
+    log.set_default_logger(logger)
+    run_history = history.RunHistory(history_path)
+    run_history.run_id = run_id
+    history.set_default_history(run_history)
+    dh.share_tag_index(*tag_index)
+    build_scheduler.share_slots(*build_slots)
+    _events = events
+    limit_memory(memory_limit)
+
+
+##
+# runs in the worker: processes the repository with its journal-entry of the parent (the budget of the run
+# expires at the wall-clock time expires). Returns the result with the metrics, spans and log-records
+def run_repository(target, repo, key, latest_version, keep_clone, entry, expires, cpu_limit):
+    from wp import deadline
+    from wp import instrumentation
+    from wp import log
+    from wp import run_journal
+    from wp import tracing
+    limit_cpu(cpu_limit)
+    _events.put(("started", key, os.getpid()))
+    journal = run_journal.RunJournal()
+    if len(entry) > 0:
+        journal.put(key, entry)
+    journal.store = ForwardingStore(_events, key)
+    run_journal.set_default_journal(journal)
+    instrumentation.set_default_metrics(instrumentation.Metrics())
+    tracing.set_default_recorder(tracing.Recorder())
+    output = log.default_logger().stream
+    output.seek(0)
+    output.truncate()
+    try:
+        with deadline.budget("run", None if expires is None else expires - time.time()):
+            result = target(repo, key, latest_version, keep_clone)
+    except Exception as e:
+        with log.repository(key):
+            log.exception(f"Unable to process repository: {e}")
+        journal.record_error(key, f"{type(e).__name__}: {e}")
+        result = 1
+
+    return {"result": result, "journal": journal.entry(key),
+            "metrics": instrumentation.default_metrics().snapshot(), "spans": tracing.default_recorder().spans(),
+            "log": [json.loads(line) for line in output.getvalue().splitlines()]}